@@ -0,0 +1,455 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Approximate Bayesian Computation (ABC-SMC) for models without a tractable likelihood.
+#
+#Closed-form OU likelihoods (ou_likelihood.py, fit_timeseries.get_OU_nlogLik) ignore
+#the clamping of coordinates to [-1,1] in Process.ou_update and the parameter
+#changes of perturbations. ABC instead compares summary statistics of the
+#observed series with those of series simulated from candidate parameters,
+#keeping candidates whose distance is within a tolerance epsilon.
+#
+#Sequential Monte Carlo (population Monte Carlo, Beaumont et al. 2009):
+#generation 0 keeps the nearest fraction (alpha) of draws from a uniform prior.
+#Each later generation sets epsilon to the alpha quantile of the previous
+#generation's distances, proposes candidates by perturbing previous particles with
+#a Gaussian kernel (twice their weighted covariance), and weights accepted
+#particles by prior / proposal density. Tolerances stop shrinking when the
+#acceptance rate falls below min_acceptance_rate.
+#
+#Candidates are simulated in batches: every candidate's copy of the observed
+#cohort is a set of rows of one MultivariateProcess (Euler updates with clamping,
+#as Process.ou_update), with per-row parameters, so a batch costs a few array
+#operations per timepoint. Batches run in parallel workers. Proposals and seeds
+#are drawn in the parent, so results depend on seed and batch sizes but not n_jobs.
+#
+#Parameters (uniform priors; others are fixed):
+#lambda, delta, mu -- base OU parameters shared by all subjects
+#perturbation_lambda, perturbation_delta, perturbation_mu -- values that replace
+#  the base parameters at timepoints within any perturbation window (start,end)
+
+from multivariate_process import MultivariateProcess,get_random_state
+from shared_arrays import run_in_pool
+from dispersion import parse_coordinates_table,parse_metadata_table
+from change_point import get_subject_series,align_subject_series
+from optparse import OptionParser
+from optparse import OptionGroup
+from time import perf_counter
+import numpy
+import logging
+
+logger = logging.getLogger("karenina.abc_smc")
+
+ABC_PARAMETERS = ("lambda","delta","mu","perturbation_lambda","perturbation_delta","perturbation_mu")
+DEFAULT_FIXED_PARAMS = {"lambda":0.2,"delta":0.25,"mu":0.0}
+POSTERIOR_COLUMNS = ["parameter","mean","sd","q0.025","median","q0.975"]
+GENERATION_COLUMNS = ["generation","epsilon","n_simulated","n_accepted","acceptance_rate",\
+  "seconds","candidates_per_second"]
+
+def make_abc_model(observed,priors,fixed_params=None,times=None,perturbation_windows=(),\
+  n_windows=4,min_bound=-1.0,max_bound=1.0,method="euler"):
+    """Return a dict describing the observed data, priors and simulator for ABC
+
+    observed -- (n_subjects,n_timepoints) array of one axis' coordinates at equally spaced times
+    priors -- dict of parameter (from ABC_PARAMETERS) -> (low,high) of a uniform prior
+    fixed_params -- values of parameters without priors (default: DEFAULT_FIXED_PARAMS;
+      perturbation parameters default to the base parameter)
+    times -- the observation times (default: 0,1,2...)
+    perturbation_windows -- (start,end) times, inclusive, during which perturbation
+      parameters replace base parameters
+    n_windows -- summary statistics are calculated in this many consecutive time windows
+    min_bound,max_bound -- clamping bounds of the simulator (None for no bound)
+    """
+    observed = numpy.asarray(observed,dtype=float)
+    if observed.ndim != 2 or observed.shape[1] < 3 or numpy.isnan(observed).any():
+        raise ValueError("observed must be an (n_subjects,n_timepoints) array of at least 3 timepoints without missing values")
+    for name,(low,high) in priors.items():
+        if name not in ABC_PARAMETERS:
+            raise ValueError("Unknown ABC parameter: %s. Valid parameters: %s" %(name,", ".join(ABC_PARAMETERS)))
+        if not low < high:
+            raise ValueError("Prior for %s must have low < high. Got: (%s,%s)" %(name,low,high))
+    if not priors:
+        raise ValueError("At least one parameter needs a prior")
+    times = numpy.arange(observed.shape[1],dtype=float) if times is None else numpy.asarray(times,dtype=float)
+    steps = numpy.diff(times)
+    if len(times) != observed.shape[1] or not numpy.allclose(steps,steps[0]) or steps[0] <= 0:
+        raise ValueError("times must be %i equally spaced, increasing values" %observed.shape[1])
+    all_fixed = dict(DEFAULT_FIXED_PARAMS)
+    all_fixed.update(fixed_params or {})
+    parameters = [name for name in ABC_PARAMETERS if name in priors]
+    perturbed = numpy.zeros(len(times),dtype=bool)
+    for start,end in perturbation_windows:
+        perturbed |= (start <= times) & (times <= end)
+    model = {"observed":observed,"times":times,"dt":float(steps[0]),"parameters":parameters,\
+      "bounds":numpy.array([priors[name] for name in parameters],dtype=float),\
+      "fixed_params":all_fixed,"perturbed":perturbed,\
+      "windows":numpy.array_split(numpy.arange(1,len(times)),min(n_windows,len(times) - 1)),\
+      "min_bound":min_bound,"max_bound":max_bound,"method":method}
+    model["observed_statistics"] = get_summary_statistics(model,observed[None])[0]
+    return model
+
+def get_summary_statistics(model,series):
+    """Return an (n_candidates,n_statistics) array of summary statistics
+
+    series -- (n_candidates,n_subjects,n_timepoints) array
+
+    For each time window: the mean coordinate, the SD of increments, the lag-1
+    autocorrelation of deviations from each subject's window mean, and the mean
+    variance across subjects. Last, the fraction of values at the bounds.
+    """
+    statistics = []
+    for window in model["windows"]:
+        x = series[:,:,window]
+        previous = series[:,:,window - 1]
+        statistics.append(x.mean(axis=(1,2)))
+        statistics.append((x - previous).std(axis=(1,2)))
+        current_deviation = x - x.mean(axis=2,keepdims=True)
+        previous_deviation = previous - previous.mean(axis=2,keepdims=True)
+        with numpy.errstate(divide="ignore",invalid="ignore"):
+            autocorrelation = (current_deviation * previous_deviation).sum(axis=(1,2)) /\
+              numpy.sqrt((current_deviation**2).sum(axis=(1,2)) * (previous_deviation**2).sum(axis=(1,2)))
+        statistics.append(numpy.nan_to_num(autocorrelation))
+        statistics.append(x.var(axis=1).mean(axis=1))
+    at_bounds = numpy.zeros(series.shape[0])
+    if model["max_bound"] is not None:
+        at_bounds = at_bounds + (series[:,:,1:] >= model["max_bound"]).mean(axis=(1,2))
+    if model["min_bound"] is not None:
+        at_bounds = at_bounds + (series[:,:,1:] <= model["min_bound"]).mean(axis=(1,2))
+    statistics.append(at_bounds)
+    return numpy.column_stack(statistics)
+
+def get_candidate_params(model,candidates):
+    """Return a dict of parameter -> (n_candidates,) values, filling in fixed parameters"""
+    candidates = numpy.asarray(candidates,dtype=float)
+    params = {}
+    for name in ABC_PARAMETERS:
+        if name in model["parameters"]:
+            params[name] = candidates[:,model["parameters"].index(name)]
+        elif name in model["fixed_params"]:
+            params[name] = numpy.full(candidates.shape[0],float(model["fixed_params"][name]))
+        else:
+            #Unperturbed value of a perturbation parameter
+            params[name] = params[name.replace("perturbation_","")]
+    return params
+
+def simulate_candidates(model,candidates,seed=None):
+    """Return (n_candidates,n_subjects,n_timepoints) series simulated for candidate parameters
+
+    Each candidate's cohort starts at the observed first timepoint, so only
+    transitions are simulated.
+    """
+    candidates = numpy.atleast_2d(numpy.asarray(candidates,dtype=float))
+    params = get_candidate_params(model,candidates)
+    n_candidates = candidates.shape[0]
+    n_subjects,n_timepoints = model["observed"].shape
+    def per_row(values):
+        return numpy.repeat(values,n_subjects)[:,None]
+    base = dict((name,per_row(params[name])) for name in ("lambda","delta","mu"))
+    perturbed = dict((name,per_row(params["perturbation_" + name])) for name in ("lambda","delta","mu"))
+    start_coords = numpy.tile(model["observed"][:,0],n_candidates)[:,None]
+    cohort = MultivariateProcess(start_coords,["x"],base,method=model["method"],\
+      min_bound=model["min_bound"],max_bound=model["max_bound"],\
+      random_state=numpy.random.RandomState(seed),history_window=0)
+    series = numpy.empty((n_candidates * n_subjects,n_timepoints))
+    series[:,0] = start_coords[:,0]
+    for k in range(1,n_timepoints):
+        current = perturbed if model["perturbed"][k] else base
+        for name in ("lambda","delta","mu"):
+            cohort.Params[name] = current[name]
+        cohort.update(model["dt"])
+        series[:,k] = cohort.Coords[:,0]
+    return series.reshape(n_candidates,n_subjects,n_timepoints)
+
+def simulate_statistics_task(task):
+    """Return summary statistics of simulations for a batch of candidates (for use in a worker Pool)"""
+    model,candidates,seed = task
+    return get_summary_statistics(model,simulate_candidates(model,candidates,seed))
+
+def simulate_statistics(model,candidates,batch_size=1000,n_jobs=1,random_state=None):
+    """Return (n_candidates,n_statistics) summary statistics, simulating batches in parallel"""
+    random_state = get_random_state(random_state)
+    starts = range(0,candidates.shape[0],batch_size)
+    tasks = [(model,candidates[start:start+batch_size],int(random_state.randint(2**32)))\
+      for start in starts]
+    return numpy.vstack(run_in_pool(simulate_statistics_task,tasks,n_jobs))
+
+def get_statistic_scales(statistics):
+    """Return per-statistic scales (median absolute deviation, or 1 if 0) for distances"""
+    scales = 1.4826 * numpy.median(numpy.abs(statistics - numpy.median(statistics,axis=0)),axis=0)
+    return numpy.where(scales > 0,scales,1.0)
+
+def get_distances(model,statistics,scales):
+    """Return scaled Euclidean distances of simulated statistics from the observed statistics"""
+    return numpy.sqrt((((statistics - model["observed_statistics"]) / scales)**2).sum(axis=1))
+
+def sample_prior(model,n,random_state):
+    """Return (n,n_parameters) draws from the uniform prior"""
+    low,high = model["bounds"][:,0],model["bounds"][:,1]
+    return low + random_state.random_sample((n,len(low))) * (high - low)
+
+def in_prior(model,candidates):
+    """Return a boolean array: whether each candidate has non-zero prior density"""
+    return ((candidates >= model["bounds"][:,0]) & (candidates <= model["bounds"][:,1])).all(axis=1)
+
+def get_kernel_log_densities(candidates,particles,covariance):
+    """Return (n_candidates,n_particles) Gaussian kernel log densities (up to a constant)"""
+    cholesky = numpy.linalg.cholesky(covariance)
+    differences = candidates[:,None,:] - particles[None,:,:]
+    standardized = numpy.linalg.solve(cholesky,differences.reshape(-1,particles.shape[1]).T).T
+    return -0.5 * (standardized**2).sum(axis=1).reshape(candidates.shape[0],particles.shape[0])
+
+def get_kernel_covariance(particles,weights):
+    """Return twice the weighted covariance of particles (Beaumont et al. 2009), kept positive definite"""
+    covariance = 2.0 * numpy.atleast_2d(numpy.cov(particles.T,aweights=weights))
+    return covariance + 1e-12 * numpy.eye(particles.shape[1]) * max(1.0,numpy.trace(covariance))
+
+def run_abc_smc(model,n_particles=500,n_generations=10,alpha=0.5,batch_size=1000,\
+  batches_per_round=4,min_acceptance_rate=0.01,max_simulations=10**7,n_jobs=1,seed=None):
+    """Return a dict with the final ABC-SMC population and per-generation diagnostics
+
+    n_particles -- accepted particles per generation
+    n_generations -- maximum number of generations (including the prior generation)
+    alpha -- quantile of the previous distances used as the next tolerance
+    batch_size -- candidates per simulation task
+    batches_per_round -- tasks proposed together (and run in parallel) before
+      checking whether enough particles have been accepted
+    min_acceptance_rate,max_simulations -- stop early when a generation's acceptance
+      rate falls below min_acceptance_rate or simulations exceed max_simulations
+
+    Returned keys: parameters, particles (n_particles,n_parameters), weights, distances,
+    epsilon, and generations (dicts with GENERATION_COLUMNS).
+    """
+    if not 0 < alpha < 1:
+        raise ValueError("alpha must be between 0 and 1. Got: %s" %alpha)
+    random_state = numpy.random.RandomState(seed)
+    n_simulated = 0
+    start_time = perf_counter()
+    n_prior = int(numpy.ceil(n_particles / alpha))
+    candidates = sample_prior(model,n_prior,random_state)
+    statistics = simulate_statistics(model,candidates,batch_size,n_jobs,random_state)
+    scales = get_statistic_scales(statistics)
+    distances = get_distances(model,statistics,scales)
+    n_simulated += n_prior
+    order = numpy.argsort(distances,kind="mergesort")[:n_particles]
+    particles = candidates[order]
+    distances = distances[order]
+    weights = numpy.full(n_particles,1.0 / n_particles)
+    generations = [make_generation_row(0,distances.max(),n_prior,n_particles,start_time)]
+    log_generation(generations[-1])
+    for generation in range(1,n_generations):
+        epsilon = numpy.quantile(distances,alpha)
+        covariance = get_kernel_covariance(particles,weights)
+        start_time = perf_counter()
+        accepted = []
+        accepted_distances = []
+        n_generation_simulated = 0
+        n_round = batch_size * batches_per_round
+        while sum(len(a) for a in accepted) < n_particles:
+            proposals = particles[random_state.choice(n_particles,n_round,p=weights)]
+            proposals = proposals + random_state.multivariate_normal(numpy.zeros(len(model["parameters"])),\
+              covariance,n_round)
+            proposals = proposals[in_prior(model,proposals)]
+            if len(proposals):
+                round_distances = get_distances(model,simulate_statistics(model,proposals,\
+                  batch_size,n_jobs,random_state),scales)
+                keep = round_distances <= epsilon
+                accepted.append(proposals[keep])
+                accepted_distances.append(round_distances[keep])
+            n_generation_simulated += len(proposals)
+            n_accepted = sum(len(a) for a in accepted)
+            if n_simulated + n_generation_simulated >= max_simulations or\
+              (n_generation_simulated >= n_particles / min_acceptance_rate and\
+              n_accepted < min_acceptance_rate * n_generation_simulated):
+                break
+        n_simulated += n_generation_simulated
+        n_accepted = sum(len(a) for a in accepted)
+        if n_accepted < n_particles:
+            logger.info("Stopping: only %i of %i particles accepted at epsilon %.4g after %i simulations",\
+              n_accepted,n_particles,epsilon,n_generation_simulated)
+            break
+        new_particles = numpy.vstack(accepted)[:n_particles]
+        distances = numpy.concatenate(accepted_distances)[:n_particles]
+        #Uniform priors: weight = 1 / sum_j w_j K(theta | theta_j)
+        log_kernel = get_kernel_log_densities(new_particles,particles,covariance)
+        log_proposal = numpy.log(numpy.exp(log_kernel - log_kernel.max(axis=1,keepdims=True)).dot(weights))\
+          + log_kernel.max(axis=1)
+        new_weights = numpy.exp(log_proposal.min() - log_proposal)
+        particles = new_particles
+        weights = new_weights / new_weights.sum()
+        generations.append(make_generation_row(generation,epsilon,n_generation_simulated,n_particles,start_time))
+        log_generation(generations[-1])
+    return {"parameters":list(model["parameters"]),"particles":particles,"weights":weights,\
+      "distances":distances,"epsilon":generations[-1]["epsilon"],"generations":generations,\
+      "n_simulated":n_simulated}
+
+def make_generation_row(generation,epsilon,n_simulated,n_accepted,start_time):
+    """Return a dict of diagnostics (GENERATION_COLUMNS) for one generation"""
+    seconds = perf_counter() - start_time
+    return {"generation":generation,"epsilon":float(epsilon),"n_simulated":n_simulated,\
+      "n_accepted":n_accepted,"acceptance_rate":n_accepted / n_simulated if n_simulated else 0.0,\
+      "seconds":seconds,"candidates_per_second":n_simulated / seconds if seconds > 0 else numpy.inf}
+
+def log_generation(row):
+    logger.info("ABC generation %i: epsilon %.4g, acceptance rate %.3f, %.0f candidates/s",\
+      row["generation"],row["epsilon"],row["acceptance_rate"],row["candidates_per_second"])
+
+def get_weighted_quantiles(values,weights,quantiles):
+    """Return quantiles of values under normalized weights"""
+    order = numpy.argsort(values)
+    cumulative = numpy.cumsum(weights[order])
+    midpoints = (cumulative - 0.5 * weights[order]) / cumulative[-1]
+    return numpy.interp(quantiles,midpoints,values[order])
+
+def get_posterior_summary(result):
+    """Return a list of dicts (POSTERIOR_COLUMNS), one per parameter, from run_abc_smc results"""
+    rows = []
+    weights = result["weights"]
+    for i,name in enumerate(result["parameters"]):
+        values = result["particles"][:,i]
+        mean = float(numpy.dot(weights,values))
+        low,median,high = get_weighted_quantiles(values,weights,[0.025,0.5,0.975])
+        rows.append({"parameter":name,"mean":mean,"sd":float(numpy.sqrt(numpy.dot(weights,(values - mean)**2))),\
+          "q0.025":low,"median":median,"q0.975":high})
+    return rows
+
+def format_posterior_table(rows):
+    """Return lines of a tab-delimited table of posterior summaries"""
+    lines = ["\t".join(POSTERIOR_COLUMNS)+"\n"]
+    for row in rows:
+        lines.append("\t".join([row["parameter"]] + [repr(float(row[column])) for column in POSTERIOR_COLUMNS[1:]])+"\n")
+    return lines
+
+def format_generation_table(generations):
+    """Return lines of a tab-delimited table of per-generation diagnostics"""
+    lines = ["\t".join(GENERATION_COLUMNS)+"\n"]
+    for row in generations:
+        lines.append("\t".join(str(row[column]) for column in GENERATION_COLUMNS)+"\n")
+    return lines
+
+def parse_priors(priors_string):
+    """Return a dict of parameter -> (low,high) from e.g. 'lambda:0:1,delta:0.01:1'"""
+    priors = {}
+    for entry in priors_string.split(","):
+        try:
+            name,low,high = entry.split(":")
+            priors[name] = (float(low),float(high))
+        except ValueError:
+            raise ValueError("Priors must be given as name:low:high. Got: %s" %entry)
+    return priors
+
+def make_option_parser():
+    """Return an optparse OptionParser object"""
+    parser = OptionParser(usage = "%prog -i simulated_coordinates.tsv -o posterior.tsv --axis x",
+    description = "Infer OU parameters (and perturbation effects) of the subjects in a " +
+    "coordinates table by ABC-SMC, simulating candidate cohorts with clamping to " +
+    "the [-1,1] bounds and comparing summary statistics.",
+    version = __version__)
+
+    required_options = OptionGroup(parser, "Required options")
+    required_options.add_option('-i','--input',type="string",
+    help='tab-delimited coordinates table with SubjectID and Timepoint columns ' +
+    '(e.g. simulated_coordinates.tsv), or an ordination table with --metadata')
+    required_options.add_option('-o','--output',type="string",
+    help='output tab-delimited table of posterior summaries')
+    parser.add_option_group(required_options)
+
+    optional_options = OptionGroup(parser, "Optional options")
+    optional_options.add_option('-m','--metadata',default=None,type="string",
+    help='tab-delimited metadata table with SubjectID and Timepoint (and Treatment) columns [default: %default]')
+    optional_options.add_option('--axis',default=None,type="string",
+    help='Axis to fit [default: the first coordinate column]')
+    optional_options.add_option('--treatment',default=None,type="string",
+    help='Only fit subjects of this treatment [default: all subjects]')
+    optional_options.add_option('--priors',default="lambda:0.0:1.0,delta:0.01:1.0",type="string",
+    help='Comma-separated name:low:high uniform priors; valid names are ' +
+    ", ".join(ABC_PARAMETERS) + ' [default: %default]')
+    optional_options.add_option('--perturbation_windows',default=None,type="string",
+    help='Comma-separated start:end timepoints during which perturbation ' +
+    'parameters apply, e.g. 10:20,30:40 [default: %default]')
+    optional_options.add_option('--unbounded',default=False,action="store_true",
+    help='Simulate without clamping to [-1,1] [default: %default]')
+    optional_options.add_option('--n_particles',default=500,type="int",
+    help='Particles per generation [default: %default]')
+    optional_options.add_option('--n_generations',default=10,type="int",
+    help='Maximum number of generations [default: %default]')
+    optional_options.add_option('--alpha',default=0.5,type="float",
+    help='Quantile of distances used as the next tolerance [default: %default]')
+    optional_options.add_option('--batch_size',default=1000,type="int",
+    help='Candidates simulated together in one batch [default: %default]')
+    optional_options.add_option('--generations_output',default=None,type="string",
+    help='Optionally, write per-generation tolerances and throughput to this file [default: %default]')
+    optional_options.add_option('--n_jobs',default=1,type="int",
+    help='Number of worker processes [default: %default]')
+    optional_options.add_option('--seed',default=None,type="int",
+    help='Random seed [default: %default]')
+    parser.add_option_group(optional_options)
+    return parser
+
+def main():
+    parser = make_option_parser()
+    opts, args = parser.parse_args()
+    if opts.input is None or opts.output is None:
+        parser.error("An input table (-i) and output file (-o) are required")
+    logging.basicConfig(level=logging.INFO,format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    with open(opts.input) as input_file:
+        sample_ids,axes,coords,metadata = parse_coordinates_table(input_file,[opts.axis] if opts.axis else None)
+    if opts.metadata is not None:
+        with open(opts.metadata) as metadata_file:
+            sample_metadata = parse_metadata_table(metadata_file)
+        metadata = dict((column,[sample_metadata[s].get(column) for s in sample_ids])\
+          for column in ("SubjectID","Timepoint","Treatment"))
+    if metadata.get("SubjectID") is None or metadata.get("Timepoint") is None:
+        parser.error("SubjectID and Timepoint columns are required")
+    rows = numpy.arange(len(sample_ids))
+    if opts.treatment is not None:
+        if metadata.get("Treatment") is None:
+            parser.error("--treatment requires a Treatment column")
+        rows = numpy.array([i for i,t in enumerate(metadata["Treatment"]) if t == opts.treatment],dtype=int)
+        if not len(rows):
+            parser.error("No samples of treatment %s" %opts.treatment)
+    subjects,times,series = get_subject_series(coords[rows,:1],[metadata["SubjectID"][i] for i in rows],\
+      [metadata["Timepoint"][i] for i in rows])
+    #Subjects are aligned on the union of their timepoints, and only subjects
+    #sampled at every timepoint are fitted, so windows apply to the right observations
+    try:
+        grid,aligned = align_subject_series(times,series)
+    except ValueError as e:
+        parser.error(str(e))
+    complete = ~numpy.isnan(aligned[:,:,0]).any(axis=1)
+    if not complete.any():
+        parser.error("No subject was sampled at every timepoint (%s)" %", ".join(repr(float(t)) for t in grid))
+    if not complete.all():
+        logger.warning("Skipping %i of %i subjects not sampled at every timepoint: %s",\
+          (~complete).sum(),len(subjects),", ".join(s for s,c in zip(subjects,complete) if not c))
+    observed = aligned[complete,:,0]
+    n_timepoints = len(grid)
+    windows = []
+    if opts.perturbation_windows:
+        windows = [tuple(map(float,window.split(":"))) for window in opts.perturbation_windows.split(",")]
+    bounds = (None,None) if opts.unbounded else (-1.0,1.0)
+    try:
+        model = make_abc_model(observed,parse_priors(opts.priors),times=grid,\
+          perturbation_windows=windows,min_bound=bounds[0],max_bound=bounds[1])
+    except ValueError as e:
+        parser.error(str(e))
+    logger.info("Fitting %i subjects x %i timepoints on axis %s",observed.shape[0],n_timepoints,axes[0])
+    result = run_abc_smc(model,opts.n_particles,opts.n_generations,opts.alpha,opts.batch_size,\
+      n_jobs=opts.n_jobs,seed=opts.seed)
+    with open(opts.output,"w") as output_file:
+        output_file.writelines(format_posterior_table(get_posterior_summary(result)))
+    if opts.generations_output is not None:
+        with open(opts.generations_output,"w") as generations_file:
+            generations_file.writelines(format_generation_table(result["generations"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Parametric bootstrap confidence intervals for OU fits.
+#
+#Given fitted (Sigma,Lambda,Theta) for a series, B replicate series are simulated
+#from the fitted model at the series' own sampling times (all B in one batched
+#draw), each replicate is refitted, and percentile intervals of the refitted
+#parameters are reported.
+#
+#Regularly sampled series are refitted all at once with the closed-form
+#ou_likelihood.fit_OU_ar1, so B=1000 costs a few array operations per subject.
+#Irregularly sampled series are refitted with ou_likelihood.fit_OU_exact across
+#worker processes.
+#
+#Parameters use ou_likelihood's exact-transition convention, the one both
+#refitting estimators report. Estimates from fit_timeseries (whose Wiener
+#increments have scale Sigma**(2*dt) around an Euler step) describe a different
+#process, and are converted before simulation (see convert_fit_timeseries_params).
+
+from ou_likelihood import fit_OU_ar1,fit_OU_exact,get_transition_moments
+from shared_arrays import fit_timeseries_parallel,run_in_pool
+from multivariate_process import get_random_state
+import numpy
+import logging
+
+logger = logging.getLogger("karenina.bootstrap")
+
+PARAM_NAMES = ("Sigma","Lambda","Theta")
+PARAM_CONVENTIONS = ("ou_likelihood","fit_timeseries")
+
+def is_regular(times,rtol=1e-6):
+    """Return True if times are equally spaced"""
+    dts = numpy.diff(numpy.asarray(times,dtype=float))
+    return len(dts) > 0 and numpy.allclose(dts,dts[0],rtol=rtol,atol=0.0)
+
+def convert_fit_timeseries_params(params,dt):
+    """Return fit_timeseries (Sigma,Lambda,Theta) in ou_likelihood's exact-transition convention
+
+    fit_timeseries models a step of dt as x + dt*(Lambda*(Theta - x) + W) with
+    W ~ N(0,Sigma**(2*dt)), i.e. an AR(1) process with phi = 1 - Lambda*dt and
+    step standard deviation dt*Sigma**(2*dt). The returned parameters give the
+    same AR(1) process at spacing dt under the exact OU transition.
+    """
+    Sigma,Lambda,Theta = params
+    phi = 1.0 - Lambda * dt
+    if not 0.0 < phi <= 1.0:
+        raise ValueError("fit_timeseries estimates need 0 <= Lambda*dt < 1 to be converted. Got: %s" %(Lambda * dt))
+    step_sd = dt * Sigma**(2.0 * dt)
+    if phi == 1.0:
+        return step_sd / numpy.sqrt(dt),0.0,Theta
+    exact_Lambda = -numpy.log(phi) / dt
+    return step_sd * numpy.sqrt(2.0 * exact_Lambda / (1.0 - phi**2)),exact_Lambda,Theta
+
+def simulate_ou_replicates(Sigma,Lambda,Theta,times,x0,n_replicates,random_state=None):
+    """Return an (n_replicates,n_timepoints) array of OU series sampled at times
+
+    Every replicate starts at x0 (e.g. the first observation of the fitted series)
+    and follows the exact OU transition between consecutive times. All random
+    draws are made at once.
+    """
+    times = numpy.asarray(times,dtype=float)
+    random_state = get_random_state(random_state)
+    z = random_state.standard_normal((n_replicates,len(times) - 1))
+    dts = numpy.diff(times)
+    phi = numpy.exp(-Lambda * dts)
+    means,variances = get_transition_moments(numpy.zeros_like(dts),dts,Sigma,Lambda,0.0)
+    noise = z * numpy.sqrt(variances)
+    replicates = numpy.empty((n_replicates,len(times)))
+    replicates[:,0] = x0
+    for k in range(len(dts)):
+        replicates[:,k+1] = Theta + (replicates[:,k] - Theta) * phi[k] + noise[:,k]
+    return replicates
+
+def fit_replicates(replicates,times,n_jobs=1):
+    """Return an (n_replicates,4) array of (Sigma,Lambda,Theta,nlogLik) fits"""
+    times = numpy.asarray(times,dtype=float)
+    if is_regular(times):
+        return fit_OU_ar1(replicates,dt=times[1] - times[0])
+    shared_fits = fit_timeseries_parallel(list(replicates),[times]*len(replicates),n_jobs=n_jobs)
+    try:
+        return shared_fits.Array.copy()
+    finally:
+        shared_fits.unlink()
+
+def bootstrap_fit(x,times,params=None,n_replicates=1000,confidence=0.95,n_jobs=1,random_state=None,\
+  convention="ou_likelihood"):
+    """Return parametric bootstrap percentile intervals for an OU fit of one series
+
+    x -- 1d array of observations, ordered by time
+    times -- times of each observation
+    params -- fitted (Sigma,Lambda,Theta) in ou_likelihood's exact-transition convention,
+      from fit_OU_ar1 (regular times) or fit_OU_exact (irregular times), the estimators
+      the replicates are refitted with. If None, the series is fitted with them here.
+    convention -- 'ou_likelihood', or 'fit_timeseries' for params from
+      fit_timeseries.fit_timeseries, which are converted with convert_fit_timeseries_params
+      (regularly sampled series only)
+    n_replicates -- number of bootstrap replicates (B)
+    confidence -- width of the percentile intervals
+
+    Returns a dict of parameter name -> (estimate,low,high), where estimates are
+    the parameters the replicates were simulated from. Replicates with undefined
+    estimates (e.g. Theta without reversion) are ignored.
+    """
+    if convention not in PARAM_CONVENTIONS:
+        raise ValueError("convention must be one of %s. Got: %s" %(", ".join(PARAM_CONVENTIONS),convention))
+    x = numpy.asarray(x,dtype=float)
+    times = numpy.asarray(times,dtype=float)
+    if len(x) < 3:
+        raise ValueError("At least 3 observations are needed to bootstrap an OU fit. Got: %i" %len(x))
+    if params is None:
+        if is_regular(times):
+            params = fit_OU_ar1(x,dt=times[1] - times[0])[0,:3]
+        else:
+            params = fit_OU_exact(x,times)[:3]
+    elif convention == "fit_timeseries":
+        if not is_regular(times):
+            raise ValueError("fit_timeseries estimates can only be converted for regularly sampled series")
+        params = convert_fit_timeseries_params(params[:3],times[1] - times[0])
+    Sigma,Lambda,Theta = params[:3]
+    if numpy.isnan(Theta):
+        #No detectable reversion: simulate around the mean instead
+        Theta = x.mean()
+    replicates = simulate_ou_replicates(Sigma,Lambda,Theta,times,x[0],n_replicates,random_state)
+    fits = fit_replicates(replicates,times,n_jobs)
+    tail = 100.0 * (1.0 - confidence) / 2.0
+    result = {}
+    for k,(name,estimate) in enumerate(zip(PARAM_NAMES,(Sigma,Lambda,Theta))):
+        low,high = numpy.nanpercentile(fits[:,k],[tail,100.0 - tail])
+        result[name] = (float(estimate),float(low),float(high))
+    return result
+
+def bootstrap_fit_task(task):
+    """Run bootstrap_fit for one series (for use in a worker Pool)"""
+    x,times,params,options,seed = task
+    return bootstrap_fit(x,times,params,random_state=numpy.random.RandomState(seed),**options)
+
+def bootstrap_cohort(series,times,params=None,n_replicates=1000,confidence=0.95,n_jobs=1,seed=None,\
+  convention="ou_likelihood"):
+    """Return bootstrap_fit results for every series in a cohort, in parallel across series
+
+    series,times -- lists of 1d arrays, one per subject
+    params -- optionally, a list of fitted (Sigma,Lambda,Theta) per series (see bootstrap_fit)
+    convention -- the convention of params (see bootstrap_fit)
+    seed -- seed for reproducible results (independent of n_jobs)
+    """
+    if len(series) != len(times):
+        raise ValueError("Got %i series but %i time arrays" %(len(series),len(times)))
+    if params is None:
+        params = [None]*len(series)
+    seeds = numpy.random.SeedSequence(seed).generate_state(len(series))
+    options = {"n_replicates":n_replicates,"confidence":confidence,"convention":convention}
+    tasks = [(x,t,p,options,int(s)) for x,t,p,s in zip(series,times,params,seeds)]
+    return run_in_pool(bootstrap_fit_task,tasks,n_jobs)
@@ -0,0 +1,281 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Change-point detection for the onset of a perturbation.
+#
+#In real data the start of a perturbation is often unknown. For regularly
+#sampled series, an OU process is an AR(1) process
+#x(t+1) = Theta (1 - phi) + phi x(t) + e (see ou_likelihood.fit_OU_ar1), so a
+#shift in Sigma, Lambda or Theta at step k is a shift in the regression of x(t+1)
+#on x(t). Each candidate split is scored with the likelihood ratio
+#
+#score(k) = 2 (nlogLik(all steps) - nlogLik(steps before k) - nlogLik(steps from k))
+#
+#where each segment is fitted by maximum likelihood. Every segment fit only needs
+#six sums (n, sum x, sum y, sum xx, sum xy, sum yy), so cumulative sums give the
+#fits for all candidate splits of all series in one linear pass, with no refitting.
+#
+#The onset index k is the first timepoint whose update follows the new parameters,
+#matching Perturbation.Start in simulations. Scores are not p-values: the maximum
+#over splits of a likelihood ratio does not follow a chi-squared distribution.
+
+from ou_likelihood import pad_series,LOG_2PI,MIN_VARIANCE
+from shared_arrays import get_chunks,run_in_pool
+from dispersion import parse_coordinates_table,parse_metadata_table
+from optparse import OptionParser
+import numpy
+import logging
+
+logger = logging.getLogger("karenina.change_point")
+
+CHANGE_POINT_COLUMNS = ["Group","Axis","onset_index","onset_time","score"]
+
+def get_step_statistics(x):
+    """Return an (n_series,n_steps,6) array of per-step sufficient statistics
+
+    x -- (n_series,n_timepoints) array of regularly sampled series, NaN-padded
+
+    For each step x(t) -> x(t+1) the statistics are (1,x(t),x(t+1),x(t)**2,x(t)x(t+1),x(t+1)**2).
+    Steps touching a NaN are all zero. Series are centered first to limit
+    rounding error in the sums.
+    """
+    x = numpy.atleast_2d(numpy.asarray(x,dtype=float))
+    with numpy.errstate(invalid="ignore"):
+        centered = x - numpy.nanmean(x,axis=1)[:,None]
+    x_prev = centered[:,:-1]
+    x_next = centered[:,1:]
+    valid = ~(numpy.isnan(x_prev) | numpy.isnan(x_next))
+    x_prev = numpy.where(valid,x_prev,0.0)
+    x_next = numpy.where(valid,x_next,0.0)
+    return numpy.stack([valid.astype(float),x_prev,x_next,x_prev**2,x_prev*x_next,x_next**2],axis=-1)
+
+def get_segment_nlogLik(statistics,min_size=3):
+    """Return the maximized AR(1) negative log likelihood of segments from their statistics
+
+    statistics -- array with the 6 sufficient statistics on the last axis
+    Segments with fewer than min_size steps get NaN.
+    """
+    n,sx,sy,sxx,sxy,syy = numpy.moveaxis(statistics,-1,0)
+    with numpy.errstate(divide="ignore",invalid="ignore"):
+        mean_x = sx / n
+        mean_y = sy / n
+        var_x = sxx / n - mean_x**2
+        cov_xy = sxy / n - mean_x * mean_y
+        var_y = syy / n - mean_y**2
+        phi = numpy.where(var_x > 0,cov_xy / var_x,0.0)
+        residual_variance = numpy.maximum(var_y - phi * cov_xy,0.0) + MIN_VARIANCE
+        nlogLik = 0.5 * n * (LOG_2PI + numpy.log(residual_variance) + 1.0)
+    return numpy.where(n >= max(min_size,1),nlogLik,numpy.nan)
+
+def get_change_point_scores(x,min_size=3,pooled=False):
+    """Return likelihood ratio scores for every candidate onset of every series
+
+    x -- (n_series,n_timepoints) array of regularly sampled series, NaN-padded
+    min_size -- minimum number of steps on each side of a split
+    pooled -- if True, all series share one onset and one set of parameters per
+      segment (e.g. all individuals of a treatment), and one row of scores is returned
+
+    Returns an (n_series,n_timepoints - 1) array (or (1,n_timepoints - 1) if pooled).
+    Column k scores an onset at timepoint k; invalid splits are -inf.
+    """
+    statistics = get_step_statistics(x)
+    if pooled:
+        statistics = statistics.sum(axis=0,keepdims=True)
+    before = numpy.cumsum(statistics,axis=1) - statistics
+    total = before[:,-1:] + statistics[:,-1:]
+    after = total - before
+    nlogLik_all = get_segment_nlogLik(total,min_size)
+    nlogLik_split = get_segment_nlogLik(before,min_size) + get_segment_nlogLik(after,min_size)
+    scores = 2.0 * (nlogLik_all - nlogLik_split)
+    return numpy.where(numpy.isnan(scores),-numpy.inf,scores)
+
+def detect_change_points(x,times=None,min_size=3,pooled=False):
+    """Return (onset_index,onset_time,score) arrays of the best onset for each series
+
+    x -- (n_series,n_timepoints) NaN-padded array, or a 1d array for one series
+    times -- times of each column (default: 0..n_timepoints-1). Must be equally spaced;
+      extra trailing times (e.g. of a longer series) are ignored.
+    pooled -- find one shared onset for all series (arrays then have length 1)
+
+    Series too short for any split get onset_index -1 and NaN time and score.
+    """
+    x = numpy.atleast_2d(numpy.asarray(x,dtype=float))
+    if times is None:
+        times = numpy.arange(x.shape[1],dtype=float)
+    if len(times) < x.shape[1]:
+        raise ValueError("Got %i times for %i timepoints" %(len(times),x.shape[1]))
+    times = numpy.asarray(times,dtype=float)[:x.shape[1]]
+    dts = numpy.diff(times)
+    if len(dts) and not numpy.allclose(dts,dts[0],rtol=1e-6,atol=0.0):
+        raise ValueError("Change-point detection needs equally spaced timepoints")
+    if x.shape[1] < 2:
+        raise ValueError("At least 2 timepoints are needed to detect change points. Got: %i" %x.shape[1])
+    scores = get_change_point_scores(x,min_size,pooled)
+    onset_index = numpy.argmax(scores,axis=1)
+    score = scores[numpy.arange(len(scores)),onset_index]
+    found = numpy.isfinite(score)
+    onset_index = numpy.where(found,onset_index,-1)
+    onset_time = numpy.where(found,times[numpy.maximum(onset_index,0)],numpy.nan)
+    return onset_index,onset_time,numpy.where(found,score,numpy.nan)
+
+def detect_change_points_task(task):
+    """Run detect_change_points for a chunk of rows (for use in a worker Pool)"""
+    x,times,min_size = task
+    return detect_change_points(x,times,min_size)
+
+def detect_cohort_change_points(series,times=None,min_size=3,n_jobs=1,chunk_size=1000):
+    """Return (onset_index,onset_time,score) arrays for every series of a cohort
+
+    series -- list of 1d arrays (ragged lengths are NaN-padded) or a 2d array
+    times -- times shared by all series (default: 0..n_timepoints-1)
+    Rows are split into chunks of chunk_size, and chunks are scanned in parallel.
+    """
+    if isinstance(series,numpy.ndarray) and series.ndim == 2:
+        x = series
+    else:
+        x,padded_times = pad_series(series,[numpy.arange(len(s),dtype=float) for s in series])
+    tasks = [(x[start:end],times,min_size) for start,end in get_chunks(len(x),chunk_size)]
+    results = run_in_pool(detect_change_points_task,tasks,n_jobs)
+    if not results:
+        return numpy.zeros(0,dtype=int),numpy.zeros(0),numpy.zeros(0)
+    return tuple(numpy.concatenate(arrays) for arrays in zip(*results))
+
+def detect_group_change_points(series,groups,times=None,min_size=3):
+    """Return a dict of group -> (onset_index,onset_time,score) for a shared onset per group
+
+    series -- list of 1d arrays, one per individual, aligned at the same start time
+    groups -- the group (e.g. treatment) of each individual
+    """
+    if len(groups) != len(series):
+        raise ValueError("Got %i series but %i group labels" %(len(series),len(groups)))
+    results = {}
+    for group in sorted(set(groups)):
+        group_series = [s for s,g in zip(series,groups) if g == group]
+        x,padded_times = pad_series(group_series,[numpy.arange(len(s),dtype=float) for s in group_series])
+        onset_index,onset_time,score = detect_change_points(x,times,min_size,pooled=True)
+        results[group] = (int(onset_index[0]),float(onset_time[0]),float(score[0]))
+    return results
+
+def get_subject_series(coords,subject_ids,timepoints):
+    """Return (subject_ids,times,series) with each subject's rows of coords ordered by time
+
+    series -- a list of (n_timepoints,n_axes) arrays, one per subject
+    """
+    coords = numpy.asarray(coords,dtype=float)
+    timepoints = numpy.asarray([float(t) for t in timepoints])
+    subjects = sorted(set(subject_ids))
+    subject_ids = numpy.asarray(subject_ids)
+    times = []
+    series = []
+    for subject in subjects:
+        rows = numpy.where(subject_ids == subject)[0]
+        rows = rows[numpy.argsort(timepoints[rows],kind="mergesort")]
+        times.append(timepoints[rows])
+        series.append(coords[rows])
+    return subjects,times,series
+
+def align_subject_series(times,series):
+    """Return (grid,x) with every subject's series placed on the union of all subjects' times
+
+    times,series -- lists from get_subject_series
+    x -- an (n_subjects,n_grid,n_axes) array, NaN where a subject has no sample,
+      so steps into or out of a missing timepoint are skipped rather than
+      joined to the wrong neighbour
+    """
+    grid = numpy.unique(numpy.concatenate(times)) if len(times) else numpy.zeros(0)
+    n_axes = series[0].shape[1] if len(series) else 0
+    x = numpy.full((len(series),len(grid),n_axes),numpy.nan)
+    for i,(subject_times,subject_series) in enumerate(zip(times,series)):
+        columns = numpy.searchsorted(grid,subject_times)
+        if len(numpy.unique(columns)) != len(columns):
+            raise ValueError("Subject %i has more than one sample at the same timepoint" %i)
+        x[i,columns] = subject_series
+    return grid,x
+
+def format_change_point_table(rows):
+    """Return lines of a tab-delimited table of (group,axis,onset_index,onset_time,score) rows"""
+    lines = ["\t".join(CHANGE_POINT_COLUMNS)+"\n"]
+    for group,axis,onset_index,onset_time,score in rows:
+        lines.append("\t".join([str(group),str(axis),str(int(onset_index)),repr(float(onset_time)),\
+          repr(float(score))])+"\n")
+    return lines
+
+def make_option_parser():
+    """Return an optparse OptionParser object"""
+    parser = OptionParser(usage = "%prog -i simulated_coordinates.tsv -o change_points.tsv",
+    description = "Estimate when a perturbation started in each subject (or each " +
+    "treatment) of a coordinates table, by scanning every timepoint for a shift " +
+    "in OU parameters. Timepoints must be equally spaced.",
+    version = __version__)
+    parser.add_option('-i','--input',type="string",
+    help='tab-delimited coordinates table with SubjectID and Timepoint columns')
+    parser.add_option('-o','--output',type="string",
+    help='output tab-delimited table of onsets and likelihood ratio scores')
+    parser.add_option('-m','--metadata',default=None,type="string",
+    help='optional metadata mapping file with SubjectID, Timepoint and Treatment columns [default: %default]')
+    parser.add_option('--axes',default=None,type="string",
+    help='comma-separated coordinate columns to scan [default: all non-metadata columns]')
+    parser.add_option('--by',default="subject",type="choice",choices=["subject","treatment"],
+    help='find an onset per subject, or one shared onset per treatment [default: %default]')
+    parser.add_option('--min_size',default=3,type="int",
+    help='minimum number of steps before and after an onset [default: %default]')
+    parser.add_option('--n_jobs',default=1,type="int",
+    help='number of worker processes for per-subject scans [default: %default]')
+    return parser
+
+def main():
+    parser = make_option_parser()
+    opts, args = parser.parse_args()
+    if opts.input is None or opts.output is None:
+        parser.error("An input table (-i) and output file (-o) are required")
+    logging.basicConfig(level=logging.INFO,format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    axes = opts.axes.split(",") if opts.axes else None
+    with open(opts.input) as input_file:
+        sample_ids,axes,coords,metadata = parse_coordinates_table(input_file,axes)
+    if opts.metadata is not None:
+        with open(opts.metadata) as metadata_file:
+            sample_metadata = parse_metadata_table(metadata_file)
+        metadata = dict((column,[sample_metadata[s].get(column) for s in sample_ids])\
+          for column in ("SubjectID","Timepoint","Treatment"))
+    if metadata.get("SubjectID") is None or metadata.get("Timepoint") is None:
+        parser.error("SubjectID and Timepoint columns are required")
+    subjects,times,series = get_subject_series(coords,metadata["SubjectID"],metadata["Timepoint"])
+    try:
+        grid,x = align_subject_series(times,series)
+    except ValueError as e:
+        parser.error(str(e))
+    dts = numpy.diff(grid)
+    if len(dts) and not numpy.allclose(dts,dts[0],rtol=1e-6,atol=0.0):
+        parser.error("Timepoints of all subjects must lie on one equally spaced grid. Got: %s"\
+          %", ".join(repr(float(t)) for t in grid))
+    missing = numpy.isnan(x[:,:,0]).sum()
+    if missing:
+        logger.info("%i subject timepoints are missing; steps across them are skipped",missing)
+    rows = []
+    if opts.by == "treatment":
+        treatment_of = dict(zip(metadata["SubjectID"],metadata["Treatment"]))
+        groups = [treatment_of[s] for s in subjects]
+        for a,axis in enumerate(axes):
+            results = detect_group_change_points(list(x[:,:,a]),groups,grid,opts.min_size)
+            rows.extend((group,axis) + results[group] for group in sorted(results))
+    else:
+        for a,axis in enumerate(axes):
+            onset_index,onset_time,score = detect_cohort_change_points(x[:,:,a],grid,opts.min_size,\
+              n_jobs=opts.n_jobs)
+            rows.extend(zip(subjects,[axis]*len(subjects),onset_index,onset_time,score))
+    logger.info("Scanned %i subjects on %i axes",len(subjects),len(axes))
+    with open(opts.output,"w") as output_file:
+        output_file.writelines(format_change_point_table(rows))
+
+if __name__ == "__main__":
+    main()
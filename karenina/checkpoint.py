@@ -0,0 +1,77 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import gzip
+import pickle
+import random
+from os import remove,replace
+from os.path import exists
+
+import numpy
+
+CHECKPOINT_FORMAT_VERSION = 1
+
+def save_checkpoint(experiment,checkpoint_path,next_timepoint,compresslevel=6):
+    """Write the full state of an experiment to a compressed checkpoint file
+
+    experiment -- an Experiment object (individuals, histories, perturbations
+      and collected data are all saved)
+    checkpoint_path -- path of the checkpoint file to write
+    next_timepoint -- the first timepoint that has NOT yet been simulated.
+      Simulation resumes from here.
+    compresslevel -- gzip compression level (1-9)
+
+    The state of both random number generators used by the simulation
+    (python's random module, used for starting positions, and numpy's
+    global generator, used by Process objects) is stored alongside the
+    experiment, so a resumed run continues bit-identically.
+
+    The file is written to a temporary path and then moved into place, so
+    a job killed mid-write never leaves a truncated checkpoint behind.
+    """
+    state = {"format_version":CHECKPOINT_FORMAT_VERSION,\
+      "next_timepoint":next_timepoint,\
+      "experiment":experiment,\
+      "python_random_state":random.getstate(),\
+      "numpy_random_state":numpy.random.get_state()}
+
+    tmp_path = checkpoint_path + ".tmp"
+    try:
+        with gzip.open(tmp_path,"wb",compresslevel=compresslevel) as checkpoint_file:
+            pickle.dump(state,checkpoint_file,protocol=pickle.HIGHEST_PROTOCOL)
+        replace(tmp_path,checkpoint_path)
+    finally:
+        if exists(tmp_path):
+            remove(tmp_path)
+
+def load_checkpoint(checkpoint_path,restore_random_state=True):
+    """Return (experiment,next_timepoint) from a checkpoint file
+
+    checkpoint_path -- path to a file written by save_checkpoint
+    restore_random_state -- if True, reset python and numpy random number
+      generators to their state at the time of the checkpoint.  This is
+      required for a resumed run to be identical to an uninterrupted one.
+    """
+    with gzip.open(checkpoint_path,"rb") as checkpoint_file:
+        state = pickle.load(checkpoint_file)
+
+    version = state.get("format_version")
+    if version != CHECKPOINT_FORMAT_VERSION:
+        raise ValueError("Unsupported checkpoint format version %s in %s (expected %i)"\
+          %(version,checkpoint_path,CHECKPOINT_FORMAT_VERSION))
+
+    if restore_random_state:
+        random.setstate(state["python_random_state"])
+        numpy.random.set_state(state["numpy_random_state"])
+
+    return state["experiment"],state["next_timepoint"]
@@ -0,0 +1,234 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Dispersion metrics for testing the Anna Karenina principle: are perturbed
+#communities more dispersed than unperturbed ones at the same timepoint?
+#
+#For each treatment and timepoint, three metrics of the spread of individuals
+#in ordination space are reported:
+#
+#centroid_distance -- mean Euclidean distance of individuals to their centroid
+#mean_pairwise_distance -- mean Euclidean distance between all pairs of individuals
+#variance -- total variance of positions (sum over axes of per-axis variance)
+#
+#Pairwise distances are computed in blocks of rows, so only a bounded number
+#of distances (max_block_size) is held in memory at once, even for 10,000+ individuals.
+
+from sinks import Sink,format_timepoint
+from scipy.spatial.distance import cdist
+import numpy
+
+DISPERSION_COLUMNS = ["Treatment","Timepoint","n_samples","centroid_distance",\
+  "mean_pairwise_distance","variance"]
+METADATA_COLUMNS = ("SampleID","SubjectID","Treatment","Timepoint")
+DEFAULT_MAX_BLOCK_SIZE = 2**22
+
+def get_chunk_size(n_rows,n_columns,max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Return the number of rows per block so a block has at most max_block_size entries"""
+    return max(1,int(max_block_size // max(1,n_columns)))
+
+def get_centroid_distances(coords):
+    """Return the Euclidean distance of each row of coords to their centroid"""
+    coords = numpy.asarray(coords,dtype=float)
+    return numpy.sqrt(((coords - coords.mean(axis=0))**2).sum(axis=1))
+
+def iter_condensed_distance_blocks(coords,max_block_size=DEFAULT_MAX_BLOCK_SIZE,metric="euclidean"):
+    """Yield (start,distances) blocks of the condensed pairwise distance vector of coords
+
+    Concatenating the blocks gives the same result as scipy.spatial.distance.pdist(coords),
+    i.e. distances for pairs (i,j), i < j, in row-major order. start is the index of
+    the block's first entry in that vector. Each block covers a range of rows i.
+    """
+    coords = numpy.asarray(coords,dtype=float)
+    n_rows = coords.shape[0]
+    chunk_size = get_chunk_size(n_rows,n_rows,max_block_size)
+    start = 0
+    for row_start in range(0,n_rows - 1,chunk_size):
+        row_end = min(row_start + chunk_size,n_rows - 1)
+        block = cdist(coords[row_start:row_end],coords[row_start + 1:],metric=metric)
+        #Keep pairs with j > i: row r of the block holds i = row_start + r
+        rows = numpy.arange(row_end - row_start)[:,None]
+        columns = numpy.arange(block.shape[1])[None,:]
+        distances = block[columns >= rows]
+        yield start,distances
+        start += len(distances)
+
+def get_mean_pairwise_distance(coords,max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Return the mean Euclidean distance between all pairs of rows of coords"""
+    n_rows = numpy.shape(coords)[0]
+    if n_rows < 2:
+        return numpy.nan
+    total = 0.0
+    for start,distances in iter_condensed_distance_blocks(coords,max_block_size):
+        total += distances.sum()
+    return total / (n_rows * (n_rows - 1) / 2.0)
+
+def get_dispersion_metrics(coords,max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Return a dict of dispersion metrics for an (n_samples,n_axes) array of positions"""
+    coords = numpy.asarray(coords,dtype=float)
+    n_samples = coords.shape[0]
+    if n_samples == 0:
+        raise ValueError("Can't calculate dispersion metrics for 0 samples")
+    return {"n_samples":n_samples,\
+      "centroid_distance":float(get_centroid_distances(coords).mean()),\
+      "mean_pairwise_distance":float(get_mean_pairwise_distance(coords,max_block_size)),\
+      "variance":float(coords.var(axis=0,ddof=1).sum()) if n_samples > 1 else numpy.nan}
+
+def get_dispersion_by_group(coords,treatments,timepoints,max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Return dispersion metric rows (dicts) for every treatment x timepoint
+
+    coords -- (n_samples,n_axes) array of positions
+    treatments,timepoints -- the treatment and timepoint of each sample
+    """
+    coords = numpy.asarray(coords,dtype=float)
+    treatments = numpy.asarray(treatments)
+    timepoints = numpy.asarray(timepoints)
+    groups = sorted(set(zip(treatments.tolist(),timepoints.tolist())))
+    rows = []
+    for treatment,timepoint in groups:
+        in_group = (treatments == treatment) & (timepoints == timepoint)
+        row = {"Treatment":treatment,"Timepoint":timepoint}
+        row.update(get_dispersion_metrics(coords[in_group],max_block_size))
+        rows.append(row)
+    return rows
+
+def get_cohort_dispersion(history,treatment_name,timepoints=None,max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Return dispersion metric rows for each timepoint of a simulated cohort
+
+    history -- (n_individuals,n_timepoints,n_axes) array, e.g. from
+      MultivariateProcess.get_history_array()
+    timepoints -- labels for each timepoint (default: 0..n_timepoints-1)
+    """
+    history = numpy.asarray(history,dtype=float)
+    if timepoints is None:
+        timepoints = range(history.shape[1])
+    rows = []
+    for t,timepoint in enumerate(timepoints):
+        row = {"Treatment":treatment_name,"Timepoint":timepoint}
+        row.update(get_dispersion_metrics(history[:,t],max_block_size))
+        rows.append(row)
+    return rows
+
+class DispersionSink(Sink):
+    """Calculate dispersion metrics for each treatment at each timepoint as it is simulated
+
+    Rows (dicts with DISPERSION_COLUMNS) accumulate in self.Rows. Since only the
+    metrics are kept, this works with history-free simulation (history_window=0).
+    When individuals are sampled at irregular times, samples sharing a time are grouped.
+    """
+
+    def __init__(self,max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+        self.MaxBlockSize = max_block_size
+        self.Rows = []
+
+    def write(self,treatment_name,t,subject_ids,coords):
+        if numpy.ndim(t) == 0:
+            row = {"Treatment":treatment_name,"Timepoint":t}
+            row.update(get_dispersion_metrics(coords,self.MaxBlockSize))
+            self.Rows.append(row)
+            return
+        self.Rows.extend(get_dispersion_by_group(coords,[treatment_name]*len(subject_ids),t,self.MaxBlockSize))
+
+def format_dispersion_table(rows):
+    """Return lines of a tab-delimited table of dispersion metric rows"""
+    lines = ["\t".join(DISPERSION_COLUMNS)+"\n"]
+    for row in rows:
+        timepoint = row["Timepoint"]
+        if not isinstance(timepoint,str):
+            timepoint = format_timepoint(timepoint)
+        fields = [str(row["Treatment"]),timepoint,str(row["n_samples"])]
+        fields.extend(repr(row[column]) for column in DISPERSION_COLUMNS[3:])
+        lines.append("\t".join(fields)+"\n")
+    return lines
+
+def parse_table_lines(lines):
+    """Return (headers,rows) for a tab-delimited table with a header line
+
+    A leading '#' on the header (e.g. '#SampleID') is removed. Other lines
+    starting with '#' and blank lines are skipped.
+    """
+    headers = None
+    rows = []
+    for line in lines:
+        if not line.strip():
+            continue
+        fields = line.rstrip("\r\n").split("\t")
+        if headers is None:
+            headers = [fields[0].lstrip("#")] + fields[1:]
+            continue
+        if line.startswith("#"):
+            continue
+        rows.append(fields)
+    if headers is None:
+        raise ValueError("Table has no header line")
+    return headers,rows
+
+def parse_coordinates_table(lines,axes=None):
+    """Return (sample_ids,axes,coords,metadata) from a tab-delimited coordinates table
+
+    The first column holds sample ids. Coordinate columns are the given axes,
+    or by default every column except SubjectID, Treatment and Timepoint. Tables
+    written by sinks.TSVFileSink, or ordination coordinates exported as a table
+    (e.g. PC1, PC2, PC3 columns) can be read.
+
+    metadata -- a dict of column name -> list of values, for non-coordinate columns
+    """
+    headers,rows = parse_table_lines(lines)
+    if axes is None:
+        axes = [h for h in headers[1:] if h not in METADATA_COLUMNS]
+    missing = [axis for axis in axes if axis not in headers]
+    if missing:
+        raise ValueError("Coordinates table has no column for axes: %s" %", ".join(missing))
+    axis_indices = [headers.index(axis) for axis in axes]
+    sample_ids = [row[0] for row in rows]
+    try:
+        coords = numpy.array([[float(row[i]) for i in axis_indices] for row in rows])
+    except ValueError as e:
+        raise ValueError("Coordinates must be numeric: %s" %e)
+    metadata = dict((h,[row[i] for row in rows]) for i,h in enumerate(headers)\
+      if i > 0 and i not in axis_indices)
+    return sample_ids,list(axes),coords.reshape(len(rows),len(axes)),metadata
+
+def parse_metadata_table(lines):
+    """Return a dict of sample id -> dict of metadata values from a tab-delimited mapping file"""
+    headers,rows = parse_table_lines(lines)
+    return dict((row[0],dict(zip(headers[1:],row[1:]))) for row in rows)
+
+def get_ordination_dispersion(coordinate_lines,metadata_lines=None,treatment_column="Treatment",\
+  timepoint_column="Timepoint",axes=None,max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Return dispersion metric rows for an ordination of real (or simulated) samples
+
+    coordinate_lines -- lines of a coordinates table (see parse_coordinates_table)
+    metadata_lines -- optionally, lines of a metadata mapping file. If not given,
+      treatment_column and timepoint_column must be in the coordinates table.
+    Samples without metadata are skipped. Numeric timepoints sort numerically.
+    """
+    sample_ids,axes,coords,table_metadata = parse_coordinates_table(coordinate_lines,axes)
+    if metadata_lines is not None:
+        metadata = parse_metadata_table(metadata_lines)
+        keep = numpy.array([s in metadata for s in sample_ids],dtype=bool)
+        sample_metadata = [metadata[s] for s in sample_ids if s in metadata]
+    else:
+        keep = numpy.ones(len(sample_ids),dtype=bool)
+        sample_metadata = [dict((column,values[i]) for column,values in table_metadata.items())\
+          for i in range(len(sample_ids))]
+    try:
+        treatments = [m[treatment_column] for m in sample_metadata]
+        timepoints = [m[timepoint_column] for m in sample_metadata]
+    except KeyError as e:
+        raise ValueError("No metadata column %s" %str(e))
+    try:
+        timepoints = [float(t) for t in timepoints]
+    except ValueError:
+        pass
+    return get_dispersion_by_group(coords[keep],treatments,timepoints,max_block_size)
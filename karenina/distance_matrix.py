@@ -0,0 +1,245 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#On-disk distance matrices between all samples (e.g. every subject x timepoint).
+#
+#Distances are computed in blocks and written straight to disk, so the full
+#matrix is never held in memory. A distance matrix is a directory containing:
+#
+#manifest.json -- format, dtype, number of samples and the list of groups
+#sample_ids.txt -- one sample id per line, in matrix order
+#one matrix per group, either:
+#  condensed -- <group>.npy, a memory-mappable condensed vector of the distances
+#    between the group's samples (as from scipy.spatial.distance.pdist)
+#  tiled -- <group>/tile_<row>_<column>.npy, square tiles of the upper
+#    triangle of the group's dense matrix (row <= column)
+#
+#Without a restriction there is one group ('all'). With restrict_to='timepoint'
+#or 'subject', only pairs of samples sharing a timepoint (or subject) are computed,
+#which keeps within-timepoint comparisons practical for very large cohorts.
+
+from dispersion import iter_condensed_distance_blocks,parse_coordinates_table,\
+  parse_metadata_table,DEFAULT_MAX_BLOCK_SIZE
+from scipy.spatial.distance import cdist,squareform
+from numpy.lib.format import open_memmap
+from optparse import OptionParser
+from os import makedirs
+from os.path import join,exists
+import numpy
+import json
+import logging
+
+logger = logging.getLogger("karenina.distance_matrix")
+
+DISTANCE_MATRIX_FORMATS = ("condensed","tiled")
+RESTRICTIONS = ("timepoint","subject")
+MANIFEST_FILENAME = "manifest.json"
+SAMPLE_IDS_FILENAME = "sample_ids.txt"
+
+def get_condensed_index(i,j,n):
+    """Return the index of the distance between samples i and j (i != j) in a condensed vector"""
+    i,j = numpy.minimum(i,j),numpy.maximum(i,j)
+    return n*i - i*(i+1)//2 + (j - i - 1)
+
+def write_condensed_distances(coords,output_path,dtype="float32",max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Write the condensed distance vector of coords to a .npy file, block by block"""
+    n_samples = coords.shape[0]
+    distances = open_memmap(output_path,mode="w+",dtype=dtype,shape=(n_samples*(n_samples-1)//2,))
+    for start,block in iter_condensed_distance_blocks(coords,max_block_size):
+        distances[start:start+len(block)] = block
+    distances.flush()
+    del distances
+
+def write_distance_tiles(coords,output_dir,tile_size=2048,dtype="float32"):
+    """Write the upper-triangle tiles of the dense distance matrix of coords to output_dir"""
+    if not exists(output_dir):
+        makedirs(output_dir)
+    n_samples = coords.shape[0]
+    for row_start in range(0,n_samples,tile_size):
+        for column_start in range(row_start,n_samples,tile_size):
+            tile = cdist(coords[row_start:row_start+tile_size],coords[column_start:column_start+tile_size])
+            numpy.save(join(output_dir,"tile_%i_%i.npy" %(row_start//tile_size,column_start//tile_size)),\
+              tile.astype(dtype))
+
+def get_sample_groups(n_samples,restrict_to=None,subject_ids=None,timepoints=None):
+    """Return a list of (group name,sample indices) to compute distances within
+
+    restrict_to -- None (one group of all samples), 'timepoint' or 'subject'
+    """
+    if restrict_to is None:
+        return [("all",numpy.arange(n_samples))]
+    if restrict_to not in RESTRICTIONS:
+        raise ValueError("restrict_to must be None or one of %s. Got: %s" %(", ".join(RESTRICTIONS),restrict_to))
+    labels = timepoints if restrict_to == "timepoint" else subject_ids
+    if labels is None:
+        raise ValueError("Restricting distances to within each %s requires %s labels for every sample" %(restrict_to,restrict_to))
+    if len(labels) != n_samples:
+        raise ValueError("Got %i %s labels for %i samples" %(len(labels),restrict_to,n_samples))
+    labels = numpy.asarray([str(label) for label in labels])
+    names,inverse = numpy.unique(labels,return_inverse=True)
+    return [("%s_%s" %(restrict_to,name),numpy.nonzero(inverse == k)[0]) for k,name in enumerate(names)]
+
+def write_distance_matrix(coords,sample_ids,output_dir,format="condensed",restrict_to=None,\
+  subject_ids=None,timepoints=None,dtype="float32",tile_size=2048,max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Write Euclidean distances between samples to an on-disk distance matrix directory
+
+    coords -- (n_samples,n_axes) array of sample positions
+    sample_ids -- ids of each sample
+    format -- 'condensed' or 'tiled' (see above)
+    restrict_to -- None, 'timepoint' or 'subject' to compute only distances within groups,
+      using the given timepoints or subject_ids of each sample
+    dtype -- dtype of stored distances. float32 halves the size on disk.
+
+    Samples are written grouped, so matrix order may differ from input order.
+    Returns the manifest dict.
+    """
+    if format not in DISTANCE_MATRIX_FORMATS:
+        raise ValueError("format must be one of %s. Got: %s" %(", ".join(DISTANCE_MATRIX_FORMATS),format))
+    coords = numpy.asarray(coords,dtype=float)
+    if len(sample_ids) != coords.shape[0]:
+        raise ValueError("Got %i sample ids for %i samples" %(len(sample_ids),coords.shape[0]))
+    if not exists(output_dir):
+        makedirs(output_dir)
+
+    groups = get_sample_groups(coords.shape[0],restrict_to,subject_ids,timepoints)
+    manifest = {"format":format,"dtype":numpy.dtype(dtype).str,"n_samples":coords.shape[0],\
+      "restrict_to":restrict_to,"tile_size":tile_size,"groups":[]}
+    ordered_ids = []
+    for name,indices in groups:
+        logger.info("Writing distances between %i samples for group %s",len(indices),name)
+        group_coords = coords[indices]
+        if format == "condensed":
+            write_condensed_distances(group_coords,join(output_dir,"%s.npy" %name),dtype,max_block_size)
+        else:
+            write_distance_tiles(group_coords,join(output_dir,name),tile_size,dtype)
+        manifest["groups"].append({"name":name,"start":len(ordered_ids),"n_samples":len(indices)})
+        ordered_ids.extend(sample_ids[i] for i in indices)
+
+    with open(join(output_dir,SAMPLE_IDS_FILENAME),"w") as ids_file:
+        ids_file.write("".join("%s\n" %sample_id for sample_id in ordered_ids))
+    with open(join(output_dir,MANIFEST_FILENAME),"w") as manifest_file:
+        json.dump(manifest,manifest_file,indent=2)
+    return manifest
+
+class OnDiskDistanceMatrix(object):
+    """Read distances from a directory written by write_distance_matrix
+
+    Distances are read from memory-mapped files, so opening a matrix is cheap
+    regardless of its size.
+    """
+
+    def __init__(self,matrix_dir):
+        self.MatrixDir = matrix_dir
+        with open(join(matrix_dir,MANIFEST_FILENAME)) as manifest_file:
+            self.Manifest = json.load(manifest_file)
+        with open(join(matrix_dir,SAMPLE_IDS_FILENAME)) as ids_file:
+            self.SampleIds = [line.rstrip("\n") for line in ids_file]
+        self.Groups = dict((group["name"],group) for group in self.Manifest["groups"])
+        #sample id -> (group name,index within group)
+        self.SampleIndex = {}
+        for group in self.Manifest["groups"]:
+            for k in range(group["n_samples"]):
+                self.SampleIndex[self.SampleIds[group["start"]+k]] = (group["name"],k)
+
+    def get_group_ids(self,group_name):
+        group = self.Groups[group_name]
+        return self.SampleIds[group["start"]:group["start"]+group["n_samples"]]
+
+    def get_condensed(self,group_name):
+        """Return a read-only memory map of a group's condensed distances (condensed format only)"""
+        if self.Manifest["format"] != "condensed":
+            raise ValueError("get_condensed requires a condensed distance matrix")
+        return numpy.load(join(self.MatrixDir,"%s.npy" %group_name),mmap_mode="r")
+
+    def get_tile(self,group_name,row,column):
+        """Return tile (row,column) of a group's dense matrix (tiled format only)"""
+        if row > column:
+            return self.get_tile(group_name,column,row).T
+        return numpy.load(join(self.MatrixDir,group_name,"tile_%i_%i.npy" %(row,column)),mmap_mode="r")
+
+    def get_distance(self,sample_id_1,sample_id_2):
+        """Return the distance between two samples
+
+        Raises a KeyError if the samples are in different groups of a restricted matrix.
+        """
+        group_1,i = self.SampleIndex[sample_id_1]
+        group_2,j = self.SampleIndex[sample_id_2]
+        if group_1 != group_2:
+            raise KeyError("Distances between %s and %s were not computed (matrix restricted to within %s)"\
+              %(sample_id_1,sample_id_2,self.Manifest["restrict_to"]))
+        if i == j:
+            return 0.0
+        if self.Manifest["format"] == "condensed":
+            n_samples = self.Groups[group_1]["n_samples"]
+            return float(self.get_condensed(group_1)[get_condensed_index(i,j,n_samples)])
+        tile_size = self.Manifest["tile_size"]
+        tile = self.get_tile(group_1,i//tile_size,j//tile_size)
+        return float(tile[i % tile_size,j % tile_size])
+
+    def get_dense(self,group_name="all"):
+        """Return a group's dense (n,n) distance matrix. Only practical for moderate n."""
+        n_samples = self.Groups[group_name]["n_samples"]
+        if self.Manifest["format"] == "condensed":
+            return squareform(numpy.asarray(self.get_condensed(group_name),dtype=float))
+        tile_size = self.Manifest["tile_size"]
+        n_tiles = (n_samples + tile_size - 1) // tile_size
+        return numpy.block([[numpy.asarray(self.get_tile(group_name,r,c),dtype=float)\
+          for c in range(n_tiles)] for r in range(n_tiles)])
+
+def make_option_parser():
+    """Return an optparse OptionParser object"""
+    parser = OptionParser(usage = "%prog -i simulated_coordinates.tsv -o distance_matrix",
+    description = "Write an on-disk distance matrix between all samples in a " +
+    "coordinates table (e.g. simulated_coordinates.tsv, or an exported ordination), " +
+    "computing distances in blocks so the full matrix is never held in memory.",
+    version = __version__)
+    parser.add_option('-i','--input',type="string",
+    help='tab-delimited coordinates table with sample ids in the first column')
+    parser.add_option('-o','--output',type="string",
+    help='output directory for the distance matrix')
+    parser.add_option('-m','--metadata',default=None,type="string",
+    help='optional metadata mapping file with SubjectID and/or Timepoint columns [default: %default]')
+    parser.add_option('--axes',default=None,type="string",
+    help='comma-separated coordinate columns to use [default: all non-metadata columns]')
+    parser.add_option('--format',default="condensed",type="choice",choices=list(DISTANCE_MATRIX_FORMATS),
+    help='on-disk format: condensed or tiled [default: %default]')
+    parser.add_option('--restrict_to',default=None,type="choice",choices=list(RESTRICTIONS),
+    help='only compute distances between samples from the same timepoint or subject [default: all pairs]')
+    parser.add_option('--dtype',default="float32",type="choice",choices=["float32","float64"],
+    help='stored distance precision [default: %default]')
+    parser.add_option('--tile_size',default=2048,type="int",
+    help='tile width for the tiled format [default: %default]')
+    return parser
+
+def main():
+    parser = make_option_parser()
+    opts, args = parser.parse_args()
+    if opts.input is None or opts.output is None:
+        parser.error("An input table (-i) and output directory (-o) are required")
+    logging.basicConfig(level=logging.INFO,format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    axes = opts.axes.split(",") if opts.axes else None
+    with open(opts.input) as input_file:
+        sample_ids,axes,coords,metadata = parse_coordinates_table(input_file,axes)
+    subject_ids = metadata.get("SubjectID")
+    timepoints = metadata.get("Timepoint")
+    if opts.metadata is not None:
+        with open(opts.metadata) as metadata_file:
+            sample_metadata = parse_metadata_table(metadata_file)
+        subject_ids = [sample_metadata[s].get("SubjectID") for s in sample_ids]
+        timepoints = [sample_metadata[s].get("Timepoint") for s in sample_ids]
+    write_distance_matrix(coords,sample_ids,opts.output,format=opts.format,\
+      restrict_to=opts.restrict_to,subject_ids=subject_ids,timepoints=timepoints,\
+      dtype=opts.dtype,tile_size=opts.tile_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Streaming summaries of simulated ensembles.
+#
+#EnsembleStatisticsSink receives coordinates from the simulation loop and keeps,
+#per treatment x timepoint (and per axis), only:
+#
+#RunningMoments -- count, mean, variance (Welford / Chan et al. batch updates),
+#  minimum and maximum
+#QuantileSketch -- a mergeable compactor sketch (as in KLL) of at most about
+#  2 * sketch_size values per level. Quantiles are exact until more than
+#  sketch_size values are added, and have a rank error of roughly
+#  log2(n / sketch_size) / sketch_size beyond that.
+#
+#Memory therefore depends on the number of treatments and timepoints, not on
+#the number of individuals, so with history_window=0 mean, variance and
+#quantile trajectories can be produced for very large cohorts. Coordinates for
+#the same treatment and timepoint may arrive in several batches (e.g. in chunks).
+
+from sinks import Sink,format_timepoint
+import numpy
+
+DEFAULT_QUANTILES = (0.05,0.25,0.5,0.75,0.95)
+DEFAULT_SKETCH_SIZE = 256
+ENSEMBLE_COLUMNS = ["Treatment","Timepoint","Axis","n","mean","variance","sd","min","max"]
+
+class RunningMoments(object):
+    """Running count, mean, variance, minimum and maximum of a stream of (n,D) batches"""
+
+    def __init__(self,n_axes):
+        self.N = 0
+        self.Mean = numpy.zeros(n_axes)
+        self.M2 = numpy.zeros(n_axes)
+        self.Min = numpy.full(n_axes,numpy.inf)
+        self.Max = numpy.full(n_axes,-numpy.inf)
+
+    def update(self,values):
+        """Add an (n,D) array of values"""
+        values = numpy.asarray(values,dtype=float)
+        n_batch = values.shape[0]
+        if n_batch == 0:
+            return
+        batch_mean = values.mean(axis=0)
+        batch_m2 = ((values - batch_mean)**2).sum(axis=0)
+        n_total = self.N + n_batch
+        difference = batch_mean - self.Mean
+        self.Mean = self.Mean + difference * (n_batch / n_total)
+        self.M2 = self.M2 + batch_m2 + difference**2 * (self.N * n_batch / n_total)
+        self.N = n_total
+        self.Min = numpy.minimum(self.Min,values.min(axis=0))
+        self.Max = numpy.maximum(self.Max,values.max(axis=0))
+
+    def merge(self,other):
+        """Add the values summarized by another RunningMoments"""
+        if other.N == 0:
+            return
+        n_total = self.N + other.N
+        difference = other.Mean - self.Mean
+        self.Mean = self.Mean + difference * (other.N / n_total)
+        self.M2 = self.M2 + other.M2 + difference**2 * (self.N * other.N / n_total)
+        self.N = n_total
+        self.Min = numpy.minimum(self.Min,other.Min)
+        self.Max = numpy.maximum(self.Max,other.Max)
+
+    def get_variance(self,ddof=1):
+        """Return the per-axis variance (NaN with too few values)"""
+        if self.N <= ddof:
+            return numpy.full(self.Mean.shape,numpy.nan)
+        return self.M2 / (self.N - ddof)
+
+class QuantileSketch(object):
+    """Approximate quantiles of a stream of (n,D) batches, one sketch per axis
+
+    Level i holds values that each stand for 2**i inputs. When a level holds
+    more than sketch_size values it is sorted per axis and every other value
+    (alternating between even and odd positions) is promoted to the next level.
+    """
+
+    def __init__(self,n_axes,sketch_size=DEFAULT_SKETCH_SIZE):
+        if sketch_size < 2:
+            raise ValueError("sketch_size must be at least 2. Got: %s" %sketch_size)
+        self.NAxes = n_axes
+        self.SketchSize = sketch_size
+        self.Levels = [numpy.empty((0,n_axes))]
+        self.Offsets = [0]
+        self.N = 0
+
+    def update(self,values):
+        """Add an (n,D) array of values"""
+        values = numpy.asarray(values,dtype=float).reshape(-1,self.NAxes)
+        self.N += values.shape[0]
+        self.Levels[0] = numpy.concatenate([self.Levels[0],values])
+        self.compact()
+
+    def merge(self,other):
+        """Add the values summarized by another QuantileSketch"""
+        self.N += other.N
+        for level,values in enumerate(other.Levels):
+            if level == len(self.Levels):
+                self.Levels.append(numpy.empty((0,self.NAxes)))
+                self.Offsets.append(0)
+            self.Levels[level] = numpy.concatenate([self.Levels[level],values])
+        self.compact()
+
+    def compact(self):
+        """Halve every level holding more than sketch_size values into the level above"""
+        level = 0
+        while level < len(self.Levels):
+            values = self.Levels[level]
+            if values.shape[0] > self.SketchSize:
+                if level + 1 == len(self.Levels):
+                    self.Levels.append(numpy.empty((0,self.NAxes)))
+                    self.Offsets.append(0)
+                n_kept = values.shape[0] - values.shape[0] % 2
+                ordered = numpy.sort(values[:n_kept],axis=0)
+                promoted = ordered[self.Offsets[level]::2]
+                self.Offsets[level] = 1 - self.Offsets[level]
+                self.Levels[level] = values[n_kept:]
+                self.Levels[level + 1] = numpy.concatenate([self.Levels[level + 1],promoted])
+            level += 1
+
+    def get_quantiles(self,quantiles):
+        """Return a (len(quantiles),D) array of approximate quantiles (NaN if empty)
+
+        Uses the inverse of the weighted empirical distribution, with linear
+        interpolation between order statistics (like numpy.quantile) while
+        the sketch is still exact.
+        """
+        quantiles = numpy.asarray(quantiles,dtype=float)
+        if self.N == 0:
+            return numpy.full((len(quantiles),self.NAxes),numpy.nan)
+        if len(self.Levels) == 1:
+            return numpy.quantile(self.Levels[0],quantiles,axis=0).reshape(len(quantiles),self.NAxes)
+        values = numpy.concatenate(self.Levels)
+        weights = numpy.concatenate([numpy.full(level.shape[0],2.0**i) for i,level in enumerate(self.Levels)])
+        result = numpy.empty((len(quantiles),self.NAxes))
+        for axis in range(self.NAxes):
+            order = numpy.argsort(values[:,axis])
+            cumulative = numpy.cumsum(weights[order])
+            midpoints = (cumulative - 0.5 * weights[order]) / cumulative[-1]
+            result[:,axis] = numpy.interp(quantiles,midpoints,values[order,axis])
+        return result
+
+class EnsembleStatistics(object):
+    """Running moments and a quantile sketch for one treatment at one timepoint"""
+
+    def __init__(self,n_axes,sketch_size=DEFAULT_SKETCH_SIZE):
+        self.Moments = RunningMoments(n_axes)
+        self.Sketch = QuantileSketch(n_axes,sketch_size)
+
+    def update(self,values):
+        self.Moments.update(values)
+        self.Sketch.update(values)
+
+    def merge(self,other):
+        self.Moments.merge(other.Moments)
+        self.Sketch.merge(other.Sketch)
+
+def get_quantile_columns(quantiles=DEFAULT_QUANTILES):
+    """Return column names for quantiles, e.g. q0.05"""
+    return ["q%s" %repr(float(q)) for q in quantiles]
+
+class EnsembleStatisticsSink(Sink):
+    """Accumulate mean, variance and quantiles per treatment, timepoint and axis as simulated
+
+    Statistics are kept in self.Statistics, keyed by (treatment,timepoint), in
+    the order first seen. When individuals are sampled at irregular times,
+    samples sharing a time are grouped. Use get_rows() for the summary table.
+    """
+
+    def __init__(self,quantiles=DEFAULT_QUANTILES,sketch_size=DEFAULT_SKETCH_SIZE):
+        for q in quantiles:
+            if not 0.0 <= q <= 1.0:
+                raise ValueError("quantiles must be between 0 and 1. Got: %s" %q)
+        self.Quantiles = tuple(quantiles)
+        self.SketchSize = sketch_size
+        self.Statistics = {}
+
+    def get_statistics(self,treatment_name,t):
+        """Return the EnsembleStatistics for a treatment and timepoint, creating it if needed"""
+        key = (treatment_name,t)
+        statistics = self.Statistics.get(key)
+        if statistics is None:
+            statistics = self.Statistics[key] = EnsembleStatistics(len(self.Axes),self.SketchSize)
+        return statistics
+
+    def write(self,treatment_name,t,subject_ids,coords):
+        coords = numpy.asarray(coords,dtype=float)
+        if numpy.ndim(t) == 0:
+            self.get_statistics(treatment_name,float(t)).update(coords)
+            return
+        times = numpy.asarray(t,dtype=float)
+        for curr_t in numpy.unique(times):
+            self.get_statistics(treatment_name,float(curr_t)).update(coords[times == curr_t])
+
+    def merge(self,other):
+        """Add the statistics accumulated by another EnsembleStatisticsSink (e.g. from a worker)"""
+        for (treatment_name,t),statistics in other.Statistics.items():
+            self.get_statistics(treatment_name,t).merge(statistics)
+
+    def get_rows(self):
+        """Return a list of dicts (ENSEMBLE_COLUMNS and quantile columns), one per treatment, timepoint and axis"""
+        quantile_columns = get_quantile_columns(self.Quantiles)
+        rows = []
+        for (treatment_name,t),statistics in self.Statistics.items():
+            moments = statistics.Moments
+            variance = moments.get_variance()
+            quantiles = statistics.Sketch.get_quantiles(self.Quantiles)
+            for axis_index,axis in enumerate(self.Axes):
+                row = {"Treatment":treatment_name,"Timepoint":t,"Axis":axis,"n":moments.N,\
+                  "mean":moments.Mean[axis_index],"variance":variance[axis_index],\
+                  "sd":numpy.sqrt(variance[axis_index]),"min":moments.Min[axis_index],\
+                  "max":moments.Max[axis_index]}
+                for column,value in zip(quantile_columns,quantiles[:,axis_index]):
+                    row[column] = value
+                rows.append(row)
+        return rows
+
+def format_ensemble_table(rows,quantiles=DEFAULT_QUANTILES):
+    """Return lines of a tab-delimited table of ensemble statistic rows"""
+    columns = ENSEMBLE_COLUMNS + get_quantile_columns(quantiles)
+    lines = ["\t".join(columns)+"\n"]
+    for row in rows:
+        fields = [str(row["Treatment"]),format_timepoint(row["Timepoint"]),str(row["Axis"]),str(row["n"])]
+        fields.extend(repr(float(row[column])) for column in columns[4:])
+        lines.append("\t".join(fields)+"\n")
+    return lines
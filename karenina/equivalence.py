@@ -0,0 +1,311 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Statistical equivalence of fast simulation engines with the reference Process.
+#
+#The reference model is one Process per individual per axis, advanced with
+#Process.update (ou_update, clamped to [-1,1], or bm_update). Fast engines
+#(MultivariateProcess, and simulate_cohort_parallel across workers) are run
+#on the same design, and ensembles pooled over many seeds are compared at every
+#timepoint and axis:
+#
+#mean -- Welch's t-test
+#variance -- Brown-Forsythe (median-centered Levene) test
+#autocovariance -- Welch's t-test of per-individual lag-1 cross-products (robust
+#  to the point masses at the bounds that break normal-theory correlation tests)
+#distribution -- two-sample Kolmogorov-Smirnov test at the last timepoint
+#
+#p-values are Bonferroni-corrected over all tests of a design. Where seeding
+#allows, results are also checked for exact equality: the reference draws from
+#numpy's global RandomState, so the Euler engine (the same arithmetic) given a
+#RandomState with the same seed must reproduce it bit for bit.
+#
+#Note that the reference noise scale is delta**2 * dt, so the 'exact' method
+#(the exact transition of a continuous OU process) is a different model: at
+#dt=1 its stationary variance is delta**4/(2 lambda) rather than
+#delta**4/(2 lambda - lambda**2), and its lag-1 autocorrelation is exp(-lambda)
+#rather than 1 - lambda. Standard designs therefore expect the exact method to
+#differ from the reference (at the CLI's default lambda and above), and such a
+#design passes only if the difference is detected. Experiment and the CLI
+#default to the Euler method, which is expected to be equivalent.
+
+from process import Process
+from multivariate_process import MultivariateProcess
+from shared_arrays import simulate_cohort_parallel
+from perturbation import Perturbation
+from scipy.stats import ttest_ind,levene,ks_2samp
+from optparse import OptionParser
+from time import perf_counter
+import numpy
+import logging
+
+logger = logging.getLogger("karenina.equivalence")
+
+ENGINES = ("multivariate","parallel")
+MOTIONS = ("Ornstein-Uhlenbeck","Brownian")
+EXPECTATIONS = ("equivalent","different")
+EQUIVALENCE_COLUMNS = ["design","engine","method","expected","n_seeds","n_tests","min_p","adjusted_p",\
+  "worst_test","exact_match","passed","seconds"]
+
+def make_equivalence_design(name,n_individuals,n_timepoints,L,delta,axes=("x",),\
+  motion="Ornstein-Uhlenbeck",perturbations=(),start_spread=0.2):
+    """Return a dict describing a design simulated identically by every engine
+
+    Individuals start evenly spaced in +/- start_spread on every axis and revert
+    to their start positions. Brownian designs are simulated by fast engines
+    with lambda = 0 and no bounds, matching Process.bm_update.
+    """
+    if motion not in MOTIONS:
+        raise ValueError("motion must be one of %s. Got: %s" %(", ".join(MOTIONS),motion))
+    start = numpy.linspace(-start_spread,start_spread,n_individuals)
+    start = numpy.repeat(start[:,None],len(axes),axis=1)
+    bounds = (-1.0,1.0) if motion == "Ornstein-Uhlenbeck" else (None,None)
+    return {"name":name,"start":start,"axes":list(axes),"n_timepoints":n_timepoints,\
+      "lambda":L if motion == "Ornstein-Uhlenbeck" else 0.0,"delta":delta,"motion":motion,\
+      "perturbations":list(perturbations),"bounds":bounds}
+
+def get_active_perturbations(design,t,axis=None):
+    """Return the design's perturbations active at timestep t (optionally only for axis)"""
+    return [p for p in design["perturbations"] if p.isActive(t) and (axis is None or axis in p.Axes)]
+
+def simulate_reference(design,seed):
+    """Return an (n_individuals,n_timepoints+1,n_axes) history from reference Process objects
+
+    Draws come from numpy's global RandomState seeded with seed (its previous
+    state is restored afterwards), in the order individual, then axis, per timestep.
+    """
+    start = design["start"]
+    n_individuals,n_axes = start.shape
+    history = numpy.empty((n_individuals,design["n_timepoints"]+1,n_axes))
+    history[:,0] = start
+    saved_state = numpy.random.get_state()
+    numpy.random.seed(seed)
+    try:
+        processes = [[Process(start[i,a],motion=design["motion"],history_window=0,\
+          params={"lambda":design["lambda"],"delta":design["delta"],"mu":start[i,a]})\
+          for a in range(n_axes)] for i in range(n_individuals)]
+        for t in range(design["n_timepoints"]):
+            active = [get_active_perturbations(design,t,axis) for axis in design["axes"]]
+            for i in range(n_individuals):
+                for a in range(n_axes):
+                    process = processes[i][a]
+                    process.Perturbations = active[a]
+                    process.update(1.0)
+                    history[i,t+1,a] = process.Coord
+    finally:
+        numpy.random.set_state(saved_state)
+    return history
+
+def simulate_engine(design,engine,seed,method="euler",chunk_size=1000,n_jobs=1):
+    """Return an (n_individuals,n_timepoints+1,n_axes) history from a fast engine
+
+    engine -- 'multivariate' (one MultivariateProcess with RandomState(seed)) or
+      'parallel' (simulate_cohort_parallel with chunk_size individuals per task)
+    """
+    if engine not in ENGINES:
+        raise ValueError("engine must be one of %s. Got: %s" %(", ".join(ENGINES),engine))
+    start = design["start"]
+    params = {"lambda":design["lambda"],"delta":design["delta"],"mu":start}
+    min_bound,max_bound = design["bounds"]
+    if engine == "parallel":
+        shared_history = simulate_cohort_parallel(start,design["axes"],params,design["n_timepoints"],\
+          perturbations=design["perturbations"],method=method,min_bound=min_bound,max_bound=max_bound,\
+          n_jobs=n_jobs,chunk_size=chunk_size,seed=seed)
+        try:
+            return shared_history.Array.copy()
+        finally:
+            shared_history.unlink()
+    cohort = MultivariateProcess(start,design["axes"],params,method=method,min_bound=min_bound,\
+      max_bound=max_bound,random_state=numpy.random.RandomState(seed))
+    for t in range(design["n_timepoints"]):
+        active = get_active_perturbations(design,t)
+        cohort.Perturbations = active
+        cohort.update(1.0)
+    return cohort.get_history_array()
+
+def get_lag_products(history,center):
+    """Return (n,n_timepoints-1,n_axes) products of x(t-1) and x(t), centered on center (n_timepoints,n_axes)"""
+    centered = history - center
+    return centered[:,:-1] * centered[:,1:]
+
+def compare_ensembles(reference,fast):
+    """Return a dict of test results comparing two (n,n_timepoints+1,n_axes) ensembles
+
+    Tests with undefined p-values (e.g. every individual clamped to the same bound)
+    are skipped. adjusted_p is the Bonferroni-corrected smallest p-value.
+    """
+    p_values = {}
+    n_timepoints = reference.shape[1]
+    with numpy.errstate(divide="ignore",invalid="ignore"):
+        for t in range(1,n_timepoints):
+            for a in range(reference.shape[2]):
+                x,y = reference[:,t,a],fast[:,t,a]
+                if x.std() == 0 and y.std() == 0:
+                    continue
+                p_values[("mean",t,a)] = ttest_ind(x,y,equal_var=False).pvalue
+                p_values[("variance",t,a)] = levene(x,y,center="median").pvalue
+        center = numpy.concatenate([reference,fast]).mean(axis=0)
+        reference_products = get_lag_products(reference,center)
+        fast_products = get_lag_products(fast,center)
+        for t in range(n_timepoints-1):
+            for a in range(reference.shape[2]):
+                x,y = reference_products[:,t,a],fast_products[:,t,a]
+                if x.std() == 0 and y.std() == 0:
+                    continue
+                p_values[("autocovariance",t+1,a)] = ttest_ind(x,y,equal_var=False).pvalue
+    for a in range(reference.shape[2]):
+        p_values[("distribution",n_timepoints-1,a)] = ks_2samp(reference[:,-1,a],fast[:,-1,a]).pvalue
+    p_values = dict((key,p) for key,p in p_values.items() if numpy.isfinite(p))
+    if not p_values:
+        return {"n_tests":0,"min_p":numpy.nan,"adjusted_p":numpy.nan,"worst_test":None}
+    worst = min(p_values,key=p_values.get)
+    min_p = p_values[worst]
+    return {"n_tests":len(p_values),"min_p":min_p,"adjusted_p":min(1.0,min_p * len(p_values)),\
+      "worst_test":"%s (t=%i, axis %i)" %worst}
+
+def check_exact_match(design,seed,chunk_size=1000):
+    """Return the largest absolute difference between engines that share a seed
+
+    Compares the reference with the Euler multivariate engine using the same seed,
+    and the parallel engine with a multivariate engine seeded like its first chunk
+    (for designs of at most chunk_size individuals). Both should be exactly 0.
+    """
+    reference = simulate_reference(design,seed)
+    euler = simulate_engine(design,"multivariate",seed,method="euler")
+    difference = numpy.abs(reference - euler).max()
+    if design["start"].shape[0] <= chunk_size:
+        chunk_seed = int(numpy.random.SeedSequence(seed).generate_state(1)[0])
+        parallel = simulate_engine(design,"parallel",seed,method="euler",chunk_size=chunk_size)
+        matching = simulate_engine(design,"multivariate",chunk_seed,method="euler")
+        difference = max(difference,numpy.abs(parallel - matching).max())
+    return float(difference)
+
+def run_equivalence(design,engine="multivariate",method="euler",n_seeds=20,min_seeds=5,\
+  time_budget=None,alpha=0.01,seed=0,chunk_size=1000,n_jobs=1,expected="equivalent"):
+    """Compare a fast engine with the reference on a design, returning a result dict
+
+    Seeds are run until n_seeds have been simulated or, once min_seeds have been
+    run, until time_budget seconds have passed. Reference and fast ensembles use
+    independent seeds and are pooled over seeds before testing.
+
+    expected -- 'equivalent': the design passes if adjusted_p > alpha and, for the
+      Euler method, the exact-match check is 0. 'different' (e.g. the exact method,
+      a different model): the design passes if adjusted_p <= alpha.
+    """
+    if expected not in EXPECTATIONS:
+        raise ValueError("expected must be one of %s. Got: %s" %(", ".join(EXPECTATIONS),expected))
+    start_time = perf_counter()
+    reference_sequence,fast_sequence = numpy.random.SeedSequence(seed).spawn(2)
+    reference_seeds = reference_sequence.generate_state(n_seeds)
+    fast_seeds = fast_sequence.generate_state(n_seeds)
+    reference = []
+    fast = []
+    for reference_seed,fast_seed in zip(reference_seeds,fast_seeds):
+        reference.append(simulate_reference(design,int(reference_seed)))
+        fast.append(simulate_engine(design,engine,int(fast_seed),method,chunk_size,n_jobs))
+        elapsed = perf_counter() - start_time
+        if time_budget is not None and len(reference) >= min_seeds and elapsed > time_budget:
+            logger.info("Time budget reached for design %s after %i seeds",design["name"],len(reference))
+            break
+    result = {"design":design["name"],"engine":engine,"method":method,"expected":expected,\
+      "n_seeds":len(reference)}
+    result.update(compare_ensembles(numpy.concatenate(reference),numpy.concatenate(fast)))
+    result["exact_match"] = check_exact_match(design,int(reference_seeds[0]),chunk_size)\
+      if method == "euler" else numpy.nan
+    if expected == "different":
+        passed = bool(result["adjusted_p"] <= alpha)
+    else:
+        passed = not result["adjusted_p"] <= alpha
+        if method == "euler":
+            passed = passed and result["exact_match"] == 0.0
+    result["passed"] = passed
+    result["seconds"] = perf_counter() - start_time
+    return result
+
+def get_standard_designs(n_individuals=100,n_timepoints=20):
+    """Return a list of (design,method,expected) covering the reference model's behaviour
+
+    The exact method is run at the CLI's default lambda (0.2) and above, and is
+    expected to differ from the reference. Its designs start every individual
+    at 0, where the two models' step variances differ most.
+    """
+    mu_shift = Perturbation(5,12,{"lambda":0.5,"mu":0.4},"replace",["x"])
+    return [(make_equivalence_design("ou",n_individuals,n_timepoints,0.2,0.25,axes=("x","y")),\
+        "euler","equivalent"),\
+      (make_equivalence_design("ou_clamped",n_individuals,n_timepoints,0.05,0.7),"euler","equivalent"),\
+      (make_equivalence_design("ou_perturbed",n_individuals,n_timepoints,0.2,0.25,axes=("x","y"),\
+        perturbations=[mu_shift]),"euler","equivalent"),\
+      (make_equivalence_design("brownian",n_individuals,n_timepoints,0.0,0.3,motion="Brownian"),\
+        "euler","equivalent"),\
+      (make_equivalence_design("ou_exact",n_individuals,n_timepoints,0.2,0.25,axes=("x","y"),\
+        start_spread=0.0),"exact","different"),\
+      (make_equivalence_design("ou_high_lambda_exact",n_individuals,n_timepoints,0.5,0.25,\
+        start_spread=0.0),"exact","different")]
+
+def format_equivalence_table(results):
+    """Return lines of a tab-delimited table of run_equivalence results"""
+    lines = ["\t".join(EQUIVALENCE_COLUMNS)+"\n"]
+    for result in results:
+        lines.append("\t".join(str(result[column]) for column in EQUIVALENCE_COLUMNS)+"\n")
+    return lines
+
+def make_option_parser():
+    """Return an optparse OptionParser object"""
+    parser = OptionParser(usage = "%prog [options]",
+    description = "Check that fast simulation engines reproduce the distribution of " +
+    "the reference Process model (including clamping to [-1,1]) on a set of " +
+    "standard designs, and that the exact method is detected as a different model. " +
+    "Exits with status 1 if any design expected to be equivalent fails.",
+    version = __version__)
+    parser.add_option('-o','--output',default=None,type="string",
+    help='optional output tab-delimited table of results [default: print to stdout]')
+    parser.add_option('--engines',default=",".join(ENGINES),type="string",
+    help='comma-separated fast engines to check [default: %default]')
+    parser.add_option('--n_individuals',default=100,type="int",
+    help='individuals per seed [default: %default]')
+    parser.add_option('--n_timepoints',default=20,type="int",
+    help='timepoints per design [default: %default]')
+    parser.add_option('--n_seeds',default=20,type="int",
+    help='maximum seeds per design [default: %default]')
+    parser.add_option('--time_budget',default=None,type="float",
+    help='seconds per design after which no more seeds are run [default: no limit]')
+    parser.add_option('--alpha',default=0.01,type="float",
+    help='significance level for the Bonferroni-corrected tests [default: %default]')
+    parser.add_option('--seed',default=0,type="int",
+    help='random seed [default: %default]')
+    return parser
+
+def main():
+    parser = make_option_parser()
+    opts, args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    results = []
+    for engine in opts.engines.split(","):
+        for design,method,expected in get_standard_designs(opts.n_individuals,opts.n_timepoints):
+            result = run_equivalence(design,engine,method,n_seeds=opts.n_seeds,\
+              time_budget=opts.time_budget,alpha=opts.alpha,seed=opts.seed,expected=expected)
+            if expected == "different" and not result["passed"]:
+                logger.warning("Design %s (%s method) was not distinguished from the reference "\
+                  "(adjusted p=%g); more seeds may be needed",design["name"],method,result["adjusted_p"])
+            results.append(result)
+    lines = format_equivalence_table(results)
+    if opts.output is None:
+        print("".join(lines))
+    else:
+        with open(opts.output,"w") as output_file:
+            output_file.writelines(lines)
+    if not all(result["passed"] for result in results if result["expected"] == "equivalent"):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -12,9 +12,21 @@ __email__ = "zaneveld@gmail.com"
 __status__ = "Development"
 
 from individual import Individual
+from multivariate_process import MultivariateProcess,get_random_state
 from perturbation import Perturbation
+from checkpoint import save_checkpoint
+from sampling import simulate_sampling_schedule
+from shared_arrays import simulate_cohort_parallel,get_chunks
+from sinks import get_sample_id
+from trajectory_storage import check_storage_dtype,save_trajectory_archive
 import visualization
+from progress import ProgressReporter
+from profiler import profile_stage
 from copy import copy
+import numpy
+import logging
+
+logger = logging.getLogger("karenina.experiment")
 
 
 
@@ -31,7 +43,10 @@ class Experiment(object):
 
     """
     def __init__(self,treatment_names,n_individuals,n_timepoints,\
-        individual_base_params,treatment_params,interindividual_variation):
+        individual_base_params,treatment_params,interindividual_variation,\
+        axes=None,engine="process",method="euler",random_state=None,\
+        history_window=None,sinks=None,collect_data=True,sampling_times=None,\
+        block_size=None,history_dtype=None):
         """Set up an experiment with multiple treatments
 
         Parameters
@@ -45,7 +60,8 @@ class Experiment(object):
           complex to allow for more powerful specifications of experimental design.  See note below.
 
         Specifying perturbations:
-        Perturbations are specified as a dict with parameters matching a 'Perturbation' object: start,end,params,update_mode representing the
+        Perturbations are specified either as Perturbation objects (e.g. from
+        perturbation_library.load_perturbation_file) or as a dict with parameters matching a 'Perturbation' object: start,end,params,update_mode representing the
         starting and ending timesteps of the perturbation, the parameters of that perturbation, and how the specified parameters affect the
         individuals pre-existing parameters (e.g. by replacement or addition).  The
         parameters of the perturbation are specified in a nested dict by axis. Mode can be set to "add", "multiply" or "replace"
@@ -57,6 +73,51 @@ class Experiment(object):
         -- this will specify a two treatment experiment, in which the 'destabilizing treatment
 
         interindividual_varation -- the amount of starting variation between individuals
+
+        axes -- list of axis names for the simulated space (default: ["x","y","z"]).
+          Any number of axes may be used, e.g. ["PC1",...,"PC20"]. Perturbations
+          target axes by name.
+        engine -- how individuals are simulated:
+          'process' -- each individual has one independent Process per axis (the reference model)
+          'multivariate' -- each treatment is simulated as a single MultivariateProcess,
+            advancing all individuals with batched array operations. This engine supports
+            cross-axis coupling via 'coupling' and 'correlation' matrices in
+            individual_base_params (see multivariate_process.py)
+        method -- 'euler' or 'exact' transitions for the multivariate engine.
+          'euler' is the same model (and arithmetic) as the process engine.
+          'exact' is the exact transition of a continuous-time OU process with
+          noise scale delta**2 per unit time, a different model for the same
+          lambda and delta: at dt=1 its stationary variance is delta**4/(2 lambda)
+          rather than delta**4/(2 lambda - lambda**2), and its lag-1 autocorrelation
+          is exp(-lambda) rather than 1 - lambda. It is required for sampling_times.
+        random_state -- None, int seed or numpy RandomState for the multivariate engine
+
+        Low-memory options:
+        history_window -- if None, every Process keeps its full History. Otherwise only the
+          current state plus the most recent history_window timepoints are kept
+          (0 keeps none), e.g. to draw a movie of the end of a long simulation.
+        history_dtype -- 'float64', 'float32' or 'int16' storage of multivariate engine
+          histories (see trajectory_storage.py). Reduced precision halves or quarters
+          history memory; coordinates are decoded back to float64 when read.
+        sinks -- a list of Sink objects (see sinks.py) that receive the coordinates of every
+          individual at each timepoint, e.g. to stream results to disk.
+        collect_data -- if True, also keep every simulated row as text in self.Data.
+          Set to False along with a history_window for memory use that does not grow
+          with the number of individuals x timepoints.
+
+        Irregular sampling:
+        sampling_times -- optionally, a dict of subject id (e.g. 'control_0') -> array of
+          the times at which that subject is sampled (see sampling.py for generating random
+          schedules or reading them from a file). Use simulate_sampling_schedule() instead
+          of simulate_timesteps() to simulate only at those times with exact OU transitions.
+          Requires engine='multivariate' and method='exact'.
+
+        Population-scale simulation:
+        block_size -- if set, no individuals are created up front. Instead
+          simulate_blocks() creates each treatment's individuals block_size at a
+          time, simulates every timepoint for the block, sends the results to
+          Data and sinks, and discards the block. Peak memory then depends on
+          block_size rather than the number of individuals (with collect_data=False).
         """
 
         self.TreatmentNames = [t for t in treatment_names]
@@ -64,10 +125,33 @@ class Experiment(object):
         self.BaseParams = individual_base_params
         self.NIndividuals = [n for n in n_individuals]
         self.NTimepoints = n_timepoints
+        self.Axes = list(axes) if axes is not None else ["x","y","z"]
+        if engine not in ("process","multivariate"):
+            raise ValueError("engine must be 'process' or 'multivariate'. Got: %s" %engine)
+        self.Engine = engine
+        self.HistoryWindow = history_window
+        self.HistoryDType = check_storage_dtype(history_dtype)
+        if self.HistoryDType != "float64" and engine != "multivariate":
+            raise ValueError("history_dtype %s requires engine='multivariate'" %self.HistoryDType)
+        self.Sinks = list(sinks) if sinks is not None else []
+        self.CollectData = collect_data
+        self.SamplingTimes = sampling_times
+        if sampling_times is not None and (engine != "multivariate" or method != "exact"):
+            raise ValueError("sampling_times require engine='multivariate' and method='exact'")
+        if block_size is not None and block_size < 1:
+            raise ValueError("block_size must be a positive integer. Got: %s" %str(block_size))
+        if block_size is not None and sampling_times is not None:
+            raise ValueError("block_size cannot be combined with sampling_times")
+        self.BlockSize = block_size
+        self.InterindividualVariation = interindividual_variation
+        self.Method = method
+        #Treatments (and blocks) draw from a single random state, so that an int
+        #seed does not give every treatment the same start positions and noise
+        self.RandomState = get_random_state(random_state)
         #Check that a few parameters are valid
-        print ("treatment_names:",self.TreatmentNames)
-        print ("n_individuals:",self.NIndividuals)
-        print ("treatment_params:",treatment_params)
+        logger.info("treatment_names: %s",self.TreatmentNames)
+        logger.info("n_individuals: %s",self.NIndividuals)
+        logger.debug("treatment_params: %s",treatment_params)
         self.check_n_timepoints_is_int(n_timepoints)
         self.check_variable_specified_per_treatment(self.NIndividuals)
         self.check_variable_specified_per_treatment(treatment_params)
@@ -84,7 +168,6 @@ class Experiment(object):
         for treatment_idx,treatment in enumerate(self.Treatments):
 
             #Set a color for each treatment
-            individuals = []
             params = copy(self.BaseParams)
 
             if treatment_idx < len(colors):
@@ -92,16 +175,26 @@ class Experiment(object):
             else:
                 params['color'] = 'lightgray'
 
-            print(treatment)
-            for i in range(treatment["n_individuals"]):
-
-                curr_subject_id = "%s_%i" %(treatment["treatment_name"],i)
-                curr_subject = Individual(subject_id = curr_subject_id,
-                  params = params,\
-                  metadata={"treatment":treatment["treatment_name"]},\
-                  interindividual_variation=interindividual_variation)
-                individuals.append(curr_subject)
-            treatment["individuals"] = individuals
+            logger.debug("Setting up individuals for treatment: %s",treatment)
+            treatment["color"] = params['color']
+            treatment["params"] = params
+            if self.BlockSize is not None:
+                #Individuals are created block by block in simulate_blocks()
+                treatment["subject_ids"] = []
+                treatment["individuals"] = []
+                continue
+            treatment["subject_ids"] = self.get_subject_ids(treatment,0,treatment["n_individuals"])
+            if self.Engine == "multivariate":
+                with profile_stage("setup_individuals"):
+                    treatment["cohort"] = self.make_cohort(treatment["n_individuals"],\
+                      params,interindividual_variation,method,self.RandomState,history_window,\
+                      self.HistoryDType)
+                treatment["individuals"] = []
+                continue
+
+            with profile_stage("setup_individuals"):
+                treatment["individuals"] = self.make_individuals(treatment,\
+                  treatment["subject_ids"],params,interindividual_variation,history_window)
 
 
         #Set up the treatment parameters
@@ -110,17 +203,59 @@ class Experiment(object):
             treatment["active_perturbations"] = []
             raw_perturbation_info = treatment_params[treatment_idx]
             #We should have a dict with start, end, and parms for each perturbation
-            print ("raw_perturbation_info:",raw_perturbation_info)
+            logger.debug("raw_perturbation_info: %s",raw_perturbation_info)
             for p in raw_perturbation_info:
-                print ("params:",p)
-                curr_perturbation = Perturbation(p["start"],p["end"],p["params"],p["update_mode"],p["axes"])
+                logger.debug("params: %s",p)
+                if isinstance(p,dict):
+                    curr_perturbation = Perturbation(p["start"],p["end"],p["params"],p["update_mode"],p["axes"])
+                else:
+                    #Already a Perturbation object (e.g. from perturbation_library)
+                    curr_perturbation = p
                 treatment["perturbations"].append(curr_perturbation)
 
         #Set up a place to hold data on the experiment outcome
 
-        coords = ["x","y","z"]
-        headers = "\t".join(["SampleID"]+coords)+"\n"
+        headers = "\t".join(["SampleID"]+self.Axes)+"\n"
         self.Data = [headers]
+        for sink in self.Sinks:
+            sink.open(self.Axes)
+
+    def get_subject_ids(self,treatment,start,end):
+        """Return subject ids (e.g. control_0) for individuals start:end of a treatment"""
+        return ["%s_%i" %(treatment["treatment_name"],i) for i in range(start,end)]
+
+    def make_individuals(self,treatment,subject_ids,params,interindividual_variation,\
+      history_window=None):
+        """Return a list of Individual objects for a treatment, one per subject id"""
+        individuals = []
+        for curr_subject_id in subject_ids:
+            curr_subject = Individual(subject_id = curr_subject_id,
+              coords = self.Axes,params = params,\
+              metadata={"treatment":treatment["treatment_name"]},\
+              interindividual_variation=interindividual_variation,\
+              history_window=history_window)
+            individuals.append(curr_subject)
+        return individuals
+
+    def make_cohort(self,n_individuals,params,interindividual_variation,\
+      method="euler",random_state=None,history_window=None,history_dtype=None):
+        """Return a MultivariateProcess for n_individuals with randomized start positions
+
+        As for Individual objects, axes listed in params (e.g. params["x"]) use that
+        fixed start position, and otherwise start positions are drawn uniformly
+        within +/- interindividual_variation. Each individual reverts to its start position.
+        """
+        random_state = get_random_state(random_state)
+        start_coords = (random_state.random_sample((n_individuals,len(self.Axes))) - 0.50) *\
+          2.0 * interindividual_variation
+        for i,axis in enumerate(self.Axes):
+            if axis in params:
+                start_coords[:,i] = params[axis]
+        cohort_params = {"lambda":params["lambda"],"delta":params["delta"],\
+          "coupling":params.get("coupling"),"correlation":params.get("correlation")}
+        return MultivariateProcess(start_coords,self.Axes,cohort_params,\
+          method=method,random_state=random_state,history_window=history_window,\
+          history_dtype=history_dtype)
 
     def run(self):
         "Run the experiment, simulating timesteps"
@@ -129,8 +264,6 @@ class Experiment(object):
 
     def check_variable_specified_per_treatment(self,v):
         """Raise a ValueError if v is not the same length as the number of treatments"""
-        print([x for x in v])
-        print(self.TreatmentNames)
         if len([x for x in v]) != len(self.TreatmentNames):
             raise ValueError('Must specify a list of n_individuals equal in length to the number of treatments. Note that n_individuals must be enclosed in quotes e.g. -n "35,35"  ')
 
@@ -141,11 +274,48 @@ class Experiment(object):
         except:
             raise ValueError("n_timepoints must be a single integer that applies to all experiments (not a list per treatment for example).")
 
-    def simulate_timesteps(self,t_start,t_end):
-        """Simulate multiple timesteps"""
+    def simulate_timesteps(self,t_start,t_end,checkpoint_path=None,checkpoint_interval=None,\
+      progress_interval=10.0):
+        """Simulate multiple timesteps
+
+        t_start -- first timestep to simulate (inclusive)
+        t_end -- last timestep to simulate (exclusive)
+        checkpoint_path -- if set, periodically save the experiment state here
+          (see checkpoint.py).  A checkpoint is always written after the last timestep.
+        checkpoint_interval -- number of timesteps between checkpoints. Ignored
+          if checkpoint_path is None.
+        progress_interval -- seconds between progress (throughput, ETA, memory)
+          log messages, or None to disable progress reporting.
+        """
+        if self.BlockSize is not None:
+            raise ValueError("Experiments with a block_size are simulated with simulate_blocks()")
+        if checkpoint_interval is not None and checkpoint_interval < 1:
+            raise ValueError("checkpoint_interval must be a positive integer of timesteps. Got: %s" %str(checkpoint_interval))
+
+        progress = None
+        if progress_interval is not None:
+            n_subjects = sum(self.NIndividuals)
+            progress = ProgressReporter(n_subjects * max(0,t_end - t_start),\
+              interval=progress_interval,units="subject-steps")
+            if not progress.Enabled:
+                progress = None
+
         for t in range(t_start,t_end):
-            print ("Simulating timestep: %i" %t)
+            logger.debug("Simulating timestep: %i",t)
             self.simulate_timestep(t)
+            if progress is not None:
+                progress.update(n_subjects)
+            if checkpoint_path is None:
+                continue
+            n_simulated = t + 1 - t_start
+            if (checkpoint_interval and n_simulated % checkpoint_interval == 0)\
+              or t == t_end - 1:
+                with profile_stage("checkpoint"):
+                    save_checkpoint(self,checkpoint_path,next_timepoint = t + 1)
+                logger.info("Saved checkpoint for timestep %i to %s",t,checkpoint_path)
+
+        if progress is not None:
+            progress.finish()
 
     def simulate_timestep(self,t):
         """Simulate timestep t of the experiemnt
@@ -160,44 +330,261 @@ class Experiment(object):
         """
 
         for treatment in self.Treatments:
-            for perturbation in treatment["perturbations"]:
-                apply_to_individuals = False
-                remove_from_individuals = False
-                #Record whether to activate perturbation
-                if perturbation.isActive(t) and\
-                    perturbation not in treatment["active_perturbations"]:
-                    apply_to_individuals = True
-                    treatment["active_perturbations"].append(perturbation)
-
-                #Record whether to deactivate perturbation
-                if perturbation in treatment["active_perturbations"] and\
-                    not perturbation.isActive(t):
-                    remove_from_individuals = True
-                    treatment["active_perturbations"].remove(perturbation)
-
-                #Apply new perturbations and remove old ones
+            self.simulate_treatment_timestep(treatment,t)
+
+    def simulate_treatment_timestep(self,treatment,t):
+        """Simulate timestep t for the current individuals of one treatment and record them"""
+        with profile_stage("apply_perturbations"):
+            self.update_perturbations(treatment,t)
+
+        #With perturbations in place and updated,
+        #simulate a timestep for each individual in treatment
+        with profile_stage("update"):
+            if self.Engine == "multivariate":
+                cohort = treatment["cohort"]
+                cohort.update(dt=1.0)
+                coords = cohort.Coords
+            else:
                 for curr_subject in treatment["individuals"]:
-                    if apply_to_individuals:
-                        curr_subject.applyPerturbation(perturbation)
-                    if remove_from_individuals:
-                        curr_subject.removePerturbation(perturbation)
-
-            #With perturbations in place and updated,
-            #simulate a timestep for each individual in treatment
-            for curr_subject in treatment["individuals"]:
                     #Simulate the timestep
                     curr_subject.simulate_movement(1)
-                    curr_data = curr_subject.get_data(1)
-                    self.Data.append("\t".join(map(str,curr_data))+"\n")
+                coords = numpy.array([curr_subject.get_current_coords()\
+                  for curr_subject in treatment["individuals"]],dtype=float)
+        with profile_stage("record_rows"):
+            self.record_timepoint(treatment,t,coords)
+
+    def simulate_blocks(self,progress_interval=10.0):
+        """Simulate every timepoint, creating and discarding individuals block_size at a time
+
+        Requires block_size to have been set when the experiment was created. For
+        each treatment, each block of individuals is set up, simulated from
+        timepoint 0 to n_timepoints with the treatment's perturbations, recorded
+        in Data and sinks, and then discarded. Sinks therefore receive each
+        treatment and timepoint once per block, e.g. a TSVFileSink lists the first
+        block's samples for every timepoint before the second block's.
+        """
+        if self.BlockSize is None:
+            raise ValueError("simulate_blocks requires block_size to be set for the experiment")
+        progress = None
+        if progress_interval is not None:
+            progress = ProgressReporter(sum(self.NIndividuals) * self.NTimepoints,\
+              interval=progress_interval,units="subject-steps")
+            if not progress.Enabled:
+                progress = None
+        for treatment in self.Treatments:
+            for start,end in get_chunks(treatment["n_individuals"],self.BlockSize):
+                logger.debug("Simulating individuals %i-%i of treatment %s",start,end-1,\
+                  treatment["treatment_name"])
+                with profile_stage("setup_individuals"):
+                    self.setup_block(treatment,start,end)
+                for t in range(self.NTimepoints):
+                    self.simulate_treatment_timestep(treatment,t)
+                    if progress is not None:
+                        progress.update(end - start)
+                self.discard_block(treatment)
+        if progress is not None:
+            progress.finish()
+
+    def setup_block(self,treatment,start,end):
+        """Create individuals start:end of a treatment, with no perturbations active yet"""
+        treatment["subject_ids"] = self.get_subject_ids(treatment,start,end)
+        treatment["active_perturbations"] = []
+        if self.Engine == "multivariate":
+            treatment["cohort"] = self.make_cohort(end - start,treatment["params"],\
+              self.InterindividualVariation,self.Method,self.RandomState,self.HistoryWindow,\
+              self.HistoryDType)
+            treatment["individuals"] = []
+        else:
+            treatment["individuals"] = self.make_individuals(treatment,treatment["subject_ids"],\
+              treatment["params"],self.InterindividualVariation,self.HistoryWindow)
+
+    def discard_block(self,treatment):
+        """Release the individuals of the block that was last simulated for a treatment"""
+        treatment.pop("cohort",None)
+        treatment["individuals"] = []
+        treatment["subject_ids"] = []
+
+    def update_perturbations(self,treatment,t):
+        """Apply perturbations to a treatment that become active at t, and remove those that end"""
+        for perturbation in treatment["perturbations"]:
+            apply_to_individuals = False
+            remove_from_individuals = False
+            #Record whether to activate perturbation
+            if perturbation.isActive(t) and\
+                perturbation not in treatment["active_perturbations"]:
+                apply_to_individuals = True
+                treatment["active_perturbations"].append(perturbation)
+
+            #Record whether to deactivate perturbation
+            if perturbation in treatment["active_perturbations"] and\
+                not perturbation.isActive(t):
+                remove_from_individuals = True
+                treatment["active_perturbations"].remove(perturbation)
+
+            #Time-varying perturbations look up their compiled weight for t
+            if perturbation.isActive(t):
+                perturbation.setTime(t)
+
+            #Apply new perturbations and remove old ones
+            if self.Engine == "multivariate":
+                if apply_to_individuals:
+                    treatment["cohort"].applyPerturbation(perturbation)
+                if remove_from_individuals:
+                    treatment["cohort"].removePerturbation(perturbation)
+            for curr_subject in treatment["individuals"]:
+                if apply_to_individuals:
+                    curr_subject.applyPerturbation(perturbation)
+                if remove_from_individuals:
+                    curr_subject.removePerturbation(perturbation)
+
+    def record_timepoint(self,treatment,t,coords):
+        """Add coordinates for all individuals in a treatment at timepoint t to Data and sinks
+
+        coords -- (n_individuals,n_axes) array of current coordinates
+        """
+        self.record_samples(treatment["treatment_name"],t,treatment["subject_ids"],coords)
+
+    def record_samples(self,treatment_name,t,subject_ids,coords):
+        """Add rows of sample coordinates to Data and sinks
+
+        t -- the timepoint, or an array with one time per row
+        subject_ids -- list of subject ids, one per row of coords
+        coords -- (n_samples,n_axes) array of coordinates
+        """
+        if self.CollectData:
+            times = numpy.broadcast_to(t,(len(subject_ids),)).tolist()
+            for subject_id,curr_t,subject_coords in zip(subject_ids,times,coords.tolist()):
+                curr_sampleid = get_sample_id(subject_id,curr_t)
+                self.Data.append("\t".join([curr_sampleid]+list(map(str,subject_coords)))+"\n")
+        for sink in self.Sinks:
+            sink.write(treatment_name,t,subject_ids,coords)
+
+    def simulate_sampling_schedule(self):
+        """Simulate every subject only at its own sampling times
+
+        Uses the sampling_times given when the experiment was created. Samples are
+        recorded in Data and sent to sinks with their real time values, and also
+        stored per treatment as treatment["samples"]: a list with one
+        (sampling_times,coords) tuple per subject.
+        """
+        if self.SamplingTimes is None:
+            raise ValueError("No sampling_times were given for this experiment")
+        for treatment in self.Treatments:
+            try:
+                times = [numpy.unique(numpy.asarray(self.SamplingTimes[subject_id],dtype=float))\
+                  for subject_id in treatment["subject_ids"]]
+            except KeyError as e:
+                raise ValueError("No sampling times were given for subject %s" %str(e))
+            logger.debug("Simulating %i irregular samples for treatment %s",\
+              sum(len(t) for t in times),treatment["treatment_name"])
+            with profile_stage("update"):
+                coords = simulate_sampling_schedule(treatment["cohort"],times,treatment["perturbations"])
+            treatment["samples"] = list(zip(times,coords))
+            subject_ids = []
+            for subject_id,subject_times in zip(treatment["subject_ids"],times):
+                subject_ids.extend([subject_id]*len(subject_times))
+            with profile_stage("record_rows"):
+                self.record_samples(treatment["treatment_name"],numpy.concatenate(times),\
+                  subject_ids,numpy.vstack(coords))
+
+    def simulate_parallel(self,n_jobs=1,chunk_size=1000,seed=None):
+        """Simulate all timepoints with each treatment's individuals split across worker processes
+
+        Requires engine='multivariate'. Each treatment's history is held in a
+        shared-memory SharedArray (see shared_arrays.py) as treatment["shared_history"],
+        an (n_individuals,n_timepoints+1,n_axes) array starting at the current coordinates.
+        Workers write their individuals' rows in place, and rows are then recorded
+        in Data and sinks directly from the shared array, as for simulate_timesteps().
+
+        Results depend on seed and chunk_size but not on n_jobs. Call
+        release_shared_arrays() to free the shared memory when done.
+        """
+        if self.Engine != "multivariate":
+            raise ValueError("simulate_parallel requires engine='multivariate'")
+        if self.BlockSize is not None:
+            raise ValueError("Experiments with a block_size are simulated with simulate_blocks()")
+        seeds = numpy.random.SeedSequence(seed).generate_state(len(self.Treatments))
+        for treatment,treatment_seed in zip(self.Treatments,seeds):
+            cohort = treatment["cohort"]
+            params = {"lambda":cohort.Params["lambda"],"delta":cohort.Params["delta"],\
+              "mu":cohort.Params["mu"],"coupling":cohort.Coupling,"correlation":cohort.Correlation}
+            logger.debug("Simulating treatment %s in parallel (n_jobs=%i)",treatment["treatment_name"],n_jobs)
+            with profile_stage("update"):
+                shared_history = simulate_cohort_parallel(cohort.Coords,self.Axes,params,\
+                  self.NTimepoints,perturbations=treatment["perturbations"],method=cohort.Method,\
+                  min_bound=cohort.MinBound,max_bound=cohort.MaxBound,n_jobs=n_jobs,\
+                  chunk_size=chunk_size,seed=int(treatment_seed))
+            treatment["shared_history"] = shared_history
+            history = shared_history.Array
+            with profile_stage("record_rows"):
+                for t in range(self.NTimepoints):
+                    self.record_timepoint(treatment,t,history[:,t+1])
+            cohort.Coords = history[:,-1].copy()
+
+    def release_shared_arrays(self):
+        """Free shared memory used by simulate_parallel()"""
+        for treatment in self.Treatments:
+            shared_history = treatment.pop("shared_history",None)
+            if shared_history is not None:
+                shared_history.unlink()
+
+    def close_sinks(self):
+        """Close all sinks (e.g. flushing output files) at the end of a simulation"""
+        for sink in self.Sinks:
+            sink.close()
+
+    def get_timeseries_data(self):
+        """Return (data,colors) for every individual in the experiment
+
+        data -- a list with one (n_axes,n_timepoints) array per individual
+        colors -- a list with the treatment color of each individual
+        """
+        data = []
+        colors = []
+        for treatment in self.Treatments:
+            if "shared_history" in treatment:
+                history = treatment["shared_history"].Array[:,1:]
+                data.extend([subject_history.T for subject_history in history])
+                colors.extend([treatment["color"]]*treatment["n_individuals"])
+            elif self.Engine == "multivariate":
+                history = treatment["cohort"].get_history_array()
+                data.extend([subject_history.T for subject_history in history])
+                colors.extend([treatment["color"]]*treatment["n_individuals"])
+            else:
+                data.extend(visualization.get_timeseries_data(treatment["individuals"],self.Axes))
+                colors.extend([i.BaseParams["color"] for i in treatment["individuals"]])
+        return data,colors
+
+    def write_trajectory_archive(self,output_path,storage="int16",delta=True):
+        """Write the kept history of every individual to a compressed trajectory archive
+
+        output_path -- path of the .npz archive
+        storage,delta -- as for trajectory_storage.save_trajectory_archive
+
+        The archive holds an (n_individuals,n_timepoints,n_axes) array, with the
+        subject ids, treatments and axes in its header. Read it back with
+        trajectory_storage.load_trajectory_archive.
+        """
+        data,colors = self.get_timeseries_data()
+        if not data or data[0].shape[1] == 0:
+            raise ValueError("No history was kept for this experiment, so no trajectory archive can be written")
+        subject_ids = []
+        treatments = []
+        for treatment in self.Treatments:
+            subject_ids.extend(treatment["subject_ids"])
+            treatments.extend([treatment["treatment_name"]]*len(treatment["subject_ids"]))
+        history = numpy.stack(data).transpose(0,2,1)
+        logger.info("Writing %s trajectory archive of %i individuals to %s",storage,len(data),output_path)
+        with profile_stage("write_archive"):
+            return save_trajectory_archive(output_path,history,storage,delta,\
+              subject_ids=subject_ids,treatments=treatments,axes=self.Axes)
 
     def writeToMovieFile(self,output_folder):
         """Write an MPG movie to output folder"""
-        individuals = []
-        for treatment in self.Treatments:
-            for curr_subject in treatment["individuals"]:
-                individuals.append(curr_subject)
-        print ("individuals:",individuals)
-        visualization.save_simulation_movie(individuals, output_folder,\
-             len(individuals),self.NTimepoints,\
-             black_background=True)
+        with profile_stage("write_movie"):
+            data,colors = self.get_timeseries_data()
+            logger.info("Writing movie for %i individuals to %s",len(data),output_folder)
+            visualization.save_simulation_movie(None, output_folder,\
+                 len(data),self.NTimepoints,\
+                 black_background=True,data=data,colors=colors)
 
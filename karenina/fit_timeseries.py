@@ -18,6 +18,9 @@ from scipy.optimize import basinhopping,brute,differential_evolution
 from scipy.stats import norm
 
 from numpy import diff,inf,all,array
+import logging
+
+logger = logging.getLogger("karenina.fit_timeseries")
 
 #Set up script parameters
 script_info = {}
@@ -142,9 +145,8 @@ def make_OU_objective_fn(x,times,verbose=False):
         Sigma,Lambda,Theta = p
         nlogLik = get_OU_nlogLik(fixed_x,fixed_times,Sigma,Lambda,Theta)
         if verbose:
-            print "\nnlogLik:",nlogLik 
-            #print "\t".join(["Sigma","Lambda","Theta"])
-            print "%.2f\t%.2f\t%.2f" % (Sigma,Lambda,Theta)
+            logger.debug("nlogLik: %s Sigma: %.2f Lambda: %.2f Theta: %.2f",\
+              nlogLik,Sigma,Lambda,Theta)
         return nlogLik
         
     return fn_to_optimize
@@ -14,13 +14,18 @@ __status__ = "Development"
 from process import Process
 from random import random,randint
 from copy import copy
+import logging
+
+logger = logging.getLogger("karenina.individual")
 
 class Individual(object):
-    def __init__(self,subject_id,coords=["x","y","z"],metadata={},params={},interindividual_variation=0.01):
+    def __init__(self,subject_id,coords=["x","y","z"],metadata={},params={},interindividual_variation=0.01,\
+      history_window=None):
         self.SubjectId = subject_id
         self.Metadata = metadata
         self.MovementProcesses = {}
         self.BaseParams = params
+        debug = logger.isEnabledFor(logging.DEBUG)
         for c in coords:
             #print "STARTING PROCESS for Axis:",c
 
@@ -38,10 +43,11 @@ class Individual(object):
             # to its starting coordinate
             curr_params = copy(self.BaseParams)
             curr_params["mu"] = start_coord
-            print ("start_coord:",start_coord)
-            print ("curr_params['mu']",curr_params['mu'])
+            if debug:
+                logger.debug("Subject %s axis %s start_coord: %f mu: %f",\
+                  subject_id,c,start_coord,curr_params['mu'])
             self.MovementProcesses[c] = Process(start_coord = start_coord,params=curr_params,\
-              motion = "Ornstein-Uhlenbeck")
+              motion = "Ornstein-Uhlenbeck",history_window=history_window)
 
     def applyPerturbation(self,perturbation):
         """Apply a perturbation to the appropriate axes"""
@@ -81,6 +87,10 @@ class Individual(object):
                 mu = self.MovementProcesses[c].StartCoord
                 self.MovementProcesses[c].update(dt=1.0)
 
+    def get_current_coords(self):
+        """Return a list of the current coordinate on each axis"""
+        return [self.MovementProcesses[c].Coord for c in self.MovementProcesses.keys()]
+
     def get_data(self,n_timepoints):
         result = []
         coords = self.MovementProcesses.keys()
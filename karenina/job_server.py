@@ -0,0 +1,474 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#A local job server for simulations and fits.
+#
+#Start it once (python job_server.py --cache_dir ./karenina_cache) and submit
+#jobs from notebooks or scripts with submit_job(). Jobs run on a persistent pool
+#of worker processes that have already imported numpy/scipy and karenina, identical
+#jobs that are already running are only run once, and results are cached on disk
+#under a hash of the job spec, so repeating a job returns the stored result.
+#
+#The protocol is JSON over HTTP, served on localhost (or a Unix socket):
+#
+#POST /jobs            body is a job spec; waits for and returns the result
+#POST /jobs?wait=0     starts the job and returns its key immediately
+#GET  /jobs/<key>      result of a job (status 202 while it is still running)
+#GET  /status          job counts
+#
+#Job specs are dicts with a 'type':
+#
+#{"type":"experiment","treatment_names":["control","treated"],"n_individuals":[10,10],
+# "n_timepoints":20,"base_params":{"lambda":0.2,"delta":0.25},
+# "perturbations":[[],[{"start":5,"end":20,"params":{"lambda":0.0},"update_mode":"replace","axes":["x","y","z"]}]],
+# "interindividual_variation":0.01,"axes":["x","y","z"],"method":"euler","seed":0}
+#
+#{"type":"fit","series":[[0.1,0.2,...],...],"times":[[0,1,...],...]}
+#
+#'method' is 'euler' (the reference Process model, the default) or 'exact' (the
+#exact transition of a continuous OU process, a different model; see Experiment).
+#
+#Experiments without a 'seed' are random, so they are never deduplicated or
+#served from the cache. Their results (and the errors of failed jobs) are kept
+#in memory for a limited time, and only for a limited number of recent jobs,
+#so they can still be fetched with GET /jobs/<key>.
+
+from experiment import Experiment
+from sinks import CallbackSink
+from ou_likelihood import fit_OU_exact
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from optparse import OptionParser
+from os import makedirs,replace
+from os.path import join,exists
+from urllib.parse import urlsplit,parse_qs
+from uuid import uuid4
+from collections import OrderedDict
+from time import monotonic
+import http.client
+import socket
+import asyncio
+import json
+import numpy
+import logging
+
+logger = logging.getLogger("karenina.job_server")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+JOB_TYPES = ("experiment","fit")
+FIT_COLUMNS = ["Sigma","Lambda","Theta","nlogLik"]
+DEFAULT_MAX_RECENT = 1000
+DEFAULT_RECENT_TTL = 3600.0
+HTTP_REASONS = {200:"OK",202:"Accepted",400:"Bad Request",404:"Not Found",500:"Internal Server Error"}
+
+def get_job_key(spec):
+    """Return a hash identifying a job spec, independent of dict key order"""
+    canonical = json.dumps(spec,sort_keys=True,separators=(",",":"))
+    return sha1(canonical.encode("utf-8")).hexdigest()
+
+def check_job_spec(spec):
+    """Raise a ValueError if spec is not a valid job spec"""
+    if not isinstance(spec,dict):
+        raise ValueError("A job spec must be a JSON object. Got: %s" %type(spec).__name__)
+    if spec.get("type") not in JOB_TYPES:
+        raise ValueError("Job 'type' must be one of: %s. Got: %s" %(", ".join(JOB_TYPES),spec.get("type")))
+    if spec["type"] == "experiment":
+        required = ("treatment_names","n_individuals","n_timepoints","base_params")
+    else:
+        required = ("series","times")
+    missing = [name for name in required if name not in spec]
+    if missing:
+        raise ValueError("%s job spec is missing: %s" %(spec["type"],", ".join(missing)))
+
+def is_cacheable(spec):
+    """Return True if spec always gives the same result (so can be cached)"""
+    return spec["type"] != "experiment" or spec.get("seed") is not None
+
+def run_experiment_job(spec):
+    """Simulate an experiment spec with the multivariate engine
+
+    Returns a dict with axes and one entry per sample in sample_ids, subject_ids,
+    treatments, timepoints and coords.
+    """
+    result = {"sample_ids":[],"subject_ids":[],"treatments":[],"timepoints":[],"coords":[]}
+
+    def collect(treatment_name,t,subject_ids,coords):
+        for subject_id,subject_coords in zip(subject_ids,coords.tolist()):
+            result["sample_ids"].append("S%s_t%i" %(subject_id,t))
+            result["subject_ids"].append(subject_id)
+            result["treatments"].append(treatment_name)
+            result["timepoints"].append(t)
+            result["coords"].append(subject_coords)
+
+    treatment_names = spec["treatment_names"]
+    #One random state for all treatments, so their start positions and noise differ
+    random_state = None if spec.get("seed") is None else numpy.random.RandomState(spec["seed"])
+    perturbations = spec.get("perturbations",[[] for name in treatment_names])
+    experiment = Experiment(treatment_names,spec["n_individuals"],spec["n_timepoints"],\
+      spec["base_params"],perturbations,spec.get("interindividual_variation",0.01),\
+      axes=spec.get("axes"),engine="multivariate",method=spec.get("method","euler"),\
+      random_state=random_state,history_window=0,sinks=[CallbackSink(collect)],\
+      collect_data=False)
+    experiment.simulate_timesteps(0,spec["n_timepoints"],progress_interval=None)
+    result["axes"] = experiment.Axes
+    return result
+
+def run_fit_job(spec):
+    """Fit an OU model to each series in spec, returning a dict of fits"""
+    series = spec["series"]
+    times = spec["times"]
+    if len(series) != len(times):
+        raise ValueError("Got %i series but %i time arrays" %(len(series),len(times)))
+    fits = [fit_OU_exact(numpy.array(x,dtype=float),numpy.array(t,dtype=float))\
+      for x,t in zip(series,times)]
+    #NaN is not valid JSON
+    fits = [[None if numpy.isnan(v) else float(v) for v in fit] for fit in fits]
+    return {"columns":FIT_COLUMNS,"fits":fits}
+
+def run_job(spec):
+    """Run a job spec in a worker, returning a JSON-serializable result"""
+    if spec["type"] == "experiment":
+        return run_experiment_job(spec)
+    return run_fit_job(spec)
+
+def warm_up_worker():
+    """Run tiny jobs so a new worker has loaded everything it needs before real jobs arrive"""
+    run_fit_job({"series":[[0.0,0.1,0.05,0.02]],"times":[[0,1,2,3]]})
+    run_experiment_job({"treatment_names":["warmup"],"n_individuals":[1],"n_timepoints":1,\
+      "base_params":{"lambda":0.1,"delta":0.1},"seed":0})
+
+class ResultCache(object):
+    """Job results stored by job key, on disk if cache_dir is set and otherwise in memory"""
+
+    def __init__(self,cache_dir=None):
+        self.CacheDir = cache_dir
+        self.Results = {}
+        if cache_dir is not None and not exists(cache_dir):
+            makedirs(cache_dir)
+
+    def get_path(self,key):
+        return join(self.CacheDir,"%s.json" %key)
+
+    def get(self,key):
+        """Return the cached result for key, or None"""
+        if self.CacheDir is None:
+            return self.Results.get(key)
+        path = self.get_path(key)
+        if not exists(path):
+            return None
+        with open(path) as result_file:
+            return json.load(result_file)
+
+    def put(self,key,result):
+        if self.CacheDir is None:
+            self.Results[key] = result
+            return
+        path = self.get_path(key)
+        tmp_path = "%s.tmp.%s" %(path,uuid4().hex)
+        with open(tmp_path,"w") as result_file:
+            json.dump(result,result_file)
+        replace(tmp_path,path)
+
+class RecentStore(object):
+    """An in-memory store of the values of recent jobs, bounded in size and age
+
+    Once max_items values are stored the oldest is dropped, and values are
+    dropped ttl seconds after they were stored.
+    """
+
+    def __init__(self,max_items=DEFAULT_MAX_RECENT,ttl=DEFAULT_RECENT_TTL):
+        self.MaxItems = max_items
+        self.TTL = ttl
+        self.Items = OrderedDict()
+
+    def expire(self):
+        """Drop values older than TTL"""
+        now = monotonic()
+        while self.Items:
+            key,(stored,value) = next(iter(self.Items.items()))
+            if now - stored <= self.TTL:
+                break
+            del self.Items[key]
+
+    def get(self,key):
+        """Return the value stored for key, or None if unknown or expired"""
+        self.expire()
+        item = self.Items.get(key)
+        return None if item is None else item[1]
+
+    def put(self,key,value):
+        self.Items.pop(key,None)
+        self.Items[key] = (monotonic(),value)
+        while len(self.Items) > self.MaxItems:
+            self.Items.popitem(last=False)
+        self.expire()
+
+    def __len__(self):
+        self.expire()
+        return len(self.Items)
+
+class JobServer(object):
+    """Runs job specs on a persistent worker pool, deduplicating and caching results"""
+
+    def __init__(self,cache_dir=None,n_workers=None,executor=None,\
+      max_recent=DEFAULT_MAX_RECENT,recent_ttl=DEFAULT_RECENT_TTL):
+        """
+        cache_dir -- directory for cached results (kept in memory if None)
+        n_workers -- number of worker processes (default: number of CPUs)
+        executor -- optionally, an existing concurrent.futures executor to use instead
+        max_recent,recent_ttl -- the results of uncacheable (unseeded) jobs and the
+          errors of failed jobs are kept for at most max_recent jobs each, for
+          recent_ttl seconds
+        """
+        self.Cache = ResultCache(cache_dir)
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=n_workers,initializer=warm_up_worker)
+        self.Executor = executor
+        self.InFlight = {}
+        self.Recent = RecentStore(max_recent,recent_ttl)
+        self.Errors = RecentStore(max_recent,recent_ttl)
+        self.Counts = {"submitted":0,"cached":0,"deduplicated":0,"completed":0,"failed":0}
+
+    def start_job(self,spec):
+        """Start a job (or find an identical one), returning (key,status,result or future)
+
+        status is 'cached' (with the result), 'deduplicated' (with the future
+        of the identical running job) or 'submitted' (with a new future).
+        Must be called from the event loop.
+        """
+        check_job_spec(spec)
+        if is_cacheable(spec):
+            key = get_job_key(spec)
+            result = self.Cache.get(key)
+            if result is not None:
+                self.Counts["cached"] += 1
+                return key,"cached",result
+            if key in self.InFlight:
+                self.Counts["deduplicated"] += 1
+                return key,"deduplicated",self.InFlight[key]
+        else:
+            key = uuid4().hex
+        self.Counts["submitted"] += 1
+        future = asyncio.ensure_future(self.run(key,spec))
+        #Failures are reported to whoever waits on the job (or via /jobs/<key>)
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.InFlight[key] = future
+        return key,"submitted",future
+
+    async def run(self,key,spec):
+        loop = asyncio.get_running_loop()
+        logger.info("Running %s job %s",spec["type"],key)
+        try:
+            result = await loop.run_in_executor(self.Executor,run_job,spec)
+        except Exception as e:
+            self.Counts["failed"] += 1
+            error = "%s: %s" %(type(e).__name__,e)
+            self.Errors.put(key,error)
+            logger.error("Job %s failed: %s",key,error)
+            raise
+        finally:
+            self.InFlight.pop(key,None)
+        self.Counts["completed"] += 1
+        #Only content-addressed results can ever be found in the cache again
+        if is_cacheable(spec):
+            self.Cache.put(key,result)
+        else:
+            self.Recent.put(key,result)
+        return result
+
+    async def submit(self,spec):
+        """Run a job spec, returning (key,status,result)"""
+        key,status,value = self.start_job(spec)
+        if status == "cached":
+            return key,status,value
+        result = await asyncio.shield(value)
+        return key,status,result
+
+    async def handle_request(self,method,target,body):
+        """Return (http status,JSON-serializable response) for a request"""
+        url = urlsplit(target)
+        path = url.path.rstrip("/")
+        query = parse_qs(url.query)
+        if method == "GET" and path == "/status":
+            status = dict(self.Counts)
+            status["in_flight"] = len(self.InFlight)
+            return 200,status
+        if method == "POST" and path == "/jobs":
+            try:
+                spec = json.loads(body.decode("utf-8"))
+            except ValueError as e:
+                raise ValueError("Job spec is not valid JSON: %s" %e)
+            if query.get("wait",["1"])[0] in ("0","false"):
+                key,status,value = self.start_job(spec)
+                if status == "cached":
+                    return 200,{"key":key,"status":status,"result":value}
+                return 202,{"key":key,"status":status}
+            try:
+                key,status,result = await self.submit(spec)
+            except ValueError:
+                raise
+            except Exception as e:
+                return 500,{"error":"%s: %s" %(type(e).__name__,e)}
+            return 200,{"key":key,"status":status,"result":result}
+        if method == "GET" and path.startswith("/jobs/"):
+            key = path[len("/jobs/"):]
+            if key in self.InFlight:
+                return 202,{"key":key,"status":"running"}
+            result = self.Recent.get(key)
+            if result is None:
+                result = self.Cache.get(key)
+            if result is not None:
+                return 200,{"key":key,"status":"done","result":result}
+            error = self.Errors.get(key)
+            if error is not None:
+                return 500,{"key":key,"status":"failed","error":error}
+            return 404,{"error":"Unknown job: %s" %key}
+        return 404,{"error":"Unknown request: %s %s" %(method,url.path)}
+
+    async def handle_connection(self,reader,writer):
+        """Serve one HTTP request on a connection"""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n",b"\n",b""):
+                    break
+                name,value = line.decode("latin-1").split(":",1)
+                headers[name.strip().lower()] = value.strip()
+            try:
+                method,target,version = request_line.split(" ",2)
+                body = await reader.readexactly(int(headers.get("content-length",0)))
+                status,response = await self.handle_request(method,target,body)
+            except ValueError as e:
+                status,response = 400,{"error":str(e)}
+            payload = json.dumps(response).encode("utf-8")
+            writer.write(("HTTP/1.1 %i %s\r\nContent-Type: application/json\r\nContent-Length: %i\r\nConnection: close\r\n\r\n"\
+              %(status,HTTP_REASONS.get(status,""),len(payload))).encode("latin-1"))
+            writer.write(payload)
+            await writer.drain()
+        except (ConnectionError,asyncio.IncompleteReadError) as e:
+            logger.debug("Connection closed early: %s",e)
+        finally:
+            writer.close()
+
+    async def start(self,host=DEFAULT_HOST,port=DEFAULT_PORT,socket_path=None):
+        """Start serving on host:port (or on a Unix socket), returning the asyncio server"""
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection,path=socket_path)
+            logger.info("Karenina job server listening on %s",socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection,host,port)
+            logger.info("Karenina job server listening on http://%s:%i",host,server.sockets[0].getsockname()[1])
+        return server
+
+    def shutdown(self):
+        self.Executor.shutdown()
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """An HTTPConnection to a server listening on a Unix socket"""
+
+    def __init__(self,socket_path,timeout=None):
+        http.client.HTTPConnection.__init__(self,"localhost",timeout=timeout)
+        self.SocketPath = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.SocketPath)
+
+def request_job_server(method,path,body=None,host=DEFAULT_HOST,port=DEFAULT_PORT,\
+  socket_path=None,timeout=None):
+    """Send a request to a job server, returning (http status,response dict)"""
+    if socket_path is not None:
+        connection = UnixHTTPConnection(socket_path,timeout=timeout)
+    else:
+        connection = http.client.HTTPConnection(host,port,timeout=timeout)
+    try:
+        headers = {"Content-Type":"application/json"}
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        connection.request(method,path,body=payload,headers=headers)
+        response = connection.getresponse()
+        return response.status,json.loads(response.read().decode("utf-8"))
+    finally:
+        connection.close()
+
+def submit_job(spec,wait=True,**kwargs):
+    """Submit a job spec to a running job server
+
+    If wait is True, returns the job's result, raising a RuntimeError if it failed.
+    Otherwise returns the job key, for use with get_job_result().
+    Keyword arguments (host,port,socket_path,timeout) are passed to request_job_server.
+    """
+    path = "/jobs" if wait else "/jobs?wait=0"
+    status,response = request_job_server("POST",path,spec,**kwargs)
+    if status not in (200,202):
+        raise RuntimeError("Job server error (%i): %s" %(status,response.get("error")))
+    if wait:
+        return response["result"]
+    return response["key"]
+
+def get_job_result(key,**kwargs):
+    """Return the result of a submitted job, or None if it is still running"""
+    status,response = request_job_server("GET","/jobs/%s" %key,**kwargs)
+    if status == 202:
+        return None
+    if status != 200:
+        raise RuntimeError("Job server error (%i): %s" %(status,response.get("error")))
+    return response["result"]
+
+def make_option_parser():
+    """Return an optparse OptionParser object"""
+    parser = OptionParser(usage = "%prog --cache_dir ./karenina_cache",
+    description = "Run a local server that accepts karenina simulation and " +
+    "fitting jobs as JSON, runs them on a persistent worker pool and caches results.",
+    version = __version__)
+    parser.add_option('--host',default=DEFAULT_HOST,type="string",\
+      help='Host to listen on. Only use a non-local address on a trusted network. [default: %default]')
+    parser.add_option('--port',default=DEFAULT_PORT,type="int",\
+      help='Port to listen on [default: %default]')
+    parser.add_option('--socket_path',default=None,type="string",\
+      help='Listen on this Unix socket instead of a TCP port [default: %default]')
+    parser.add_option('--cache_dir',default=None,type="string",\
+      help='Directory for cached job results. Results are kept in memory if not set. [default: %default]')
+    parser.add_option('--n_workers',default=None,type="int",\
+      help='Number of worker processes [default: number of CPUs]')
+    parser.add_option('--max_recent',default=DEFAULT_MAX_RECENT,type="int",\
+      help='Number of unseeded job results and job errors kept in memory for retrieval [default: %default]')
+    parser.add_option('--recent_ttl',default=DEFAULT_RECENT_TTL,type="float",\
+      help='Seconds that unseeded job results and job errors are kept [default: %default]')
+    return parser
+
+def main():
+    parser = make_option_parser()
+    opts, args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    job_server = JobServer(cache_dir=opts.cache_dir,n_workers=opts.n_workers,\
+      max_recent=opts.max_recent,recent_ttl=opts.recent_ttl)
+
+    async def serve():
+        server = await job_server.start(opts.host,opts.port,opts.socket_path)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        logger.info("Shutting down job server")
+    finally:
+        job_server.shutdown()
+
+if __name__ == "__main__":
+    main()
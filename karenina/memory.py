@@ -0,0 +1,252 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Memory accounting for simulations and fits.
+#
+#estimate_experiment_memory predicts peak memory from an experiment's design
+#before anything is simulated, as a sum of components:
+#
+#baseline -- the interpreter with numpy and scipy loaded
+#individuals -- Individual and Process objects (process engine)
+#history -- stored coordinates: ~33 bytes per value for the process engine
+#  (a Python float in a list), 8 bytes per value for the multivariate engine
+#  (4 or 2 with a float32 or int16 history_dtype)
+#shared_history -- the shared-memory cohort array of Experiment.simulate_parallel
+#data_rows -- text rows kept in Experiment.Data unless output is streamed
+#movie -- the timeseries arrays copied when a movie is written
+#
+#With a block_size (Experiment.simulate_blocks), only one block of individuals
+#exists at a time, so the individuals and history components are those of the
+#largest block rather than of the whole population.
+#
+#Per-value costs were measured with tracemalloc, so estimates are
+#approximate (typically within 20%) but scale correctly with the design.
+#
+#MemoryProfiler is a profiler.PhaseProfiler that also records the peak memory
+#reached during each stage, using either tracemalloc (Python and numpy
+#allocations; exact but slows the run) or RSS sampling (cheap, whole process).
+
+from profiler import PhaseProfiler,Stage,PROFILE_COLUMNS
+from progress import get_peak_memory_mb
+from trajectory_storage import check_storage_dtype
+import tracemalloc
+import logging
+import numpy
+
+logger = logging.getLogger("karenina.memory")
+
+MB = 1024.0 * 1024.0
+BASELINE_MB = 100.0
+PROCESS_HISTORY_BYTES = 33.0
+MULTIVARIATE_HISTORY_BYTES = 8.0
+TIMEPOINT_ARRAY_BYTES = 128.0
+INDIVIDUAL_BYTES = 600.0
+PROCESS_BYTES = 500.0
+ROW_BYTES = 80.0
+ROW_BYTES_PER_AXIS = 20.0
+MEMORY_METHODS = ("rss","tracemalloc")
+OVER_BUDGET_ACTIONS = ("stream","refuse")
+
+def get_kept_timepoints(n_timepoints,history_window=None):
+    """Return the number of timepoints of history kept per individual"""
+    if history_window is None:
+        return n_timepoints + 1
+    return min(history_window,n_timepoints + 1)
+
+def estimate_experiment_memory(n_individuals,n_timepoints,n_axes,engine="process",\
+  history_window=None,collect_data=True,write_movie=True,shared_history=False,block_size=None,\
+  history_dtype=None):
+    """Return a dict of component -> estimated peak bytes for an Experiment design
+
+    n_individuals -- list of the number of individuals per treatment (or a total)
+    n_timepoints -- number of simulated timepoints
+    n_axes -- number of axes
+    engine,history_window,collect_data -- as for Experiment
+    write_movie -- whether a movie is written at the end (needs kept history)
+    shared_history -- whether Experiment.simulate_parallel is used
+    block_size -- individuals per block if Experiment.simulate_blocks is used
+      (no movie or shared history is possible then)
+    history_dtype -- storage of multivariate engine histories, as for Experiment
+
+    The dict includes a 'total' entry.
+    """
+    if engine not in ("process","multivariate"):
+        raise ValueError("engine must be 'process' or 'multivariate'. Got: %s" %engine)
+    n_total = sum(n_individuals) if hasattr(n_individuals,"__iter__") else n_individuals
+    n_treatments = len(n_individuals) if hasattr(n_individuals,"__iter__") else 1
+    n_live = n_total
+    if block_size is not None:
+        per_treatment = n_individuals if hasattr(n_individuals,"__iter__") else [n_individuals]
+        n_live = min(block_size,max(per_treatment))
+        n_treatments = 1
+        write_movie = shared_history = False
+    kept = get_kept_timepoints(n_timepoints,history_window)
+    n_values = n_live * kept * n_axes
+    estimate = {"baseline":BASELINE_MB * MB}
+    if engine == "process":
+        estimate["individuals"] = n_live * (INDIVIDUAL_BYTES + PROCESS_BYTES * n_axes)
+        estimate["history"] = n_values * PROCESS_HISTORY_BYTES
+    else:
+        estimate["individuals"] = 0.0
+        history_bytes = MULTIVARIATE_HISTORY_BYTES * numpy.dtype(check_storage_dtype(history_dtype)).itemsize / 8.0
+        estimate["history"] = n_values * history_bytes + n_treatments * kept * TIMEPOINT_ARRAY_BYTES
+    estimate["shared_history"] = n_total * (n_timepoints + 1) * n_axes * 8.0 if shared_history else 0.0
+    estimate["data_rows"] = n_total * n_timepoints * (ROW_BYTES + ROW_BYTES_PER_AXIS * n_axes)\
+      if collect_data else 0.0
+    estimate["movie"] = n_total * kept * n_axes * 8.0 if write_movie and kept > 0 else 0.0
+    estimate["total"] = sum(estimate.values())
+    return estimate
+
+def estimate_fit_memory(n_series,n_timepoints,n_outputs=4):
+    """Return a dict of component -> estimated peak bytes for fitting many series at once
+
+    Vectorized fits (e.g. ou_likelihood.fit_OU_ar1 or a pooled likelihood) hold
+    the NaN-padded series, its times and about six temporaries of the same size.
+    """
+    padded = n_series * n_timepoints * 8.0
+    estimate = {"baseline":BASELINE_MB * MB,"series":2 * padded,"temporaries":6 * padded,\
+      "results":n_series * n_outputs * 8.0}
+    estimate["total"] = sum(estimate.values())
+    return estimate
+
+def format_memory_estimate(estimate):
+    """Return a one-line summary of a memory estimate in MB"""
+    parts = ["%s %.1f MB" %(name,estimate[name] / MB) for name in sorted(estimate)\
+      if name != "total" and estimate[name] > 0]
+    return "%.1f MB (%s)" %(estimate["total"] / MB,", ".join(parts))
+
+def fit_to_memory_budget(n_individuals,n_timepoints,n_axes,budget_mb,engine="process",\
+  history_window=None,stream_output=False,write_movie=True,over_budget="stream",block_size=None,\
+  history_dtype=None):
+    """Return (history_window,stream_output,estimate) that keep a design within budget_mb
+
+    If the estimate exceeds budget_mb and over_budget is 'stream', output is
+    streamed to disk (no Data rows) and no history is kept (no movie). A
+    ValueError is raised if over_budget is 'refuse', or if even streaming
+    without history exceeds the budget.
+    """
+    if over_budget not in OVER_BUDGET_ACTIONS:
+        raise ValueError("over_budget must be one of %s. Got: %s" %(", ".join(OVER_BUDGET_ACTIONS),over_budget))
+    estimate = estimate_experiment_memory(n_individuals,n_timepoints,n_axes,engine,\
+      history_window,not stream_output,write_movie and history_window != 0,block_size=block_size,\
+      history_dtype=history_dtype)
+    if budget_mb is None or estimate["total"] <= budget_mb * MB:
+        return history_window,stream_output,estimate
+    message = "Estimated peak memory %s exceeds the memory budget of %.1f MB"\
+      %(format_memory_estimate(estimate),budget_mb)
+    if over_budget == "refuse":
+        raise ValueError(message)
+    streaming_estimate = estimate_experiment_memory(n_individuals,n_timepoints,n_axes,engine,\
+      0,False,False,block_size=block_size)
+    if streaming_estimate["total"] > budget_mb * MB:
+        raise ValueError(message + ", even when streaming output without history (%s)"\
+          %format_memory_estimate(streaming_estimate))
+    logger.warning("%s; streaming output without history (no movie) instead",message)
+    return 0,True,streaming_estimate
+
+def get_current_memory_mb():
+    """Return the current resident memory of this process in MB, or None if unknown"""
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (IOError,OSError,ValueError,IndexError):
+        return get_peak_memory_mb()
+    from resource import getpagesize
+    return resident_pages * getpagesize() / MB
+
+class MemoryStage(Stage):
+    """Times one entry into a stage and tracks the peak memory reached during it"""
+
+    def __enter__(self):
+        self.PeakMB = 0.0
+        self.Profiler.update_peaks()
+        self.Profiler.ActiveStages.append(self)
+        return Stage.__enter__(self)
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        Stage.__exit__(self,exc_type,exc_value,traceback)
+        self.Profiler.update_peaks()
+        self.Profiler.ActiveStages.remove(self)
+        self.Profiler.record_peak(self.Name,self.PeakMB)
+        return False
+
+class MemoryProfiler(PhaseProfiler):
+    """A PhaseProfiler that also reports the peak memory (in MB) reached in each stage
+
+    method -- 'rss' to sample resident memory at stage boundaries (the process
+      high-water mark catches peaks between samples), or 'tracemalloc' for the
+      exact peak of Python and numpy allocations (excluding the baseline), at
+      the cost of slowing the run.
+    """
+    Columns = PROFILE_COLUMNS + ["peak_mb"]
+
+    def __init__(self,method="rss"):
+        if method not in MEMORY_METHODS:
+            raise ValueError("method must be one of %s. Got: %s" %(", ".join(MEMORY_METHODS),method))
+        PhaseProfiler.__init__(self)
+        self.Method = method
+        self.ActiveStages = []
+        self.Peaks = {}
+        self.PeakMB = 0.0
+        self.StartedTracing = False
+        if method == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.StartedTracing = True
+        self.LastHighWaterMB = get_peak_memory_mb() or 0.0
+
+    def stage(self,name):
+        return MemoryStage(self,name)
+
+    def get_peak_since_update(self):
+        """Return the peak memory in MB since the last call"""
+        if self.Method == "tracemalloc":
+            peak = tracemalloc.get_traced_memory()[1] / MB
+            tracemalloc.reset_peak()
+            return peak
+        high_water = get_peak_memory_mb() or 0.0
+        current = get_current_memory_mb() or 0.0
+        grew = high_water > self.LastHighWaterMB
+        self.LastHighWaterMB = high_water
+        return high_water if grew else current
+
+    def update_peaks(self):
+        """Attribute the peak since the last update to every active stage"""
+        peak = self.get_peak_since_update()
+        self.PeakMB = max(self.PeakMB,peak)
+        for stage in self.ActiveStages:
+            stage.PeakMB = max(stage.PeakMB,peak)
+
+    def record_peak(self,name,peak_mb):
+        """Record peak_mb for stage name, keeping the highest over calls"""
+        self.Peaks[name] = max(self.Peaks.get(name,0.0),peak_mb)
+
+    def stop(self):
+        if self.TotalWall is not None:
+            return
+        self.update_peaks()
+        PhaseProfiler.stop(self)
+        if self.StartedTracing:
+            tracemalloc.stop()
+            self.StartedTracing = False
+
+    def get_rows(self):
+        rows = PhaseProfiler.get_rows(self)
+        for row in rows:
+            row["peak_mb"] = self.Peaks.get(row["stage"],0.0)
+        return rows
+
+    def get_report(self):
+        report = PhaseProfiler.get_report(self)
+        report["peak_mb"] = self.PeakMB
+        report["method"] = self.Method
+        return report
@@ -0,0 +1,363 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import numpy
+from collections import deque
+from numpy import asarray,exp,expm1,sqrt,zeros,eye,diag,where
+from scipy.linalg import expm,eigh
+from trajectory_storage import check_storage_dtype,encode_values,decode_values
+
+def get_random_state(random_state=None):
+    """Return a numpy RandomState
+
+    random_state -- None to use numpy's global generator (the one used by
+      scipy.stats and therefore by Process objects), an int seed, or an
+      existing RandomState object.
+    """
+    if random_state is None:
+        return numpy.random.mtrand._rand
+    if isinstance(random_state,numpy.random.RandomState):
+        return random_state
+    return numpy.random.RandomState(random_state)
+
+def psd_sqrt(m):
+    """Return a square root L of positive semi-definite matrix m, so L.dot(L.T) == m
+
+    Unlike a Cholesky factorization, this tolerates singular matrices
+    (e.g. when some axes have zero variance).
+    """
+    eigenvalues,eigenvectors = eigh(m)
+    eigenvalues = numpy.clip(eigenvalues,0.0,None)
+    return eigenvectors * sqrt(eigenvalues)
+
+def get_exact_ou_transition(drift,diffusion,dt):
+    """Return the (transition matrix,noise covariance) of a multivariate OU process over dt
+
+    The process is dX = -drift (X - mu) dt + dW, Cov(dW) = diffusion * dt,
+    so over an interval dt:
+
+    X(t+dt) = mu + Phi (X(t) - mu) + e,  e ~ N(0,Q)
+
+    drift -- (D,D) drift matrix (e.g. diag(lambda) plus cross-axis coupling)
+    diffusion -- (D,D) diffusion covariance per unit time
+    dt -- the time interval
+
+    Phi = expm(-drift * dt). Q is computed with Van Loan's method
+    (a single matrix exponential of a 2D x 2D block matrix).
+    """
+    n_dim = drift.shape[0]
+    block = zeros((2*n_dim,2*n_dim))
+    block[:n_dim,:n_dim] = drift
+    block[:n_dim,n_dim:] = diffusion
+    block[n_dim:,n_dim:] = -drift.T
+    block_exp = expm(block * dt)
+    phi = block_exp[n_dim:,n_dim:].T
+    q = phi.dot(block_exp[:n_dim,n_dim:])
+    #Symmetrize to remove roundoff
+    q = (q + q.T) / 2.0
+    return phi,q
+
+class MultivariateProcess(object):
+    """Represents a cohort of Ornstein-Uhlenbeck processes in a D-dimensional Euclidean space
+
+    Each row of Coords is the position of one individual. All individuals
+    are advanced together with batched array operations, so one update()
+    call replaces n_individuals x n_axes Process.update() calls.
+
+    The model for each individual is:
+
+    dX = -A (X - mu) dt + dW,  Cov(dW) = S R S dt
+
+    A -- drift matrix, diag(lambda) plus optional cross-axis 'coupling'
+    mu -- mean (home) position
+    S -- diag(delta**2), the per-axis noise scale.  (This matches the scale
+      used by Process.bm_change for a unit timestep.)
+    R -- optional noise 'correlation' matrix between axes (identity by default)
+
+    lambda, delta and mu may vary per individual (shape (n_individuals,D)),
+    and update() accepts a separate dt per individual. This lets many
+    parameter combinations or irregular sampling schedules be simulated
+    in one batched call.  Without coupling or correlation the axes are
+    independent and every update is purely elementwise.
+    """
+
+    def __init__(self,start_coords,axes,params,method="exact",\
+      min_bound=-1.0,max_bound=1.0,random_state=None,history_window=None,history_dtype=None):
+        """
+        start_coords -- (n_individuals,D) array of starting positions
+        axes -- list of D axis names. Perturbations target axes by name.
+        params -- dict with 'lambda', 'delta' and optionally 'mu' (defaults to
+          start_coords). Each may be a scalar, a (D,) array or a (n_individuals,D) array.
+          Optional 'coupling' (D,D) off-diagonal drift and 'correlation' (D,D)
+          noise correlation matrices allow dependence between axes.
+        method -- 'exact' (matrix exponential transition, valid for any dt) or
+          'euler' (Euler-Maruyama update, as used by Process.ou_update)
+        min_bound,max_bound -- coordinates are clamped to this range after
+          every update (set to None for no bound), as in Process.ou_update
+        random_state -- None (numpy's global generator), an int seed or a RandomState
+        history_window -- if None, store the coordinates after every update in History.
+          Otherwise keep only the most recent history_window coordinate arrays
+          (0 keeps none), so memory does not grow with the number of timepoints.
+        history_dtype -- how History is stored: 'float64' (default), 'float32' or 'int16'
+          (quantized within min_bound,max_bound; see trajectory_storage.py).
+          get_history_array() decodes stored coordinates back to float64.
+        """
+        start_coords = numpy.array(start_coords,dtype=float)
+        if start_coords.ndim != 2 or start_coords.shape[1] != len(axes):
+            raise ValueError("start_coords must be an (n_individuals,%i) array matching axes %s. Got shape: %s"\
+              %(len(axes),axes,str(start_coords.shape)))
+        if method not in ("exact","euler"):
+            raise ValueError("Invalid method for MultivariateProcess: %s" %method)
+
+        self.Axes = list(axes)
+        self.AxisIndex = dict((axis,i) for i,axis in enumerate(self.Axes))
+        self.StartCoords = start_coords
+        self.Coords = start_coords.copy()
+        self.Method = method
+        self.MinBound = min_bound
+        self.MaxBound = max_bound
+        self.RandomState = get_random_state(random_state)
+        self.Perturbations = []
+
+        self.Params = {}
+        for name in ("lambda","delta"):
+            if name not in params:
+                raise ValueError("MultivariateProcess requires a '%s' parameter" %name)
+            self.Params[name] = self.check_param_shape(name,params[name])
+        self.Params["mu"] = self.check_param_shape("mu",params.get("mu",start_coords))
+
+        self.Coupling = None
+        self.Correlation = None
+        if params.get("coupling") is not None:
+            self.Coupling = self.check_matrix_shape("coupling",params["coupling"])
+        if params.get("correlation") is not None:
+            self.Correlation = self.check_matrix_shape("correlation",params["correlation"])
+        self.TransitionCache = {}
+
+        self.HistoryDType = check_storage_dtype(history_dtype)
+        if self.HistoryDType == "int16" and (min_bound is None or max_bound is None):
+            raise ValueError("int16 history_dtype requires both min_bound and max_bound")
+        self.HistoryWindow = history_window
+        if history_window is None:
+            self.History = [self.encode_history(self.Coords.copy())]
+        else:
+            self.History = deque([self.encode_history(self.Coords.copy())],maxlen=history_window)
+
+    @property
+    def NIndividuals(self):
+        return self.Coords.shape[0]
+
+    def check_param_shape(self,name,value):
+        """Return value as a float array broadcastable to (n_individuals,D)"""
+        value = numpy.array(value,dtype=float)
+        try:
+            valid = numpy.broadcast_shapes(value.shape,self.StartCoords.shape) == self.StartCoords.shape
+        except ValueError:
+            valid = False
+        if not valid:
+            raise ValueError("Parameter '%s' with shape %s can't be applied to %i individuals x %i axes"\
+              %(name,str(value.shape),self.StartCoords.shape[0],self.StartCoords.shape[1]))
+        if value.ndim == 0:
+            value = numpy.repeat(value,self.StartCoords.shape[1])
+        return value
+
+    def check_matrix_shape(self,name,value):
+        """Return value as a (D,D) float array"""
+        value = asarray(value,dtype=float)
+        n_dim = len(self.Axes)
+        if value.shape != (n_dim,n_dim):
+            raise ValueError("Parameter '%s' must be a (%i,%i) matrix. Got shape: %s"\
+              %(name,n_dim,n_dim,str(value.shape)))
+        return value
+
+    def is_coupled(self):
+        """Return True if axes are coupled through drift or noise correlation"""
+        return self.Coupling is not None or self.Correlation is not None
+
+    def get_axis_indices(self,axes):
+        """Return column indices for a list of axis names"""
+        try:
+            return [self.AxisIndex[axis] for axis in axes]
+        except KeyError as e:
+            raise ValueError("Perturbation targets axis %s, which is not one of %s" %(str(e),self.Axes))
+
+    def get_current_params(self,times=None):
+        """Return a dict of lambda, delta and mu arrays with all active perturbations applied
+
+        times -- optionally, an (n_individuals,) array with the current time of each
+          individual. Each perturbation is then applied only to individuals for which it
+          is active, i.e. Start <= time < End + 1 (the continuous-time equivalent of
+          the inclusive Start and End timesteps used by Experiment).
+
+        ScheduledPerturbations are applied at their CurrentWeight or, when times
+        are given, at each individual's compiled weight for its current time.
+        """
+        curr_params = dict(self.Params)
+        for perturbation in self.Perturbations:
+            rows = None
+            if times is not None:
+                active = (perturbation.Start <= times) & (times < perturbation.End + 1)
+                if not active.any():
+                    continue
+                if not active.all():
+                    rows = numpy.nonzero(active)[0]
+            indices = self.get_axis_indices(perturbation.Axes)
+            #Only the columns for targeted axes are passed to the perturbation
+            targeted = {}
+            for name in perturbation.Params.keys():
+                if name not in curr_params:
+                    raise ValueError("Perturbation alters unknown parameter '%s'. Supported parameters: %s"\
+                      %(name,sorted(curr_params.keys())))
+                targeted[name] = curr_params[name][...,indices]
+            if perturbation.Weights is not None and times is not None:
+                weights = perturbation.getWeights(times)[:,numpy.newaxis]
+                updated = perturbation.updateParams(targeted,weights)
+                if rows is None:
+                    rows = numpy.arange(self.NIndividuals)
+            else:
+                updated = perturbation.updateParams(targeted)
+            for name,value in updated.items():
+                if rows is None:
+                    new_value = curr_params[name].astype(float)
+                    new_value[...,indices] = value
+                else:
+                    #Only some individuals are perturbed, so expand to one row per individual
+                    new_value = numpy.array(numpy.broadcast_to(curr_params[name],self.Coords.shape))
+                    value = numpy.broadcast_to(value,(self.Coords.shape[0],len(indices)))
+                    new_value[numpy.ix_(rows,indices)] = value[rows]
+                curr_params[name] = new_value
+        return curr_params
+
+    def applyPerturbation(self,perturbation):
+        """Apply a perturbation to all individuals in the cohort"""
+        self.get_axis_indices(perturbation.Axes)
+        self.Perturbations.append(perturbation)
+
+    def removePerturbation(self,perturbation):
+        """Remove a perturbation from all individuals in the cohort"""
+        self.Perturbations.remove(perturbation)
+
+    def get_coupled_transition(self,dt,L,delta):
+        """Return cached (Phi,noise square root) for the coupled exact update"""
+        key = (dt,L.tobytes(),delta.tobytes())
+        if key not in self.TransitionCache:
+            drift = diag(L)
+            if self.Coupling is not None:
+                drift = drift + self.Coupling
+            scale = diag(delta**2)
+            correlation = self.Correlation if self.Correlation is not None else eye(len(self.Axes))
+            diffusion = scale.dot(correlation).dot(scale)
+            phi,q = get_exact_ou_transition(drift,diffusion,dt)
+            if len(self.TransitionCache) >= 10000:
+                self.TransitionCache.clear()
+            self.TransitionCache[key] = (phi,psd_sqrt(q))
+        return self.TransitionCache[key]
+
+    def coupled_exact_update(self,x,mu,L,delta,dt,z):
+        """Return new coordinates for coupled axes using exact transitions
+
+        Individuals sharing the same (dt,lambda,delta) share one transition
+        matrix, so the common case (all equal) is a single batched product.
+        """
+        if numpy.ndim(dt) == 0 and L.ndim == 1 and delta.ndim == 1:
+            phi,noise_sqrt = self.get_coupled_transition(float(dt),L,delta)
+            return mu + (x - mu).dot(phi.T) + z.dot(noise_sqrt.T)
+
+        n_individuals,n_dim = x.shape
+        dts = numpy.broadcast_to(numpy.reshape(dt,(-1,1)),(n_individuals,1))
+        keys = numpy.hstack([dts,numpy.broadcast_to(L,x.shape),numpy.broadcast_to(delta,x.shape)])
+        unique_keys,groups = numpy.unique(keys,axis=0,return_inverse=True)
+        groups = groups.reshape(-1)
+        mu = numpy.broadcast_to(mu,x.shape)
+        new_coords = numpy.empty_like(x)
+        for group,key in enumerate(unique_keys):
+            rows = groups == group
+            phi,noise_sqrt = self.get_coupled_transition(key[0],key[1:n_dim+1],key[n_dim+1:])
+            new_coords[rows] = mu[rows] + (x[rows] - mu[rows]).dot(phi.T) + z[rows].dot(noise_sqrt.T)
+        return new_coords
+
+    def update(self,dt,times=None):
+        """Advance all individuals by dt
+
+        dt -- the time step, either one value or an (n_individuals,) array
+          giving a separate step for each individual
+        times -- optionally, an (n_individuals,) array of the time at the start of
+          the step for each individual, used to decide which perturbations are
+          active for each individual (see get_current_params)
+        """
+        params = self.get_current_params(times)
+        L = params["lambda"]
+        delta = params["delta"]
+        mu = params["mu"]
+        x = self.Coords
+        z = self.RandomState.standard_normal(x.shape)
+        if numpy.ndim(dt) != 0:
+            dt = numpy.reshape(numpy.asarray(dt,dtype=float),(-1,1))
+
+        if self.is_coupled():
+            if self.Method == "exact":
+                new_coords = self.coupled_exact_update(x,mu,L,delta,dt,z)
+            else:
+                displacement = x - mu
+                drift = L * displacement
+                if self.Coupling is not None:
+                    drift = drift + displacement.dot(self.Coupling.T)
+                if self.Correlation is not None:
+                    z = z.dot(psd_sqrt(self.Correlation).T)
+                dW = z * (delta**2 * dt)
+                new_coords = x - drift * dt + dW
+        elif self.Method == "exact":
+            phi = exp(-L * dt)
+            #Variance of the exact transition: s**2 (1-exp(-2 L dt)) / 2L,
+            #which tends to s**2 dt (Brownian motion) as L -> 0
+            two_L_dt = 2.0 * L * dt
+            safe_L = where(L == 0,1.0,L)
+            variance_factor = where(L == 0,dt,-expm1(-two_L_dt) / (2.0 * safe_L))
+            std = delta**2 * sqrt(variance_factor)
+            new_coords = mu + phi * (x - mu) + z * std
+        else:
+            #Same arithmetic as Process.ou_change / ou_update
+            dW = z * (delta**2 * dt)
+            ds = L * (mu - x) * dt + dW
+            new_coords = x + ds
+
+        if self.MinBound is not None:
+            new_coords = numpy.maximum(new_coords,self.MinBound)
+        if self.MaxBound is not None:
+            new_coords = numpy.minimum(new_coords,self.MaxBound)
+        self.Coords = new_coords
+        if self.HistoryWindow != 0:
+            self.History.append(self.encode_history(new_coords))
+
+    def simulate(self,n_timepoints,dt=1.0):
+        """Advance all individuals n_timepoints times by dt"""
+        for t in range(n_timepoints):
+            self.update(dt)
+
+    def encode_history(self,coords):
+        """Return coords converted to HistoryDType for storage in History"""
+        if self.HistoryDType == "float64":
+            return coords
+        return encode_values(coords,self.HistoryDType,self.MinBound,self.MaxBound)
+
+    def get_history_array(self):
+        """Return History as a (n_individuals,n_timepoints,D) float64 array
+
+        If a history_window was set, only the most recent timepoints are included.
+        """
+        if not self.History:
+            raise ValueError("History was not kept for this MultivariateProcess (history_window=0)")
+        history = numpy.stack(self.History,axis=1)
+        if self.HistoryDType == "float64":
+            return history
+        return decode_values(history,self.MinBound,self.MaxBound)
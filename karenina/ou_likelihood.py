@@ -0,0 +1,429 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import numpy
+from numpy import asarray,exp,expm1,log,pi,where,inf,array,isfinite
+from scipy.optimize import minimize
+from scipy.signal import lfilter
+
+#Vectorized likelihoods for OU timeseries.
+#
+#These use the exact OU transition density, which is valid for any
+#spacing of timepoints:
+#
+#x(t+dt) | x(t) ~ N(Theta + (x(t) - Theta) exp(-Lambda dt),
+#                  Sigma**2 (1 - exp(-2 Lambda dt)) / (2 Lambda))
+#
+#Sigma -- scale of the Wiener process per unit time. For data simulated by
+#  karenina, Sigma corresponds to delta**2.
+#Lambda -- rate of reversion to Theta
+#Theta -- mean ('home') position
+#
+#Many series can be evaluated at once by passing x as an (n_series,n_timepoints)
+#array. Series of different lengths are padded with NaN at the end.
+
+LOG_2PI = log(2.0 * pi)
+MIN_VARIANCE = 1e-12
+
+def get_transition_moments(x_prev,dts,Sigma,Lambda,Theta):
+    """Return (mean,variance) of the exact OU transition from x_prev over dts"""
+    phi = exp(-Lambda * dts)
+    safe_Lambda = where(Lambda == 0,1.0,Lambda)
+    variance_factor = where(Lambda == 0,dts,-expm1(-2.0 * Lambda * dts) / (2.0 * safe_Lambda))
+    variance = Sigma**2 * variance_factor + MIN_VARIANCE
+    mean = Theta + (x_prev - Theta) * phi
+    return mean,variance
+
+def get_exact_OU_nlogLik(x,times,Sigma,Lambda,Theta):
+    """Return the negative log likelihood of OU parameters given one or many series
+
+    x -- a 1d array for one series, or an (n_series,n_timepoints) array with
+      NaN padding at the end of shorter series. MUST be ordered by time.
+    times -- times matching x (a 1d array shared by all series, or an array shaped like x)
+    Sigma,Lambda,Theta -- OU parameters: scalars, or (n_series,) arrays
+
+    Returns a float for 1d x, otherwise an (n_series,) array. The first
+    observation of each series is conditioned on (not scored).
+    """
+    x = asarray(x,dtype=float)
+    single = x.ndim == 1
+    x = numpy.atleast_2d(x)
+    times = numpy.broadcast_to(asarray(times,dtype=float),x.shape)
+    Sigma,Lambda,Theta = [numpy.reshape(asarray(p,dtype=float),(-1,1)) for p in (Sigma,Lambda,Theta)]
+
+    dts = numpy.diff(times,axis=1)
+    x_prev = x[:,:-1]
+    x_next = x[:,1:]
+    mean,variance = get_transition_moments(x_prev,dts,Sigma,Lambda,Theta)
+    terms = 0.5 * (LOG_2PI + log(variance) + (x_next - mean)**2 / variance)
+    #Padding (NaN) steps contribute nothing
+    terms = where(numpy.isnan(x_next) | numpy.isnan(x_prev),0.0,terms)
+    nlogLik = terms.sum(axis=1)
+    if single:
+        return float(nlogLik[0])
+    return nlogLik
+
+def make_exact_OU_objective_fn(x,times):
+    """Return f(p) -> negative log likelihood, for p = array([Sigma,Lambda,Theta])
+
+    A drop-in replacement for fit_timeseries.make_OU_objective_fn using
+    the exact (and vectorized) transition density.
+    """
+    x = asarray(x,dtype=float)
+    times = asarray(times,dtype=float)
+
+    def fn_to_optimize(p):
+        if numpy.shape(p) != (3,):
+            raise ValueError("OU optimization must operate on a (3,) array representing Sigma,Lamda,and Theta values")
+        Sigma,Lambda,Theta = p
+        return get_exact_OU_nlogLik(x,times,Sigma,Lambda,Theta)
+
+    return fn_to_optimize
+
+def get_starting_params(x,times):
+    """Return a rough (Sigma,Lambda,Theta) starting guess for a series"""
+    x = asarray(x,dtype=float)
+    keep = ~numpy.isnan(x)
+    x = x[keep]
+    times = asarray(times,dtype=float)[keep]
+    Theta = x.mean() if len(x) else 0.0
+    if len(x) < 3:
+        return array([0.1,0.1,Theta])
+    dts = numpy.diff(times)
+    dx = numpy.diff(x)
+    Sigma = max(numpy.sqrt(numpy.mean(dx**2 / dts)),1e-3)
+    #Lag-1 autocorrelation ~ exp(-Lambda dt)
+    centered = x - Theta
+    denominator = (centered[:-1]**2).sum()
+    rho = (centered[:-1] * centered[1:]).sum() / denominator if denominator > 0 else 0.0
+    rho = min(max(rho,1e-3),0.999)
+    Lambda = -log(rho) / numpy.mean(dts)
+    return array([Sigma,Lambda,Theta])
+
+def fit_OU_exact(x,times,x0=None,xmin=array([1e-6,0.0,-inf]),xmax=array([inf,inf,inf])):
+    """Return array([Sigma,Lambda,Theta,nlogLik]) fitted to one series by maximum likelihood
+
+    x -- 1d array of observations, ordered by time (trailing NaNs are ignored)
+    times -- times of each observation
+    x0 -- optional starting (Sigma,Lambda,Theta). Defaults to a moment-based guess.
+
+    Uses a single bounded quasi-Newton (L-BFGS-B) run on the exact likelihood,
+    which is far cheaper than a global basinhopping search and suitable for
+    fitting thousands of series.
+    """
+    x = asarray(x,dtype=float)
+    times = asarray(times,dtype=float)
+    keep = ~numpy.isnan(x)
+    x = x[keep]
+    times = times[keep]
+    if x0 is None:
+        x0 = get_starting_params(x,times)
+    x0 = numpy.clip(asarray(x0,dtype=float),xmin,xmax)
+    fn_to_optimize = make_exact_OU_objective_fn(x,times)
+    result = minimize(fn_to_optimize,x0,method="L-BFGS-B",bounds=list(zip(xmin,xmax)))
+    fitted = numpy.append(result.x,result.fun)
+    if not isfinite(result.fun):
+        fitted[:] = numpy.nan
+    return fitted
+
+def get_OU_kalman_nlogLik(x,times,Sigma,Lambda,Theta,Epsilon):
+    """Return the negative log likelihood of an OU process observed with measurement noise
+
+    The latent position follows an OU process (Sigma,Lambda,Theta as for
+    get_exact_OU_nlogLik), and each observation adds independent Gaussian
+    noise with standard deviation Epsilon. The likelihood is computed with a
+    Kalman filter: one pass over timepoints (O(n)), vectorized across series.
+
+    x -- a 1d array for one series, or an (n_series,n_timepoints) array with
+      NaN padding at the end of shorter series. MUST be ordered by time.
+    times -- times matching x (a 1d array shared by all series, or an array shaped like x)
+    Sigma,Lambda,Theta,Epsilon -- scalars, or (n_series,) arrays
+
+    As for get_exact_OU_nlogLik, the first observation is conditioned on: the latent
+    position starts at the first observation with variance Epsilon**2. With Epsilon=0
+    this equals get_exact_OU_nlogLik.
+    """
+    x = asarray(x,dtype=float)
+    single = x.ndim == 1
+    x = numpy.atleast_2d(x)
+    times = numpy.atleast_2d(asarray(times,dtype=float))
+    Sigma,Lambda,Theta,Epsilon = [numpy.reshape(asarray(p,dtype=float),(-1,1))\
+      for p in (Sigma,Lambda,Theta,Epsilon)]
+    noise_variance = Epsilon**2
+    n_steps = x.shape[1] - 1
+
+    #The filter's variances and gains do not depend on the observations, so they
+    #are computed once per distinct row of times/parameters (often a single row)
+    dts = numpy.diff(times,axis=1)
+    dts = where(numpy.isnan(dts),0.0,dts)
+    phi = exp(-Lambda * dts)
+    zero,step_variance = get_transition_moments(0.0,dts,Sigma,Lambda,0.0)
+    variance_shape = numpy.broadcast_shapes(phi.shape,step_variance.shape,noise_variance.shape)
+    phi = numpy.broadcast_to(phi,variance_shape)
+    step_variance = numpy.broadcast_to(step_variance,variance_shape)
+    total_variance = numpy.empty(variance_shape)
+    gain = numpy.empty(variance_shape)
+    variance = numpy.broadcast_to(noise_variance,variance_shape[:1]+(1,))[:,0]
+    #With regular sampling the gain quickly reaches a steady state
+    regular = n_steps > 0 and (phi == phi[:,:1]).all() and (step_variance == step_variance[:,:1]).all()
+    steady_from = n_steps
+    for k in range(n_steps):
+        predicted_variance = phi[:,k]**2 * variance + step_variance[:,k]
+        total_variance[:,k] = predicted_variance + noise_variance[:,0]
+        gain[:,k] = predicted_variance / total_variance[:,k]
+        variance = (1.0 - gain[:,k]) * predicted_variance
+        if regular and k > 0 and numpy.allclose(gain[:,k],gain[:,k-1],rtol=1e-14,atol=0.0):
+            total_variance[:,k+1:] = total_variance[:,k:k+1]
+            gain[:,k+1:] = gain[:,k:k+1]
+            steady_from = k
+            break
+
+    #The filtered mean is then a linear recurrence: m[k+1] = a[k] m[k] + b[k]
+    y = x[:,1:]
+    a = (1.0 - gain) * phi
+    b = (1.0 - gain) * Theta * (1.0 - phi) + gain * where(numpy.isnan(y),0.0,y)
+    a,b = numpy.broadcast_arrays(a,b)
+    filtered_mean = numpy.empty((x.shape[0],n_steps+1))
+    filtered_mean[:,0] = x[:,0]
+    if variance_shape[0] > 1:
+        steady_from = n_steps
+    for k in range(min(steady_from,n_steps)):
+        filtered_mean[:,k+1] = a[:,k] * filtered_mean[:,k] + b[:,k]
+    if steady_from < n_steps:
+        #Constant coefficients from here on: run the rest of the recurrence as one linear filter
+        c = a[0,steady_from]
+        filtered_mean[:,steady_from+1:] = lfilter([1.0],[1.0,-c],b[:,steady_from:],axis=1,\
+          zi=c * filtered_mean[:,steady_from:steady_from+1])[0]
+
+    predicted_mean = Theta + (filtered_mean[:,:-1] - Theta) * phi
+    innovation = y - predicted_mean
+    terms = 0.5 * (LOG_2PI + log(total_variance) + innovation**2 / total_variance)
+    #Padding (NaN) steps contribute nothing
+    terms = where(numpy.isnan(y),0.0,terms)
+    nlogLik = terms.sum(axis=1)
+    if single:
+        return float(nlogLik[0])
+    return nlogLik
+
+def make_kalman_OU_objective_fn(x,times,measurement_error=None):
+    """Return f(p) -> negative log likelihood of an OU process with measurement noise
+
+    If measurement_error is None, p = array([Sigma,Lambda,Theta,Epsilon]) and the noise
+    level is fitted. Otherwise p = array([Sigma,Lambda,Theta]) as for
+    fit_timeseries.make_OU_objective_fn, with Epsilon fixed at measurement_error.
+    Either can be minimized with fit_timeseries.fit_timeseries (with matching xmin/xmax).
+    """
+    x = asarray(x,dtype=float)
+    times = asarray(times,dtype=float)
+    n_params = 4 if measurement_error is None else 3
+
+    def fn_to_optimize(p):
+        if numpy.shape(p) != (n_params,):
+            raise ValueError("Kalman OU optimization must operate on a (%i,) array. Got shape: %s"\
+              %(n_params,str(numpy.shape(p))))
+        if measurement_error is None:
+            Sigma,Lambda,Theta,Epsilon = p
+        else:
+            Sigma,Lambda,Theta = p
+            Epsilon = measurement_error
+        return get_OU_kalman_nlogLik(x,times,Sigma,Lambda,Theta,Epsilon)
+
+    return fn_to_optimize
+
+def fit_OU_kalman(x,times,x0=None,xmin=array([1e-6,0.0,-inf,0.0]),xmax=array([inf,inf,inf,inf])):
+    """Return array([Sigma,Lambda,Theta,Epsilon,nlogLik]) fitted with measurement noise
+
+    As fit_OU_exact, but also fits Epsilon, the standard deviation of
+    measurement noise on each observation.
+    """
+    x = asarray(x,dtype=float)
+    times = asarray(times,dtype=float)
+    keep = ~numpy.isnan(x)
+    x = x[keep]
+    times = times[keep]
+    if x0 is None:
+        Sigma,Lambda,Theta = get_starting_params(x,times)
+        x0 = array([Sigma,Lambda,Theta,0.1 * Sigma])
+    x0 = numpy.clip(asarray(x0,dtype=float),xmin,xmax)
+    fn_to_optimize = make_kalman_OU_objective_fn(x,times)
+    result = minimize(fn_to_optimize,x0,method="L-BFGS-B",bounds=list(zip(xmin,xmax)))
+    fitted = numpy.append(result.x,result.fun)
+    if not isfinite(result.fun):
+        fitted[:] = numpy.nan
+    return fitted
+
+def fit_OU_ar1(x,dt=1.0):
+    """Return an (n_series,4) array of (Sigma,Lambda,Theta,nlogLik) for regularly sampled series
+
+    x -- (n_series,n_timepoints) array of series sampled every dt (or a 1d array for one series)
+
+    With a constant dt, an OU series is an AR(1) process
+    x(t+dt) = Theta (1 - phi) + phi x(t) + e, with phi = exp(-Lambda dt),
+    so the maximum likelihood estimates (conditioning on the first observation)
+    have a closed form: a least-squares regression of each x(t+dt) on x(t).
+    All series are fitted at once with array operations, with no optimizer.
+
+    Series with no detectable reversion (phi >= 1) get Lambda = 0 and
+    Theta = NaN; phi <= 0 is clipped to a small positive value.
+    """
+    x = numpy.atleast_2d(asarray(x,dtype=float))
+    x_prev = x[:,:-1]
+    x_next = x[:,1:]
+    n_steps = x_prev.shape[1]
+    mean_prev = x_prev.mean(axis=1)
+    mean_next = x_next.mean(axis=1)
+    centered_prev = x_prev - mean_prev[:,None]
+    covariance = (centered_prev * (x_next - mean_next[:,None])).mean(axis=1)
+    variance = (centered_prev**2).mean(axis=1)
+    with numpy.errstate(divide="ignore",invalid="ignore"):
+        phi = where(variance > 0,covariance / variance,0.0)
+        phi = numpy.clip(phi,1e-6,1.0)
+        intercept = mean_next - phi * mean_prev
+        residuals = x_next - (intercept[:,None] + phi[:,None] * x_prev)
+        residual_variance = (residuals**2).mean(axis=1) + MIN_VARIANCE
+        reverting = phi < 1.0
+        Lambda = where(reverting,-log(phi) / dt,0.0)
+        Theta = where(reverting,intercept / (1.0 - phi),numpy.nan)
+        Sigma = where(reverting,numpy.sqrt(residual_variance * 2.0 * Lambda / (1.0 - phi**2)),\
+          numpy.sqrt(residual_variance / dt))
+    nlogLik = 0.5 * n_steps * (LOG_2PI + log(residual_variance) + 1.0)
+    return numpy.column_stack([Sigma,Lambda,Theta,nlogLik])
+
+def pad_series(series,times):
+    """Return (x,times) (n_series,max_length) arrays for a ragged list of series
+
+    series,times -- lists of 1d arrays, one per individual (times may also be
+      a single 1d array shared by all series). Shorter series are padded with NaN.
+    """
+    if numpy.ndim(times[0]) == 0:
+        times = [times]*len(series)
+    if len(series) != len(times):
+        raise ValueError("Got %i series but %i time arrays" %(len(series),len(times)))
+    max_length = max(len(s) for s in series)
+    x = numpy.full((len(series),max_length),numpy.nan)
+    padded_times = numpy.full((len(series),max_length),numpy.nan)
+    for i,(s,t) in enumerate(zip(series,times)):
+        if len(s) != len(t):
+            raise ValueError("Series %i has %i observations but %i times" %(i,len(s),len(t)))
+        x[i,:len(s)] = s
+        padded_times[i,:len(t)] = t
+    return x,padded_times
+
+def get_pooled_Theta(x,times,Sigma,Lambda,per_subject_theta=False):
+    """Return the maximum likelihood Theta given shared Sigma and Lambda
+
+    Given Sigma and Lambda the exact OU likelihood is Gaussian in Theta, so the
+    best Theta is a weighted least squares estimate. Returns a float (shared
+    Theta) or an (n_series,) array (per_subject_theta). Without reversion
+    (Lambda = 0) Theta is unidentified and the mean of observations is used.
+    """
+    x = numpy.atleast_2d(asarray(x,dtype=float))
+    times = numpy.broadcast_to(asarray(times,dtype=float),x.shape)
+    x_prev = x[:,:-1]
+    x_next = x[:,1:]
+    dts = numpy.diff(times,axis=1)
+    valid = ~(numpy.isnan(x_prev) | numpy.isnan(x_next))
+    phi = where(valid,exp(-Lambda * where(valid,dts,0.0)),1.0)
+    mean,variance = get_transition_moments(0.0,where(valid,dts,1.0),Sigma,Lambda,0.0)
+    weights = where(valid,1.0 / variance,0.0)
+    reversion = 1.0 - phi
+    target = where(valid,x_next - phi * where(valid,x_prev,0.0),0.0)
+    numerator = (weights * reversion * target).sum(axis=1)
+    denominator = (weights * reversion**2).sum(axis=1)
+    if not per_subject_theta:
+        numerator = numerator.sum()
+        denominator = denominator.sum()
+        fallback = numpy.nanmean(x)
+    else:
+        fallback = numpy.nanmean(x,axis=1)
+    with numpy.errstate(divide="ignore",invalid="ignore"):
+        Theta = where(denominator > 0,numerator / denominator,fallback)
+    if not per_subject_theta:
+        return float(Theta)
+    return Theta
+
+def make_pooled_OU_objective_fn(x,times,per_subject_theta=False,profile_theta=False):
+    """Return f(p) -> joint negative log likelihood of many series with shared Sigma and Lambda
+
+    x,times -- NaN-padded (n_series,n_timepoints) arrays (see pad_series)
+    per_subject_theta -- if True each series has its own Theta, otherwise Theta is shared
+    profile_theta -- if True, p = array([Sigma,Lambda]) and Theta is set to its
+      maximum likelihood value (see get_pooled_Theta). Otherwise p = array([Sigma,Lambda,Theta])
+      or, with per_subject_theta, array([Sigma,Lambda,Theta_1,...,Theta_n]).
+
+    All series are scored in one vectorized evaluation of get_exact_OU_nlogLik.
+    """
+    x = numpy.atleast_2d(asarray(x,dtype=float))
+    times = asarray(times,dtype=float)
+    if profile_theta:
+        n_params = 2
+    else:
+        n_params = 2 + (x.shape[0] if per_subject_theta else 1)
+
+    def fn_to_optimize(p):
+        if numpy.shape(p) != (n_params,):
+            raise ValueError("Pooled OU optimization must operate on a (%i,) array. Got shape: %s"\
+              %(n_params,str(numpy.shape(p))))
+        Sigma,Lambda = p[0],p[1]
+        if profile_theta:
+            Theta = get_pooled_Theta(x,times,Sigma,Lambda,per_subject_theta)
+        else:
+            Theta = p[2:] if per_subject_theta else p[2]
+        return get_exact_OU_nlogLik(x,times,Sigma,Lambda,Theta).sum()
+
+    return fn_to_optimize
+
+def fit_OU_pooled(series,times,per_subject_theta=False,x0=None,xmin=array([1e-6,0.0]),xmax=array([inf,inf])):
+    """Return (Sigma,Lambda,Theta,nlogLik) jointly fitted to all series of a group
+
+    series,times -- lists of 1d arrays, one per individual, or NaN-padded 2d arrays
+    per_subject_theta -- fit a Theta per individual (Theta is then an (n_series,) array)
+    x0 -- optional starting (Sigma,Lambda). Defaults to the median of per-series guesses.
+
+    Individuals share Sigma and Lambda, so short series (5-20 timepoints) pool
+    their information, and one optimizer run replaces one run per individual.
+    Theta is profiled out analytically, so the optimizer only searches over
+    (Sigma,Lambda) however many individuals there are.
+    """
+    if isinstance(series,numpy.ndarray) and series.ndim == 2:
+        x = asarray(series,dtype=float)
+        times = numpy.broadcast_to(asarray(times,dtype=float),x.shape)
+    else:
+        x,times = pad_series(series,times)
+    if x0 is None:
+        guesses = array([get_starting_params(s,t) for s,t in zip(x,times)])
+        x0 = numpy.median(guesses[:,:2],axis=0)
+    x0 = numpy.clip(asarray(x0,dtype=float),xmin,xmax)
+    fn_to_optimize = make_pooled_OU_objective_fn(x,times,per_subject_theta,profile_theta=True)
+    result = minimize(fn_to_optimize,x0,method="L-BFGS-B",bounds=list(zip(xmin,xmax)))
+    Sigma,Lambda = result.x
+    Theta = get_pooled_Theta(x,times,Sigma,Lambda,per_subject_theta)
+    return float(Sigma),float(Lambda),Theta,float(result.fun)
+
+def fit_OU_pooled_by_group(series,times,groups,per_subject_theta=False):
+    """Return a dict of group -> (Sigma,Lambda,Theta,nlogLik) from fit_OU_pooled
+
+    series,times -- lists of 1d arrays, one per individual
+    groups -- the group (e.g. treatment) of each individual
+    With per_subject_theta, Theta holds one value per individual of the group, in input order.
+    """
+    if len(groups) != len(series):
+        raise ValueError("Got %i series but %i group labels" %(len(series),len(groups)))
+    if numpy.ndim(times[0]) == 0:
+        times = [times]*len(series)
+    results = {}
+    for group in sorted(set(groups)):
+        indices = [i for i,g in enumerate(groups) if g == group]
+        results[group] = fit_OU_pooled([series[i] for i in indices],[times[i] for i in indices],\
+          per_subject_theta)
+    return results
@@ -12,8 +12,13 @@ __email__ = "zaneveld@gmail.com"
 __status__ = "Development"
 
 from copy import copy
+import numpy
 
 class Perturbation(object):
+    #Compiled per-timestep weights of a ScheduledPerturbation. None for a press
+    #disturbance, which has the same effect at every active timestep.
+    Weights = None
+
     def __init__(self,start,end,params,update_mode="replace",axes=["x","y","z"]):
         """Alter a simulation to impose a press disturbance,
            shifting the microbiome torwards a new configuration
@@ -43,6 +48,10 @@ class Perturbation(object):
     def isActive(self,t):
         return self.Start <= t <= self.End
 
+    def setTime(self,t):
+        """Prepare to update parameters at timestep t (press disturbances are constant)"""
+        pass
+
     def updateParams(self,params):
         if self.UpdateMode == "replace":
             update_f = self.updateByReplacement
@@ -70,3 +79,129 @@ class Perturbation(object):
 
     def updateByMultiplication(self,curr_param, perturbation_param):
         return curr_param * perturbation_param
+
+
+class ScheduledPerturbation(Perturbation):
+    def __init__(self,start,end,params,update_mode="add",axes=["x","y","z"]):
+        """A perturbation whose strength varies over time, e.g. pulses, ramps or seasonal forcing
+
+           start,end,params,update_mode,axes -- as for Perturbation
+
+           Subclasses define getProfile(), the strength (weight) of the perturbation
+           at each whole timestep since start. The profile is compiled once into the
+           Weights array covering start to end, so no Python code runs per update:
+           setTime(t) looks up the current weight (Experiment calls it once per
+           timestep), and getWeights() looks up the weights for an array of times.
+
+           A weight w applies a fraction of the perturbation to a parameter p:
+                'replace' -- (1-w)*p + w*value
+                'add' -- p + w*value
+                'multiply' -- (1 + w*(value-1))*p
+           so w=1 matches a press Perturbation and w=0 leaves p unchanged.
+        """
+        Perturbation.__init__(self,start,end,params,update_mode,axes)
+        if end < start:
+            raise ValueError("Perturbation end (%s) must not be before start (%s)" %(end,start))
+        elapsed = numpy.arange(int(end) - int(start) + 1,dtype=float)
+        self.Weights = numpy.asarray(self.getProfile(elapsed),dtype=float) * numpy.ones(elapsed.shape)
+        self.CurrentWeight = self.Weights[0]
+
+    def getProfile(self,elapsed):
+        """Return the weight at each value of an array of timesteps elapsed since Start"""
+        raise NotImplementedError("ScheduledPerturbation subclasses must implement getProfile()")
+
+    def getWeights(self,t):
+        """Return the compiled weight at time t (a number or an array of times)"""
+        index = numpy.clip(numpy.floor(t).astype(int) - int(self.Start),0,len(self.Weights) - 1)
+        return self.Weights[index]
+
+    def setTime(self,t):
+        """Set the weight used by updateParams() to the weight at timestep t"""
+        self.CurrentWeight = float(self.getWeights(t))
+
+    def getAffine(self,weights,perturbation_param):
+        """Return (A,B) such that the perturbed parameter is A * p + B"""
+        if self.UpdateMode == "replace":
+            return 1.0 - weights,weights * perturbation_param
+        elif self.UpdateMode == "add":
+            return 1.0,weights * perturbation_param
+        elif self.UpdateMode == "multiply":
+            return 1.0 + weights * (perturbation_param - 1.0),0.0
+        raise ValueError("Invalid update mode for perturbation: %s" %self.UpdateMode)
+
+    def updateParams(self,params,weights=None):
+        """Return params with the perturbation applied at weights (default: CurrentWeight)"""
+        if weights is None:
+            weights = self.CurrentWeight
+        new_params = copy(params)
+        for k,v in iter(self.Params.items()):
+            A,B = self.getAffine(weights,v)
+            new_params[k] = A * params[k] + B
+        return new_params
+
+    def compileParams(self,params):
+        """Return a dict of parameter name -> array of its value at each timestep from Start to End"""
+        return self.updateParams(params,self.Weights)
+
+class PulsePerturbation(ScheduledPerturbation):
+    def __init__(self,start,end,params,period,pulse_length=1,update_mode="add",axes=["x","y","z"]):
+        """A train of pulses: full strength for pulse_length timesteps every period timesteps
+
+           e.g. PulsePerturbation(10,40,{"mu":0.5},period=10,pulse_length=2) shifts mu
+           during timesteps 10-11, 20-21, 30-31 and 40.
+        """
+        if period <= 0 or pulse_length <= 0:
+            raise ValueError("period and pulse_length must be positive. Got: %s,%s" %(period,pulse_length))
+        self.Period = period
+        self.PulseLength = pulse_length
+        ScheduledPerturbation.__init__(self,start,end,params,update_mode,axes)
+
+    def getProfile(self,elapsed):
+        return (elapsed % self.Period) < self.PulseLength
+
+class RampPerturbation(ScheduledPerturbation):
+    def __init__(self,start,end,params,update_mode="replace",axes=["x","y","z"],\
+      start_weight=0.0,end_weight=1.0):
+        """A linear ramp in strength from start_weight at start to end_weight at end
+
+           e.g. RampPerturbation(10,20,{"lambda":0.01}) moves lambda linearly from its
+           base value to 0.01 over timesteps 10-20. Swap the weights to ramp back down.
+        """
+        self.StartWeight = start_weight
+        self.EndWeight = end_weight
+        ScheduledPerturbation.__init__(self,start,end,params,update_mode,axes)
+
+    def getProfile(self,elapsed):
+        duration = max(elapsed[-1],1.0)
+        return self.StartWeight + (self.EndWeight - self.StartWeight) * elapsed / duration
+
+class DecayPerturbation(ScheduledPerturbation):
+    def __init__(self,start,end,params,half_life,update_mode="add",axes=["x","y","z"]):
+        """A perturbation at full strength at start that decays exponentially back to baseline
+
+           half_life -- timesteps for the strength to halve. Set end to a few
+             half lives after start, after which the perturbation is removed.
+        """
+        if half_life <= 0:
+            raise ValueError("half_life must be positive. Got: %s" %half_life)
+        self.HalfLife = half_life
+        ScheduledPerturbation.__init__(self,start,end,params,update_mode,axes)
+
+    def getProfile(self,elapsed):
+        return 0.5 ** (elapsed / self.HalfLife)
+
+class PeriodicPerturbation(ScheduledPerturbation):
+    def __init__(self,start,end,params,period,phase=0.0,update_mode="add",axes=["x","y","z"]):
+        """Sinusoidal (e.g. seasonal) forcing with a weight of sin(2 pi elapsed / period + phase)
+
+           With update_mode 'add' the parameter oscillates between base - value and
+           base + value, e.g. PeriodicPerturbation(0,365,{"mu":0.2},period=365).
+        """
+        if period <= 0:
+            raise ValueError("period must be positive. Got: %s" %period)
+        self.Period = period
+        self.Phase = phase
+        ScheduledPerturbation.__init__(self,start,end,params,update_mode,axes)
+
+    def getProfile(self,elapsed):
+        return numpy.sin(2.0 * numpy.pi * elapsed / self.Period + self.Phase)
@@ -0,0 +1,185 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+from perturbation import Perturbation
+from hashlib import sha1
+from os import listdir,stat
+from os.path import join,isfile,realpath,splitext
+import logging
+
+logger = logging.getLogger("karenina.perturbation_library")
+
+VALID_UPDATE_MODES = ("replace","add","multiply")
+VALID_PARAMS = ("lambda","delta","mu")
+PERTURBATION_FILE_EXTENSIONS = (".csv",".tsv")
+
+#Parsed perturbation files, keyed by real path.
+#Values are (mtime,size,content hash,list of perturbation specs)
+_perturbation_file_cache = {}
+
+def make_perturbation_spec(params,update_mode,axes,location):
+    """Return a validated (params,update_mode,axes) tuple
+
+    location -- 'file:line' string used in error messages
+    """
+    if not params:
+        raise ValueError("%s: perturbation does not alter any parameters" %location)
+    for name,value in params.items():
+        if name not in VALID_PARAMS:
+            raise ValueError("%s: unknown perturbation parameter '%s'. Valid parameters: %s"\
+              %(location,name,", ".join(VALID_PARAMS)))
+    if update_mode not in VALID_UPDATE_MODES:
+        raise ValueError("%s: invalid update_mode '%s'. Valid modes: %s"\
+          %(location,update_mode,", ".join(VALID_UPDATE_MODES)))
+    if not axes:
+        raise ValueError("%s: perturbation does not specify any axes" %location)
+    return (params,update_mode,tuple(axes))
+
+def parse_float(value,location):
+    """Return value as a float, raising a ValueError naming location if invalid"""
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("%s: expected a numeric parameter value, got '%s'" %(location,value))
+
+def parse_keyword_fields(fields,location):
+    """Parse 'params k v [k v ...] update_mode m axes a [a ...]' fields into a spec"""
+    try:
+        params_idx = fields.index("params")
+        mode_idx = fields.index("update_mode")
+        axes_idx = fields.index("axes")
+    except ValueError:
+        raise ValueError("%s: expected 'params', 'update_mode' and 'axes' fields. Got: %s"\
+          %(location,"\t".join(fields)))
+    if not params_idx < mode_idx < axes_idx:
+        raise ValueError("%s: fields must be in the order params, update_mode, axes" %location)
+
+    param_fields = fields[params_idx+1:mode_idx]
+    if len(param_fields) % 2 != 0:
+        raise ValueError("%s: params must be given as name,value pairs. Got: %s"\
+          %(location,param_fields))
+    params = {}
+    for name,value in zip(param_fields[0::2],param_fields[1::2]):
+        params[name] = parse_float(value,location)
+
+    mode_fields = fields[mode_idx+1:axes_idx]
+    if len(mode_fields) != 1:
+        raise ValueError("%s: expected one update_mode value. Got: %s" %(location,mode_fields))
+    axes = [a for a in fields[axes_idx+1:] if a]
+    return make_perturbation_spec(params,mode_fields[0],axes,location)
+
+def parse_column_fields(fields,location):
+    """Parse 'parameter value update_mode x,y,z' fields (the header-based format) into a spec"""
+    if len(fields) != 4:
+        raise ValueError("%s: expected 4 columns (parameter,value,update_mode,axes). Got: %s"\
+          %(location,"\t".join(fields)))
+    name,value,update_mode,axes = fields
+    params = {name:parse_float(value,location)}
+    axes = [a.strip() for a in axes.split(",") if a.strip()]
+    return make_perturbation_spec(params,update_mode,axes,location)
+
+def parse_perturbation_lines(lines,source="<perturbations>"):
+    """Return a list of perturbation specs (params,update_mode,axes) from lines of a perturbation file
+
+    Two tab-delimited formats are supported, one perturbation per line:
+
+    params	lambda	0.005	mu	-0.08	update_mode	replace	axes	x	y	z
+
+    or, after a '#parameter	value	update_mode	axes' header line:
+
+    lambda	0	replace	x,y,z
+
+    Blank lines and other lines starting with '#' are ignored.
+    Raises a ValueError naming the file and line for any invalid entry.
+    """
+    specs = []
+    column_format = False
+    for line_number,line in enumerate(lines,1):
+        location = "%s:%i" %(source,line_number)
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith("#"):
+            header = [f.strip() for f in stripped.lstrip("#").split("\t")]
+            if header[:2] == ["parameter","value"]:
+                column_format = True
+            continue
+        fields = [f.strip() for f in line.rstrip("\r\n").split("\t")]
+        #Drop empty trailing columns left by spreadsheet exports
+        while fields and not fields[-1]:
+            fields.pop()
+        if fields[0] == "params":
+            specs.append(parse_keyword_fields(fields,location))
+        elif column_format:
+            specs.append(parse_column_fields(fields,location))
+        else:
+            raise ValueError("%s: unrecognized perturbation line. Lines must start with 'params' or follow a '#parameter\\tvalue\\tupdate_mode\\taxes' header. Got: %s"\
+              %(location,stripped))
+    return specs
+
+def make_perturbations(specs,start,end):
+    """Return new Perturbation objects for a list of specs, active from start to end (inclusive)"""
+    return [Perturbation(start,end,dict(params),update_mode,list(axes))\
+      for params,update_mode,axes in specs]
+
+def load_perturbation_specs(file_path):
+    """Return the perturbation specs in file_path, re-parsing only if the file changed
+
+    Parsed files are cached by path. A cached entry is reused when the file's
+    modification time and size are unchanged, or when its content hash is
+    unchanged (e.g. the file was touched or copied over with identical data).
+    """
+    path = realpath(file_path)
+    file_stat = stat(path)
+    cached = _perturbation_file_cache.get(path)
+    if cached is not None and cached[0] == file_stat.st_mtime and cached[1] == file_stat.st_size:
+        return cached[3]
+
+    with open(path,"rb") as input_file:
+        content = input_file.read()
+    content_hash = sha1(content).hexdigest()
+    if cached is not None and cached[2] == content_hash:
+        specs = cached[3]
+    else:
+        logger.debug("Parsing perturbation file: %s",path)
+        specs = parse_perturbation_lines(content.decode("utf-8").splitlines(),source=file_path)
+    _perturbation_file_cache[path] = (file_stat.st_mtime,file_stat.st_size,content_hash,specs)
+    return specs
+
+def load_perturbation_file(file_path,start,end):
+    """Return a list of Perturbation objects from a perturbation file
+
+    file_path -- path to a perturbation file (see parse_perturbation_lines)
+    start,end -- inclusive timepoints at which the perturbations start and end
+    """
+    return make_perturbations(load_perturbation_specs(file_path),start,end)
+
+def load_perturbation_library(directory,start,end,extensions=PERTURBATION_FILE_EXTENSIONS):
+    """Return a dict of perturbation name -> list of Perturbation objects for every file in directory
+
+    Names are file names without extension (e.g. 'xyz_lambda_zero').  Files are
+    parsed once and cached, so repeated calls (e.g. once per run of a parameter sweep)
+    only re-read files that have changed.
+    """
+    library = {}
+    for file_name in sorted(listdir(directory)):
+        name,extension = splitext(file_name)
+        file_path = join(directory,file_name)
+        if extension not in extensions or not isfile(file_path):
+            continue
+        library[name] = load_perturbation_file(file_path,start,end)
+    return library
+
+def clear_perturbation_cache():
+    """Empty the cache of parsed perturbation files"""
+    _perturbation_file_cache.clear()
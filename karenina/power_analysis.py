@@ -0,0 +1,281 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Simulation-based power analysis: how many individuals are needed to detect a perturbation?
+#
+#For each number of individuals and effect size, replicate experiments are simulated,
+#every individual's timeseries is fitted with an OU model, and a fitted parameter
+#(e.g. Lambda) is compared between control and perturbed treatments. Power is the
+#fraction of replicates with p < alpha.
+#
+#All replicates in a batch are simulated as one Experiment (batch_size x n_individuals
+#per treatment) and fitted together with the closed-form ou_likelihood.fit_OU_ar1.
+#Replicate batches continue until the confidence interval on power is narrower than
+#ci_width (or max_replicates is reached), and grid points run in parallel.
+
+from experiment import Experiment
+from perturbation import Perturbation
+from ou_likelihood import fit_OU_ar1
+from shared_arrays import run_in_pool
+import visualization
+from optparse import OptionParser
+from optparse import OptionGroup
+from scipy.stats import norm,ttest_ind,mannwhitneyu
+import numpy
+import logging
+
+logger = logging.getLogger("karenina.power_analysis")
+
+FIT_PARAMS = ("Sigma","Lambda","Theta")
+VALID_TESTS = ("welch","mannwhitney")
+POWER_COLUMNS = ["n_individuals","effect","n_replicates","n_significant","power","ci_low","ci_high"]
+
+def get_binomial_ci(n_successes,n_trials,confidence=0.95):
+    """Return the (low,high) Wilson score interval for a binomial proportion"""
+    if n_trials == 0:
+        return 0.0,1.0
+    z = norm.ppf(0.5 + confidence / 2.0)
+    p = n_successes / n_trials
+    denominator = 1.0 + z**2 / n_trials
+    center = (p + z**2 / (2.0 * n_trials)) / denominator
+    half_width = z * numpy.sqrt(p * (1.0 - p) / n_trials + z**2 / (4.0 * n_trials**2)) / denominator
+    return max(0.0,center - half_width),min(1.0,center + half_width)
+
+def make_power_design(base_params,n_timepoints,perturbation_start,perturbation_end,\
+  effect_param="lambda",update_mode="replace",axes=("x","y","z"),effect_axes=None,\
+  interindividual_variation=0.01,method="euler",fit_param="Lambda",test="welch",\
+  alpha=0.05):
+    """Return a dict describing the simulated experiment and test for a power analysis
+
+    base_params -- dict with 'lambda' and 'delta' for unperturbed individuals
+    n_timepoints -- number of timepoints per experiment
+    perturbation_start,perturbation_end -- inclusive timepoints of the perturbation
+    effect_param,update_mode,effect_axes -- the perturbation: effect_param is set
+      (or added to, or multiplied by) each effect value on effect_axes (default: all axes)
+    method -- 'euler' (the reference Process model) or 'exact' (exact OU transitions,
+      a different model for the same lambda and delta; see Experiment)
+    fit_param -- fitted OU parameter compared between treatments: Sigma, Lambda or Theta.
+      It is averaged over effect_axes, using timepoints during the perturbation.
+    test -- 'welch' (Welch's t-test) or 'mannwhitney' (Mann-Whitney U test)
+    alpha -- significance level
+    """
+    if fit_param not in FIT_PARAMS:
+        raise ValueError("fit_param must be one of %s. Got: %s" %(", ".join(FIT_PARAMS),fit_param))
+    if test not in VALID_TESTS:
+        raise ValueError("test must be one of %s. Got: %s" %(", ".join(VALID_TESTS),test))
+    axes = list(axes)
+    effect_axes = list(effect_axes) if effect_axes is not None else axes
+    fit_end = min(perturbation_end,n_timepoints - 1)
+    if fit_end - perturbation_start < 2:
+        raise ValueError("At least 3 timepoints during the perturbation are needed to fit timeseries. Got perturbation timepoints %i-%i of %i"\
+          %(perturbation_start,perturbation_end,n_timepoints))
+    return {"base_params":dict(base_params),"n_timepoints":n_timepoints,\
+      "perturbation_start":perturbation_start,"perturbation_end":perturbation_end,\
+      "effect_param":effect_param,"update_mode":update_mode,"axes":axes,\
+      "effect_axes":effect_axes,"interindividual_variation":interindividual_variation,\
+      "method":method,"fit_param":fit_param,"test":test,"alpha":alpha}
+
+def simulate_replicate_batch(design,n_individuals,effect,n_replicates,random_state):
+    """Return (control,perturbed) fitted parameter arrays, each (n_replicates,n_individuals)
+
+    All replicates are simulated together as one two-treatment Experiment with
+    n_replicates x n_individuals individuals per treatment.
+    """
+    perturbation = Perturbation(design["perturbation_start"],design["perturbation_end"],\
+      {design["effect_param"]:effect},design["update_mode"],design["effect_axes"])
+    n_rows = n_replicates * n_individuals
+    experiment = Experiment(["control","perturbed"],[n_rows,n_rows],design["n_timepoints"],\
+      design["base_params"],[[],[perturbation]],design["interindividual_variation"],\
+      axes=design["axes"],engine="multivariate",method=design["method"],\
+      random_state=random_state,collect_data=False)
+    experiment.simulate_timesteps(0,design["n_timepoints"],progress_interval=None)
+
+    axis_indices = [design["axes"].index(axis) for axis in design["effect_axes"]]
+    fit_column = FIT_PARAMS.index(design["fit_param"])
+    fit_end = min(design["perturbation_end"],design["n_timepoints"] - 1)
+    results = []
+    for treatment in experiment.Treatments:
+        #(n_rows,n_timepoints,D) -> one series per individual per effect axis
+        history = treatment["cohort"].get_history_array()
+        window = history[:,design["perturbation_start"]:fit_end + 1][:,:,axis_indices]
+        series = window.transpose(0,2,1).reshape(-1,window.shape[1])
+        fits = fit_OU_ar1(series)[:,fit_column].reshape(n_rows,len(axis_indices))
+        results.append(fits.mean(axis=1).reshape(n_replicates,n_individuals))
+    return results[0],results[1]
+
+def compare_treatments(control,perturbed,test="welch"):
+    """Return p-values comparing each row of control with the same row of perturbed"""
+    if test == "welch":
+        return ttest_ind(control,perturbed,axis=1,equal_var=False).pvalue
+    return mannwhitneyu(control,perturbed,axis=1,alternative="two-sided").pvalue
+
+def estimate_power(design,n_individuals,effect,min_replicates=20,max_replicates=500,\
+  batch_size=20,ci_width=0.1,confidence=0.95,random_state=None):
+    """Return a dict with the estimated power for one n_individuals and effect size
+
+    Replicates are simulated in batches of batch_size. After at least min_replicates,
+    simulation stops early once the Wilson confidence interval on power is narrower
+    than ci_width. NaN p-values (e.g. from constant fitted values) count as not significant.
+    """
+    if n_individuals < 2:
+        raise ValueError("At least 2 individuals per treatment are needed to compare treatments. Got: %i" %n_individuals)
+    random_state = numpy.random.RandomState(random_state)
+    n_replicates = 0
+    n_significant = 0
+    while n_replicates < max_replicates:
+        n_batch = min(batch_size,max_replicates - n_replicates)
+        control,perturbed = simulate_replicate_batch(design,n_individuals,effect,n_batch,random_state)
+        p_values = compare_treatments(control,perturbed,design["test"])
+        n_significant += int(numpy.sum(p_values < design["alpha"]))
+        n_replicates += n_batch
+        ci_low,ci_high = get_binomial_ci(n_significant,n_replicates,confidence)
+        if n_replicates >= min_replicates and ci_high - ci_low <= ci_width:
+            break
+    ci_low,ci_high = get_binomial_ci(n_significant,n_replicates,confidence)
+    logger.info("n_individuals=%i effect=%s: power %.3f (%.3f-%.3f) from %i replicates",\
+      n_individuals,effect,n_significant / n_replicates,ci_low,ci_high,n_replicates)
+    return {"n_individuals":n_individuals,"effect":effect,"n_replicates":n_replicates,\
+      "n_significant":n_significant,"power":n_significant / n_replicates,\
+      "ci_low":ci_low,"ci_high":ci_high}
+
+def estimate_power_task(task):
+    """Run estimate_power for one grid point (for use in a worker Pool)"""
+    design,n_individuals,effect,options,seed = task
+    return estimate_power(design,n_individuals,effect,random_state=seed,**options)
+
+def run_power_analysis(design,n_individuals_list,effect_values,min_replicates=20,\
+  max_replicates=500,batch_size=20,ci_width=0.1,confidence=0.95,n_jobs=1,seed=None):
+    """Return power estimates (dicts, see POWER_COLUMNS) for every n_individuals x effect size
+
+    design -- from make_power_design
+    n_individuals_list -- numbers of individuals per treatment to try
+    effect_values -- values of the design's effect_param to try
+    n_jobs -- number of worker processes; grid points are run in parallel
+    seed -- seed for reproducible results (independent of n_jobs)
+    """
+    grid = [(n,effect) for n in n_individuals_list for effect in effect_values]
+    seeds = numpy.random.SeedSequence(seed).generate_state(len(grid))
+    options = {"min_replicates":min_replicates,"max_replicates":max_replicates,\
+      "batch_size":batch_size,"ci_width":ci_width,"confidence":confidence}
+    tasks = [(design,n,effect,options,int(grid_seed)) for (n,effect),grid_seed in zip(grid,seeds)]
+    return run_in_pool(estimate_power_task,tasks,n_jobs)
+
+def format_power_table(power_rows):
+    """Return lines of a tab-delimited table of power estimates"""
+    lines = ["\t".join(POWER_COLUMNS)+"\n"]
+    for row in power_rows:
+        lines.append("\t".join(str(row[column]) for column in POWER_COLUMNS)+"\n")
+    return lines
+
+def make_option_parser():
+    """Return an optparse OptionParser object"""
+
+    parser = OptionParser(usage = "%prog -o power.tsv -n 5,10,20 --effect_values 0.1,0.05,0",
+    description = "Estimate the power to detect a perturbation as a function " +
+    "of the number of individuals per treatment, by simulating replicate " +
+    "experiments, fitting OU models to each individual and testing for a " +
+    "difference in a fitted parameter between control and perturbed treatments.",
+    version = __version__)
+
+    required_options = OptionGroup(parser, "Required options")
+    required_options.add_option('-o','--output',type="string",
+    help='output file for the tab-delimited table of power estimates')
+    parser.add_option_group(required_options)
+
+    optional_options = OptionGroup(parser, "Optional options")
+    optional_options.add_option('-n','--n_individuals',default="5,10,20,40",type="string",
+    help='Comma-separated numbers of individuals per treatment [default: %default]')
+    optional_options.add_option('--effect_param',default="lambda",type="choice",
+    choices=["lambda","delta","mu"],
+    help='Parameter altered by the perturbation [default: %default]')
+    optional_options.add_option('--effect_values',default="0.1,0.05,0.0",type="string",
+    help='Comma-separated perturbation values of --effect_param [default: %default]')
+    optional_options.add_option('--update_mode',default="replace",type="choice",
+    choices=["replace","add","multiply"],
+    help='How effect values alter the base parameter [default: %default]')
+    optional_options.add_option('--axes',default="x,y,z",type="string",
+    help='Comma-separated names of the simulated axes [default: %default]')
+    optional_options.add_option('--effect_axes',default=None,type="string",
+    help='Comma-separated axes the perturbation affects [default: all axes]')
+    optional_options.add_option('-t','--n_timepoints',default=30,type="int",
+    help='Number of timepoints per experiment [default: %default]')
+    optional_options.add_option('-p','--perturbation_timepoint',default=10,type="int",
+    help='Timepoint at which the perturbation starts [default: %default]')
+    optional_options.add_option('-d','--perturbation_duration',default=100,type="int",
+    help='Duration of the perturbation [default: %default]')
+    optional_options.add_option('--interindividual_variation',default=0.01,type="float",
+    help='Starting variability between individuals [default: %default]')
+    optional_options.add_option('--delta',default=0.25,type="float",
+    help='Base delta parameter [default: %default]')
+    optional_options.add_option('-l','--L',default=0.20,type="float",
+    help='Base lambda parameter [default: %default]')
+    optional_options.add_option('--method',default="euler",type="choice",
+    choices=["euler","exact"],
+    help='Transitions used to simulate individuals. "euler" is the same ' +
+    'model as spatial_ornstein_uhlenbeck.py. "exact" uses the exact transitions of a ' +
+    'continuous-time OU process, which is a different model for the same ' +
+    '--L and --delta: its stationary variance is delta^4/(2 lambda) ' +
+    'rather than delta^4/(2 lambda - lambda^2), and its lag-1 ' +
+    'autocorrelation is exp(-lambda) rather than 1 - lambda [default: %default]')
+    optional_options.add_option('--fit_param',default="Lambda",type="choice",
+    choices=list(FIT_PARAMS),
+    help='Fitted OU parameter compared between treatments [default: %default]')
+    optional_options.add_option('--test',default="welch",type="choice",
+    choices=list(VALID_TESTS),
+    help='Test comparing treatments [default: %default]')
+    optional_options.add_option('--alpha',default=0.05,type="float",
+    help='Significance level [default: %default]')
+    optional_options.add_option('--min_replicates',default=20,type="int",
+    help='Minimum replicate experiments per grid point [default: %default]')
+    optional_options.add_option('--max_replicates',default=500,type="int",
+    help='Maximum replicate experiments per grid point [default: %default]')
+    optional_options.add_option('--batch_size',default=20,type="int",
+    help='Replicate experiments simulated together in one batch [default: %default]')
+    optional_options.add_option('--ci_width',default=0.1,type="float",
+    help='Stop adding replicates once the 95%% confidence interval on power ' +
+    'is narrower than this [default: %default]')
+    optional_options.add_option('--n_jobs',default=1,type="int",
+    help='Number of worker processes [default: %default]')
+    optional_options.add_option('--seed',default=None,type="int",
+    help='Random seed [default: %default]')
+    optional_options.add_option('--plot',default=None,type="string",
+    help='Optionally, save a .pdf plot of power curves to this path [default: %default]')
+    parser.add_option_group(optional_options)
+    return parser
+
+def main():
+    parser = make_option_parser()
+    opts, args = parser.parse_args()
+    if opts.output is None:
+        parser.error("An output file (-o) is required")
+    logging.basicConfig(level=logging.INFO,format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    axes = opts.axes.split(",")
+    effect_axes = opts.effect_axes.split(",") if opts.effect_axes else None
+    perturbation_end = opts.perturbation_timepoint + opts.perturbation_duration
+    design = make_power_design({"lambda":opts.L,"delta":opts.delta},opts.n_timepoints,\
+      opts.perturbation_timepoint,perturbation_end,effect_param=opts.effect_param,\
+      update_mode=opts.update_mode,axes=axes,effect_axes=effect_axes,\
+      interindividual_variation=opts.interindividual_variation,method=opts.method,\
+      fit_param=opts.fit_param,test=opts.test,alpha=opts.alpha)
+    power_rows = run_power_analysis(design,list(map(int,opts.n_individuals.split(","))),\
+      list(map(float,opts.effect_values.split(","))),min_replicates=opts.min_replicates,\
+      max_replicates=opts.max_replicates,batch_size=opts.batch_size,ci_width=opts.ci_width,\
+      n_jobs=opts.n_jobs,seed=opts.seed)
+    with open(opts.output,"w") as output_file:
+        output_file.writelines(format_power_table(power_rows))
+    if opts.plot is not None:
+        visualization.save_power_curves(power_rows,opts.plot)
+
+if __name__ == "__main__":
+    main()
@@ -13,17 +13,23 @@ __status__ = "Development"
 
 from scipy.stats import norm
 from copy import copy
+from collections import deque
 
 class Process(object):
     """Represents a 1d process in a Euclidean space"""
 
     def __init__(self,start_coord, motion = "Ornstein-Uhlenbeck",\
-        history = None,params={"L":0.20,"delta":0.25}):
+        history = None,params={"L":0.20,"delta":0.25},history_window=None):
         """
         start_coords - float starting coordinate for the particle
+        history_window - if None, keep the full History of coordinates. Otherwise
+          keep only the most recent history_window coordinates (0 keeps none),
+          so memory does not grow with the number of timepoints.
         """
         if history is None:
             history = []
+        if history_window is not None:
+            history = deque(history,maxlen=history_window)
         self.StartCoord = start_coord
         self.Coord = start_coord
         self.History = history
@@ -44,7 +50,9 @@ class Process(object):
             L=curr_params["lambda"])
 
     def bm_change(self,dt,delta):
-        change =  norm.rvs(loc=0,size=1,scale=delta**2*dt)
+        #Draw a length 1 array (as always) but return a plain float,
+        #so Coord and History hold floats rather than 1-element arrays
+        change =  norm.rvs(loc=0,size=1,scale=delta**2*dt)[0]
         return change
 
     def bm_update(self,dt,delta):
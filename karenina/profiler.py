@@ -0,0 +1,174 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Opt-in profiling of where a simulation spends its time.
+#
+#Code marks named stages with:
+#
+#    with profile_stage("update"):
+#        ...
+#
+#When a PhaseProfiler is active (see profile()), each stage accumulates wall
+#time, CPU time and a call count. Otherwise profile_stage returns a shared
+#no-op context, so instrumented code costs one function call per stage.
+#Stages are placed around per-treatment, per-timestep work (not per individual),
+#so the cost when disabled does not grow with the number of individuals.
+#
+#Stages may nest; each stage's time includes any stages inside it.
+
+from contextlib import contextmanager
+from os.path import join
+from time import perf_counter,process_time
+import json
+import logging
+
+logger = logging.getLogger("karenina.profiler")
+
+PROFILE_COLUMNS = ["stage","calls","wall_seconds","cpu_seconds","wall_fraction","mean_wall_ms"]
+
+_active_profiler = None
+
+class NullStage(object):
+    """A context manager that does nothing (used when profiling is disabled)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        return False
+
+NULL_STAGE = NullStage()
+
+class Stage(object):
+    """Times one entry into a named stage of a PhaseProfiler"""
+
+    def __init__(self,profiler,name):
+        self.Profiler = profiler
+        self.Name = name
+
+    def __enter__(self):
+        self.StartWall = perf_counter()
+        self.StartCPU = process_time()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.Profiler.record(self.Name,perf_counter() - self.StartWall,process_time() - self.StartCPU)
+        return False
+
+class PhaseProfiler(object):
+    """Accumulate wall time, CPU time and call counts per named stage"""
+    Columns = PROFILE_COLUMNS
+
+    def __init__(self):
+        self.Stages = {}
+        self.StartWall = perf_counter()
+        self.StartCPU = process_time()
+        self.TotalWall = None
+        self.TotalCPU = None
+
+    def stage(self,name):
+        """Return a context manager timing one call of stage name"""
+        return Stage(self,name)
+
+    def record(self,name,wall,cpu,calls=1):
+        """Add wall and CPU seconds and calls to stage name"""
+        totals = self.Stages.get(name)
+        if totals is None:
+            totals = self.Stages[name] = [0,0.0,0.0]
+        totals[0] += calls
+        totals[1] += wall
+        totals[2] += cpu
+
+    def stop(self):
+        """Record the total wall and CPU time since the profiler was created"""
+        self.TotalWall = perf_counter() - self.StartWall
+        self.TotalCPU = process_time() - self.StartCPU
+
+    def get_rows(self):
+        """Return a list of dicts (PROFILE_COLUMNS) per stage, slowest first"""
+        total_wall = self.TotalWall if self.TotalWall is not None else perf_counter() - self.StartWall
+        rows = []
+        for name,(calls,wall,cpu) in self.Stages.items():
+            rows.append({"stage":name,"calls":calls,"wall_seconds":wall,"cpu_seconds":cpu,\
+              "wall_fraction":wall / total_wall if total_wall > 0 else 0.0,\
+              "mean_wall_ms":1000.0 * wall / calls if calls else 0.0})
+        return sorted(rows,key=lambda row: -row["wall_seconds"])
+
+    def get_report(self):
+        """Return a JSON-serializable dict of total times and per-stage rows"""
+        if self.TotalWall is None:
+            self.stop()
+        return {"total_wall_seconds":self.TotalWall,"total_cpu_seconds":self.TotalCPU,\
+          "stages":self.get_rows()}
+
+    def format_table(self):
+        """Return lines of a tab-delimited table of per-stage timings"""
+        lines = ["\t".join(self.Columns)+"\n"]
+        for row in self.get_rows():
+            lines.append("\t".join([row["stage"],str(row["calls"])] +\
+              ["%.6f" %row[column] for column in self.Columns[2:]])+"\n")
+        return lines
+
+    def write_report(self,output_dir,basename="profile"):
+        """Write <basename>.json and <basename>.tsv to output_dir and return their paths"""
+        report = self.get_report()
+        json_path = join(output_dir,basename + ".json")
+        tsv_path = join(output_dir,basename + ".tsv")
+        with open(json_path,"w") as json_file:
+            json.dump(report,json_file,indent=2)
+        with open(tsv_path,"w") as tsv_file:
+            tsv_file.writelines(self.format_table())
+        return json_path,tsv_path
+
+def get_active_profiler():
+    """Return the active PhaseProfiler, or None if profiling is disabled"""
+    return _active_profiler
+
+def profile_stage(name):
+    """Return a context manager timing stage name in the active profiler (if any)"""
+    if _active_profiler is None:
+        return NULL_STAGE
+    return _active_profiler.stage(name)
+
+@contextmanager
+def profile(output_dir=None,enabled=True,basename="profile",profiler=None):
+    """Profile stages run inside this context, yielding the PhaseProfiler
+
+    output_dir -- if set, write <basename>.json and <basename>.tsv here on exit
+    enabled -- if False, nothing is profiled and None is yielded
+    profiler -- the profiler to activate (default: a new PhaseProfiler), e.g. a
+      memory.MemoryProfiler to also record peak memory per stage
+
+    e.g.
+        with profile("output") as profiler:
+            experiment.simulate_timesteps(0,100)
+    """
+    global _active_profiler
+    if not enabled:
+        yield None
+        return
+    previous = _active_profiler
+    if profiler is None:
+        profiler = PhaseProfiler()
+    _active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _active_profiler = previous
+        profiler.stop()
+        if output_dir is not None:
+            json_path,tsv_path = profiler.write_report(output_dir,basename)
+            logger.info("Wrote profile to %s and %s",json_path,tsv_path)
+        for row in profiler.get_rows()[:5]:
+            logger.info("Profile: %s took %.3f s wall (%.1f%%), %.3f s CPU in %i calls",\
+              row["stage"],row["wall_seconds"],100.0 * row["wall_fraction"],row["cpu_seconds"],row["calls"])
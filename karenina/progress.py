@@ -0,0 +1,104 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import logging
+from time import time
+
+try:
+    import resource
+except ImportError:
+    #resource is unavailable on Windows
+    resource = None
+
+logger = logging.getLogger("karenina.progress")
+
+def get_peak_memory_mb():
+    """Return peak resident memory of this process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    #ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def format_seconds(seconds):
+    """Return a compact h:mm:ss string for a number of seconds"""
+    if seconds is None:
+        return "?"
+    seconds = int(round(seconds))
+    hours,remainder = divmod(seconds,3600)
+    minutes,seconds = divmod(remainder,60)
+    return "%i:%02i:%02i" %(hours,minutes,seconds)
+
+class ProgressReporter(object):
+    """Periodically log throughput, ETA and memory for a long-running loop
+
+    Reporting is driven by the caller: update() is called with the number of
+    work units (e.g. subject-steps) completed since the last call.  Messages
+    are only formatted once per interval, and if the logger is not enabled
+    for the reporting level the reporter does no timing or formatting at all.
+    """
+
+    def __init__(self,total,interval=10.0,units="subject-steps",\
+      log=None,level=logging.INFO):
+        """
+        total -- total number of work units expected
+        interval -- minimum number of seconds between progress messages
+        units -- name of the work units, used in messages
+        log -- logger to report to (default: karenina.progress)
+        level -- logging level for progress messages
+        """
+        self.Total = total
+        self.Interval = interval
+        self.Units = units
+        self.Logger = log if log is not None else logger
+        self.Level = level
+        self.Enabled = self.Logger.isEnabledFor(level)
+        self.Completed = 0
+        self.StartTime = time()
+        self.LastReportTime = self.StartTime
+
+    def update(self,n=1):
+        """Record n more completed work units, reporting if the interval has passed"""
+        if not self.Enabled:
+            return
+        self.Completed += n
+        now = time()
+        if now - self.LastReportTime >= self.Interval:
+            self.LastReportTime = now
+            self.report(now)
+
+    def get_metrics(self,now=None):
+        """Return a dict of progress metrics"""
+        if now is None:
+            now = time()
+        elapsed = now - self.StartTime
+        rate = self.Completed / elapsed if elapsed > 0 else None
+        remaining = self.Total - self.Completed
+        eta = remaining / rate if rate else None
+        return {"completed":self.Completed,"total":self.Total,\
+          "elapsed":elapsed,"rate":rate,"eta":eta,\
+          "peak_memory_mb":get_peak_memory_mb()}
+
+    def report(self,now=None):
+        """Log a progress message"""
+        metrics = self.get_metrics(now)
+        percent = 100.0 * metrics["completed"] / self.Total if self.Total else 100.0
+        memory = metrics["peak_memory_mb"]
+        self.Logger.log(self.Level,"Progress: %i/%i %s (%.1f%%); %.1f %s/sec; elapsed %s; ETA %s; peak memory %s MB",\
+          metrics["completed"],metrics["total"],self.Units,percent,\
+          metrics["rate"] or 0.0,self.Units,format_seconds(metrics["elapsed"]),\
+          format_seconds(metrics["eta"]),"?" if memory is None else "%.1f" %memory)
+
+    def finish(self):
+        """Log a final progress message"""
+        if self.Enabled:
+            self.report()
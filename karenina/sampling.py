@@ -0,0 +1,138 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import numpy
+from multivariate_process import get_random_state
+
+def make_random_sampling_times(subject_ids,n_samples,t_max,random_state=None,include_start=True):
+    """Return a dict of subject id -> sorted array of random sampling times
+
+    subject_ids -- list of subject ids
+    n_samples -- number of samples per subject
+    t_max -- samples are drawn uniformly from [0,t_max]
+    include_start -- if True, the first sample of every subject is at time 0
+    """
+    if n_samples < 1:
+        raise ValueError("n_samples must be at least 1. Got: %s" %str(n_samples))
+    random_state = get_random_state(random_state)
+    times = numpy.sort(random_state.uniform(0.0,t_max,(len(subject_ids),n_samples)),axis=1)
+    if include_start:
+        times[:,0] = 0.0
+    return dict(zip(subject_ids,times))
+
+def parse_sampling_times_file(lines):
+    """Return a dict of subject id -> sorted array of sampling times
+
+    Each non-comment line is tab-delimited: a subject id followed by
+    its sampling times, e.g. control_0	0	1.5	4	9.25
+    """
+    sampling_times = {}
+    for line_number,line in enumerate(lines,1):
+        if not line.strip() or line.startswith("#"):
+            continue
+        fields = [f for f in line.rstrip("\r\n").split("\t") if f.strip()]
+        subject_id = fields[0]
+        try:
+            times = numpy.array(list(map(float,fields[1:])))
+        except ValueError:
+            raise ValueError("Line %i: sampling times for %s must be numbers. Got: %s"\
+              %(line_number,subject_id,fields[1:]))
+        if subject_id in sampling_times:
+            raise ValueError("Line %i: duplicate sampling times for subject %s" %(line_number,subject_id))
+        sampling_times[subject_id] = numpy.sort(times)
+    return sampling_times
+
+def get_event_schedule(sampling_times,perturbations):
+    """Return (event_times,is_sample) arrays for a cohort
+
+    sampling_times -- list of 1d arrays of sampling times, one per individual
+    perturbations -- Perturbation objects whose start and end split the timeline
+
+    Each individual's events are its own sampling times plus any perturbation
+    boundaries (Start and End + 1, and every whole timestep in between for a
+    ScheduledPerturbation) falling between 0 and its last sample, so that
+    parameters are constant between consecutive events. Rows are padded
+    with repeats of the last event (a zero-length step) to a common length.
+
+    event_times -- (n_individuals,n_events) array, starting at time 0
+    is_sample -- boolean array of the same shape, True where an event is a sample
+    """
+    boundaries = set()
+    for perturbation in perturbations:
+        boundaries.add(float(perturbation.Start))
+        boundaries.add(float(perturbation.End + 1))
+        if perturbation.Weights is not None:
+            boundaries.update(numpy.arange(perturbation.Start,perturbation.End + 1,dtype=float))
+
+    rows = []
+    for times in sampling_times:
+        times = numpy.asarray(times,dtype=float)
+        if times.size == 0:
+            raise ValueError("Every individual must have at least one sampling time")
+        if times.min() < 0:
+            raise ValueError("Sampling times must not be negative. Got: %s" %str(times.min()))
+        last = times.max()
+        breaks = [b for b in boundaries if 0.0 < b < last]
+        events = numpy.unique(numpy.concatenate([[0.0],times,breaks]))
+        rows.append((events,numpy.isin(events,times)))
+
+    n_events = max(len(events) for events,samples in rows)
+    event_times = numpy.empty((len(rows),n_events))
+    is_sample = numpy.zeros((len(rows),n_events),dtype=bool)
+    for i,(events,samples) in enumerate(rows):
+        event_times[i,:len(events)] = events
+        event_times[i,len(events):] = events[-1]
+        is_sample[i,:len(events)] = samples
+    return event_times,is_sample
+
+def simulate_sampling_schedule(cohort,sampling_times,perturbations=()):
+    """Simulate a cohort only at each individual's sampling times
+
+    cohort -- a MultivariateProcess using method='exact', at time 0
+    sampling_times -- list of 1d arrays of sampling times, one per individual
+      in the cohort, in the same order as cohort rows
+    perturbations -- Perturbation objects applied to the cohort. Each is active
+      for Start <= t < End + 1.
+
+    Individuals advance from event to event with exact OU transitions (every
+    individual in one batched update per event), so the unobserved unit steps
+    in between are never simulated. Coordinates are clamped to the cohort's
+    bounds at every event.
+
+    Returns a list with one (n_samples,n_axes) coordinate array per individual,
+    in the order of its sorted sampling times.
+    """
+    if cohort.Method != "exact":
+        raise ValueError("Irregular sampling requires exact transitions (method='exact'), not '%s'" %cohort.Method)
+    if len(sampling_times) != cohort.NIndividuals:
+        raise ValueError("Got sampling times for %i individuals, but the cohort has %i"\
+          %(len(sampling_times),cohort.NIndividuals))
+
+    event_times,is_sample = get_event_schedule(sampling_times,perturbations)
+    for perturbation in perturbations:
+        cohort.applyPerturbation(perturbation)
+
+    samples = [[] for times in sampling_times]
+    try:
+        for k in range(event_times.shape[1]):
+            if k > 0:
+                dt = event_times[:,k] - event_times[:,k-1]
+                cohort.update(dt,times=event_times[:,k-1])
+            sampled_rows = numpy.nonzero(is_sample[:,k])[0]
+            coords = cohort.Coords[sampled_rows]
+            for row,row_coords in zip(sampled_rows,coords):
+                samples[row].append(row_coords)
+    finally:
+        for perturbation in perturbations:
+            cohort.removePerturbation(perturbation)
+    return [numpy.array(s) for s in samples]
@@ -0,0 +1,401 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Global sensitivity analysis: which simulation parameters drive dispersion outcomes?
+#
+#Parameters varied (any subset; the others are held at fixed values):
+#
+#lambda -- base OU reversion strength
+#delta -- base OU noise
+#mu_shift -- amount added to mu on every axis of perturbed individuals while perturbed
+#interindividual_variation -- spread of starting positions
+#perturbation_duration -- timesteps the perturbation lasts (rounded to an integer)
+#
+#Design points follow Saltelli's scheme: base matrices A and B of n_base points
+#each (from a scrambled Sobol sequence or Latin hypercubes), plus one matrix AB_i
+#per parameter (A with column i taken from B), n_base x (n_params + 2) points in
+#all. First-order indices use the Saltelli (2010) estimator and total indices
+#Jansen's estimator, with bootstrap confidence intervals over base points.
+#
+#Each design point is a control and a perturbed treatment of n_individuals,
+#sharing start positions and noise. Points are simulated in batches, each
+#treatment as one MultivariateProcess with one row per individual (per-row
+#lambda, delta and mu), so tens of thousands of points take a handful of array
+#operations per timestep, and batches run in parallel.
+#Outputs are dispersion metrics (see dispersion.py) of the perturbed treatment at
+#the evaluation timepoint, and their difference from control ('_effect').
+#Simulation noise adds to the unexplained variance, so indices sum to less than
+#one for noisy outputs; more individuals per point reduce this.
+
+from multivariate_process import MultivariateProcess
+from shared_arrays import run_in_pool,get_chunks
+from dispersion import DISPERSION_COLUMNS
+from optparse import OptionParser
+from optparse import OptionGroup
+from scipy.stats import qmc
+import numpy
+import logging
+
+logger = logging.getLogger("karenina.sensitivity")
+
+SENSITIVITY_PARAMETERS = ("lambda","delta","mu_shift","interindividual_variation","perturbation_duration")
+DEFAULT_FIXED_PARAMS = {"lambda":0.2,"delta":0.25,"mu_shift":0.3,"interindividual_variation":0.01}
+DEFAULT_BOUNDS = {"lambda":(0.01,0.5),"delta":(0.05,0.5),"mu_shift":(0.0,0.5),\
+  "interindividual_variation":(0.0,0.2)}
+SAMPLING_METHODS = ("sobol","lhs")
+DISPERSION_METRICS = tuple(DISPERSION_COLUMNS[3:])
+SENSITIVITY_OUTPUTS = DISPERSION_METRICS + tuple(metric + "_effect" for metric in DISPERSION_METRICS)
+SENSITIVITY_COLUMNS = ["output","parameter","first_order","first_order_ci_low","first_order_ci_high",\
+  "total","total_ci_low","total_ci_high"]
+
+def make_sensitivity_design(n_timepoints,perturbation_start,parameters=SENSITIVITY_PARAMETERS,\
+  bounds=None,fixed_params=None,n_individuals=20,axes=("x","y","z"),method="euler",\
+  evaluation_timepoint=None):
+    """Return a dict describing the parameters varied and the experiment simulated at each point
+
+    parameters -- names from SENSITIVITY_PARAMETERS to vary
+    bounds -- dict of parameter -> (low,high), overriding DEFAULT_BOUNDS. By default
+      perturbation_duration ranges from 0 to the number of timesteps after perturbation_start.
+    fixed_params -- values for parameters that are not varied, overriding
+      DEFAULT_FIXED_PARAMS (default perturbation_duration: until the last timepoint)
+    n_individuals -- individuals per treatment at each design point
+    method -- 'euler' (the reference Process model) or 'exact' (exact OU transitions,
+      a different model for the same lambda and delta; see Experiment)
+    evaluation_timepoint -- timepoint at which outputs are calculated (default: the last)
+    """
+    for name in parameters:
+        if name not in SENSITIVITY_PARAMETERS:
+            raise ValueError("Unknown sensitivity parameter: %s. Valid parameters: %s"\
+              %(name,", ".join(SENSITIVITY_PARAMETERS)))
+    if len(set(parameters)) != len(parameters) or not parameters:
+        raise ValueError("parameters must list one or more distinct parameters. Got: %s" %str(parameters))
+    if n_individuals < 2:
+        raise ValueError("At least 2 individuals per treatment are needed for dispersion. Got: %i" %n_individuals)
+    if not 0 <= perturbation_start < n_timepoints:
+        raise ValueError("perturbation_start must be a timepoint between 0 and %i. Got: %i"\
+          %(n_timepoints - 1,perturbation_start))
+    max_duration = n_timepoints - 1 - perturbation_start
+    all_bounds = dict(DEFAULT_BOUNDS)
+    all_bounds["perturbation_duration"] = (0,max_duration)
+    all_bounds.update(bounds or {})
+    all_fixed = dict(DEFAULT_FIXED_PARAMS)
+    all_fixed["perturbation_duration"] = max_duration
+    all_fixed.update(fixed_params or {})
+    design_bounds = []
+    for name in parameters:
+        low,high = all_bounds[name]
+        if not low < high:
+            raise ValueError("Bounds for %s must have low < high. Got: (%s,%s)" %(name,low,high))
+        design_bounds.append((float(low),float(high)))
+    if evaluation_timepoint is None:
+        evaluation_timepoint = n_timepoints - 1
+    return {"parameters":list(parameters),"bounds":design_bounds,"fixed_params":all_fixed,\
+      "n_timepoints":n_timepoints,"perturbation_start":perturbation_start,\
+      "n_individuals":n_individuals,"axes":list(axes),"method":method,\
+      "evaluation_timepoint":evaluation_timepoint}
+
+def get_unit_samples(n_points,n_dims,sampling="sobol",seed=None):
+    """Return an (n_points,n_dims) array of samples in the unit hypercube
+
+    sampling -- 'sobol' (scrambled Sobol sequence; n_points should be a power of 2)
+      or 'lhs' (Latin hypercube: each dimension has one point in each of n_points strata)
+    """
+    if sampling == "sobol":
+        sampler = qmc.Sobol(n_dims,scramble=True,seed=seed)
+        m = int(numpy.log2(n_points)) if n_points > 0 else 0
+        if 2**m == n_points:
+            return sampler.random_base2(m)
+        logger.warning("Sobol sequences are balanced for powers of 2 points; using %i points",n_points)
+        return sampler.random(n_points)
+    if sampling == "lhs":
+        return qmc.LatinHypercube(n_dims,seed=seed).random(n_points)
+    raise ValueError("sampling must be one of %s. Got: %s" %(", ".join(SAMPLING_METHODS),sampling))
+
+def make_saltelli_samples(n_base,n_params,sampling="sobol",seed=None):
+    """Return an (n_base*(n_params+2),n_params) unit sample ordered as A, B, AB_1 ... AB_n_params
+
+    A and B are the two halves of one 2*n_params dimensional sample, so they are
+    independent but jointly well spread.
+    """
+    samples = get_unit_samples(n_base,2 * n_params,sampling,seed)
+    A = samples[:,:n_params]
+    B = samples[:,n_params:]
+    matrices = [A,B]
+    for i in range(n_params):
+        AB = A.copy()
+        AB[:,i] = B[:,i]
+        matrices.append(AB)
+    return numpy.vstack(matrices)
+
+def scale_samples(design,unit_samples):
+    """Return design points: unit samples scaled to the design's bounds"""
+    low = numpy.array([bound[0] for bound in design["bounds"]])
+    high = numpy.array([bound[1] for bound in design["bounds"]])
+    return low + unit_samples * (high - low)
+
+def get_point_params(design,points):
+    """Return a dict of parameter -> (n_points,) values, filling in fixed parameters"""
+    points = numpy.asarray(points,dtype=float)
+    point_params = {}
+    for name in SENSITIVITY_PARAMETERS:
+        if name in design["parameters"]:
+            point_params[name] = points[:,design["parameters"].index(name)]
+        else:
+            point_params[name] = numpy.full(points.shape[0],float(design["fixed_params"][name]))
+    point_params["perturbation_duration"] = numpy.round(point_params["perturbation_duration"])
+    return point_params
+
+def get_batch_dispersion(coords):
+    """Return a dict of dispersion metric -> (n_points,) values for (n_points,n_individuals,D) coords"""
+    n_individuals = coords.shape[1]
+    centroids = coords.mean(axis=1)
+    centroid_distances = numpy.sqrt(((coords - centroids[:,None])**2).sum(axis=2))
+    #One individual at a time, so memory is n_points x n_individuals x D
+    pairwise_total = numpy.zeros(coords.shape[0])
+    for i in range(n_individuals):
+        pairwise_total += numpy.sqrt(((coords - coords[:,i:i+1])**2).sum(axis=2)).sum(axis=1)
+    return {"centroid_distance":centroid_distances.mean(axis=1),\
+      "mean_pairwise_distance":pairwise_total / (n_individuals * (n_individuals - 1)),\
+      "variance":coords.var(axis=1,ddof=1).sum(axis=1)}
+
+def simulate_point_batch(design,points,seed=None):
+    """Return a dict of output -> (n_points,) values for a batch of design points
+
+    The individuals of every point are rows of one MultivariateProcess per
+    treatment. Each individual reverts to its start position; perturbed
+    individuals' mu is shifted by mu_shift on every axis at timesteps
+    perturbation_start to perturbation_start + perturbation_duration (inclusive,
+    as for Perturbation). Control and perturbed treatments share start positions
+    and noise (common random numbers), so '_effect' outputs measure the
+    perturbation alone rather than the difference between two random cohorts.
+    """
+    start_seed,noise_seed = numpy.random.SeedSequence(seed).generate_state(2)
+    point_params = get_point_params(design,points)
+    n_points = len(point_params["lambda"])
+    n_individuals = design["n_individuals"]
+    n_axes = len(design["axes"])
+    #Rows are ordered point, individual
+    def per_row(values):
+        return numpy.repeat(values,n_individuals)[:,None]
+    variation = per_row(point_params["interindividual_variation"])
+    start_coords = (numpy.random.RandomState(start_seed).random_sample((n_points * n_individuals,n_axes))\
+      - 0.5) * 2.0 * variation
+    params = {"lambda":per_row(point_params["lambda"]),"delta":per_row(point_params["delta"])}
+    cohorts = [MultivariateProcess(start_coords,design["axes"],params,method=design["method"],\
+      random_state=numpy.random.RandomState(noise_seed),history_window=0) for treatment in range(2)]
+    control,perturbed = cohorts
+    base_mu = perturbed.Params["mu"]
+    shift = per_row(point_params["mu_shift"])
+    start = design["perturbation_start"]
+    end = start + per_row(point_params["perturbation_duration"])
+    for t in range(design["evaluation_timepoint"] + 1):
+        active = (start <= t) & (t <= end)
+        perturbed.Params["mu"] = base_mu + shift * active
+        control.update(1.0)
+        perturbed.update(1.0)
+    control_metrics = get_batch_dispersion(control.Coords.reshape(n_points,n_individuals,n_axes))
+    perturbed_metrics = get_batch_dispersion(perturbed.Coords.reshape(n_points,n_individuals,n_axes))
+    outputs = {}
+    for metric in DISPERSION_METRICS:
+        outputs[metric] = perturbed_metrics[metric]
+        outputs[metric + "_effect"] = perturbed_metrics[metric] - control_metrics[metric]
+    return outputs
+
+def simulate_point_batch_task(task):
+    """Run simulate_point_batch for one batch (for use in a worker Pool)"""
+    design,points,seed = task
+    return simulate_point_batch(design,points,seed)
+
+def evaluate_points(design,points,batch_size=500,n_jobs=1,seed=None):
+    """Return a dict of output -> (n_points,) values for every design point
+
+    Points are simulated in batches of batch_size, in parallel if n_jobs > 1.
+    Results depend on seed and batch_size but not on n_jobs.
+    """
+    points = numpy.asarray(points,dtype=float)
+    batches = get_chunks(points.shape[0],batch_size)
+    seeds = numpy.random.SeedSequence(seed).generate_state(len(batches))
+    tasks = [(design,points[start:end],int(batch_seed)) for (start,end),batch_seed in zip(batches,seeds)]
+    results = run_in_pool(simulate_point_batch_task,tasks,n_jobs)
+    return dict((output,numpy.concatenate([result[output] for result in results])) for output in SENSITIVITY_OUTPUTS)
+
+def get_sobol_indices(values,n_params):
+    """Return (first_order,total) (n_params,) Sobol index arrays from outputs at Saltelli points
+
+    values -- (n_base*(n_params+2),) outputs ordered as make_saltelli_samples (A, B, AB_i),
+      or an (n_bootstrap,n_base*(n_params+2)) array to get (n_bootstrap,n_params) indices.
+      Indices are NaN for an output with no variance.
+    """
+    values = numpy.asarray(values,dtype=float)
+    blocks = values.reshape(values.shape[:-1] + (n_params + 2,-1))
+    f_A = blocks[...,0,:]
+    f_B = blocks[...,1,:]
+    f_AB = blocks[...,2:,:]
+    variance = numpy.concatenate([f_A,f_B],axis=-1).var(axis=-1)[...,None]
+    with numpy.errstate(divide="ignore",invalid="ignore"):
+        first_order = (f_B[...,None,:] * (f_AB - f_A[...,None,:])).mean(axis=-1) / variance
+        total = 0.5 * ((f_A[...,None,:] - f_AB)**2).mean(axis=-1) / variance
+    return first_order,total
+
+def get_sobol_confidence_intervals(values,n_params,n_bootstrap=100,confidence=0.95,random_state=None):
+    """Return (first_low,first_high,total_low,total_high) bootstrap percentile intervals
+
+    Base points are resampled with replacement, keeping each point's A, B and
+    AB_i evaluations together.
+    """
+    random_state = numpy.random.RandomState(random_state)
+    blocks = numpy.asarray(values,dtype=float).reshape(n_params + 2,-1)
+    n_base = blocks.shape[1]
+    resampled = blocks[:,random_state.randint(0,n_base,(n_bootstrap,n_base))].transpose(1,0,2)
+    first_order,total = get_sobol_indices(resampled.reshape(n_bootstrap,-1),n_params)
+    tail = 50.0 * (1.0 - confidence)
+    low,high = numpy.nanpercentile(first_order,[tail,100.0 - tail],axis=0)
+    total_low,total_high = numpy.nanpercentile(total,[tail,100.0 - tail],axis=0)
+    return low,high,total_low,total_high
+
+def run_sensitivity_analysis(design,n_base=1024,sampling="sobol",outputs=SENSITIVITY_OUTPUTS,\
+  batch_size=500,n_bootstrap=100,confidence=0.95,n_jobs=1,seed=None):
+    """Return (rows,points,values) for a Sobol sensitivity analysis of a design
+
+    rows -- list of dicts (SENSITIVITY_COLUMNS), one per output x parameter
+    points -- (n_base*(n_params+2),n_params) array of design points
+    values -- dict of output -> values at each point
+    """
+    for output in outputs:
+        if output not in SENSITIVITY_OUTPUTS:
+            raise ValueError("Unknown output: %s. Valid outputs: %s" %(output,", ".join(SENSITIVITY_OUTPUTS)))
+    sample_seed,simulation_seed,bootstrap_seed = numpy.random.SeedSequence(seed).generate_state(3)
+    n_params = len(design["parameters"])
+    points = scale_samples(design,make_saltelli_samples(n_base,n_params,sampling,int(sample_seed)))
+    logger.info("Evaluating %i design points (%i base points x %i matrices)",points.shape[0],n_base,n_params + 2)
+    values = evaluate_points(design,points,batch_size,n_jobs,int(simulation_seed))
+    rows = []
+    for output in outputs:
+        first_order,total = get_sobol_indices(values[output],n_params)
+        intervals = get_sobol_confidence_intervals(values[output],n_params,n_bootstrap,\
+          confidence,int(bootstrap_seed))
+        for i,name in enumerate(design["parameters"]):
+            rows.append({"output":output,"parameter":name,"first_order":first_order[i],\
+              "first_order_ci_low":intervals[0][i],"first_order_ci_high":intervals[1][i],\
+              "total":total[i],"total_ci_low":intervals[2][i],"total_ci_high":intervals[3][i]})
+    return rows,points,values
+
+def format_sensitivity_table(rows):
+    """Return lines of a tab-delimited table of Sobol indices"""
+    lines = ["\t".join(SENSITIVITY_COLUMNS)+"\n"]
+    for row in rows:
+        fields = [row["output"],row["parameter"]] + [repr(float(row[column])) for column in SENSITIVITY_COLUMNS[2:]]
+        lines.append("\t".join(fields)+"\n")
+    return lines
+
+def format_points_table(design,points,values):
+    """Return lines of a tab-delimited table of design points and their outputs"""
+    lines = ["\t".join(design["parameters"] + list(SENSITIVITY_OUTPUTS))+"\n"]
+    for i in range(points.shape[0]):
+        fields = [repr(float(value)) for value in points[i]]
+        fields.extend(repr(float(values[output][i])) for output in SENSITIVITY_OUTPUTS)
+        lines.append("\t".join(fields)+"\n")
+    return lines
+
+def parse_bounds(bounds_string):
+    """Return a dict of parameter -> (low,high) from e.g. 'lambda:0.01:0.5,delta:0.1:0.3'"""
+    bounds = {}
+    if not bounds_string:
+        return bounds
+    for entry in bounds_string.split(","):
+        try:
+            name,low,high = entry.split(":")
+            bounds[name] = (float(low),float(high))
+        except ValueError:
+            raise ValueError("Bounds must be given as name:low:high. Got: %s" %entry)
+    return bounds
+
+def make_option_parser():
+    """Return an optparse OptionParser object"""
+
+    parser = OptionParser(usage = "%prog -o sobol_indices.tsv --n_base 1024",
+    description = "Estimate first-order and total Sobol indices of dispersion " +
+    "outcomes with respect to simulation parameters (lambda, delta, mu shift, " +
+    "interindividual variation and perturbation duration), simulating control " +
+    "and perturbed treatments at Sobol or Latin hypercube design points.",
+    version = __version__)
+
+    required_options = OptionGroup(parser, "Required options")
+    required_options.add_option('-o','--output',type="string",
+    help='output file for the tab-delimited table of Sobol indices')
+    parser.add_option_group(required_options)
+
+    optional_options = OptionGroup(parser, "Optional options")
+    optional_options.add_option('--parameters',default=",".join(SENSITIVITY_PARAMETERS),type="string",
+    help='Comma-separated parameters to vary [default: %default]')
+    optional_options.add_option('--bounds',default=None,type="string",
+    help='Comma-separated name:low:high bounds overriding the defaults, ' +
+    'e.g. lambda:0.01:0.3,delta:0.1:0.4 [default: %default]')
+    optional_options.add_option('--n_base',default=1024,type="int",
+    help='Base design points; n_base x (n_parameters + 2) points are simulated. ' +
+    'Use a power of 2 for Sobol sampling [default: %default]')
+    optional_options.add_option('--sampling',default="sobol",type="choice",
+    choices=list(SAMPLING_METHODS),
+    help='Design: scrambled Sobol sequence or Latin hypercube [default: %default]')
+    optional_options.add_option('-n','--n_individuals',default=20,type="int",
+    help='Individuals per treatment at each design point [default: %default]')
+    optional_options.add_option('--axes',default="x,y,z",type="string",
+    help='Comma-separated names of the simulated axes [default: %default]')
+    optional_options.add_option('-t','--n_timepoints',default=30,type="int",
+    help='Number of timepoints [default: %default]')
+    optional_options.add_option('-p','--perturbation_timepoint',default=10,type="int",
+    help='Timepoint at which the perturbation starts [default: %default]')
+    optional_options.add_option('--method',default="euler",type="choice",
+    choices=["euler","exact"],
+    help='Transitions used to simulate individuals. "euler" is the same ' +
+    'model as spatial_ornstein_uhlenbeck.py. "exact" uses the exact transitions of a ' +
+    'continuous-time OU process, which is a different model for the same ' +
+    'lambda and delta: its stationary variance is delta^4/(2 lambda) ' +
+    'rather than delta^4/(2 lambda - lambda^2), and its lag-1 ' +
+    'autocorrelation is exp(-lambda) rather than 1 - lambda [default: %default]')
+    optional_options.add_option('--evaluation_timepoint',default=None,type="int",
+    help='Timepoint at which dispersion is measured [default: the last]')
+    optional_options.add_option('--batch_size',default=500,type="int",
+    help='Design points simulated together in one batch [default: %default]')
+    optional_options.add_option('--n_bootstrap',default=100,type="int",
+    help='Bootstrap resamples for confidence intervals [default: %default]')
+    optional_options.add_option('--points_output',default=None,type="string",
+    help='Optionally, write every design point and its outputs to this file [default: %default]')
+    optional_options.add_option('--n_jobs',default=1,type="int",
+    help='Number of worker processes [default: %default]')
+    optional_options.add_option('--seed',default=None,type="int",
+    help='Random seed [default: %default]')
+    parser.add_option_group(optional_options)
+    return parser
+
+def main():
+    parser = make_option_parser()
+    opts, args = parser.parse_args()
+    if opts.output is None:
+        parser.error("An output file (-o) is required")
+    logging.basicConfig(level=logging.INFO,format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+
+    design = make_sensitivity_design(opts.n_timepoints,opts.perturbation_timepoint,\
+      parameters=opts.parameters.split(","),bounds=parse_bounds(opts.bounds),\
+      n_individuals=opts.n_individuals,axes=opts.axes.split(","),method=opts.method,\
+      evaluation_timepoint=opts.evaluation_timepoint)
+    rows,points,values = run_sensitivity_analysis(design,opts.n_base,opts.sampling,\
+      batch_size=opts.batch_size,n_bootstrap=opts.n_bootstrap,n_jobs=opts.n_jobs,seed=opts.seed)
+    with open(opts.output,"w") as output_file:
+        output_file.writelines(format_sensitivity_table(rows))
+    if opts.points_output is not None:
+        with open(opts.points_output,"w") as points_file:
+            points_file.writelines(format_points_table(design,points,values))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import numpy
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from multivariate_process import MultivariateProcess
+from ou_likelihood import fit_OU_exact
+import logging
+
+logger = logging.getLogger("karenina.shared_arrays")
+
+class SharedArray(object):
+    """A numpy array backed by shared memory, for zero-copy results from worker processes
+
+    The process that creates a SharedArray owns it and must call unlink()
+    (or use it as a context manager) when done. Pickling a SharedArray (e.g.
+    passing it to a Pool worker) sends only its name, shape and dtype; the
+    worker attaches to the same memory and writes its slice in place.
+    """
+
+    def __init__(self,shape,dtype=float,name=None,fill_value=None):
+        """
+        shape,dtype -- shape and dtype of the array
+        name -- name of existing shared memory to attach to. If None, new
+          shared memory is created and owned by this object.
+        fill_value -- optionally, a value to initialize a new array with
+        """
+        self.Shape = tuple(shape)
+        self.DType = numpy.dtype(dtype)
+        n_bytes = max(1,int(numpy.prod(self.Shape)) * self.DType.itemsize)
+        if name is None:
+            self.SharedMemory = SharedMemory(create=True,size=n_bytes)
+            self.Owner = True
+        else:
+            self.SharedMemory = SharedMemory(name=name)
+            self.Owner = False
+        self.Name = self.SharedMemory.name
+        self.Array = numpy.ndarray(self.Shape,dtype=self.DType,buffer=self.SharedMemory.buf)
+        if fill_value is not None and self.Owner:
+            self.Array.fill(fill_value)
+
+    def __getstate__(self):
+        return {"Shape":self.Shape,"DType":self.DType.str,"Name":self.Name}
+
+    def __setstate__(self,state):
+        self.__init__(state["Shape"],state["DType"],name=state["Name"])
+
+    def close(self):
+        """Release this process's view of the shared memory"""
+        if self.SharedMemory is None:
+            return
+        self.Array = None
+        self.SharedMemory.close()
+
+    def unlink(self):
+        """Close and free the shared memory (owner only)"""
+        shared_memory = self.SharedMemory
+        self.close()
+        if self.Owner and shared_memory is not None:
+            shared_memory.unlink()
+        self.SharedMemory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.unlink()
+
+def get_chunks(n_rows,chunk_size):
+    """Return a list of (start,end) row ranges covering n_rows"""
+    return [(start,min(start+chunk_size,n_rows)) for start in range(0,n_rows,chunk_size)]
+
+def slice_rows(value,start,end,n_rows):
+    """Return rows start:end of a parameter that may be per-row or shared"""
+    value = numpy.asarray(value)
+    if value.ndim == 2 and value.shape[0] == n_rows:
+        return value[start:end]
+    return value
+
+def run_in_pool(f,tasks,n_jobs):
+    """Run f over tasks, in a Pool if n_jobs > 1"""
+    if n_jobs is None or n_jobs <= 1 or len(tasks) <= 1:
+        return [f(task) for task in tasks]
+    pool = Pool(processes=n_jobs)
+    try:
+        return pool.map(f,tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def simulate_chunk(task):
+    """Simulate rows start:end of a cohort, writing timepoints into a SharedArray in place"""
+    shared_history,start,end,axes,params,n_timepoints,dt,method,perturbations,bounds,seed = task
+    n_rows = shared_history.Shape[0]
+    chunk_params = {}
+    for name,value in params.items():
+        if value is None or name in ("coupling","correlation"):
+            chunk_params[name] = value
+        else:
+            chunk_params[name] = slice_rows(value,start,end,n_rows)
+    history = shared_history.Array
+    cohort = MultivariateProcess(history[start:end,0],axes,chunk_params,method=method,\
+      min_bound=bounds[0],max_bound=bounds[1],random_state=numpy.random.RandomState(seed),\
+      history_window=0)
+    for t in range(n_timepoints):
+        for perturbation in perturbations:
+            if perturbation.isActive(t) and perturbation not in cohort.Perturbations:
+                cohort.applyPerturbation(perturbation)
+            elif not perturbation.isActive(t) and perturbation in cohort.Perturbations:
+                cohort.removePerturbation(perturbation)
+            if perturbation.isActive(t):
+                perturbation.setTime(t)
+        cohort.update(dt)
+        history[start:end,t+1] = cohort.Coords
+    if not shared_history.Owner:
+        shared_history.close()
+    return end - start
+
+def simulate_cohort_parallel(start_coords,axes,params,n_timepoints,dt=1.0,\
+  perturbations=(),method="exact",min_bound=-1.0,max_bound=1.0,\
+  n_jobs=1,chunk_size=1000,seed=None):
+    """Simulate a cohort across worker processes, returning a SharedArray of its history
+
+    start_coords -- (n_individuals,D) starting coordinates
+    axes,params,method,min_bound,max_bound -- as for MultivariateProcess.
+      Per-individual (n_individuals,D) parameters are split between workers.
+    n_timepoints -- number of timesteps of size dt to simulate
+    perturbations -- Perturbation objects, active at timestep t when isActive(t)
+    n_jobs -- number of worker processes
+    chunk_size -- individuals per task. Each chunk gets its own random seed derived
+      from seed, so results depend on seed and chunk_size but not on n_jobs.
+
+    Returns a SharedArray whose .Array is (n_individuals,n_timepoints+1,D), with the
+    start coordinates at t=0. Workers write their rows directly into it, so nothing
+    is pickled back to the parent. Call unlink() on the result when done with it.
+    """
+    start_coords = numpy.asarray(start_coords,dtype=float)
+    n_rows,n_dim = start_coords.shape
+    shared_history = SharedArray((n_rows,n_timepoints+1,n_dim))
+    shared_history.Array[:,0] = start_coords
+    chunks = get_chunks(n_rows,chunk_size)
+    seeds = numpy.random.SeedSequence(seed).generate_state(len(chunks))
+    tasks = [(shared_history,start,end,axes,params,n_timepoints,dt,method,\
+      list(perturbations),(min_bound,max_bound),int(chunk_seed))\
+      for (start,end),chunk_seed in zip(chunks,seeds)]
+    try:
+        run_in_pool(simulate_chunk,tasks,n_jobs)
+    except BaseException:
+        shared_history.unlink()
+        raise
+    return shared_history
+
+def fit_chunk(task):
+    """Fit series start:end, writing results into a SharedArray in place
+
+    A series whose fit raises an exception keeps its NaN row, so one bad
+    series does not discard the rest of the batch.
+    """
+    shared_results,start,end,series,times,fit_function = task
+    results = shared_results.Array
+    try:
+        for i in range(start,end):
+            try:
+                results[i] = fit_function(series[i-start],times[i-start])
+            except Exception as e:
+                logger.warning("Fit of series %i failed: %s",i,e)
+    finally:
+        if not shared_results.Owner:
+            shared_results.close()
+    return end - start
+
+def fit_timeseries_parallel(series,times,fit_function=fit_OU_exact,n_outputs=4,\
+  n_jobs=1,chunk_size=100):
+    """Fit many series across worker processes, returning a SharedArray of results
+
+    series -- list of 1d arrays (one per series)
+    times -- list of matching 1d time arrays
+    fit_function -- f(x,times) returning n_outputs values. Must be picklable
+      (a module-level function). Defaults to ou_likelihood.fit_OU_exact, which
+      returns (Sigma,Lambda,Theta,nlogLik).
+
+    Returns a SharedArray whose .Array is (n_series,n_outputs), NaN for any series
+    whose fit failed (raised an exception or returned NaN). Call unlink() on the
+    result when done with it.
+    """
+    if len(series) != len(times):
+        raise ValueError("Got %i series but %i time arrays" %(len(series),len(times)))
+    shared_results = SharedArray((len(series),n_outputs),fill_value=numpy.nan)
+    tasks = [(shared_results,start,end,series[start:end],times[start:end],fit_function)\
+      for start,end in get_chunks(len(series),chunk_size)]
+    try:
+        run_in_pool(fit_chunk,tasks,n_jobs)
+    except BaseException:
+        shared_results.unlink()
+        raise
+    return shared_results
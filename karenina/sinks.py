@@ -0,0 +1,111 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Sinks receive simulated coordinates from an Experiment one timepoint at a time.
+#This lets results be streamed to disk or summarized as they are produced,
+#instead of being held in memory as Process histories.
+
+import numpy
+
+def format_timepoint(t):
+    """Return t as a string for sample ids: integers without a decimal point"""
+    t = float(t)
+    if t.is_integer():
+        return "%i" %t
+    return "%s" %round(t,6)
+
+def get_sample_id(subject_id,t):
+    """Return the sample id for a subject at time t, e.g. Scontrol_0_t5"""
+    return "S%s_t%s" %(subject_id,format_timepoint(t))
+
+class Sink(object):
+    """Base class for objects that receive simulated coordinates
+
+    Subclasses implement write(). Experiment calls open() once with the
+    names of the simulated axes, write() once per treatment per timepoint,
+    and close() when the simulation is finished.
+    """
+
+    def open(self,axes):
+        self.Axes = list(axes)
+
+    def write(self,treatment_name,t,subject_ids,coords):
+        """Receive coordinates for one treatment at one timepoint
+
+        treatment_name -- name of the treatment
+        t -- the timepoint, or an array with one (possibly non-integer)
+          time per row when individuals are sampled at irregular times
+        subject_ids -- list of subject ids, in the same order as coords rows
+        coords -- (n_subjects,n_axes) array of coordinates
+        """
+        raise NotImplementedError("Sink subclasses must implement write()")
+
+    def close(self):
+        pass
+
+class CallbackSink(Sink):
+    """Pass each timepoint to a function f(treatment_name,t,subject_ids,coords)"""
+
+    def __init__(self,f):
+        self.Function = f
+
+    def write(self,treatment_name,t,subject_ids,coords):
+        self.Function(treatment_name,t,subject_ids,coords)
+
+class TSVFileSink(Sink):
+    """Stream simulated coordinates to a tab-delimited file, one row per sample
+
+    Columns are SampleID, SubjectID, Treatment, Timepoint and one column per axis.
+    The sink can be pickled (e.g. in an Experiment checkpoint); when unpickled it
+    reopens the file and truncates it to the rows written before the checkpoint,
+    so a resumed run does not duplicate rows.
+    """
+
+    def __init__(self,output_path):
+        self.OutputPath = output_path
+        self.OutputFile = None
+
+    def open(self,axes):
+        Sink.open(self,axes)
+        self.OutputFile = open(self.OutputPath,"w")
+        self.OutputFile.write("\t".join(["SampleID","SubjectID","Treatment","Timepoint"]+self.Axes)+"\n")
+
+    def write(self,treatment_name,t,subject_ids,coords):
+        lines = []
+        times = numpy.broadcast_to(t,(len(subject_ids),)).tolist()
+        for subject_id,curr_t,subject_coords in zip(subject_ids,times,coords.tolist()):
+            fields = [get_sample_id(subject_id,curr_t),subject_id,treatment_name,format_timepoint(curr_t)]
+            fields.extend(map(repr,subject_coords))
+            lines.append("\t".join(fields))
+        self.OutputFile.write("\n".join(lines)+"\n")
+
+    def close(self):
+        if self.OutputFile is not None:
+            self.OutputFile.close()
+            self.OutputFile = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.OutputFile is not None:
+            self.OutputFile.flush()
+            state["Position"] = self.OutputFile.tell()
+        state["OutputFile"] = None
+        return state
+
+    def __setstate__(self,state):
+        position = state.pop("Position",None)
+        self.__dict__.update(state)
+        if position is not None:
+            self.OutputFile = open(self.OutputPath,"r+")
+            self.OutputFile.seek(position)
+            self.OutputFile.truncate()
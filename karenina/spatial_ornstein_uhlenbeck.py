@@ -12,11 +12,24 @@ __email__ = "zaneveld@gmail.com"
 __status__ = "Development"
 
 from experiment import Experiment
+from checkpoint import load_checkpoint
+from perturbation_library import load_perturbation_file
+from sinks import TSVFileSink
+from dispersion import DispersionSink,format_dispersion_table
+from ensemble_statistics import EnsembleStatisticsSink,format_ensemble_table
+from sampling import make_random_sampling_times,parse_sampling_times_file
+from trajectory_storage import STORAGE_DTYPES
+from profiler import profile,profile_stage
+from memory import MemoryProfiler,fit_to_memory_budget,format_memory_estimate,\
+  MEMORY_METHODS,OVER_BUDGET_ACTIONS
 import visualization
 from optparse import OptionParser
 from optparse import OptionGroup
-from os.path import join,isdir,realpath,dirname
+from os.path import join,isdir,realpath,dirname,exists
 from os import makedirs
+import logging
+
+logger = logging.getLogger("karenina.spatial_ornstein_uhlenbeck")
 
 
 def make_option_parser():
@@ -83,16 +96,155 @@ def make_option_parser():
     'value. [default: %default]')
 
     optional_options.add_option('--fixed_start_pos',default=None,type="string",
-    help='Starting x,y,z position for all points, as comma separated ' +
+    help='Starting position for all points on each axis, as comma separated ' +
     'floating point values, e.g. 0.0,0.1,0.2. If not supplied, starting ' +
     'positions will be randomized based on the interindividual_variation ' +
     'parameter [default: %default]')
 
+    optional_options.add_option('--axes',default="x,y,z",type="string",
+    help='Comma-separated names of the axes of the simulated space. Any ' +
+    'number of axes may be used, e.g. PC1,PC2,PC3,PC4 [default: %default]')
+
+    optional_options.add_option('--engine',default="process",type="choice",
+    choices=["process","multivariate"],
+    help='Simulation engine. "process" simulates one independent Process ' +
+    'per axis per individual. "multivariate" advances all individuals in a ' +
+    'treatment together with batched array operations, using the ' +
+    'transitions chosen by --method [default: %default]')
+
+    optional_options.add_option('--method',default="euler",type="choice",
+    choices=["euler","exact"],
+    help='Transitions used by --engine multivariate. "euler" is the same ' +
+    'model as --engine process. "exact" uses the exact transitions of a ' +
+    'continuous-time OU process, which is a different model for the same ' +
+    '--lambda and --delta: its stationary variance is delta^4/(2 lambda) ' +
+    'rather than delta^4/(2 lambda - lambda^2), and its lag-1 ' +
+    'autocorrelation is exp(-lambda) rather than 1 - lambda. Irregular ' +
+    'sampling always uses "exact" [default: %default]')
+
+    optional_options.add_option('--history_window',default=None,type="int",
+    help='Low-memory mode: keep only the last N timepoints of each ' +
+    'individual\'s history (0 keeps none, and no movie is written). ' +
+    'If not supplied, full histories are kept [default: %default]')
+
+    optional_options.add_option('--history_dtype',default="float64",type="choice",
+    choices=list(STORAGE_DTYPES),
+    help='Storage of simulated histories with --engine multivariate. ' +
+    'float32 halves and int16 (quantized within the [-1,1] bounds) quarters ' +
+    'history memory [default: %default]')
+
+    optional_options.add_option('--trajectory_archive',default=None,type="choice",
+    choices=list(STORAGE_DTYPES),
+    help='Write the kept histories of all individuals to trajectories.npz ' +
+    'in the output folder, stored with this precision, delta encoded and ' +
+    'compressed. Read it with trajectory_storage.load_trajectory_archive ' +
+    '[default: %default]')
+
+    optional_options.add_option('--stream_output',default=False,action="store_true",
+    help='Write simulated coordinates to simulated_coordinates.tsv in the ' +
+    'output folder as they are simulated, rather than holding them in ' +
+    'memory [default: %default]')
+
+    optional_options.add_option('--dispersion',default=False,action="store_true",
+    help='Calculate dispersion metrics (centroid distance, mean pairwise ' +
+    'distance and variance) for each treatment at each timepoint, and write ' +
+    'them to dispersion.tsv in the output folder [default: %default]')
+
+    optional_options.add_option('--ensemble_statistics',default=False,action="store_true",
+    help='Accumulate the mean, variance and quantiles of each axis for each ' +
+    'treatment at each timepoint as the simulation runs, and write them to ' +
+    'ensemble_statistics.tsv in the output folder. Combine with ' +
+    '--history_window 0 and --stream_output for low-memory runs [default: %default]')
+
+    optional_options.add_option('--block_size',default=None,type="int",
+    help='Population-scale mode: create and simulate each treatment\'s ' +
+    'individuals this many at a time, writing results to the output files ' +
+    'and discarding each block before the next. Peak memory then depends on ' +
+    'the block size rather than the number of individuals. Use with ' +
+    '--ensemble_statistics and/or --stream_output (implied without ' +
+    '--ensemble_statistics); no movie, dispersion ' +
+    'table or checkpoints are written [default: %default]')
+
+    optional_options.add_option('--random_sampling',default=None,type="int",
+    help='Sample each subject this many times, at random times between 0 ' +
+    'and --n_timepoints, simulating only at those times with exact OU ' +
+    'transitions. Implies --engine multivariate and --method exact. ' +
+    'Results are written to ' +
+    'simulated_coordinates.tsv [default: %default]')
+
+    optional_options.add_option('--sampling_times_file',default=None,type="string",
+    help='Tab-delimited file giving the sampling times of every subject, ' +
+    'one subject per line: a subject id (e.g. control_0) followed by its ' +
+    'times. Implies --engine multivariate and --method exact [default: %default]')
+
+    optional_options.add_option('--checkpoint_interval',default=None,type="int",
+    help='Save a checkpoint of the simulation state every N timesteps, ' +
+    'so that an interrupted run can be continued with --resume. ' +
+    'If not supplied, no checkpoints are written [default: %default]')
+
+    optional_options.add_option('--checkpoint_path',default=None,type="string",
+    help='File path for simulation checkpoints. [default: ' +
+    'checkpoint.pkl.gz in the output folder]')
+
+    optional_options.add_option('--resume',default=False,action="store_true",
+    help='Resume the simulation from the checkpoint file, if one exists, ' +
+    'instead of starting over [default: %default]')
+
+    optional_options.add_option('-v','--verbose',default=False,action="store_true",
+    help='Log detailed per-subject and per-timestep debugging information ' +
+    '[default: %default]')
+
+    optional_options.add_option('-q','--quiet',default=False,action="store_true",
+    help='Only log warnings and errors. No progress is reported ' +
+    '[default: %default]')
+
+    optional_options.add_option('--progress_interval',default=10.0,type="float",
+    help='Seconds between progress reports (throughput, ETA and memory). ' +
+    '[default: %default]')
+
+    optional_options.add_option('--profile',default=False,action="store_true",
+    help='Record wall time, CPU time and call counts for each stage of the ' +
+    'run (setup, perturbations, updates, row formatting, movie writing) and ' +
+    'write them to profile.json and profile.tsv in the output folder ' +
+    '[default: %default]')
+
+    optional_options.add_option('--track_memory',default=None,type="choice",
+    choices=list(MEMORY_METHODS),
+    help='Also record the peak memory reached in each stage of the profile ' +
+    '(implies --profile): "rss" samples resident memory cheaply, ' +
+    '"tracemalloc" traces Python and numpy allocations exactly but slows ' +
+    'the run [default: %default]')
+
+    optional_options.add_option('--memory_budget',default=None,type="float",
+    help='Memory budget in MB. Peak memory is estimated from the design ' +
+    'before simulating; see --over_budget for designs that exceed it ' +
+    '[default: no budget]')
+
+    optional_options.add_option('--over_budget',default="stream",type="choice",
+    choices=list(OVER_BUDGET_ACTIONS),
+    help='What to do if the estimated peak memory exceeds --memory_budget: ' +
+    '"stream" writes coordinates to simulated_coordinates.tsv and keeps no ' +
+    'history (no movie), "refuse" stops with an error [default: %default]')
+
     parser.add_option_group(optional_options)
 
     return parser
 
 
+def setup_logging(opts):
+    """Configure the karenina loggers from --verbose and --quiet"""
+    if opts.verbose and opts.quiet:
+        raise ValueError("--verbose and --quiet cannot be used together")
+    if opts.verbose:
+        level = logging.DEBUG
+    elif opts.quiet:
+        level = logging.WARNING
+    else:
+        level = logging.INFO
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    logging.getLogger("karenina").setLevel(level)
+
+
 def check_perturbation_timepoint(perturbation_timepoint,n_timepoints):
     """Raise ValueError if perturbation_timepoint is < 0 or >n_timepoints"""
     if perturbation_timepoint and perturbation_timepoint >= n_timepoints:
@@ -133,6 +285,13 @@ def write_options_to_log(log, opts):
     logfile.write("Lambda: " + (str(opts.L)) + "\n")
     logfile.write("Fixed starting position: " + (str(opts.fixed_start_pos)) +
     "\n")
+    logfile.write("Axes: " + (str(opts.axes)) + "\n")
+    logfile.write("Engine: " + (str(opts.engine)) + "\n")
+    logfile.write("Method: " + (str(opts.method)) + "\n")
+    logfile.write("History window: " + (str(opts.history_window)) + "\n")
+    logfile.write("Dispersion: " + (str(opts.dispersion)) + "\n")
+    logfile.write("Ensemble statistics: " + (str(opts.ensemble_statistics)) + "\n")
+    logfile.write("Block size: " + (str(opts.block_size)) + "\n")
 
     logfile.close()
 
@@ -140,9 +299,10 @@ def write_options_to_log(log, opts):
 def parse_perturbation_file(opts):
     """Return a list of perturbations
     infile -- a .csv file describing one perturbation per line
-    assume input file is correctly formatted (no warnings if not)
+    (see perturbation_library.parse_perturbation_lines for supported formats).
+    Invalid entries raise a ValueError naming the file and line.
 
-    NOTE: each pertubation should be in the format:
+    NOTE: each pertubation is returned in the format:
     set_xyz_lambda_low =
        {"start":opts.perturbation_timepoint,\
        "end":opts.perturbation_timepoint + opts.perturbation_duration,\
@@ -150,75 +310,71 @@ def parse_perturbation_file(opts):
       "update_mode":"replace",\
       "axes":["x","y","z"]}
     """
+    start = opts.perturbation_timepoint
+    end = opts.perturbation_timepoint + opts.perturbation_duration
     perturb_list = []
     if (opts.pert_file_path != None):
-        input_file = open(opts.pert_file_path, "r")
-
-        for line in input_file:
-            print (line)
-            temp_list = []
-
-            for word in line.split('\t'):
-                temp_list.append(word)
-
-            temp_dict = {"start":opts.perturbation_timepoint,\
-              "end":opts.perturbation_timepoint + opts.perturbation_duration}
-
-            for temp_list_index in range(len(temp_list)):
-                if (temp_list[temp_list_index] == 'params'):
-                    index = temp_list_index + 1
-                    temp_dict['params'] = {}
-                    while (temp_list[index] != 'update_mode'):
-                        temp_dict['params'][temp_list[index]] =\
-                        float(temp_list[index + 1])
-                        index += 2
-                elif (temp_list[temp_list_index] == 'update_mode'):
-                    temp_dict["update_mode"] = temp_list[temp_list_index + 1]
-                elif (temp_list[temp_list_index] == 'axes'):
-                    index = temp_list_index + 1;
-                    temp_dict["axes"] = []
-                    while (index != len(temp_list) and temp_list[index] != ''
-                    and temp_list[index] != '\n'):
-                        split = temp_list[index].split('\n')
-                        temp_dict["axes"].append(split[0])
-                        index += 1
-            perturb_list.append(temp_dict)
-        input_file.close()
+        for perturbation in load_perturbation_file(opts.pert_file_path,start,end):
+            perturb_list.append({"start":perturbation.Start,"end":perturbation.End,\
+              "params":perturbation.Params,"update_mode":perturbation.UpdateMode,\
+              "axes":perturbation.Axes})
 
     else:
-        set_xyz_lambda_zero = {"start":opts.perturbation_timepoint,\
-        "end":opts.perturbation_timepoint + opts.perturbation_duration,\
-        "params":{"lambda":0.000},"update_mode":"replace","axes":["x","y","z"]}
+        set_xyz_lambda_zero = {"start":start,"end":end,\
+        "params":{"lambda":0.000},"update_mode":"replace","axes":opts.axes.split(",")}
 
         perturb_list.append(set_xyz_lambda_zero)
 
     return perturb_list
 
+def write_summary_tables(experiment,output_folder):
+    """Write dispersion.tsv and ensemble_statistics.tsv to output_folder for the experiment's summary sinks"""
+    for sink in experiment.Sinks:
+        if isinstance(sink,DispersionSink):
+            output_path = join(output_folder,"dispersion.tsv")
+            with open(output_path,"w") as output_file:
+                output_file.writelines(format_dispersion_table(sink.Rows))
+            logger.info("Wrote dispersion metrics to %s",output_path)
+        elif isinstance(sink,EnsembleStatisticsSink):
+            output_path = join(output_folder,"ensemble_statistics.tsv")
+            with open(output_path,"w") as output_file:
+                output_file.writelines(format_ensemble_table(sink.get_rows(),sink.Quantiles))
+            logger.info("Wrote ensemble statistics to %s",output_path)
+
 
 def main():
 
     parser = make_option_parser()
     opts, args = parser.parse_args()
-    print (opts)
+    setup_logging(opts)
+    logger.debug("Options: %s",opts)
 
     write_options_to_log("log.txt", opts)
 
+    profiler = MemoryProfiler(opts.track_memory) if opts.track_memory else None
+    with profile(opts.output,enabled=opts.profile or profiler is not None,profiler=profiler):
+        run_simulation(opts)
+
+def run_simulation(opts):
+    """Set up and simulate the experiment described by command-line options"""
     #Check timepoints
     check_perturbation_timepoint(opts.perturbation_timepoint,opts.n_timepoints)
     #Set the base parameters for microbiome change over time
     #in unperturbed individuals.
     individual_base_params = {"lambda":opts.L,"delta":opts.delta,\
       "interindividual_variation":opts.interindividual_variation}
+    axes = opts.axes.split(",")
     if opts.fixed_start_pos:
         try:
-            x,y,z = map(float,opts.fixed_start_pos.split(","))
-            individual_base_params['x']=x
-            individual_base_params['y']=y
-            individual_base_params['z']=z
+            start_pos = list(map(float,opts.fixed_start_pos.split(",")))
+            if len(start_pos) != len(axes):
+                raise ValueError("Expected %i values" %len(axes))
+            for axis,value in zip(axes,start_pos):
+                individual_base_params[axis]=value
 
         except:
-            print ("Supplied value for fixed start position after parsing:",opts.fixed_start_pos)
-            raise ValueError('Problem with --fixed_start_pos. Got %s Please supply x,y,z values in the range (-1,1) separated by commas and enclosed in quotes. Example: "0.1,-0.2,0.3"'% opts.fixed_start_pos)
+            logger.error("Supplied value for fixed start position after parsing: %s",opts.fixed_start_pos)
+            raise ValueError('Problem with --fixed_start_pos. Got %s Please supply one value per axis (%s) in the range (-1,1) separated by commas and enclosed in quotes. Example: "0.1,-0.2,0.3"'% (opts.fixed_start_pos,opts.axes))
 
     #Set up the treatments to be applied
 
@@ -226,19 +382,99 @@ def main():
 
     treatments = [[], perturbations]
     treatment_names = opts.treatment_names.split(",")
-    print("Raw number of individuals from user:",opts.n_individuals)
-    print("n_individuals.split(',')",opts.n_individuals.split(','))
+    logger.debug("Raw number of individuals from user: %s",opts.n_individuals)
     n_individuals = list(map(int,opts.n_individuals.split(",")))
 
-    print ("**Experiment Design**")
-    print ("treatments:",treatment_names)
-    print ("n_individuals:",n_individuals)
-    print ("interindividual_variation",opts.interindividual_variation)
-    print ("treatment_effects:",treatments)
-    print ("individual_base_params:",individual_base_params)
-    experiment = Experiment(treatment_names,n_individuals,opts.n_timepoints,\
-        individual_base_params,treatments,opts.interindividual_variation)
-    experiment.simulate_timesteps(0,opts.n_timepoints)
+    logger.info("**Experiment Design**")
+    logger.info("treatments: %s",treatment_names)
+    logger.info("n_individuals: %s",n_individuals)
+    logger.info("interindividual_variation: %s",opts.interindividual_variation)
+    logger.info("treatment_effects: %s",treatments)
+    logger.info("individual_base_params: %s",individual_base_params)
+
+    checkpoint_path = opts.checkpoint_path
+    if checkpoint_path is None and (opts.checkpoint_interval or opts.resume):
+        checkpoint_path = join(opts.output,"checkpoint.pkl.gz")
+
+    if opts.resume and exists(checkpoint_path):
+        experiment,t_start = load_checkpoint(checkpoint_path)
+        logger.info("Resuming simulation from timestep %i using checkpoint: %s",t_start,checkpoint_path)
+    else:
+        sampling_times = None
+        engine = opts.engine
+        method = opts.method
+        if opts.random_sampling is not None or opts.sampling_times_file is not None:
+            if opts.random_sampling is not None and opts.sampling_times_file is not None:
+                raise ValueError("Use only one of --random_sampling and --sampling_times_file")
+            if opts.sampling_times_file is not None:
+                with open(opts.sampling_times_file) as sampling_times_file:
+                    sampling_times = parse_sampling_times_file(sampling_times_file)
+            else:
+                subject_ids = ["%s_%i" %(name,i) for name,n in zip(treatment_names,n_individuals)\
+                  for i in range(n)]
+                sampling_times = make_random_sampling_times(subject_ids,opts.random_sampling,\
+                  opts.n_timepoints)
+            engine = "multivariate"
+            if method != "exact":
+                logger.info("Irregular sampling uses exact OU transitions (--method exact)")
+            method = "exact"
+        if opts.block_size is not None:
+            if sampling_times is not None or opts.dispersion or opts.checkpoint_interval:
+                raise ValueError("--block_size cannot be combined with irregular sampling, --dispersion or checkpoints")
+            if opts.history_window is None:
+                opts.history_window = 0
+            #Results must leave each block through a sink
+            if not opts.ensemble_statistics:
+                opts.stream_output = True
+
+        opts.history_window,opts.stream_output,estimate = fit_to_memory_budget(n_individuals,\
+          opts.n_timepoints,len(axes),opts.memory_budget,engine=engine,\
+          history_window=opts.history_window,stream_output=opts.stream_output,\
+          write_movie=sampling_times is None,over_budget=opts.over_budget,block_size=opts.block_size,\
+          history_dtype=opts.history_dtype if engine == "multivariate" else None)
+        logger.info("Estimated peak memory: %s",format_memory_estimate(estimate))
+
+        sinks = []
+        if opts.stream_output or sampling_times is not None:
+            sinks.append(TSVFileSink(join(opts.output,"simulated_coordinates.tsv")))
+        if opts.dispersion:
+            sinks.append(DispersionSink())
+        if opts.ensemble_statistics:
+            sinks.append(EnsembleStatisticsSink())
+        experiment = Experiment(treatment_names,n_individuals,opts.n_timepoints,\
+            individual_base_params,treatments,opts.interindividual_variation,\
+            axes=axes,engine=engine,method=method,history_window=opts.history_window,\
+            sinks=sinks,collect_data=not opts.stream_output and opts.block_size is None,\
+            sampling_times=sampling_times,block_size=opts.block_size,\
+            history_dtype=opts.history_dtype)
+        t_start = 0
+
+    if experiment.SamplingTimes is not None:
+        experiment.simulate_sampling_schedule()
+        experiment.close_sinks()
+        write_summary_tables(experiment,opts.output)
+        logger.info("Wrote irregularly sampled coordinates to the output folder; no movie is written for irregular samples")
+        return
+
+    if experiment.BlockSize is not None:
+        experiment.simulate_blocks(progress_interval=opts.progress_interval)
+        experiment.close_sinks()
+        with profile_stage("write_tables"):
+            write_summary_tables(experiment,opts.output)
+        logger.info("Simulated in blocks of %i individuals; no movie is written",experiment.BlockSize)
+        return
+
+    experiment.simulate_timesteps(t_start,opts.n_timepoints,\
+        checkpoint_path=checkpoint_path,checkpoint_interval=opts.checkpoint_interval,\
+        progress_interval=opts.progress_interval)
+    experiment.close_sinks()
+    with profile_stage("write_tables"):
+        write_summary_tables(experiment,opts.output)
+    if opts.history_window == 0:
+        logger.info("No history was kept (--history_window 0), so no movie will be written")
+        return
+    if opts.trajectory_archive is not None:
+        experiment.write_trajectory_archive(join(opts.output,"trajectories.npz"),opts.trajectory_archive)
     experiment.writeToMovieFile(opts.output)
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+#/usr/bin/env python
+
+from __future__ import division
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2016, The Karenina Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "0.0.1-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+#Reduced-precision storage of simulated trajectories.
+#
+#Coordinates are clamped to [min_bound,max_bound] (by default [-1,1], as in
+#Process.ou_update), so they rarely need float64. Trajectories may be stored as:
+#
+#float64 -- full precision (8 bytes per value)
+#float32 -- ~7 significant digits (4 bytes per value)
+#int16 -- quantized to 65535 evenly spaced levels across [min_bound,max_bound]
+#  (2 bytes per value). Values are recovered to within half a level, e.g.
+#  1.5e-5 for the default bounds. -32768 marks missing (NaN) values.
+#
+#For on-disk archives, each subject's values may also be delta encoded along
+#the time axis before compression. Deltas are taken between the integer
+#representations of consecutive values, with wrap-around arithmetic, so delta
+#encoding is lossless for every storage type and only changes how well the
+#archive compresses. Archives are compressed .npz files holding the encoded
+#array and a JSON header, and load_trajectory_archive decodes them back to
+#float64 arrays.
+
+import json
+import numpy
+
+STORAGE_DTYPES = ("float64","float32","int16")
+INT16_LEVELS = 32767
+INT16_MISSING = -32768
+ARCHIVE_FORMAT_VERSION = 1
+
+def check_storage_dtype(storage):
+    """Return storage as a name in STORAGE_DTYPES (None means float64)"""
+    if storage is None:
+        return "float64"
+    storage = numpy.dtype(storage).name
+    if storage not in STORAGE_DTYPES:
+        raise ValueError("storage dtype must be one of %s. Got: %s" %(", ".join(STORAGE_DTYPES),storage))
+    return storage
+
+def get_quantization(min_bound,max_bound):
+    """Return (center,scale) mapping [min_bound,max_bound] onto [-INT16_LEVELS,INT16_LEVELS]"""
+    if min_bound is None or max_bound is None:
+        raise ValueError("int16 storage requires finite min_bound and max_bound")
+    if not min_bound < max_bound:
+        raise ValueError("min_bound must be less than max_bound. Got: %s,%s" %(min_bound,max_bound))
+    center = (max_bound + min_bound) / 2.0
+    scale = INT16_LEVELS / ((max_bound - min_bound) / 2.0)
+    return center,scale
+
+def quantize(values,min_bound=-1.0,max_bound=1.0):
+    """Return values in [min_bound,max_bound] as an int16 array (NaN -> INT16_MISSING)"""
+    center,scale = get_quantization(min_bound,max_bound)
+    values = numpy.asarray(values,dtype=float)
+    missing = numpy.isnan(values)
+    levels = numpy.rint((numpy.where(missing,center,values) - center) * scale)
+    if numpy.abs(levels).max(initial=0) > INT16_LEVELS:
+        raise ValueError("int16 storage requires values within [%s,%s]. Got values from %s to %s"\
+          %(min_bound,max_bound,numpy.nanmin(values),numpy.nanmax(values)))
+    levels[missing] = INT16_MISSING
+    return levels.astype(numpy.int16)
+
+def dequantize(levels,min_bound=-1.0,max_bound=1.0):
+    """Return int16 levels from quantize() as a float64 array"""
+    center,scale = get_quantization(min_bound,max_bound)
+    levels = numpy.asarray(levels)
+    values = center + levels / scale
+    values[levels == INT16_MISSING] = numpy.nan
+    return values
+
+def encode_values(values,storage="float64",min_bound=-1.0,max_bound=1.0):
+    """Return values converted to a storage dtype
+
+    float64 values are returned without copying.
+    """
+    storage = check_storage_dtype(storage)
+    if storage == "int16":
+        return quantize(values,min_bound,max_bound)
+    return numpy.asarray(values,dtype=storage)
+
+def decode_values(encoded,min_bound=-1.0,max_bound=1.0):
+    """Return values from encode_values() as a float64 array"""
+    encoded = numpy.asarray(encoded)
+    if encoded.dtype == numpy.int16:
+        return dequantize(encoded,min_bound,max_bound)
+    return encoded.astype(float)
+
+def get_integer_view(encoded):
+    """Return an unsigned integer view of encoded with the same item size"""
+    return encoded.view("u%i" %encoded.dtype.itemsize)
+
+def delta_encode(encoded,axis=1):
+    """Return encoded with each value replaced by its difference from the previous value along axis
+
+    Differences are taken between integer representations with wrap-around,
+    so delta_decode() recovers encoded exactly, including float and NaN values.
+    """
+    encoded = numpy.ascontiguousarray(encoded)
+    integers = get_integer_view(encoded)
+    deltas = integers.copy()
+    if integers.shape[axis] > 1:
+        current = [slice(None)] * integers.ndim
+        previous = [slice(None)] * integers.ndim
+        current[axis] = slice(1,None)
+        previous[axis] = slice(None,-1)
+        deltas[tuple(current)] = integers[tuple(current)] - integers[tuple(previous)]
+    return deltas.view(encoded.dtype)
+
+def delta_decode(deltas,axis=1):
+    """Return the array that delta_encode() was called on"""
+    deltas = numpy.ascontiguousarray(deltas)
+    integers = get_integer_view(deltas)
+    return numpy.cumsum(integers,axis=axis,dtype=integers.dtype).view(deltas.dtype)
+
+def save_trajectory_archive(output_path,history,storage="int16",delta=True,\
+  min_bound=-1.0,max_bound=1.0,axis=1,compress=True,**metadata):
+    """Write a trajectory array to a compressed .npz archive
+
+    output_path -- path of the archive (numpy adds .npz if missing)
+    history -- e.g. a (n_subjects,n_timepoints,n_axes) array of coordinates
+    storage -- one of STORAGE_DTYPES
+    delta -- if True, delta encode values along axis (time) before compression
+    min_bound,max_bound -- the range of the coordinates (required for int16)
+    compress -- if False, the archive is written without zlib compression
+    metadata -- additional JSON-serializable values to store in the archive
+      header, e.g. subject_ids, treatments or axes
+
+    Returns the header dict that was written.
+    """
+    storage = check_storage_dtype(storage)
+    history = numpy.asarray(history,dtype=float)
+    encoded = encode_values(history,storage,min_bound,max_bound)
+    if delta:
+        encoded = delta_encode(encoded,axis)
+    header = dict(metadata)
+    header.update({"format_version":ARCHIVE_FORMAT_VERSION,"storage":storage,"delta":bool(delta),\
+      "axis":axis,"min_bound":min_bound,"max_bound":max_bound,"shape":list(history.shape)})
+    save = numpy.savez_compressed if compress else numpy.savez
+    save(output_path,trajectories=encoded,header=numpy.array(json.dumps(header)))
+    return header
+
+def load_trajectory_archive(archive_path):
+    """Return (history,header) from an archive written by save_trajectory_archive
+
+    history is decoded to a float64 array. Plain .npy arrays (e.g. written
+    with numpy.save) are also accepted, and returned with an empty header.
+    """
+    if archive_path.endswith(".npy"):
+        return numpy.load(archive_path).astype(float),{}
+    with numpy.load(archive_path) as archive:
+        header = json.loads(str(archive["header"]))
+        encoded = archive["trajectories"]
+    if header.get("format_version") != ARCHIVE_FORMAT_VERSION:
+        raise ValueError("Unsupported trajectory archive version: %s" %header.get("format_version"))
+    if header["delta"]:
+        encoded = delta_decode(encoded,header["axis"])
+    return decode_values(encoded,header["min_bound"],header["max_bound"]),header
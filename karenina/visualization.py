@@ -13,6 +13,9 @@ __status__ = "Development"
 
 from os.path import join,isdir,realpath,dirname
 from numpy import array
+import logging
+
+logger = logging.getLogger("karenina.visualization")
 
 def get_timeseries_data(individuals,axes=["x","y","z"]):
     results = []
@@ -73,8 +76,13 @@ def save_simulation_figure(individuals, output_folder,n_individuals,n_timepoints
 
 def save_simulation_movie(individuals, output_folder,\
      n_individuals,n_timepoints,\
-    black_background=True):
-    """Save an .ffmpg move of the simulated community change"""
+    black_background=True,data=None,colors=None):
+    """Save an .ffmpg move of the simulated community change
+
+    data,colors -- optionally, precomputed timeseries data (as from
+      get_timeseries_data) and colors per individual. If supplied,
+      individuals is ignored. Only the first three axes are plotted.
+    """
 
     #TODO: standardize these and put them up above
 
@@ -93,10 +101,12 @@ def save_simulation_movie(individuals, output_folder,\
     fig = plt.figure()
     ax = p3.Axes3D(fig)
 
-    data = get_timeseries_data(individuals)
-    colors = [i.BaseParams["color"] for i in individuals]
-    print("Individual colors:",colors)
-    print ("Movie raw data:",data)
+    if data is None:
+        data = get_timeseries_data(individuals)
+    if colors is None:
+        colors = [i.BaseParams["color"] for i in individuals]
+    logger.debug("Individual colors: %s",colors)
+    logger.debug("Movie raw data: %s",data)
     # NOTE: Can't pass empty arrays into 3d version of plot()
     linestyle = '-'
     pointstyle = 'o' #cheat to use lines to represent points
@@ -128,7 +138,7 @@ def save_simulation_movie(individuals, output_folder,\
         #Set 3d background grid color to a dull red
         new_grid_params = ax.w_xaxis._axinfo['grid']
         new_grid_params.update({'color': dull_red, 'linewidth':1.0})
-        print(new_grid_params)
+        logger.debug("3d grid params: %s",new_grid_params)
         ax.w_xaxis._axinfo.update({'grid' : new_grid_params})
         ax.w_yaxis._axinfo.update({'grid' : new_grid_params})
         ax.w_zaxis._axinfo.update({'grid' : new_grid_params})
@@ -162,3 +172,29 @@ def update_3d_plot(end_t,timeseries_data,ax,lines,points=None,start_t=0):
             point.set_3d_properties(data[2,end_t-1:end_t])
     rotation_speed = 0.5
     ax.view_init(30, rotation_speed * end_t)
+
+def save_power_curves(power_rows,output_path):
+    """Save a .pdf plot of power against n_individuals, one line per effect size
+
+    power_rows -- dicts from power_analysis.run_power_analysis
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(5, 4))
+    ax = fig.add_subplot(1,1,1)
+    effects = sorted(set(row["effect"] for row in power_rows))
+    for effect in effects:
+        rows = sorted([row for row in power_rows if row["effect"] == effect],key=lambda row: row["n_individuals"])
+        ns = [row["n_individuals"] for row in rows]
+        power = array([row["power"] for row in rows])
+        errors = array([[row["power"] - row["ci_low"] for row in rows],[row["ci_high"] - row["power"] for row in rows]])
+        ax.errorbar(ns,power,yerr=errors,marker="o",capsize=3,label="effect = %s" %effect)
+    ax.axhline(0.8,color="lightgray",linestyle="--")
+    ax.set_xlabel("Individuals per treatment")
+    ax.set_ylabel("Power")
+    ax.set_ylim((0.0,1.05))
+    ax.legend(loc="lower right",fontsize=8)
+    fig.savefig(output_path,bbox_inches='tight')
+    plt.close(fig)
@@ -0,0 +1,53 @@
+import skbio
+import qiime
+
+from ._format import SampleDistancesDirectoryFormat
+from karenina.distance_matrix import write_distance_matrix
+
+
+def distance_matrix(ordination: skbio.OrdinationResults,
+                    number_of_dimensions: int = 3,
+                    restrict_to: str = 'none',
+                    metadata: qiime.Metadata = None,
+                    subject_column: str = 'SubjectID',
+                    timepoint_column: str = 'Timepoint',
+                    dtype: str = 'float32') -> SampleDistancesDirectoryFormat:
+    """Euclidean distances between samples in the first dimensions of an ordination
+
+    Distances are written in blocks by karenina.distance_matrix straight into
+    the artifact's directory, as memory-mappable condensed vectors, so the
+    dense matrix is never built. With restrict_to 'timepoint' or 'subject',
+    only pairs of samples sharing a timepoint (or subject) in the metadata
+    are computed.
+    """
+    samples = ordination.samples
+    if number_of_dimensions > samples.shape[1]:
+        raise ValueError("The ordination has %i dimensions, but %i were requested"
+                         % (samples.shape[1], number_of_dimensions))
+    sample_ids = [str(sample_id) for sample_id in samples.index]
+    restriction = None if restrict_to == 'none' else restrict_to
+    subject_ids = timepoints = None
+    if restriction is not None:
+        if metadata is None:
+            raise ValueError("Restricting distances to within each %s requires "
+                             "metadata" % restriction)
+        column = {'timepoint': timepoint_column,
+                  'subject': subject_column}[restriction]
+        df = metadata.to_dataframe()
+        if column not in df.columns:
+            raise ValueError("No metadata column %s" % column)
+        missing = [s for s in sample_ids if s not in df.index]
+        if missing:
+            raise ValueError("%i ordination samples have no metadata, e.g. %s"
+                             % (len(missing), missing[0]))
+        labels = df.loc[sample_ids, column].astype(str).tolist()
+        if restriction == 'timepoint':
+            timepoints = labels
+        else:
+            subject_ids = labels
+    ff = SampleDistancesDirectoryFormat()
+    write_distance_matrix(samples.values[:, :number_of_dimensions], sample_ids,
+                          str(ff.path), restrict_to=restriction,
+                          subject_ids=subject_ids, timepoints=timepoints,
+                          dtype=dtype)
+    return ff
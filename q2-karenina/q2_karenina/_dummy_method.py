@@ -1,7 +0,0 @@
-# This file is only included as an example. Remove this file when you are
-# ready to develop your plugin.
-
-
-def concatenate_ints(ints1: list, ints2: list, ints3: list, int1: int,
-                     int2: int) -> list:
-    return ints1 + ints2 + ints3 + [int1] + [int2]
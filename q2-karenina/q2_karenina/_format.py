@@ -0,0 +1,101 @@
+import json
+
+import qiime.plugin.model as model
+
+from karenina.dispersion import DISPERSION_COLUMNS
+from karenina.distance_matrix import MANIFEST_FILENAME, SAMPLE_IDS_FILENAME
+
+
+OU_FIT_COLUMNS = ['SubjectID', 'Treatment', 'Axis', 'Sigma', 'Lambda',
+                  'Theta', 'nlogLik']
+NPY_MAGIC = b'\x93NUMPY'
+
+
+class TrajectoryArrayFormat(model.BinaryFileFormat):
+    """A .npy (n_subjects, n_timepoints, n_axes) float array"""
+
+    def sniff(self):
+        with self.open() as fh:
+            return fh.read(len(NPY_MAGIC)) == NPY_MAGIC
+
+
+class TrajectoryManifestFormat(model.TextFileFormat):
+    """JSON with subject_ids, treatments, times and axes of a trajectory array"""
+
+    def sniff(self):
+        with self.open() as fh:
+            try:
+                manifest = json.load(fh)
+            except ValueError:
+                return False
+        return set(['subject_ids', 'treatments', 'times', 'axes']) <= \
+            set(manifest)
+
+
+class TrajectoryDirectoryFormat(model.DirectoryFormat):
+    history = model.File('trajectories.npy', format=TrajectoryArrayFormat)
+    manifest = model.File('manifest.json', format=TrajectoryManifestFormat)
+
+
+class DistanceManifestFormat(model.TextFileFormat):
+    """JSON manifest of a karenina.distance_matrix condensed distance matrix"""
+
+    def sniff(self):
+        with self.open() as fh:
+            try:
+                manifest = json.load(fh)
+            except ValueError:
+                return False
+        return manifest.get('format') == 'condensed' and \
+            set(['dtype', 'n_samples', 'groups']) <= set(manifest)
+
+
+class SampleIdsFormat(model.TextFileFormat):
+    """One sample id per line, in distance matrix order"""
+
+    def sniff(self):
+        return True
+
+
+class CondensedDistancesFormat(TrajectoryArrayFormat):
+    """A .npy condensed distance vector of one group of samples"""
+
+
+class SampleDistancesDirectoryFormat(model.DirectoryFormat):
+    """An on-disk distance matrix written by karenina.distance_matrix
+
+    Each group's distances are a memory-mappable .npy file, so matrices
+    too large for a dense skbio.DistanceMatrix can be stored and read back
+    with karenina.distance_matrix.OnDiskDistanceMatrix.
+    """
+    manifest = model.File(MANIFEST_FILENAME, format=DistanceManifestFormat)
+    sample_ids = model.File(SAMPLE_IDS_FILENAME, format=SampleIdsFormat)
+    groups = model.FileCollection(r'.+\.npy', format=CondensedDistancesFormat)
+
+    @groups.set_path_maker
+    def groups_path_maker(self, name):
+        return '%s.npy' % name
+
+
+class _TableFormat(model.TextFileFormat):
+    """A tab-delimited table whose header starts with Columns"""
+    Columns = []
+
+    def sniff(self):
+        with self.open() as fh:
+            header = fh.readline().rstrip('\n').split('\t')
+        return header[:len(self.Columns)] == self.Columns
+
+
+class OUFitsFormat(_TableFormat):
+    Columns = OU_FIT_COLUMNS
+
+
+class DispersionFormat(_TableFormat):
+    Columns = DISPERSION_COLUMNS
+
+
+OUFitsDirectoryFormat = model.SingleFileDirectoryFormat(
+    'OUFitsDirectoryFormat', 'ou_fits.tsv', OUFitsFormat)
+DispersionDirectoryFormat = model.SingleFileDirectoryFormat(
+    'DispersionDirectoryFormat', 'dispersion.tsv', DispersionFormat)
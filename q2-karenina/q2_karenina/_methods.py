@@ -0,0 +1,145 @@
+import numpy
+import skbio
+import qiime
+import pandas as pd
+
+from ._trajectories import TrajectoryData, trajectories_from_samples
+from ._format import OU_FIT_COLUMNS
+from karenina.experiment import Experiment
+from karenina.perturbation import Perturbation
+from karenina.ou_likelihood import fit_OU_ar1, fit_OU_exact, fit_OU_pooled_by_group
+from karenina.dispersion import get_dispersion_metrics, DISPERSION_COLUMNS
+
+
+def simulate(n_individuals: int = 10, n_timepoints: int = 50,
+             perturbation_timepoint: int = 25,
+             perturbation_duration: int = 10,
+             base_lambda: float = 0.2, base_delta: float = 0.25,
+             perturbation_parameter: str = 'lambda',
+             perturbation_value: float = 0.0,
+             perturbation_mode: str = 'replace',
+             number_of_dimensions: int = 3,
+             interindividual_variation: float = 0.01,
+             seed: int = 0, n_jobs: int = 1) -> (TrajectoryData,
+                                                 skbio.OrdinationResults):
+    """Simulate a control and a perturbed treatment of OU individuals
+
+    Individuals are simulated in worker processes by
+    karenina.experiment.Experiment.simulate_parallel, and their histories
+    are returned as one array. Both treatments draw their start coordinates
+    from one RandomState, so they start from different positions.
+    """
+    if not 0 <= perturbation_timepoint < n_timepoints:
+        raise ValueError("The perturbation timepoint must be in 0-%i. Got: %i"
+                         % (n_timepoints - 1, perturbation_timepoint))
+    axes = ['PC%i' % (i + 1) for i in range(number_of_dimensions)]
+    perturbation = Perturbation(perturbation_timepoint,
+                                perturbation_timepoint + perturbation_duration,
+                                {perturbation_parameter: perturbation_value},
+                                perturbation_mode, axes)
+    treatment_names = ['control', 'perturbed']
+    experiment = Experiment(treatment_names, [n_individuals] * 2, n_timepoints,
+                            {'lambda': base_lambda, 'delta': base_delta},
+                            [[], [perturbation]], interindividual_variation,
+                            axes=axes, engine='multivariate',
+                            random_state=numpy.random.RandomState(seed),
+                            collect_data=False)
+    experiment.simulate_parallel(n_jobs=n_jobs, seed=seed)
+    try:
+        history = numpy.concatenate(
+            [treatment['shared_history'].Array
+             for treatment in experiment.Treatments])
+    finally:
+        experiment.release_shared_arrays()
+    subject_ids = ['%s_%i' % (name, i) for name in treatment_names
+                   for i in range(n_individuals)]
+    treatments = [name for name in treatment_names
+                  for i in range(n_individuals)]
+    trajectories = TrajectoryData(history, subject_ids, treatments,
+                                  numpy.arange(n_timepoints + 1), axes)
+    return trajectories, trajectories.to_ordination()
+
+
+def ordination_trajectories(ordination: skbio.OrdinationResults,
+                            metadata: qiime.Metadata,
+                            subject_column: str = 'SubjectID',
+                            timepoint_column: str = 'Timepoint',
+                            treatment_column: str = 'Treatment',
+                            number_of_dimensions: int = 3) -> TrajectoryData:
+    """Collect each subject's positions in an ordination into trajectories"""
+    samples = ordination.samples
+    if number_of_dimensions > samples.shape[1]:
+        raise ValueError("The ordination has %i dimensions, but %i were requested"
+                         % (samples.shape[1], number_of_dimensions))
+    df = metadata.to_dataframe()
+    for column in (subject_column, timepoint_column, treatment_column):
+        if column not in df.columns:
+            raise ValueError("No metadata column %s" % column)
+    sample_ids = [s for s in samples.index if s in df.index]
+    if not sample_ids:
+        raise ValueError("No ordination samples have metadata")
+    df = df.loc[sample_ids]
+    try:
+        times = df[timepoint_column].astype(float).values
+    except ValueError as e:
+        raise ValueError("Timepoints must be numeric: %s" % e)
+    coords = samples.loc[sample_ids].values[:, :number_of_dimensions]
+    axes = [str(a) for a in samples.columns[:number_of_dimensions]]
+    return trajectories_from_samples(coords,
+                                     df[subject_column].astype(str).tolist(),
+                                     times,
+                                     df[treatment_column].astype(str).tolist(),
+                                     axes)
+
+
+def _fit_series(series, times):
+    """Return an (n_series, 4) array of OU fits of NaN-padded series"""
+    dts = numpy.diff(times)
+    complete = not numpy.isnan(series).any()
+    if complete and len(dts) and numpy.allclose(dts, dts[0]):
+        return fit_OU_ar1(series, dt=dts[0])
+    return numpy.array([fit_OU_exact(x, times) for x in series])
+
+
+def fit_ou(trajectories: TrajectoryData,
+           pooled: bool = False) -> pd.DataFrame:
+    """Fit Sigma, Lambda and Theta to every subject on every axis
+
+    If pooled, subjects of a treatment share Sigma, Lambda and Theta, and
+    there is one row per treatment and axis (with SubjectID 'all').
+    """
+    history = trajectories.History
+    times = trajectories.Times
+    rows = []
+    for a, axis in enumerate(trajectories.Axes):
+        series = numpy.asarray(history[:, :, a], dtype=float)
+        if pooled:
+            results = fit_OU_pooled_by_group(list(series),
+                                             [times] * len(series),
+                                             trajectories.Treatments)
+            for treatment in sorted(results):
+                rows.append(['all', treatment, axis] + list(results[treatment]))
+            continue
+        fits = _fit_series(series, times)
+        for subject_id, treatment, fit in zip(trajectories.SubjectIDs,
+                                              trajectories.Treatments, fits):
+            rows.append([subject_id, treatment, axis] + list(fit))
+    return pd.DataFrame(rows, columns=OU_FIT_COLUMNS)
+
+
+def dispersion(trajectories: TrajectoryData) -> pd.DataFrame:
+    """Dispersion of each treatment at each timepoint (see karenina.dispersion)"""
+    history = trajectories.History
+    treatments = numpy.asarray(trajectories.Treatments)
+    rows = []
+    for treatment in sorted(set(trajectories.Treatments)):
+        in_treatment = numpy.nonzero(treatments == treatment)[0]
+        for t, time in enumerate(trajectories.Times):
+            coords = numpy.asarray(history[in_treatment, t], dtype=float)
+            coords = coords[~numpy.isnan(coords).any(axis=1)]
+            if len(coords) == 0:
+                continue
+            row = {'Treatment': treatment, 'Timepoint': time}
+            row.update(get_dispersion_metrics(coords))
+            rows.append(row)
+    return pd.DataFrame(rows, columns=DISPERSION_COLUMNS)
@@ -0,0 +1,89 @@
+import numpy
+import skbio
+import pandas as pd
+
+
+class TrajectoryData(object):
+    """Positions of individuals over time, held as one array
+
+    history -- (n_subjects, n_timepoints, n_axes) array of positions. Subjects
+      not sampled at a timepoint have NaN positions.
+    subject_ids, treatments -- the id and treatment of each subject
+    times -- the time of each timepoint
+    axes -- the name of each axis
+
+    Artifacts store history as a .npy file, which is memory-mapped when
+    loaded, so large cohorts pass between methods without being parsed.
+    """
+
+    def __init__(self, history, subject_ids, treatments, times, axes):
+        self.History = history
+        self.SubjectIDs = [str(s) for s in subject_ids]
+        self.Treatments = [str(t) for t in treatments]
+        self.Times = numpy.asarray(times, dtype=float)
+        self.Axes = [str(a) for a in axes]
+        expected_shape = (len(self.SubjectIDs), len(self.Times), len(self.Axes))
+        if numpy.shape(history) != expected_shape:
+            raise ValueError("Trajectory history has shape %s, but %i subjects, "
+                             "%i timepoints and %i axes were given"
+                             % ((str(numpy.shape(history)),) + expected_shape))
+        if len(self.Treatments) != len(self.SubjectIDs):
+            raise ValueError("Got %i subjects but %i treatments"
+                             % (len(self.SubjectIDs), len(self.Treatments)))
+
+    def get_manifest(self):
+        """Return a JSON-serializable dict of everything except history"""
+        return {'subject_ids': self.SubjectIDs, 'treatments': self.Treatments,
+                'times': self.Times.tolist(), 'axes': self.Axes}
+
+    def get_sample_ids(self):
+        """Return (sample_ids, subject_indices, time_indices) of observed samples"""
+        observed = ~numpy.isnan(self.History).any(axis=2)
+        subject_indices, time_indices = numpy.nonzero(observed)
+        sample_ids = ['%s.%s' % (self.SubjectIDs[i], _format_time(self.Times[t]))
+                      for i, t in zip(subject_indices, time_indices)]
+        return sample_ids, subject_indices, time_indices
+
+    def to_ordination(self):
+        """Return an skbio.OrdinationResults with one sample per subject x timepoint"""
+        sample_ids, subject_indices, time_indices = self.get_sample_ids()
+        coords = numpy.asarray(self.History[subject_indices, time_indices])
+        samples = pd.DataFrame(coords, index=sample_ids, columns=self.Axes)
+        variance = coords.var(axis=0, ddof=1) if len(coords) > 1 \
+            else numpy.zeros(len(self.Axes))
+        eigvals = pd.Series(variance, index=self.Axes)
+        total = variance.sum()
+        proportion = pd.Series(variance / total if total > 0 else variance,
+                               index=self.Axes)
+        return skbio.OrdinationResults(
+            short_method_name='karenina',
+            long_method_name='karenina simulated trajectories',
+            eigvals=eigvals, samples=samples,
+            proportion_explained=proportion)
+
+
+def _format_time(time):
+    """Return a time as an integer string where possible"""
+    return str(int(time)) if float(time).is_integer() else repr(float(time))
+
+
+def trajectories_from_samples(coords, subject_ids, times, treatments, axes):
+    """Return TrajectoryData from per-sample positions
+
+    coords -- (n_samples, n_axes) array of positions
+    subject_ids, times, treatments -- the subject, time and treatment of each sample
+    Subjects are padded with NaN at timepoints where they were not sampled.
+    """
+    coords = numpy.asarray(coords, dtype=float)
+    times = numpy.asarray(times, dtype=float)
+    subjects = sorted(set(subject_ids))
+    all_times = numpy.unique(times)
+    subject_index = dict((s, i) for i, s in enumerate(subjects))
+    rows = numpy.array([subject_index[s] for s in subject_ids], dtype=int)
+    columns = numpy.searchsorted(all_times, times)
+    history = numpy.full((len(subjects), len(all_times), coords.shape[1]),
+                         numpy.nan)
+    history[rows, columns] = coords
+    treatment_of = dict(zip(subject_ids, treatments))
+    return TrajectoryData(history, subjects, [treatment_of[s] for s in subjects],
+                          all_times, axes)
@@ -0,0 +1,57 @@
+import json
+
+import numpy
+import pandas as pd
+
+from .plugin_setup import plugin
+from ._format import (TrajectoryDirectoryFormat, OUFitsFormat, DispersionFormat,
+                      OU_FIT_COLUMNS)
+from ._trajectories import TrajectoryData
+from karenina.dispersion import DISPERSION_COLUMNS
+
+
+@plugin.register_transformer
+def _1(data: TrajectoryData) -> TrajectoryDirectoryFormat:
+    ff = TrajectoryDirectoryFormat()
+    numpy.save(str(ff.path / 'trajectories.npy'),
+               numpy.asarray(data.History, dtype=float))
+    with (ff.path / 'manifest.json').open('w') as fh:
+        json.dump(data.get_manifest(), fh)
+    return ff
+
+
+@plugin.register_transformer
+def _2(ff: TrajectoryDirectoryFormat) -> TrajectoryData:
+    with (ff.path / 'manifest.json').open() as fh:
+        manifest = json.load(fh)
+    # Memory-mapped: only the rows a method touches are read from disk
+    history = numpy.load(str(ff.path / 'trajectories.npy'), mmap_mode='r')
+    return TrajectoryData(history, manifest['subject_ids'],
+                          manifest['treatments'], manifest['times'],
+                          manifest['axes'])
+
+
+def _write_table(df, ff, columns):
+    df[columns].to_csv(str(ff), sep='\t', index=False)
+    return ff
+
+
+@plugin.register_transformer
+def _3(df: pd.DataFrame) -> OUFitsFormat:
+    return _write_table(df, OUFitsFormat(), OU_FIT_COLUMNS)
+
+
+@plugin.register_transformer
+def _4(ff: OUFitsFormat) -> pd.DataFrame:
+    return pd.read_csv(str(ff), sep='\t', dtype={'SubjectID': str,
+                                                 'Treatment': str})
+
+
+@plugin.register_transformer
+def _5(df: pd.DataFrame) -> DispersionFormat:
+    return _write_table(df, DispersionFormat(), DISPERSION_COLUMNS)
+
+
+@plugin.register_transformer
+def _6(ff: DispersionFormat) -> pd.DataFrame:
+    return pd.read_csv(str(ff), sep='\t', dtype={'Treatment': str})
@@ -0,0 +1,7 @@
+from qiime.plugin import SemanticType
+
+
+Trajectories = SemanticType('Trajectories')
+OUFits = SemanticType('OUFits')
+Dispersion = SemanticType('Dispersion')
+SampleDistances = SemanticType('SampleDistances')
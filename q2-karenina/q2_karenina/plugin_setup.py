@@ -1,12 +1,19 @@
+import importlib
+
 import qiime.plugin
+from qiime.plugin import Int, Float, Str, Bool, Choices
+from q2_types.ordination import PCoAResults
 
 import q2_karenina
-
-# These imports are only included to support the example methods and
-# visualizers. Remove these imports when you are ready to develop your plugin.
-from q2_dummy_types import IntSequence1, IntSequence2, Mapping
-from ._dummy_method import concatenate_ints
-from ._dummy_visualizer import mapping_viz
+from ._distance_matrix import distance_matrix
+from ._methods import simulate, ordination_trajectories, fit_ou, dispersion
+from ._type import Trajectories, OUFits, Dispersion, SampleDistances
+from ._format import (TrajectoryArrayFormat, TrajectoryManifestFormat,
+                      TrajectoryDirectoryFormat, OUFitsFormat,
+                      OUFitsDirectoryFormat, DispersionFormat,
+                      DispersionDirectoryFormat, DistanceManifestFormat,
+                      SampleIdsFormat, CondensedDistancesFormat,
+                      SampleDistancesDirectoryFormat)
 
 plugin = qiime.plugin.Plugin(
     name='karenina',
@@ -23,40 +30,131 @@ plugin = qiime.plugin.Plugin(
     citation_text=None
 )
 
-# The next two code blocks are examples of how to register methods and
-# visualizers. Replace them with your own registrations when you are ready to
-# develop your plugin.
+plugin.register_semantic_types(Trajectories, OUFits, Dispersion,
+                               SampleDistances)
+plugin.register_formats(TrajectoryArrayFormat, TrajectoryManifestFormat,
+                        TrajectoryDirectoryFormat, OUFitsFormat,
+                        OUFitsDirectoryFormat, DispersionFormat,
+                        DispersionDirectoryFormat, DistanceManifestFormat,
+                        SampleIdsFormat, CondensedDistancesFormat,
+                        SampleDistancesDirectoryFormat)
+# Trajectories are stored as a .npy array, so large cohorts move between
+# methods without being written out and parsed as text.
+plugin.register_semantic_type_to_format(
+    Trajectories, artifact_format=TrajectoryDirectoryFormat)
+plugin.register_semantic_type_to_format(
+    OUFits, artifact_format=OUFitsDirectoryFormat)
+plugin.register_semantic_type_to_format(
+    Dispersion, artifact_format=DispersionDirectoryFormat)
+# Distances between every sample can outgrow a dense DistanceMatrix, so they
+# stay in karenina.distance_matrix's memory-mappable on-disk layout.
+plugin.register_semantic_type_to_format(
+    SampleDistances, artifact_format=SampleDistancesDirectoryFormat)
 
 plugin.methods.register_function(
-    function=concatenate_ints,
+    function=distance_matrix,
     inputs={
-        'ints1': IntSequence1 | IntSequence2,
-        'ints2': IntSequence1,
-        'ints3': IntSequence2
+        'ordination': PCoAResults
     },
     parameters={
-        'int1': qiime.plugin.Int,
-        'int2': qiime.plugin.Int
+        'number_of_dimensions': Int,
+        'restrict_to': Str % Choices({'none', 'timepoint', 'subject'}),
+        'metadata': qiime.plugin.Metadata,
+        'subject_column': Str,
+        'timepoint_column': Str,
+        'dtype': Str % Choices({'float32', 'float64'})
     },
     outputs=[
-        ('concatenated_ints', IntSequence1)
+        ('distance_matrix', SampleDistances)
     ],
-    name='Concatenate integers',
-    description='This method concatenates integers into a single sequence in '
-                'the order they are provided.'
+    name='Ordination distance matrix',
+    description='This method computes Euclidean distances between samples '
+                'in the first dimensions of an ordination (e.g. simulated '
+                'karenina coordinates) in blocks, and stores them on disk as '
+                'memory-mappable condensed vectors. Distances may be '
+                'restricted to pairs of samples sharing a timepoint or '
+                'subject in the metadata.'
 )
 
-plugin.visualizers.register_function(
-    function=mapping_viz,
+plugin.methods.register_function(
+    function=simulate,
+    inputs={},
+    parameters={
+        'n_individuals': Int,
+        'n_timepoints': Int,
+        'perturbation_timepoint': Int,
+        'perturbation_duration': Int,
+        'base_lambda': Float,
+        'base_delta': Float,
+        'perturbation_parameter': Str % Choices({'lambda', 'delta', 'mu'}),
+        'perturbation_value': Float,
+        'perturbation_mode': Str % Choices({'replace', 'add', 'multiply'}),
+        'number_of_dimensions': Int,
+        'interindividual_variation': Float,
+        'seed': Int,
+        'n_jobs': Int
+    },
+    outputs=[
+        ('trajectories', Trajectories),
+        ('ordination', PCoAResults)
+    ],
+    name='Simulate an experiment',
+    description='This method simulates control and perturbed individuals as '
+                'Ornstein-Uhlenbeck processes, returning their trajectories '
+                'and an ordination of every individual at every timepoint.'
+)
+
+plugin.methods.register_function(
+    function=ordination_trajectories,
     inputs={
-        'mapping1': Mapping,
-        'mapping2': Mapping
+        'ordination': PCoAResults
     },
     parameters={
-        'key_label': qiime.plugin.Str,
-        'value_label': qiime.plugin.Str
+        'metadata': qiime.plugin.Metadata,
+        'subject_column': Str,
+        'timepoint_column': Str,
+        'treatment_column': Str,
+        'number_of_dimensions': Int
     },
-    name='Visualize two mappings',
-    description='This visualizer produces an HTML visualization of two '
-                'key-value mappings, each sorted in alphabetical order by key.'
+    outputs=[
+        ('trajectories', Trajectories)
+    ],
+    name='Ordination trajectories',
+    description='This method collects the positions of each subject in the '
+                'first dimensions of an ordination into timeseries, using '
+                'subject, timepoint and treatment metadata columns.'
 )
+
+plugin.methods.register_function(
+    function=fit_ou,
+    inputs={
+        'trajectories': Trajectories
+    },
+    parameters={
+        'pooled': Bool
+    },
+    outputs=[
+        ('ou_fits', OUFits)
+    ],
+    name='Fit Ornstein-Uhlenbeck models',
+    description='This method fits Sigma, Lambda and Theta of an '
+                'Ornstein-Uhlenbeck process to every subject on every axis, '
+                'or jointly to all subjects of each treatment.'
+)
+
+plugin.methods.register_function(
+    function=dispersion,
+    inputs={
+        'trajectories': Trajectories
+    },
+    parameters={},
+    outputs=[
+        ('dispersion', Dispersion)
+    ],
+    name='Dispersion',
+    description='This method computes the centroid distance, mean pairwise '
+                'distance and variance of each treatment at each timepoint, '
+                'to test whether perturbed subjects are more dispersed.'
+)
+
+importlib.import_module('q2_karenina._transformer')
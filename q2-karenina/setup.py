@@ -14,11 +14,8 @@ setup(
     name="q2-karenina",
     version=version,
     packages=find_packages(),
-    # pandas and q2-dummy-types are only required for the dummy methods and
-    # visualizers provided as examples. Remove these dependencies when you're
-    # ready to develop your plugin, and add your own dependencies (if there are
-    # any).
-    install_requires=['qiime >= 2.0.0', 'pandas', 'q2-dummy-types'],
+    install_requires=['qiime >= 2.0.0', 'pandas', 'numpy', 'q2-types',
+                      'scikit-bio'],
     author="Jesse Zaneveld",
     author_email="zaneveld@gmail.com",
     description="Simulation and fitting for Anna Karenina effects in animal microbiomes. ",
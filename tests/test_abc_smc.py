@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.abc_smc import make_abc_model,get_summary_statistics,simulate_candidates,\
+  simulate_statistics,run_abc_smc,get_posterior_summary,format_posterior_table,\
+  format_generation_table,parse_priors,get_weighted_quantiles
+from numpy import abs,array,diff,ones,zeros
+from numpy.random import RandomState
+import numpy.testing as npt
+
+"""
+Tests for abc_smc.py
+"""
+
+class TestABCSMC(unittest.TestCase):
+    """Tests of ABC-SMC inference"""
+
+    def setUp(self):
+        self.Priors = {"lambda":(0.0,1.0),"delta":(0.01,1.0)}
+        template = make_abc_model(zeros((30,25)),self.Priors)
+        self.Observed = simulate_candidates(template,[[0.3,0.6]],seed=5)[0]
+        self.Model = make_abc_model(self.Observed,self.Priors)
+
+    def test_summary_statistics_batched(self):
+        """Statistics of a batch of candidates equal those of each candidate alone"""
+        series = RandomState(0).normal(size=(3,30,25))
+        batched = get_summary_statistics(self.Model,series)
+        self.assertEqual(batched.shape,(3,4 * 4 + 1))
+        for i in range(3):
+            npt.assert_allclose(batched[i],get_summary_statistics(self.Model,series[i:i+1])[0])
+
+    def test_simulate_candidates(self):
+        """Simulations start at the observed values, respect bounds and apply perturbations"""
+        series = simulate_candidates(self.Model,[[0.3,0.9],[0.1,0.2]],seed=1)
+        self.assertEqual(series.shape,(2,30,25))
+        npt.assert_array_equal(series[:,:,0],[self.Observed[:,0]]*2)
+        self.assertTrue(abs(series).max() <= 1.0)
+        self.assertTrue((abs(series[0]) == 1.0).any())
+        npt.assert_array_equal(series,simulate_candidates(self.Model,[[0.3,0.9],[0.1,0.2]],seed=1))
+        model = make_abc_model(zeros((5,20)),{"perturbation_mu":(-1.0,1.0)},perturbation_windows=[(8,12)],\
+          fixed_params={"lambda":1.0,"delta":0.01})
+        series = simulate_candidates(model,[[0.8]],seed=0)[0]
+        npt.assert_allclose(series[:,8:13],0.8,atol=0.01)
+        npt.assert_allclose(series[:,14:],0.0,atol=0.01)
+
+    def test_recovers_parameters(self):
+        """The posterior of clamped data concentrates around the simulated parameters"""
+        result = run_abc_smc(self.Model,n_particles=200,n_generations=5,batch_size=500,seed=1)
+        epsilons = [row["epsilon"] for row in result["generations"]]
+        self.assertTrue((diff(epsilons) < 0).all())
+        self.assertAlmostEqual(result["weights"].sum(),1.0)
+        summary = dict((row["parameter"],row) for row in get_posterior_summary(result))
+        self.assertTrue(abs(summary["delta"]["mean"] - 0.6) < 0.1)
+        for name,truth in (("lambda",0.3),("delta",0.6)):
+            self.assertTrue(summary[name]["q0.025"] < truth < summary[name]["q0.975"])
+        self.assertTrue(summary["delta"]["sd"] < 0.15)
+        self.assertTrue(result["generations"][-1]["candidates_per_second"] > 0)
+
+    def test_independent_of_n_jobs(self):
+        """Results depend on seed and batch size, not on the number of workers"""
+        serial = run_abc_smc(self.Model,n_particles=30,n_generations=2,batch_size=40,seed=3)
+        parallel = run_abc_smc(self.Model,n_particles=30,n_generations=2,batch_size=40,n_jobs=2,seed=3)
+        npt.assert_array_equal(serial["particles"],parallel["particles"])
+        statistics = simulate_statistics(self.Model,array([[0.3,0.6]]*5),batch_size=2,random_state=0)
+        self.assertEqual(statistics.shape,(5,17))
+
+    def test_tables_and_errors(self):
+        """Output tables have headers, and invalid models raise ValueErrors"""
+        result = run_abc_smc(self.Model,n_particles=20,n_generations=2,batch_size=40,seed=0)
+        self.assertEqual(format_posterior_table(get_posterior_summary(result))[0].split("\t")[0],"parameter")
+        self.assertEqual(len(format_generation_table(result["generations"])),3)
+        self.assertEqual(parse_priors("lambda:0:1,perturbation_mu:-1:1"),\
+          {"lambda":(0.0,1.0),"perturbation_mu":(-1.0,1.0)})
+        self.assertRaises(ValueError,make_abc_model,self.Observed,{"kappa":(0,1)})
+        self.assertRaises(ValueError,make_abc_model,self.Observed,{"delta":(1,0)})
+        self.assertRaises(ValueError,make_abc_model,self.Observed[:,:2],self.Priors)
+        self.assertRaises(ValueError,run_abc_smc,self.Model,alpha=1.5)
+        npt.assert_allclose(get_weighted_quantiles(array([1.0,2.0,3.0]),ones(3) / 3,[0.5]),[2.0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.bootstrap import is_regular,simulate_ou_replicates,fit_replicates,\
+  bootstrap_fit,bootstrap_cohort,convert_fit_timeseries_params
+from numpy import arange,array,exp,sqrt,var,mean,cumsum
+from numpy.random import RandomState
+import numpy.testing as npt
+
+"""
+Tests for bootstrap.py
+"""
+
+class TestBootstrap(unittest.TestCase):
+    """Tests of parametric bootstrap intervals for OU fits"""
+
+    def setUp(self):
+        self.times = arange(60)
+        self.x = simulate_ou_replicates(0.2,0.3,0.1,self.times,0.1,1,random_state=0)[0]
+
+    def test_is_regular(self):
+        """Equally spaced times are regular"""
+        self.assertTrue(is_regular([0,2,4,6]))
+        self.assertFalse(is_regular([0,1,3]))
+
+    def test_simulate_ou_replicates_moments(self):
+        """Replicates have the exact OU transition mean and variance"""
+        replicates = simulate_ou_replicates(0.2,0.5,1.0,[0.0,2.0],0.0,20000,random_state=1)
+        self.assertEqual(replicates.shape,(20000,2))
+        npt.assert_array_equal(replicates[:,0],0.0)
+        self.assertAlmostEqual(mean(replicates[:,1]),1.0 - exp(-1.0),delta=0.01)
+        self.assertAlmostEqual(var(replicates[:,1]),0.04*(1.0-exp(-2.0))/1.0,delta=0.002)
+
+    def test_fit_replicates_irregular(self):
+        """Irregularly sampled replicates are fitted one by one"""
+        times = array([0.0,0.5,2.0,2.5,4.0,7.0])
+        replicates = simulate_ou_replicates(0.2,0.3,0.0,times,0.0,3,random_state=2)
+        fits = fit_replicates(replicates,times)
+        self.assertEqual(fits.shape,(3,4))
+
+    def test_bootstrap_fit_contains_truth(self):
+        """Intervals bracket the estimates and the true parameters of a long series"""
+        x = simulate_ou_replicates(0.2,0.3,0.1,arange(400),0.1,1,random_state=3)[0]
+        result = bootstrap_fit(x,arange(400),n_replicates=500,random_state=4)
+        for name,truth in (("Sigma",0.2),("Lambda",0.3),("Theta",0.1)):
+            estimate,low,high = result[name]
+            self.assertTrue(low <= estimate <= high)
+            self.assertTrue(low <= truth <= high)
+
+    def test_bootstrap_fit_reproducible(self):
+        """Seeded bootstraps repeat, and given params are used as estimates"""
+        first = bootstrap_fit(self.x,self.times,params=(0.2,0.3,0.1),n_replicates=50,random_state=5)
+        second = bootstrap_fit(self.x,self.times,params=(0.2,0.3,0.1),n_replicates=50,random_state=5)
+        self.assertEqual(first,second)
+        self.assertEqual(first["Lambda"][0],0.3)
+        self.assertRaises(ValueError,bootstrap_fit,self.x[:2],self.times[:2])
+
+    def test_convert_fit_timeseries_params(self):
+        """Converted fit_timeseries estimates give the same AR(1) process"""
+        Sigma,Lambda,Theta = convert_fit_timeseries_params((0.5,0.2,0.1),1.0)
+        self.assertAlmostEqual(exp(-Lambda),0.8)
+        self.assertAlmostEqual(Sigma**2 / (2.0 * Lambda),0.25**2 / (1.0 - 0.8**2))
+        self.assertEqual(Theta,0.1)
+        self.assertRaises(ValueError,convert_fit_timeseries_params,(0.5,1.5,0.1),1.0)
+        result = bootstrap_fit(self.x,self.times,params=(0.5,0.2,0.1),n_replicates=50,\
+          random_state=5,convention="fit_timeseries")
+        self.assertAlmostEqual(result["Lambda"][0],Lambda)
+        self.assertRaises(ValueError,bootstrap_fit,self.x,self.times,(0.5,0.2,0.1),\
+          convention="exact")
+        self.assertRaises(ValueError,bootstrap_fit,self.x[:5],[0,1,3,4,6],(0.5,0.2,0.1),\
+          convention="fit_timeseries")
+
+    def test_bootstrap_fit_reports_simulated_theta(self):
+        """Without reversion, the mean that was simulated around is reported as Theta"""
+        x = cumsum(RandomState(6).normal(0.0,0.1,60))
+        result = bootstrap_fit(x,self.times,params=(0.1,0.0,float("nan")),n_replicates=20,random_state=7)
+        self.assertAlmostEqual(result["Theta"][0],mean(x))
+
+    def test_bootstrap_cohort(self):
+        """Cohort results do not depend on n_jobs"""
+        series = [self.x,self.x[:30],self.x[10:]]
+        times = [self.times,self.times[:30],self.times[10:]]
+        serial = bootstrap_cohort(series,times,n_replicates=50,seed=0)
+        parallel = bootstrap_cohort(series,times,n_replicates=50,n_jobs=2,seed=0)
+        self.assertEqual(len(serial),3)
+        self.assertEqual(serial,parallel)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.change_point import get_change_point_scores,detect_change_points,\
+  detect_cohort_change_points,detect_group_change_points,get_subject_series,\
+  align_subject_series,format_change_point_table
+from karenina.bootstrap import simulate_ou_replicates
+from numpy import arange,array,hstack,log,pi,polyfit,polyval,isnan,nan
+from numpy.random import RandomState
+import numpy.testing as npt
+
+"""
+Tests for change_point.py
+"""
+
+def simulate_shifted_series(n_series,n_timepoints,onset,theta_after,seed=0):
+    """Return OU series whose Theta shifts from 0 to theta_after at onset"""
+    random_state = RandomState(seed)
+    before = simulate_ou_replicates(0.1,0.5,0.0,arange(onset + 1.0),0.0,n_series,random_state)
+    after = array([simulate_ou_replicates(0.1,0.5,theta_after,arange(n_timepoints - onset + 0.0),\
+      x0,1,random_state)[0] for x0 in before[:,-1]])
+    return hstack([before,after[:,1:]])
+
+def get_reference_nlogLik(x_prev,x_next):
+    """Return the maximized AR(1) negative log likelihood by least squares"""
+    slope,intercept = polyfit(x_prev,x_next,1)
+    residual_variance = ((x_next - polyval([slope,intercept],x_prev))**2).mean()
+    return 0.5 * len(x_prev) * (log(2*pi) + log(residual_variance) + 1.0)
+
+class TestChangePoint(unittest.TestCase):
+    """Tests of change-point detection"""
+
+    def setUp(self):
+        self.x = simulate_shifted_series(50,40,25,0.8)
+
+    def test_scores_match_refitting(self):
+        """Cumulative-sum scores equal explicitly refitting each segment"""
+        x = self.x[0]
+        scores = get_change_point_scores(x,min_size=3)[0]
+        whole = get_reference_nlogLik(x[:-1],x[1:])
+        for k in (3,10,25,36):
+            expected = 2.0 * (whole - get_reference_nlogLik(x[:k],x[1:k+1]) - get_reference_nlogLik(x[k:-1],x[k+1:]))
+            self.assertAlmostEqual(scores[k],expected,places=6)
+        self.assertEqual(scores[2],-float("inf"))
+        self.assertEqual(scores[37],-float("inf"))
+
+    def test_detects_onset(self):
+        """Onsets of a shift in Theta are found in most series"""
+        onset_index,onset_time,score = detect_change_points(self.x,arange(40)*2.0)
+        self.assertTrue((abs(onset_index - 25) <= 2).mean() > 0.8)
+        npt.assert_array_equal(onset_time,onset_index*2.0)
+        self.assertTrue((score > 0).all())
+
+    def test_irregular_times_rejected(self):
+        """Unequally spaced timepoints are rejected"""
+        times = arange(40.0)
+        times[5] += 0.5
+        self.assertRaises(ValueError,detect_change_points,self.x,times)
+
+    def test_cohort_padding_and_parallel(self):
+        """Ragged series are padded, and results do not depend on n_jobs"""
+        series = [self.x[0],self.x[1][:30],self.x[2][:4]]
+        serial = detect_cohort_change_points(series,n_jobs=1,chunk_size=1)
+        parallel = detect_cohort_change_points(series,n_jobs=2,chunk_size=1)
+        for s,p in zip(serial,parallel):
+            npt.assert_array_equal(s,p)
+        self.assertEqual(serial[0][0],detect_change_points(self.x[0])[0][0])
+        self.assertEqual(serial[0][2],-1)
+        self.assertTrue(isnan(serial[2][2]))
+
+    def test_group_change_points(self):
+        """Pooling a group gives one sharper onset per group"""
+        flat = simulate_shifted_series(20,40,25,0.0,seed=1)
+        series = list(self.x[:20]) + list(flat)
+        results = detect_group_change_points(series,["shifted"]*20 + ["flat"]*20)
+        self.assertEqual(results["shifted"][0],25)
+        self.assertTrue(results["shifted"][2] > 10*results["flat"][2])
+
+    def test_get_subject_series(self):
+        """Samples are grouped by subject and ordered by time"""
+        coords = array([[1.0],[2.0],[3.0],[4.0]])
+        subjects,times,series = get_subject_series(coords,["b","a","b","a"],["2","1","1","0"])
+        self.assertEqual(subjects,["a","b"])
+        npt.assert_array_equal(times[0],[0.0,1.0])
+        npt.assert_array_equal(series[1],[[3.0],[1.0]])
+        lines = format_change_point_table([("a","x",array([3])[0],array([3.0])[0],1.5)])
+        self.assertEqual(lines[1],"a\tx\t3\t3.0\t1.5\n")
+
+    def test_align_subject_series(self):
+        """Subjects with missing timepoints are placed on the shared grid, not shifted"""
+        x = simulate_shifted_series(2,40,20,1.0,seed=3)
+        times = [arange(40.0),arange(40.0)[arange(40) != 5]]
+        series = [x[0][:,None],x[1][arange(40) != 5][:,None]]
+        grid,aligned = align_subject_series(times,series)
+        npt.assert_array_equal(grid,arange(40.0))
+        self.assertTrue(isnan(aligned[1,5,0]))
+        npt.assert_array_equal(aligned[1,6:,0],x[1,6:])
+        onset_index,onset_time,score = detect_cohort_change_points(aligned[:,:,0],grid)
+        npt.assert_array_equal(onset_time,[20.0,20.0])
+        self.assertRaises(ValueError,align_subject_series,[array([0.0,0.0])],[array([[1.0],[2.0]])])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+import random
+from os.path import join,exists
+from shutil import rmtree
+from tempfile import mkdtemp
+from karenina.experiment import Experiment
+from karenina.checkpoint import save_checkpoint,load_checkpoint
+import numpy
+import numpy.testing as npt
+
+"""
+Tests for checkpoint.py
+"""
+
+def make_experiment(seed):
+    """Return a small seeded two-treatment experiment"""
+    random.seed(seed)
+    numpy.random.seed(seed)
+    set_lambda_zero = {"start":2,"end":4,"params":{"lambda":0.0},\
+      "update_mode":"replace","axes":["x","y","z"]}
+    base_params = {"lambda":0.2,"delta":0.25,"interindividual_variation":0.01}
+    return Experiment(["control","destabilizing_treatment"],[3,3],6,\
+      base_params,[[],[set_lambda_zero]],0.01)
+
+def get_histories(experiment):
+    """Return all Process histories in an experiment as a list of lists"""
+    histories = []
+    for treatment in experiment.Treatments:
+        for subject in treatment["individuals"]:
+            for axis in sorted(subject.MovementProcesses.keys()):
+                histories.append(numpy.hstack(subject.MovementProcesses[axis].History).tolist())
+    return histories
+
+class TestCheckpoint(unittest.TestCase):
+    """Tests of checkpointing and resuming experiments"""
+
+    def setUp(self):
+        self.OutputDir = mkdtemp()
+        self.CheckpointPath = join(self.OutputDir,"checkpoint.pkl.gz")
+
+    def tearDown(self):
+        rmtree(self.OutputDir)
+
+    def test_save_and_load_checkpoint_roundtrip(self):
+        """load_checkpoint returns the saved experiment and timepoint"""
+        experiment = make_experiment(seed=1)
+        experiment.simulate_timesteps(0,2)
+        save_checkpoint(experiment,self.CheckpointPath,next_timepoint=2)
+        loaded,next_timepoint = load_checkpoint(self.CheckpointPath)
+        self.assertEqual(next_timepoint,2)
+        self.assertEqual(get_histories(loaded),get_histories(experiment))
+        self.assertEqual(loaded.Data,experiment.Data)
+
+    def test_checkpoint_interval_writes_file(self):
+        """simulate_timesteps writes a checkpoint at the requested interval"""
+        experiment = make_experiment(seed=2)
+        experiment.simulate_timesteps(0,3,checkpoint_path=self.CheckpointPath,\
+          checkpoint_interval=2)
+        self.assertTrue(exists(self.CheckpointPath))
+        loaded,next_timepoint = load_checkpoint(self.CheckpointPath)
+        #A final checkpoint is always written after the last timestep
+        self.assertEqual(next_timepoint,3)
+
+    def test_resume_is_bit_identical(self):
+        """A resumed experiment matches an uninterrupted one exactly"""
+        uninterrupted = make_experiment(seed=3)
+        uninterrupted.simulate_timesteps(0,6)
+
+        interrupted = make_experiment(seed=3)
+        interrupted.simulate_timesteps(0,3,checkpoint_path=self.CheckpointPath,\
+          checkpoint_interval=3)
+        #Scramble random state as a fresh process on a new node would
+        random.seed(12345)
+        numpy.random.seed(12345)
+        resumed,t_start = load_checkpoint(self.CheckpointPath)
+        self.assertEqual(t_start,3)
+        resumed.simulate_timesteps(t_start,6)
+
+        self.assertEqual(get_histories(resumed),get_histories(uninterrupted))
+        self.assertEqual(resumed.Data,uninterrupted.Data)
+
+    def test_invalid_checkpoint_interval(self):
+        """simulate_timesteps rejects non-positive checkpoint intervals"""
+        experiment = make_experiment(seed=4)
+        self.assertRaises(ValueError,experiment.simulate_timesteps,0,2,\
+          self.CheckpointPath,0)
+
+if __name__ == '__main__':
+    unittest.main()
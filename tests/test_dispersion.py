@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.dispersion import get_centroid_distances,iter_condensed_distance_blocks,\
+  get_mean_pairwise_distance,get_dispersion_metrics,get_dispersion_by_group,\
+  get_cohort_dispersion,DispersionSink,format_dispersion_table,parse_coordinates_table,\
+  get_ordination_dispersion
+from karenina.experiment import Experiment
+from scipy.spatial.distance import pdist
+from numpy import array,concatenate,sqrt
+from numpy.random import RandomState
+import numpy.testing as npt
+
+"""
+Tests for dispersion.py
+"""
+
+class TestDispersion(unittest.TestCase):
+    """Tests of dispersion metrics"""
+
+    def setUp(self):
+        self.coords = RandomState(0).normal(0,1,(50,3))
+
+    def test_condensed_blocks_match_pdist(self):
+        """Blocks of distances concatenate to pdist's condensed vector"""
+        for max_block_size in (1,7,60,10**6):
+            blocks = list(iter_condensed_distance_blocks(self.coords,max_block_size))
+            npt.assert_allclose(concatenate([b for start,b in blocks]),pdist(self.coords))
+            starts = [start for start,b in blocks]
+            self.assertEqual(starts[0],0)
+
+    def test_mean_pairwise_distance(self):
+        """Chunked mean pairwise distance matches pdist"""
+        self.assertAlmostEqual(get_mean_pairwise_distance(self.coords,max_block_size=100),\
+          pdist(self.coords).mean())
+
+    def test_get_dispersion_metrics(self):
+        """Metrics for a simple square of points"""
+        square = array([[1.0,1.0],[1.0,-1.0],[-1.0,1.0],[-1.0,-1.0]])
+        metrics = get_dispersion_metrics(square)
+        self.assertEqual(metrics["n_samples"],4)
+        self.assertAlmostEqual(metrics["centroid_distance"],sqrt(2))
+        self.assertAlmostEqual(metrics["mean_pairwise_distance"],(4*2.0+2*sqrt(8))/6.0)
+        self.assertAlmostEqual(metrics["variance"],8.0/3.0)
+        self.assertRaises(ValueError,get_dispersion_metrics,square[:0])
+
+    def test_get_dispersion_by_group(self):
+        """Samples are grouped by treatment and timepoint"""
+        rows = get_dispersion_by_group(self.coords[:6],["a","a","a","b","b","b"],[0,0,1,0,0,0])
+        self.assertEqual([(r["Treatment"],r["Timepoint"],r["n_samples"]) for r in rows],\
+          [("a",0,2),("a",1,1),("b",0,3)])
+
+    def test_get_cohort_dispersion(self):
+        """One row per timepoint of a cohort history"""
+        history = RandomState(1).normal(0,1,(10,4,2))
+        rows = get_cohort_dispersion(history,"control")
+        self.assertEqual(len(rows),4)
+        self.assertAlmostEqual(rows[2]["centroid_distance"],get_centroid_distances(history[:,2]).mean())
+
+    def test_dispersion_sink(self):
+        """A DispersionSink records metrics for each treatment and timepoint of an experiment"""
+        sink = DispersionSink()
+        params = {"lambda":0.2,"delta":0.25,"interindividual_variation":0.01}
+        experiment = Experiment(["control","treated"],[5,5],4,params,[[],[]],0.1,\
+          engine="multivariate",random_state=0,sinks=[sink],history_window=0)
+        experiment.simulate_timesteps(0,4,progress_interval=None)
+        self.assertEqual(len(sink.Rows),8)
+        self.assertEqual(sink.Rows[1]["Treatment"],"treated")
+        lines = format_dispersion_table(sink.Rows)
+        self.assertEqual(lines[0],"Treatment\tTimepoint\tn_samples\tcentroid_distance\tmean_pairwise_distance\tvariance\n")
+        self.assertTrue(lines[1].startswith("control\t0\t5\t"))
+
+    def test_ordination_dispersion(self):
+        """Real ordinations are grouped using metadata"""
+        coordinate_lines = ["#SampleID\tPC1\tPC2\n","s1\t0.0\t0.0\n","s2\t1.0\t0.0\n",\
+          "s3\t0.0\t2.0\n","s4\t0.0\t4.0\n","s5\t9.0\t9.0\n"]
+        metadata_lines = ["#SampleID\tTreatment\tTimepoint\n","s1\tcontrol\t1\n",\
+          "s2\tcontrol\t1\n","s3\tstress\t1\n","s4\tstress\t1\n"]
+        sample_ids,axes,coords,metadata = parse_coordinates_table(coordinate_lines)
+        self.assertEqual(axes,["PC1","PC2"])
+        self.assertEqual(coords.shape,(5,2))
+        rows = get_ordination_dispersion(coordinate_lines,metadata_lines)
+        self.assertEqual([(r["Treatment"],r["Timepoint"]) for r in rows],[("control",1.0),("stress",1.0)])
+        self.assertAlmostEqual(rows[0]["mean_pairwise_distance"],1.0)
+        self.assertAlmostEqual(rows[1]["mean_pairwise_distance"],2.0)
+
+    def test_ordination_dispersion_from_sink_table(self):
+        """Tables written by TSVFileSink carry their own treatment and timepoint columns"""
+        lines = ["SampleID\tSubjectID\tTreatment\tTimepoint\tx\ty\n",\
+          "Sa_0_t0\ta_0\ta\t0\t0.0\t0.0\n","Sa_1_t0\ta_1\ta\t0\t3.0\t4.0\n"]
+        rows = get_ordination_dispersion(lines)
+        self.assertEqual(len(rows),1)
+        self.assertAlmostEqual(rows[0]["mean_pairwise_distance"],5.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+import shutil
+from tempfile import mkdtemp
+from os.path import join,exists
+from karenina.distance_matrix import get_condensed_index,get_sample_groups,\
+  write_distance_matrix,OnDiskDistanceMatrix
+from scipy.spatial.distance import pdist,cdist,squareform
+from numpy import arange
+from numpy.random import RandomState
+import numpy.testing as npt
+
+"""
+Tests for distance_matrix.py
+"""
+
+class TestDistanceMatrix(unittest.TestCase):
+    """Tests of chunked on-disk distance matrices"""
+
+    def setUp(self):
+        self.output_dir = mkdtemp()
+        self.coords = RandomState(0).normal(0,1,(23,3))
+        self.sample_ids = ["s%i" %i for i in range(23)]
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_get_condensed_index(self):
+        """Condensed indices match scipy's squareform layout"""
+        dense = squareform(pdist(self.coords))
+        condensed = pdist(self.coords)
+        for i,j in [(0,1),(0,22),(5,3),(21,22)]:
+            self.assertEqual(condensed[get_condensed_index(i,j,23)],dense[i,j])
+
+    def test_write_condensed(self):
+        """Condensed output written in small blocks matches pdist"""
+        manifest = write_distance_matrix(self.coords,self.sample_ids,self.output_dir,\
+          dtype="float64",max_block_size=10)
+        self.assertEqual(manifest["groups"],[{"name":"all","start":0,"n_samples":23}])
+        matrix = OnDiskDistanceMatrix(self.output_dir)
+        npt.assert_allclose(matrix.get_condensed("all"),pdist(self.coords))
+        self.assertAlmostEqual(matrix.get_distance("s4","s9"),cdist(self.coords[4:5],self.coords[9:10])[0,0])
+        self.assertEqual(matrix.get_distance("s4","s4"),0.0)
+
+    def test_write_tiled(self):
+        """Tiled output reassembles to the dense matrix"""
+        write_distance_matrix(self.coords,self.sample_ids,self.output_dir,format="tiled",tile_size=5)
+        self.assertTrue(exists(join(self.output_dir,"all","tile_0_4.npy")))
+        self.assertFalse(exists(join(self.output_dir,"all","tile_4_0.npy")))
+        matrix = OnDiskDistanceMatrix(self.output_dir)
+        npt.assert_allclose(matrix.get_dense(),squareform(pdist(self.coords)),rtol=1e-6)
+        self.assertAlmostEqual(matrix.get_distance("s21","s2"),squareform(pdist(self.coords))[21,2],places=5)
+
+    def test_restrict_to_timepoint(self):
+        """Restricted matrices only hold pairs within each timepoint"""
+        timepoints = [i % 3 for i in range(23)]
+        manifest = write_distance_matrix(self.coords,self.sample_ids,self.output_dir,\
+          restrict_to="timepoint",timepoints=timepoints,dtype="float64")
+        self.assertEqual([g["name"] for g in manifest["groups"]],["timepoint_0","timepoint_1","timepoint_2"])
+        matrix = OnDiskDistanceMatrix(self.output_dir)
+        self.assertEqual(matrix.get_group_ids("timepoint_1"),["s%i" %i for i in range(1,23,3)])
+        npt.assert_allclose(matrix.get_condensed("timepoint_1"),pdist(self.coords[1::3]))
+        self.assertAlmostEqual(matrix.get_distance("s0","s3"),cdist(self.coords[0:1],self.coords[3:4])[0,0])
+        self.assertRaises(KeyError,matrix.get_distance,"s0","s1")
+
+    def test_get_sample_groups_validates(self):
+        """Restrictions need labels for every sample"""
+        self.assertRaises(ValueError,get_sample_groups,3,"timepoint")
+        self.assertRaises(ValueError,get_sample_groups,3,"subject",subject_ids=["a"])
+        self.assertRaises(ValueError,get_sample_groups,3,"treatment",subject_ids=["a"]*3)
+        self.assertRaises(ValueError,write_distance_matrix,self.coords,self.sample_ids,self.output_dir,format="dense")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.ensemble_statistics import RunningMoments,QuantileSketch,EnsembleStatisticsSink,\
+  format_ensemble_table,get_quantile_columns
+from karenina.experiment import Experiment
+from numpy import array,isnan,quantile,searchsorted,sort
+from numpy.random import RandomState
+import numpy.testing as npt
+
+"""
+Tests for ensemble_statistics.py
+"""
+
+class TestEnsembleStatistics(unittest.TestCase):
+    """Tests of streaming ensemble statistics"""
+
+    def setUp(self):
+        self.Values = RandomState(0).normal(1.0,2.0,size=(5000,2))
+
+    def test_running_moments_batches(self):
+        """Moments accumulated in uneven batches match numpy on all values"""
+        moments = RunningMoments(2)
+        for start,end in [(0,1),(1,2),(2,700),(700,701),(701,5000)]:
+            moments.update(self.Values[start:end])
+        self.assertEqual(moments.N,5000)
+        npt.assert_allclose(moments.Mean,self.Values.mean(axis=0))
+        npt.assert_allclose(moments.get_variance(),self.Values.var(axis=0,ddof=1))
+        npt.assert_array_equal(moments.Min,self.Values.min(axis=0))
+        npt.assert_array_equal(moments.Max,self.Values.max(axis=0))
+
+    def test_running_moments_merge(self):
+        """Merging two RunningMoments matches accumulating every value in one"""
+        first,second = RunningMoments(2),RunningMoments(2)
+        first.update(self.Values[:1234])
+        second.update(self.Values[1234:])
+        first.merge(second)
+        npt.assert_allclose(first.Mean,self.Values.mean(axis=0))
+        npt.assert_allclose(first.get_variance(),self.Values.var(axis=0,ddof=1))
+        self.assertTrue(isnan(RunningMoments(1).get_variance()[0]))
+
+    def test_sketch_exact_for_small_streams(self):
+        """Quantiles are exact while no more than sketch_size values have been added"""
+        sketch = QuantileSketch(2,sketch_size=300)
+        sketch.update(self.Values[:100])
+        sketch.update(self.Values[100:250])
+        quantiles = [0.0,0.1,0.5,0.9,1.0]
+        npt.assert_allclose(sketch.get_quantiles(quantiles),quantile(self.Values[:250],quantiles,axis=0))
+
+    def test_sketch_rank_error(self):
+        """Sketch quantiles of a large stream are within a small rank error"""
+        sketch = QuantileSketch(2,sketch_size=128)
+        for start in range(0,5000,37):
+            sketch.update(self.Values[start:start+37])
+        self.assertEqual(sketch.N,5000)
+        self.assertTrue(sum(level.shape[0] for level in sketch.Levels) < 128 * len(sketch.Levels))
+        quantiles = [0.05,0.25,0.5,0.75,0.95]
+        estimates = sketch.get_quantiles(quantiles)
+        for axis in range(2):
+            ranks = searchsorted(sort(self.Values[:,axis]),estimates[:,axis]) / 5000.0
+            self.assertTrue(abs(ranks - array(quantiles)).max() < 0.03)
+
+    def test_sketch_merge(self):
+        """Merged sketches approximate quantiles of the combined stream"""
+        first,second = QuantileSketch(2,128),QuantileSketch(2,128)
+        first.update(self.Values[:2500])
+        second.update(self.Values[2500:])
+        first.merge(second)
+        self.assertEqual(first.N,5000)
+        npt.assert_allclose(first.get_quantiles([0.5])[0],quantile(self.Values,0.5,axis=0),atol=0.15)
+        self.assertRaises(ValueError,QuantileSketch,2,1)
+
+    def test_sink_with_experiment(self):
+        """An EnsembleStatisticsSink summarizes each treatment, timepoint and axis of a history-free run"""
+        sink = EnsembleStatisticsSink(quantiles=(0.5,))
+        params = {"lambda":0.2,"delta":0.25,"interindividual_variation":0.01}
+        experiment = Experiment(["control","treated"],[5,5],4,params,[[],[]],0.1,\
+          engine="multivariate",random_state=0,sinks=[sink],history_window=0)
+        experiment.simulate_timesteps(0,4,progress_interval=None)
+        rows = sink.get_rows()
+        self.assertEqual(len(rows),2 * 4 * 3)
+        self.assertEqual([rows[0]["Treatment"],rows[0]["Axis"],rows[0]["n"]],["control","x",5])
+        lines = format_ensemble_table(rows,sink.Quantiles)
+        self.assertEqual(lines[0],"Treatment\tTimepoint\tAxis\tn\tmean\tvariance\tsd\tmin\tmax\tq0.5\n")
+        self.assertTrue(lines[1].startswith("control\t0\tx\t5\t"))
+
+    def test_sink_irregular_times_and_merge(self):
+        """Samples at irregular times are grouped by time, and sinks can be merged"""
+        sink = EnsembleStatisticsSink()
+        sink.open(["PC1"])
+        coords = array([[1.0],[3.0],[10.0]])
+        sink.write("control",array([0.5,0.5,2.0]),["a","b","c"],coords)
+        other = EnsembleStatisticsSink()
+        other.open(["PC1"])
+        other.write("control",2.0,["d"],array([[20.0]]))
+        sink.merge(other)
+        rows = sink.get_rows()
+        self.assertEqual([(row["Timepoint"],row["n"],row["mean"]) for row in rows],[(0.5,2,2.0),(2.0,2,15.0)])
+        self.assertEqual(get_quantile_columns((0.05,0.5)),["q0.05","q0.5"])
+        self.assertRaises(ValueError,EnsembleStatisticsSink,(0.5,1.5))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.equivalence import make_equivalence_design,simulate_reference,simulate_engine,\
+  compare_ensembles,check_exact_match,run_equivalence,get_standard_designs,format_equivalence_table
+from karenina.perturbation import Perturbation
+from numpy import concatenate
+import numpy
+import numpy.testing as npt
+
+"""
+Tests for equivalence.py
+"""
+
+class TestEquivalence(unittest.TestCase):
+    """Tests of fast engines against the reference Process model"""
+
+    def setUp(self):
+        self.Designs = dict((design["name"],(design,method,expected))\
+          for design,method,expected in get_standard_designs(60,12))
+
+    def test_reference_restores_global_random_state(self):
+        """simulate_reference is reproducible and leaves numpy's global state untouched"""
+        design = self.Designs["ou"][0]
+        numpy.random.seed(1)
+        before = numpy.random.get_state()[1].copy()
+        first = simulate_reference(design,5)
+        npt.assert_array_equal(numpy.random.get_state()[1],before)
+        npt.assert_array_equal(simulate_reference(design,5),first)
+        self.assertEqual(first.shape,(60,13,2))
+        npt.assert_array_equal(first[:,0],design["start"])
+
+    def test_exact_match_with_shared_seed(self):
+        """The Euler engines reproduce the reference bit for bit given matching seeds"""
+        for name in ("ou","ou_clamped","ou_perturbed","brownian"):
+            self.assertEqual(check_exact_match(self.Designs[name][0],7),0.0)
+
+    def test_clamped_design_hits_bounds(self):
+        """The clamped design actually exercises the [-1,1] bounds"""
+        history = simulate_reference(self.Designs["ou_clamped"][0],0)
+        self.assertTrue((numpy.abs(history) == 1.0).any())
+        self.assertTrue(numpy.abs(history).max() <= 1.0)
+
+    def test_brownian_is_unbounded(self):
+        """Brownian designs are simulated without bounds by both models"""
+        design = make_equivalence_design("wide",40,10,0.0,1.2,motion="Brownian")
+        history = simulate_engine(design,"multivariate",0)
+        self.assertTrue(numpy.abs(history).max() > 1.0)
+        self.assertRaises(ValueError,make_equivalence_design,"bad",10,5,0.1,0.1,motion="Levy")
+
+    def test_standard_designs_pass(self):
+        """Every design expected to be equivalent passes for both fast engines within a time budget"""
+        for design,method,expected in self.Designs.values():
+            if expected != "equivalent":
+                continue
+            for engine in ("multivariate","parallel"):
+                result = run_equivalence(design,engine,method,n_seeds=8,min_seeds=3,time_budget=1.0)
+                self.assertTrue(result["passed"],result)
+                self.assertTrue(result["n_seeds"] >= 3)
+                self.assertTrue(result["n_tests"] > 0)
+
+    def test_exact_method_is_a_different_model(self):
+        """The exact method is detected as differing from the reference at high lambda"""
+        design,method,expected = self.Designs["ou_high_lambda_exact"]
+        self.assertEqual((method,expected),("exact","different"))
+        result = run_equivalence(design,"multivariate",method,n_seeds=8,expected=expected)
+        self.assertTrue(result["adjusted_p"] < 0.01,result)
+        self.assertTrue(result["passed"])
+        self.assertEqual(result["expected"],"different")
+        self.assertRaises(ValueError,run_equivalence,design,"multivariate",method,expected="same")
+
+    def test_detects_different_parameters(self):
+        """compare_ensembles rejects a fast ensemble simulated with a different delta"""
+        design = self.Designs["ou"][0]
+        wrong = dict(design,delta=0.32)
+        reference = concatenate([simulate_reference(design,seed) for seed in range(4)])
+        fast = concatenate([simulate_engine(wrong,"multivariate",seed + 10) for seed in range(4)])
+        self.assertTrue(compare_ensembles(reference,fast)["adjusted_p"] < 0.01)
+
+    def test_detects_missing_perturbation(self):
+        """compare_ensembles rejects a fast ensemble that ignores a perturbation"""
+        shift = Perturbation(3,12,{"mu":0.3},"replace",["x"])
+        design = make_equivalence_design("shift",60,12,0.3,0.25,perturbations=[shift])
+        unperturbed = dict(design,perturbations=[])
+        reference = concatenate([simulate_reference(design,seed) for seed in range(4)])
+        fast = concatenate([simulate_engine(unperturbed,"multivariate",seed + 10) for seed in range(4)])
+        self.assertTrue(compare_ensembles(reference,fast)["adjusted_p"] < 0.01)
+
+    def test_time_budget_limits_seeds(self):
+        """A zero time budget stops after min_seeds"""
+        design = self.Designs["brownian"][0]
+        result = run_equivalence(design,"multivariate",n_seeds=50,min_seeds=2,time_budget=0.0)
+        self.assertEqual(result["n_seeds"],2)
+
+    def test_format_equivalence_table(self):
+        """format_equivalence_table writes a header and one row per result"""
+        result = run_equivalence(self.Designs["brownian"][0],"multivariate",n_seeds=2,min_seeds=2)
+        lines = format_equivalence_table([result])
+        self.assertEqual(len(lines),2)
+        self.assertEqual(lines[0].split("\t")[0],"design")
+        self.assertEqual(lines[1].split("\t")[0],"brownian")
+
+    def test_unknown_engine(self):
+        """An unknown engine raises a ValueError"""
+        self.assertRaises(ValueError,simulate_engine,self.Designs["ou"][0],"gpu",0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,9 @@ __status__ = "Development"
 import unittest
 from warnings import catch_warnings
 from karenina.experiment import Experiment
+from karenina.sinks import CallbackSink
+from karenina.ensemble_statistics import EnsembleStatisticsSink
+import numpy
 import numpy.testing as npt
 
 """
@@ -40,6 +43,70 @@ class TestExperiment(unittest.TestCase):
     def test_writeToMovieFile(self):
         pass
 
+    def test_seeded_treatments_differ(self):
+        """An int seed gives treatments different start positions and noise, reproducibly"""
+        params = {"lambda":0.2,"delta":0.25}
+        histories = []
+        for repeat in range(2):
+            experiment = Experiment(["control","treated"],[5,5],4,params,[[],[]],0.1,\
+              engine="multivariate",random_state=7)
+            experiment.simulate_timesteps(0,4,progress_interval=None)
+            histories.append([treatment["cohort"].get_history_array() for treatment in experiment.Treatments])
+        control,treated = histories[0]
+        self.assertFalse(numpy.array_equal(control[:,0],treated[:,0]))
+        self.assertFalse(numpy.array_equal(control[:,1:] - control[:,:-1],treated[:,1:] - treated[:,:-1]))
+        npt.assert_array_equal(histories[1][0],control)
+        npt.assert_array_equal(histories[1][1],treated)
+
+class TestBlocks(unittest.TestCase):
+    """Tests of simulating individuals in blocks"""
+
+    def make_experiment(self,engine,sinks,block_size=3,perturbations=()):
+        params = {"lambda":0.2,"delta":0.25}
+        return Experiment(["control","treated"],[7,4],5,params,[[],list(perturbations)],0.1,\
+          engine=engine,random_state=0,sinks=sinks,collect_data=False,history_window=0,\
+          block_size=block_size)
+
+    def test_blocks_reach_sinks(self):
+        """Every subject is simulated at every timepoint, one block at a time"""
+        for engine in ("process","multivariate"):
+            written = []
+            sink = CallbackSink(lambda name,t,subject_ids,coords: written.append((name,t,list(subject_ids),coords.shape)))
+            experiment = self.make_experiment(engine,[sink])
+            self.assertEqual(experiment.Treatments[0]["individuals"],[])
+            experiment.simulate_blocks(progress_interval=None)
+            self.assertEqual(len(written),(3 + 2) * 5)
+            self.assertEqual(written[0],("control",0,["control_0","control_1","control_2"],(3,3)))
+            self.assertEqual(written[5][2],["control_3","control_4","control_5"])
+            self.assertEqual(written[10][2],["control_6"])
+            subjects = set(subject_id for name,t,subject_ids,shape in written for subject_id in subject_ids)
+            self.assertEqual(len(subjects),11)
+            self.assertEqual(experiment.Treatments[0]["individuals"],[])
+            self.assertTrue("cohort" not in experiment.Treatments[0])
+
+    def test_blocks_differ_and_are_perturbed(self):
+        """Blocks are independent draws, and perturbations apply within each block"""
+        perturbation = {"start":2,"end":4,"params":{"mu":0.5,"lambda":0.9},"update_mode":"replace","axes":["x"]}
+        sink = EnsembleStatisticsSink()
+        experiment = self.make_experiment("multivariate",[sink],block_size=2,perturbations=[perturbation])
+        starts = []
+        experiment.Sinks.append(CallbackSink(lambda name,t,subject_ids,coords: starts.append(coords[0,0]) if t == 0 else None))
+        experiment.simulate_blocks(progress_interval=None)
+        self.assertEqual(len(set(starts)),len(starts))
+        rows = dict(((row["Treatment"],row["Timepoint"],row["Axis"]),row) for row in sink.get_rows())
+        self.assertEqual(rows[("treated",4.0,"x")]["n"],4)
+        self.assertTrue(rows[("treated",4.0,"x")]["mean"] > 0.3)
+        self.assertTrue(abs(rows[("control",4.0,"x")]["mean"]) < 0.3)
+
+    def test_block_mode_errors(self):
+        """Block experiments must be simulated with simulate_blocks"""
+        experiment = self.make_experiment("multivariate",[])
+        self.assertRaises(ValueError,experiment.simulate_timesteps,0,5)
+        self.assertRaises(ValueError,experiment.simulate_parallel)
+        self.assertRaises(ValueError,self.make_experiment,"process",[],0)
+        unblocked = self.make_experiment("process",[],None)
+        self.assertRaises(ValueError,unblocked.simulate_blocks)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+import asyncio
+import shutil
+from tempfile import mkdtemp
+from os import listdir
+from concurrent.futures import ThreadPoolExecutor
+from karenina.job_server import JobServer,ResultCache,RecentStore,get_job_key,check_job_spec,\
+  run_job,submit_job,get_job_result,request_job_server
+from time import monotonic
+
+"""
+Tests for job_server.py
+"""
+
+def make_experiment_spec(seed=0):
+    return {"type":"experiment","treatment_names":["control","treated"],\
+      "n_individuals":[3,2],"n_timepoints":4,"base_params":{"lambda":0.2,"delta":0.25},\
+      "perturbations":[[],[{"start":1,"end":3,"params":{"lambda":0.0},\
+      "update_mode":"replace","axes":["x","y","z"]}]],"seed":seed}
+
+class TestJobSpecs(unittest.TestCase):
+    """Tests of job specs and running jobs"""
+
+    def test_get_job_key_ignores_key_order(self):
+        """Specs that differ only in key order have the same key"""
+        self.assertEqual(get_job_key({"a":1,"b":[1,2]}),get_job_key({"b":[1,2],"a":1}))
+        self.assertNotEqual(get_job_key({"a":1}),get_job_key({"a":2}))
+
+    def test_check_job_spec(self):
+        """Invalid specs raise ValueErrors"""
+        self.assertRaises(ValueError,check_job_spec,{"type":"unknown"})
+        self.assertRaises(ValueError,check_job_spec,{"type":"fit","series":[]})
+        check_job_spec(make_experiment_spec())
+
+    def test_run_experiment_job(self):
+        """Experiment jobs return one row per subject per timepoint, reproducibly"""
+        result = run_job(make_experiment_spec())
+        self.assertEqual(result["axes"],["x","y","z"])
+        self.assertEqual(len(result["coords"]),5*4)
+        self.assertEqual(result["sample_ids"][0],"Scontrol_0_t0")
+        self.assertEqual(result,run_job(make_experiment_spec()))
+        #Seeded treatments must not share start positions
+        starts = dict((subject_id,coords) for subject_id,t,coords in\
+          zip(result["subject_ids"],result["timepoints"],result["coords"]) if t == 0)
+        self.assertNotEqual(starts["control_0"],starts["treated_0"])
+
+    def test_run_fit_job(self):
+        """Fit jobs return one row of OU parameters per series"""
+        spec = {"type":"fit","series":[[0.0,0.1,0.05,0.2,0.1]]*2,"times":[[0,1,2,3,4]]*2}
+        result = run_job(spec)
+        self.assertEqual(result["columns"],["Sigma","Lambda","Theta","nlogLik"])
+        self.assertEqual(len(result["fits"]),2)
+        self.assertEqual(result["fits"][0],result["fits"][1])
+
+    def test_result_cache_on_disk(self):
+        """ResultCache stores results as files named by key"""
+        cache_dir = mkdtemp()
+        try:
+            cache = ResultCache(cache_dir)
+            self.assertEqual(cache.get("abc"),None)
+            cache.put("abc",{"x":[1,2]})
+            self.assertEqual(ResultCache(cache_dir).get("abc"),{"x":[1,2]})
+            self.assertEqual(listdir(cache_dir),["abc.json"])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_recent_store_bounded(self):
+        """A RecentStore keeps at most max_items values, each for at most ttl seconds"""
+        store = RecentStore(max_items=2,ttl=60.0)
+        for key in ("a","b","c"):
+            store.put(key,key.upper())
+        self.assertEqual(len(store),2)
+        self.assertEqual(store.get("a"),None)
+        self.assertEqual(store.get("c"),"C")
+        store.Items["b"] = (monotonic() - 120.0,"B")
+        self.assertEqual(store.get("b"),None)
+        self.assertEqual(len(store),1)
+
+class TestJobServer(unittest.TestCase):
+    """Tests of JobServer deduplication, caching and HTTP handling"""
+
+    def setUp(self):
+        self.server = JobServer(executor=ThreadPoolExecutor(max_workers=2))
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_identical_jobs_deduplicated_then_cached(self):
+        """Identical in-flight jobs run once; later repeats come from the cache"""
+        async def run():
+            spec = make_experiment_spec()
+            first,second = await asyncio.gather(self.server.submit(spec),self.server.submit(spec))
+            third = await self.server.submit(spec)
+            return first,second,third
+        first,second,third = asyncio.run(run())
+        self.assertEqual([first[1],second[1],third[1]],["submitted","deduplicated","cached"])
+        self.assertEqual(first[2],second[2])
+        self.assertEqual(first[2],third[2])
+        self.assertEqual(self.server.Counts["completed"],1)
+
+    def test_unseeded_experiments_not_cached(self):
+        """Experiments without a seed always run"""
+        async def run():
+            spec = make_experiment_spec(seed=None)
+            first = await self.server.submit(spec)
+            second = await self.server.submit(spec)
+            return first,second
+        first,second = asyncio.run(run())
+        self.assertEqual([first[1],second[1]],["submitted","submitted"])
+        self.assertNotEqual(first[0],second[0])
+        #Random keys are never looked up by content, so results stay out of the cache
+        self.assertEqual(self.server.Cache.Results,{})
+        self.assertEqual(self.server.Recent.get(first[0]),first[2])
+
+    def test_errors_bounded(self):
+        """Only the most recent job errors are kept"""
+        server = JobServer(executor=ThreadPoolExecutor(max_workers=1),max_recent=2)
+        async def run():
+            keys = []
+            for i in range(3):
+                key,status,future = server.start_job({"type":"fit","series":[[0.0]*i],"times":[]})
+                keys.append(key)
+                with self.assertRaises(ValueError):
+                    await future
+            return keys
+        try:
+            keys = asyncio.run(run())
+        finally:
+            server.shutdown()
+        self.assertEqual(len(server.Errors),2)
+        self.assertEqual(server.Errors.get(keys[0]),None)
+        self.assertTrue(server.Errors.get(keys[2]).startswith("ValueError"))
+
+    def test_http_round_trip(self):
+        """Jobs can be submitted and fetched over HTTP on localhost"""
+        async def run():
+            server = await self.server.start("127.0.0.1",0)
+            port = server.sockets[0].getsockname()[1]
+            loop = asyncio.get_event_loop()
+            call = lambda f,*args,**kwargs: loop.run_in_executor(None,lambda: f(*args,port=port,**kwargs))
+            spec = make_experiment_spec()
+            result = await call(submit_job,spec)
+            key = await call(submit_job,spec,wait=False)
+            fetched = await call(get_job_result,key)
+            bad_request = await call(request_job_server,"POST","/jobs",{"type":"nope"})
+            missing = await call(request_job_server,"GET","/jobs/unknown")
+            status = await call(request_job_server,"GET","/status")
+            server.close()
+            await server.wait_closed()
+            return result,key,fetched,bad_request,missing,status
+        result,key,fetched,bad_request,missing,status = asyncio.run(run())
+        self.assertEqual(len(result["coords"]),20)
+        self.assertEqual(key,get_job_key(make_experiment_spec()))
+        self.assertEqual(fetched,result)
+        self.assertEqual(bad_request[0],400)
+        self.assertEqual(missing[0],404)
+        self.assertEqual(status[1]["completed"],1)
+        self.assertEqual(status[1]["cached"],1)
+
+if __name__ == '__main__':
+    unittest.main()
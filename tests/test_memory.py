@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+import tracemalloc
+import gc
+from karenina.memory import estimate_experiment_memory,estimate_fit_memory,\
+  fit_to_memory_budget,format_memory_estimate,MemoryProfiler,MB
+from karenina.experiment import Experiment
+from numpy import ones
+
+"""
+Tests for memory.py
+"""
+
+def measure_experiment_memory(engine,n_individuals,n_timepoints,axes,collect_data):
+    """Return bytes allocated by setting up and simulating an experiment"""
+    gc.collect()
+    tracemalloc.start()
+    experiment = Experiment(["control","treated"],n_individuals,n_timepoints,\
+      {"lambda":0.2,"delta":0.25},[[],[]],0.1,axes=axes,engine=engine,\
+      collect_data=collect_data,random_state=0 if engine == "multivariate" else None)
+    experiment.simulate_timesteps(0,n_timepoints,progress_interval=None)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return allocated
+
+class TestMemoryEstimates(unittest.TestCase):
+    """Tests of memory estimates from an experiment design"""
+
+    def test_estimates_match_measurements(self):
+        """Estimates (without baseline and movie) are close to measured allocations"""
+        for engine,collect_data in (("process",True),("multivariate",False),("multivariate",True)):
+            n_individuals = [20,20] if engine == "process" else [200,200]
+            measured = measure_experiment_memory(engine,n_individuals,50,["x","y","z"],collect_data)
+            estimate = estimate_experiment_memory(n_individuals,50,3,engine,collect_data=collect_data)
+            predicted = estimate["total"] - estimate["baseline"] - estimate["movie"]
+            self.assertTrue(0.7 < predicted / measured < 1.3,"%s: %i vs %i" %(engine,predicted,measured))
+
+    def test_history_window_and_streaming(self):
+        """Dropping history and streaming output remove those components"""
+        full = estimate_experiment_memory([100,100],500,3,"multivariate")
+        streaming = estimate_experiment_memory([100,100],500,3,"multivariate",history_window=0,\
+          collect_data=False,write_movie=False)
+        self.assertEqual(streaming["data_rows"],0.0)
+        self.assertEqual(streaming["history"],0.0)
+        self.assertTrue(full["total"] > streaming["total"])
+        self.assertTrue(format_memory_estimate(full).startswith("%.1f MB" %(full["total"] / MB)))
+        self.assertTrue(estimate_fit_memory(1000,20)["total"] > estimate_fit_memory(10,20)["total"])
+
+    def test_block_size(self):
+        """With a block size, individuals and history scale with the block, not the population"""
+        small = estimate_experiment_memory([1000,1000],100,3,"process",history_window=0,\
+          collect_data=False,block_size=500)
+        large = estimate_experiment_memory([10**6,10**6],100,3,"process",history_window=0,\
+          collect_data=False,block_size=500)
+        self.assertEqual(small["total"],large["total"])
+        self.assertEqual(large["movie"],0.0)
+        self.assertEqual(fit_to_memory_budget([10**6,10**6],100,3,budget_mb=120,history_window=0,\
+          stream_output=True,write_movie=False,block_size=500,over_budget="refuse")[:2],(0,True))
+
+    def test_fit_to_memory_budget(self):
+        """Designs over budget are streamed, or refused"""
+        design = ([5000,5000],1000,3)
+        self.assertEqual(fit_to_memory_budget(*design,budget_mb=None)[:2],(None,False))
+        history_window,stream_output,estimate = fit_to_memory_budget(*design,budget_mb=200)
+        self.assertEqual((history_window,stream_output),(0,True))
+        self.assertTrue(estimate["total"] <= 200 * MB)
+        self.assertRaises(ValueError,fit_to_memory_budget,*design,budget_mb=200,over_budget="refuse")
+        self.assertRaises(ValueError,fit_to_memory_budget,*design,budget_mb=10)
+
+class TestMemoryProfiler(unittest.TestCase):
+    """Tests of per-stage peak memory"""
+
+    def test_tracemalloc_peaks(self):
+        """The stage allocating a large array has the higher peak, and outer stages include inner peaks"""
+        profiler = MemoryProfiler("tracemalloc")
+        with profiler.stage("outer"):
+            with profiler.stage("small"):
+                small = ones(1000)
+            with profiler.stage("large"):
+                large = ones(2000000)
+                del large
+        profiler.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+        peaks = dict((row["stage"],row["peak_mb"]) for row in profiler.get_rows())
+        self.assertTrue(peaks["large"] - peaks["small"] > 14.0)
+        self.assertEqual(peaks["outer"],peaks["large"])
+        self.assertTrue(profiler.format_table()[0].rstrip("\n").endswith("peak_mb"))
+
+    def test_rss_method(self):
+        """RSS sampling reports a positive peak per stage"""
+        profiler = MemoryProfiler("rss")
+        with profiler.stage("update"):
+            pass
+        profiler.stop()
+        self.assertTrue(profiler.get_report()["stages"][0]["peak_mb"] > 0)
+        self.assertRaises(ValueError,MemoryProfiler,"psutil")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.multivariate_process import MultivariateProcess,\
+  get_exact_ou_transition,psd_sqrt
+from karenina.perturbation import Perturbation
+from karenina.experiment import Experiment
+from numpy import array,zeros,ones,eye,diag,exp,var,mean
+import numpy.testing as npt
+
+"""
+Tests for multivariate_process.py
+"""
+
+class TestMultivariateProcess(unittest.TestCase):
+    """Tests of the MultivariateProcess class"""
+
+    def setUp(self):
+        self.Axes = ["PC%i" %i for i in range(1,11)]
+        self.StartCoords = zeros((500,10))
+
+    def test_exact_transition_matches_scalar_ou(self):
+        """get_exact_ou_transition matches the closed form for independent axes"""
+        L = array([0.2,0.5])
+        s = array([0.1,0.3])
+        phi,q = get_exact_ou_transition(diag(L),diag(s**2),2.0)
+        npt.assert_almost_equal(phi,diag(exp(-L*2.0)))
+        expected_var = s**2 * (1 - exp(-2*L*2.0)) / (2*L)
+        npt.assert_almost_equal(q,diag(expected_var))
+
+    def test_psd_sqrt_singular(self):
+        """psd_sqrt handles singular covariance matrices"""
+        m = array([[1.0,0.0],[0.0,0.0]])
+        root = psd_sqrt(m)
+        npt.assert_almost_equal(root.dot(root.T),m)
+
+    def test_stationary_variance(self):
+        """Exact updates reach the stationary OU variance in every dimension"""
+        delta = 0.5
+        L = 0.5
+        cohort = MultivariateProcess(self.StartCoords,self.Axes,\
+          {"lambda":L,"delta":delta},random_state=1,min_bound=None,max_bound=None)
+        cohort.simulate(50,dt=1.0)
+        expected_var = (delta**2)**2 / (2*L)
+        npt.assert_allclose(var(cohort.Coords,axis=0),expected_var,rtol=0.25)
+        self.assertEqual(cohort.get_history_array().shape,(500,51,10))
+
+    def test_stable_process_does_not_move(self):
+        """With zero delta, individuals stay at their mean"""
+        start = ones((5,3)) * 0.3
+        cohort = MultivariateProcess(start,["x","y","z"],{"lambda":1.0,"delta":0.0},random_state=0)
+        cohort.simulate(20)
+        npt.assert_almost_equal(cohort.Coords,start)
+
+    def test_coupling_moves_other_axes(self):
+        """Cross-axis coupling lets displacement on one axis drive another"""
+        start = zeros((3,2))
+        start[:,0] = 0.5
+        params = {"lambda":[0.5,0.5],"delta":[0.0,0.0],"mu":zeros(2),\
+          "coupling":array([[0.0,0.0],[-0.5,0.0]])}
+        cohort = MultivariateProcess(start,["x","y"],params,random_state=0)
+        cohort.update(1.0)
+        self.assertTrue(all(cohort.Coords[:,1] > 0.0))
+        uncoupled = MultivariateProcess(start,["x","y"],\
+          {"lambda":[0.5,0.5],"delta":[0.0,0.0],"mu":zeros(2)},random_state=0)
+        uncoupled.update(1.0)
+        npt.assert_almost_equal(uncoupled.Coords[:,1],0.0)
+        #x evolves identically in both, since y does not feed back into x
+        npt.assert_almost_equal(cohort.Coords[:,0],uncoupled.Coords[:,0])
+
+    def test_perturbation_targets_named_axes(self):
+        """Perturbations only alter the axes they name"""
+        start = zeros((200,4))
+        axes = ["PC1","PC2","PC3","PC4"]
+        cohort = MultivariateProcess(start,axes,{"lambda":0.5,"delta":0.5},\
+          random_state=2,min_bound=None,max_bound=None)
+        shift_mu = Perturbation(0,10,params={"mu":0.8},update_mode="replace",axes=["PC2","PC4"])
+        cohort.applyPerturbation(shift_mu)
+        cohort.simulate(40)
+        means = mean(cohort.Coords,axis=0)
+        npt.assert_allclose(means[[1,3]],0.8,atol=0.1)
+        npt.assert_allclose(means[[0,2]],0.0,atol=0.1)
+        cohort.removePerturbation(shift_mu)
+        self.assertEqual(cohort.Perturbations,[])
+
+    def test_invalid_perturbation_axis(self):
+        """Perturbations naming unknown axes raise ValueError"""
+        cohort = MultivariateProcess(zeros((2,2)),["x","y"],{"lambda":0.5,"delta":0.5})
+        bad = Perturbation(0,10,params={"lambda":0.0},axes=["z"])
+        self.assertRaises(ValueError,cohort.applyPerturbation,bad)
+
+    def test_per_individual_params(self):
+        """lambda, delta and mu can vary per individual"""
+        start = zeros((2,1))
+        params = {"lambda":[[1.0],[1.0]],"delta":[[0.0],[0.0]],"mu":[[0.5],[-0.5]]}
+        cohort = MultivariateProcess(start,["x"],params,method="euler")
+        cohort.update(1.0)
+        npt.assert_almost_equal(cohort.Coords,array([[0.5],[-0.5]]))
+
+    def test_bounds(self):
+        """Coordinates are clamped to [-1,1] by default"""
+        cohort = MultivariateProcess(zeros((100,2)),["x","y"],{"lambda":0.0,"delta":3.0},random_state=3)
+        cohort.simulate(5)
+        self.assertTrue((abs(cohort.get_history_array()) <= 1.0).all())
+
+    def test_invalid_param_shape(self):
+        """Parameters that can't broadcast to the cohort raise ValueError"""
+        self.assertRaises(ValueError,MultivariateProcess,zeros((3,2)),["x","y"],\
+          {"lambda":[0.1,0.2,0.3],"delta":0.1})
+
+class TestMultivariateExperiment(unittest.TestCase):
+    """Tests of Experiment with the multivariate engine"""
+
+    def test_experiment_with_many_axes(self):
+        """Experiment simulates arbitrary named axes with the multivariate engine"""
+        axes = ["PC%i" %i for i in range(1,13)]
+        perturbation = {"start":2,"end":4,"params":{"lambda":0.0},\
+          "update_mode":"replace","axes":["PC3","PC7"]}
+        experiment = Experiment(["control","treated"],[4,5],6,\
+          {"lambda":0.2,"delta":0.25},[[],[perturbation]],0.01,\
+          axes=axes,engine="multivariate",random_state=0)
+        experiment.simulate_timesteps(0,6)
+        self.assertEqual(experiment.Data[0].strip().split("\t"),["SampleID"]+axes)
+        self.assertEqual(len(experiment.Data),1 + 6 * 9)
+        self.assertEqual(len(experiment.Data[1].strip().split("\t")),13)
+        data,colors = experiment.get_timeseries_data()
+        self.assertEqual(len(data),9)
+        self.assertEqual(data[0].shape,(12,7))
+
+if __name__ == '__main__':
+    unittest.main()
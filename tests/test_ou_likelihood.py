@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.ou_likelihood import get_exact_OU_nlogLik,get_OU_kalman_nlogLik,\
+  make_kalman_OU_objective_fn,fit_OU_kalman,fit_OU_exact,get_transition_moments,\
+  pad_series,get_pooled_Theta,make_pooled_OU_objective_fn,fit_OU_pooled,fit_OU_pooled_by_group,\
+  fit_OU_ar1
+from karenina.bootstrap import simulate_ou_replicates
+from numpy import arange,array,nan,log,pi,exp,cumsum,isnan,sqrt,zeros
+from numpy.random import RandomState
+from scipy.optimize import minimize
+import numpy.testing as npt
+
+"""
+Tests for ou_likelihood.py
+"""
+
+def simulate_ou_series(n_series,n_timepoints,sigma,lamb,theta,seed=0):
+    """Return (n_series,n_timepoints) exact OU series with unit timesteps"""
+    random_state = RandomState(seed)
+    x = zeros((n_series,n_timepoints))
+    x[:,0] = theta
+    phi = exp(-lamb)
+    sd = sigma * sqrt((1.0 - exp(-2.0*lamb)) / (2.0*lamb))
+    for t in range(1,n_timepoints):
+        x[:,t] = theta + (x[:,t-1] - theta) * phi + random_state.normal(0,sd,n_series)
+    return x
+
+def get_reference_kalman_nlogLik(x,times,Sigma,Lambda,Theta,Epsilon):
+    """Unvectorized Kalman filter for one series"""
+    mean,variance = x[0],Epsilon**2
+    total = 0.0
+    for k in range(1,len(x)):
+        dt = times[k] - times[k-1]
+        phi = exp(-Lambda*dt)
+        predicted_mean,step_variance = get_transition_moments(mean,dt,Sigma,Lambda,Theta)
+        predicted_variance = phi**2 * variance + step_variance
+        s = predicted_variance + Epsilon**2
+        v = x[k] - predicted_mean
+        total += 0.5*(log(2*pi) + log(s) + v**2/s)
+        gain = predicted_variance / s
+        mean = predicted_mean + gain*v
+        variance = (1-gain)*predicted_variance
+    return total
+
+class TestOULikelihood(unittest.TestCase):
+    """Tests of the exact OU likelihood and batch fitting"""
+
+    def test_vectorized_matches_single(self):
+        """nlogLik for many series equals nlogLik of each series"""
+        x = simulate_ou_series(3,20,0.1,0.5,0.2)
+        times = arange(20)
+        batch = get_exact_OU_nlogLik(x,times,0.1,0.5,0.2)
+        for i in range(3):
+            self.assertAlmostEqual(batch[i],get_exact_OU_nlogLik(x[i],times,0.1,0.5,0.2))
+
+    def test_nan_padding_ignored(self):
+        """Trailing NaN padding does not change a series' likelihood"""
+        x = simulate_ou_series(1,10,0.1,0.5,0.0)[0]
+        padded = array([list(x)+[nan,nan]])
+        expected = get_exact_OU_nlogLik(x,arange(10),0.1,0.5,0.0)
+        observed = get_exact_OU_nlogLik(padded,arange(12),0.1,0.5,0.0)
+        self.assertAlmostEqual(observed[0],expected)
+
+    def test_fit_OU_exact_recovers_params(self):
+        """fit_OU_exact recovers parameters of a long simulated series"""
+        x = simulate_ou_series(1,2000,0.2,0.3,0.1,seed=2)[0]
+        sigma,lamb,theta,nlogLik = fit_OU_exact(x,arange(2000))
+        self.assertAlmostEqual(sigma,0.2,delta=0.02)
+        self.assertAlmostEqual(lamb,0.3,delta=0.08)
+        self.assertAlmostEqual(theta,0.1,delta=0.05)
+
+    def test_fit_OU_ar1_matches_exact_fit(self):
+        """The closed-form fit of many series agrees with numerical fits"""
+        x = simulate_ou_series(3,500,0.2,0.3,0.1,seed=5)
+        fits = fit_OU_ar1(x)
+        self.assertEqual(fits.shape,(3,4))
+        for i in range(3):
+            npt.assert_allclose(fits[i],fit_OU_exact(x[i],arange(500)),rtol=1e-3,atol=1e-4)
+
+    def test_fit_OU_ar1_random_walk(self):
+        """Series without reversion get Lambda 0 and an undefined Theta"""
+        x = array([[0.0,1.0,2.0,3.0,4.0,5.0]])
+        sigma,lamb,theta,nlogLik = fit_OU_ar1(x)[0]
+        self.assertEqual(lamb,0.0)
+        self.assertTrue(isnan(theta))
+
+class TestKalmanLikelihood(unittest.TestCase):
+    """Tests of the OU likelihood with measurement noise"""
+
+    def setUp(self):
+        self.times = arange(40.0)
+        self.x = simulate_ou_replicates(0.2,0.3,0.1,self.times,0.0,5,random_state=0)
+
+    def test_no_noise_matches_exact(self):
+        """With Epsilon = 0 the Kalman likelihood is the exact OU likelihood"""
+        npt.assert_allclose(get_OU_kalman_nlogLik(self.x,self.times,0.2,0.3,0.1,0.0),\
+          get_exact_OU_nlogLik(self.x,self.times,0.2,0.3,0.1))
+
+    def test_matches_reference_filter(self):
+        """Regular and irregular times match an unvectorized filter"""
+        irregular = cumsum(RandomState(1).uniform(0.1,2.0,40))
+        for times in (self.times,irregular):
+            expected = get_reference_kalman_nlogLik(self.x[2],times,0.2,0.3,0.1,0.15)
+            self.assertAlmostEqual(get_OU_kalman_nlogLik(self.x[2],times,0.2,0.3,0.1,0.15),expected)
+
+    def test_per_series_params_and_padding(self):
+        """Parameters may differ per series, and NaN padding is ignored"""
+        padded = self.x.copy()
+        padded[1,25:] = nan
+        Sigma = array([0.1,0.2,0.3,0.2,0.2])
+        observed = get_OU_kalman_nlogLik(padded,self.times,Sigma,0.3,0.1,0.05)
+        for i in range(5):
+            n = 25 if i == 1 else 40
+            expected = get_reference_kalman_nlogLik(padded[i,:n],self.times[:n],Sigma[i],0.3,0.1,0.05)
+            self.assertAlmostEqual(observed[i],expected)
+
+    def test_objective_fn(self):
+        """Objectives take 4 parameters, or 3 with a fixed measurement error"""
+        fitted_noise = make_kalman_OU_objective_fn(self.x[0],self.times)
+        fixed_noise = make_kalman_OU_objective_fn(self.x[0],self.times,measurement_error=0.1)
+        self.assertAlmostEqual(fitted_noise(array([0.2,0.3,0.1,0.1])),fixed_noise(array([0.2,0.3,0.1])))
+        self.assertRaises(ValueError,fixed_noise,array([0.2,0.3,0.1,0.1]))
+
+    def test_fit_OU_kalman_reduces_lambda_bias(self):
+        """Fitting measurement noise avoids the upward bias in Lambda"""
+        times = arange(2000.0)
+        latent = simulate_ou_replicates(0.2,0.3,0.0,times,0.0,1,random_state=2)[0]
+        noisy = latent + RandomState(3).normal(0,0.2,2000)
+        Sigma,Lambda,Theta,Epsilon,nlogLik = fit_OU_kalman(noisy,times)
+        self.assertAlmostEqual(Lambda,0.3,delta=0.1)
+        self.assertAlmostEqual(Epsilon,0.2,delta=0.05)
+        self.assertTrue(fit_OU_exact(noisy,times)[1] > Lambda + 0.2)
+
+class TestPooledFitting(unittest.TestCase):
+    """Tests of joint OU fits with shared Sigma and Lambda"""
+
+    def setUp(self):
+        random_state = RandomState(0)
+        self.series = []
+        self.times = []
+        for i in range(300):
+            n_timepoints = random_state.randint(5,21)
+            times = cumsum(random_state.uniform(0.5,1.5,n_timepoints))
+            x0 = random_state.normal(0.1,0.3)
+            self.series.append(simulate_ou_replicates(0.2,0.3,0.1,times,x0,1,random_state)[0])
+            self.times.append(times)
+
+    def test_pad_series(self):
+        """Ragged series are NaN-padded, and mismatched lengths are rejected"""
+        x,times = pad_series([array([1.0,2.0]),array([3.0])],[array([0.0,1.0]),array([5.0])])
+        npt.assert_array_equal(x,array([[1.0,2.0],[3.0,nan]]))
+        npt.assert_array_equal(times,array([[0.0,1.0],[5.0,nan]]))
+        self.assertRaises(ValueError,pad_series,[array([1.0,2.0])],[array([0.0])])
+
+    def test_objective_sums_series(self):
+        """The joint objective is the sum of per-series likelihoods"""
+        x,times = pad_series(self.series[:10],self.times[:10])
+        Thetas = RandomState(1).normal(0,0.1,10)
+        expected = sum(get_exact_OU_nlogLik(s,t,0.2,0.3,theta)\
+          for s,t,theta in zip(self.series[:10],self.times[:10],Thetas))
+        per_subject = make_pooled_OU_objective_fn(x,times,per_subject_theta=True)
+        self.assertAlmostEqual(per_subject(array([0.2,0.3] + list(Thetas))),expected)
+        shared = make_pooled_OU_objective_fn(x,times)
+        self.assertRaises(ValueError,shared,array([0.2,0.3,0.1,0.1]))
+
+    def test_profiled_Theta_is_optimal(self):
+        """The closed-form Theta matches a numerical optimum"""
+        x,times = pad_series(self.series[:10],self.times[:10])
+        fn_to_optimize = make_pooled_OU_objective_fn(x,times)
+        numerical = minimize(lambda p: fn_to_optimize(array([0.2,0.3,p[0]])),[0.0]).x[0]
+        self.assertAlmostEqual(get_pooled_Theta(x,times,0.2,0.3),numerical,places=4)
+        Thetas = get_pooled_Theta(x,times,0.2,0.3,per_subject_theta=True)
+        self.assertEqual(Thetas.shape,(10,))
+
+    def test_fit_OU_pooled_recovers_params(self):
+        """Many short, irregular series pooled together recover shared parameters"""
+        Sigma,Lambda,Theta,nlogLik = fit_OU_pooled(self.series,self.times)
+        self.assertAlmostEqual(Sigma,0.2,delta=0.02)
+        self.assertAlmostEqual(Lambda,0.3,delta=0.05)
+        self.assertAlmostEqual(Theta,0.1,delta=0.05)
+
+    def test_fit_OU_pooled_per_subject_theta(self):
+        """Per-subject Thetas track each individual's home position"""
+        random_state = RandomState(2)
+        homes = random_state.normal(0,0.5,50)
+        x = array([simulate_ou_replicates(0.2,0.3,home,arange(40.0),home,1,random_state)[0] for home in homes])
+        Sigma,Lambda,Theta,nlogLik = fit_OU_pooled(x,arange(40.0),per_subject_theta=True)
+        self.assertEqual(Theta.shape,(50,))
+        self.assertAlmostEqual(Sigma,0.2,delta=0.03)
+        self.assertTrue(abs(Theta - homes).mean() < 0.15)
+
+    def test_fit_OU_pooled_by_group(self):
+        """Each group gets its own joint fit"""
+        groups = ["a"]*150 + ["b"]*150
+        results = fit_OU_pooled_by_group(self.series,self.times,groups)
+        self.assertEqual(sorted(results),["a","b"])
+        npt.assert_allclose(results["a"],fit_OU_pooled(self.series[:150],self.times[:150]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,7 +11,12 @@ __status__ = "Development"
 
 import unittest
 from warnings import catch_warnings
-from karenina.perturbation import Perturbation
+from karenina.perturbation import Perturbation,ScheduledPerturbation,PulsePerturbation,\
+  RampPerturbation,DecayPerturbation,PeriodicPerturbation
+from karenina.multivariate_process import MultivariateProcess
+from karenina.experiment import Experiment
+from karenina.sinks import CallbackSink
+from numpy import array,arange,pi,sin,zeros
 import numpy.testing as npt
 
 """
@@ -115,5 +120,65 @@ class TestPerturbation(unittest.TestCase):
         self.assertEqual(obs, exp)
 
 
+class TestScheduledPerturbation(unittest.TestCase):
+    """Tests of compiled time-varying perturbations"""
+
+    def test_compiled_profiles(self):
+        """Each perturbation type compiles one weight per timestep from Start to End"""
+        pulses = PulsePerturbation(10,25,{"mu":0.5},period=5,pulse_length=2)
+        npt.assert_array_equal(pulses.Weights,[1,1,0,0,0]*3+[1])
+        ramp = RampPerturbation(0,4,{"lambda":0.01})
+        npt.assert_allclose(ramp.Weights,[0.0,0.25,0.5,0.75,1.0])
+        npt.assert_allclose(RampPerturbation(0,4,{"lambda":0.01},start_weight=1.0,end_weight=0.0).Weights,\
+          [1.0,0.75,0.5,0.25,0.0])
+        decay = DecayPerturbation(3,9,{"mu":0.4},half_life=2)
+        npt.assert_allclose(decay.Weights,0.5 ** (arange(7) / 2.0))
+        seasonal = PeriodicPerturbation(0,11,{"mu":0.2},period=12,phase=0.5)
+        npt.assert_allclose(seasonal.Weights,sin(2 * pi * arange(12) / 12.0 + 0.5))
+        npt.assert_allclose(decay.getWeights(array([0.0,3.0,4.5,9.0,20.0])),[1.0,1.0,0.5 ** 0.5,0.125,0.125])
+        self.assertRaises(NotImplementedError,ScheduledPerturbation,0,5,{"mu":0.1})
+        self.assertRaises(ValueError,DecayPerturbation,0,5,{"mu":0.1},half_life=0)
+        self.assertRaises(ValueError,PulsePerturbation,5,0,{"mu":0.1},period=2)
+
+    def test_compile_params(self):
+        """Parameters at each timestep are an affine function of the base value"""
+        base_params = {"mu": 0.1, "lambda": 0.25, "delta": 0.18}
+        for mode,values in (("replace",[0.25,0.375,0.5]),("add",[0.25,0.5,0.75]),("multiply",[0.25,0.375,0.5])):
+            compiled = RampPerturbation(0,2,{"lambda": 2.0 if mode == "multiply" else 0.5},mode).compileParams(base_params)
+            npt.assert_allclose(compiled["lambda"],values)
+            self.assertEqual(compiled["delta"],0.18)
+        press = Perturbation(0,2,{"lambda":0.5},"add")
+        full = RampPerturbation(0,2,{"lambda":0.5},"add",start_weight=1.0)
+        self.assertEqual(full.updateParams(base_params),press.updateParams(base_params))
+        full.Weights[:] = 0.0
+        full.setTime(1)
+        self.assertEqual(full.updateParams(base_params),base_params)
+        full.UpdateMode = "divide"
+        self.assertRaises(ValueError,full.updateParams,base_params)
+
+    def test_experiment_engines(self):
+        """Both engines follow the compiled schedule at every timestep"""
+        expected = zeros(12)
+        expected[3:10] = 0.4 * 0.5 ** (arange(7) / 2.0)
+        for engine in ("process","multivariate"):
+            observed = []
+            sink = CallbackSink(lambda name,t,subject_ids,coords: observed.append(coords[0,0]))
+            decay = DecayPerturbation(3,9,{"mu":0.4},half_life=2,axes=["x"])
+            params = {"lambda":1.0,"delta":0.001,"interindividual_variation":0.0,"x":0.0}
+            experiment = Experiment(["treated"],[1],12,params,[[decay]],0.0,axes=["x"],\
+              engine=engine,method="euler",random_state=0,sinks=[sink])
+            experiment.simulate_timesteps(0,12,progress_interval=None)
+            npt.assert_allclose(observed,expected,atol=1e-4)
+
+    def test_irregular_times(self):
+        """Individuals at different times get their own compiled weights"""
+        cohort = MultivariateProcess(zeros((3,2)),["x","y"],{"lambda":0.2,"delta":0.1})
+        pulses = PulsePerturbation(0,10,{"mu":0.5},period=4,pulse_length=1,axes=["y"])
+        cohort.applyPerturbation(pulses)
+        params = cohort.get_current_params(times=array([0.5,2.0,4.0]))
+        npt.assert_allclose(params["mu"],[[0.0,0.5],[0.0,0.0],[0.0,0.5]])
+        pulses.setTime(1)
+        npt.assert_allclose(cohort.get_current_params()["mu"],zeros((3,2)))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from os.path import join,dirname,realpath
+from shutil import rmtree,copy
+from tempfile import mkdtemp
+import karenina.perturbation_library as perturbation_library
+from karenina.perturbation_library import parse_perturbation_lines,\
+  load_perturbation_file,load_perturbation_library,clear_perturbation_cache
+
+"""
+Tests for perturbation_library.py
+"""
+
+PERTURBATION_DIR = join(dirname(dirname(realpath(__file__))),"data","perturbations")
+
+class TestPerturbationLibrary(unittest.TestCase):
+    """Tests of perturbation file parsing and caching"""
+
+    def setUp(self):
+        clear_perturbation_cache()
+        self.TempDir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.TempDir)
+
+    def test_parse_keyword_format(self):
+        """parse_perturbation_lines parses params/update_mode/axes lines"""
+        lines = ["params\tlambda\t0.008\tmu\t-0.08\tupdate_mode\treplace\taxes\tx\n",\
+          "params\tlambda\t0.080\tupdate_mode\treplace\taxes\tz\ty\t\n"]
+        obs = parse_perturbation_lines(lines)
+        exp = [({"lambda":0.008,"mu":-0.08},"replace",("x",)),\
+          ({"lambda":0.08},"replace",("z","y"))]
+        self.assertEqual(obs,exp)
+
+    def test_parse_column_format(self):
+        """parse_perturbation_lines parses the header-based column format"""
+        lines = ["#parameter\tvalue\tupdate_mode\taxes\n","lambda\t0\treplace\tx,y,z\n"]
+        obs = parse_perturbation_lines(lines)
+        self.assertEqual(obs,[({"lambda":0.0},"replace",("x","y","z"))])
+
+    def test_formats_agree(self):
+        """Both formats of the xyz_lambda_zero perturbation load identically"""
+        keyword = load_perturbation_file(join(PERTURBATION_DIR,"xyz_lambda_zero.csv"),5,10)
+        column = load_perturbation_file(join(PERTURBATION_DIR,"xyz_lambda_zero_alt_format.csv"),5,10)
+        for p1,p2 in zip(keyword,column):
+            self.assertEqual((p1.Params,p1.UpdateMode,p1.Axes,p1.Start,p1.End),\
+              (p2.Params,p2.UpdateMode,p2.Axes,p2.Start,p2.End))
+
+    def test_invalid_lines_raise(self):
+        """Invalid perturbations raise a ValueError naming the line"""
+        bad_mode = ["params\tlambda\t0.1\tupdate_mode\tdivide\taxes\tx"]
+        self.assertRaises(ValueError,parse_perturbation_lines,bad_mode)
+        bad_param = ["params\tsigma\t0.1\tupdate_mode\treplace\taxes\tx"]
+        self.assertRaises(ValueError,parse_perturbation_lines,bad_param)
+        bad_value = ["params\tlambda\tlow\tupdate_mode\treplace\taxes\tx"]
+        self.assertRaises(ValueError,parse_perturbation_lines,bad_value)
+        no_axes = ["params\tlambda\t0.1\tupdate_mode\treplace\taxes"]
+        self.assertRaises(ValueError,parse_perturbation_lines,no_axes)
+        try:
+            parse_perturbation_lines(["","params\tlambda"],source="bad.csv")
+        except ValueError as e:
+            self.assertTrue("bad.csv:2" in str(e))
+
+    def test_load_library(self):
+        """load_perturbation_library loads every perturbation file in a folder"""
+        library = load_perturbation_library(PERTURBATION_DIR,5,105)
+        self.assertTrue("xyz_lambda_zero" in library)
+        self.assertTrue("README" not in library)
+        self.assertEqual(len(library["all_perturbations"]),17)
+        self.assertEqual(library["xyz_lambda_zero"][0].Start,5)
+        self.assertEqual(library["xyz_lambda_zero"][0].End,105)
+
+    def test_library_is_cached(self):
+        """Files are not re-parsed unless they change"""
+        path = join(self.TempDir,"x_mu_low.csv")
+        copy(join(PERTURBATION_DIR,"x_mu_low.csv"),path)
+        calls = []
+        original = perturbation_library.parse_perturbation_lines
+        def counting_parser(*args,**kwargs):
+            calls.append(1)
+            return original(*args,**kwargs)
+        perturbation_library.parse_perturbation_lines = counting_parser
+        try:
+            first = load_perturbation_file(path,0,1)
+            second = load_perturbation_file(path,0,1)
+            self.assertEqual(len(calls),1)
+            #Each call still returns independent Perturbation objects
+            self.assertFalse(first[0] is second[0])
+            with open(path,"w") as f:
+                f.write("params\tmu\t0.5\tupdate_mode\tadd\taxes\ty\n")
+            third = load_perturbation_file(path,0,1)
+            self.assertEqual(len(calls),2)
+            self.assertEqual(third[0].Params,{"mu":0.5})
+        finally:
+            perturbation_library.parse_perturbation_lines = original
+
+if __name__ == '__main__':
+    unittest.main()
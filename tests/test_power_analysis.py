@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.power_analysis import get_binomial_ci,make_power_design,\
+  simulate_replicate_batch,compare_treatments,estimate_power,run_power_analysis,\
+  format_power_table
+from numpy import array
+from numpy.random import RandomState
+
+"""
+Tests for power_analysis.py
+"""
+
+class TestPowerAnalysis(unittest.TestCase):
+    """Tests of simulation-based power analysis"""
+
+    def setUp(self):
+        self.design = make_power_design({"lambda":0.3,"delta":0.25},25,5,100)
+
+    def test_get_binomial_ci(self):
+        """Wilson intervals contain the estimate and narrow with more trials"""
+        low,high = get_binomial_ci(5,10)
+        self.assertTrue(low < 0.5 < high)
+        low_100,high_100 = get_binomial_ci(50,100)
+        self.assertTrue(high_100 - low_100 < high - low)
+        self.assertEqual(get_binomial_ci(0,10)[0],0.0)
+
+    def test_make_power_design_validates(self):
+        """Invalid designs raise ValueErrors, and designs default to the reference (euler) model"""
+        self.assertEqual(self.design["method"],"euler")
+        self.assertRaises(ValueError,make_power_design,{"lambda":0.3,"delta":0.25},10,9,100)
+        self.assertRaises(ValueError,make_power_design,{"lambda":0.3,"delta":0.25},25,5,100,fit_param="Mu")
+        self.assertRaises(ValueError,make_power_design,{"lambda":0.3,"delta":0.25},25,5,100,test="anova")
+
+    def test_simulate_replicate_batch(self):
+        """Batches return one fitted value per replicate per individual"""
+        control,perturbed = simulate_replicate_batch(self.design,4,0.0,3,RandomState(0))
+        self.assertEqual(control.shape,(3,4))
+        self.assertEqual(perturbed.shape,(3,4))
+        #Removing reversion (lambda 0) lowers the fitted Lambda
+        self.assertTrue(perturbed.mean() < control.mean())
+
+    def test_compare_treatments(self):
+        """Each row is tested separately"""
+        control = array([[1.0,1.1,0.9,1.0],[1.0,1.1,0.9,1.0]])
+        perturbed = array([[5.0,5.1,4.9,5.0],[1.0,1.1,0.9,1.05]])
+        for test in ("welch","mannwhitney"):
+            p_values = compare_treatments(control,perturbed,test)
+            self.assertEqual(len(p_values),2)
+            self.assertTrue(p_values[0] < 0.05)
+            self.assertTrue(p_values[1] > 0.05)
+
+    def test_power_increases_with_effect(self):
+        """A large effect has more power than no effect"""
+        null = estimate_power(self.design,15,0.3,min_replicates=40,max_replicates=40,random_state=0)
+        strong = estimate_power(self.design,15,0.0,min_replicates=40,max_replicates=40,random_state=0)
+        self.assertEqual(null["n_replicates"],40)
+        self.assertTrue(null["power"] < 0.2)
+        self.assertTrue(strong["power"] > null["power"])
+
+    def test_early_stopping(self):
+        """Replicates stop once the power interval is narrow enough"""
+        result = estimate_power(self.design,3,0.3,min_replicates=20,max_replicates=1000,\
+          batch_size=20,ci_width=0.5,random_state=0)
+        self.assertEqual(result["n_replicates"],20)
+
+    def test_run_power_analysis(self):
+        """Results cover the grid and do not depend on n_jobs"""
+        kwargs = {"min_replicates":10,"max_replicates":10,"batch_size":5,"seed":2}
+        serial = run_power_analysis(self.design,[3,6],[0.3,0.0],n_jobs=1,**kwargs)
+        parallel = run_power_analysis(self.design,[3,6],[0.3,0.0],n_jobs=2,**kwargs)
+        self.assertEqual(serial,parallel)
+        self.assertEqual([(r["n_individuals"],r["effect"]) for r in serial],[(3,0.3),(3,0.0),(6,0.3),(6,0.0)])
+        lines = format_power_table(serial)
+        self.assertEqual(len(lines),5)
+        self.assertTrue(lines[0].startswith("n_individuals\teffect"))
+
+if __name__ == '__main__':
+    unittest.main()
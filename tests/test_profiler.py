@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+import json
+from os.path import join,exists
+from tempfile import mkdtemp
+from shutil import rmtree
+from karenina.experiment import Experiment
+#experiment.py imports profiler as a top-level module, so share that module's active profiler
+from profiler import PhaseProfiler,profile,profile_stage,get_active_profiler,\
+  NULL_STAGE,PROFILE_COLUMNS
+
+"""
+Tests for profiler.py
+"""
+
+class TestProfiler(unittest.TestCase):
+    """Tests of per-stage profiling"""
+
+    def setUp(self):
+        self.output_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.output_dir)
+
+    def test_disabled_by_default(self):
+        """Without an active profiler stages are a shared no-op"""
+        self.assertTrue(get_active_profiler() is None)
+        self.assertTrue(profile_stage("update") is NULL_STAGE)
+        with profile(self.output_dir,enabled=False) as profiler:
+            self.assertTrue(profiler is None)
+            self.assertTrue(profile_stage("update") is NULL_STAGE)
+        self.assertFalse(exists(join(self.output_dir,"profile.json")))
+
+    def test_records_stages(self):
+        """Calls, wall and CPU time accumulate per stage"""
+        profiler = PhaseProfiler()
+        profiler.record("update",0.5,0.4)
+        profiler.record("update",0.25,0.2)
+        profiler.record("record_rows",1.0,1.0)
+        rows = profiler.get_rows()
+        self.assertEqual([row["stage"] for row in rows],["record_rows","update"])
+        self.assertEqual(rows[1]["calls"],2)
+        self.assertAlmostEqual(rows[1]["wall_seconds"],0.75)
+        self.assertAlmostEqual(rows[1]["mean_wall_ms"],375.0)
+
+    def test_profile_experiment(self):
+        """Profiling an experiment writes JSON and TSV reports of its stages"""
+        with profile(self.output_dir) as profiler:
+            self.assertTrue(get_active_profiler() is profiler)
+            experiment = Experiment(["control","treated"],[3,3],5,{"lambda":0.2,"delta":0.25},\
+              [[],[]],0.1)
+            experiment.simulate_timesteps(0,5,progress_interval=None)
+        self.assertTrue(get_active_profiler() is None)
+        with open(join(self.output_dir,"profile.json")) as json_file:
+            report = json.load(json_file)
+        calls = dict((row["stage"],row["calls"]) for row in report["stages"])
+        self.assertEqual(calls["setup_individuals"],2)
+        self.assertEqual(calls["update"],10)
+        self.assertEqual(calls["record_rows"],10)
+        self.assertEqual(calls["apply_perturbations"],10)
+        self.assertTrue(report["total_wall_seconds"] > 0)
+        with open(join(self.output_dir,"profile.tsv")) as tsv_file:
+            lines = tsv_file.readlines()
+        self.assertEqual(lines[0],"\t".join(PROFILE_COLUMNS)+"\n")
+        self.assertEqual(len(lines),5)
+
+if __name__ == '__main__':
+    unittest.main()
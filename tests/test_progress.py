@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+import logging
+from karenina.progress import ProgressReporter,format_seconds
+
+"""
+Tests for progress.py
+"""
+
+class ListHandler(logging.Handler):
+    """Logging handler that keeps formatted messages in a list"""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.Messages = []
+
+    def emit(self,record):
+        self.Messages.append(record.getMessage())
+
+class TestProgressReporter(unittest.TestCase):
+    """Tests of the ProgressReporter class"""
+
+    def setUp(self):
+        self.Logger = logging.getLogger("karenina.test_progress")
+        self.Handler = ListHandler()
+        self.Logger.addHandler(self.Handler)
+        self.Logger.propagate = False
+
+    def tearDown(self):
+        self.Logger.removeHandler(self.Handler)
+
+    def test_reports_throughput(self):
+        """ProgressReporter logs completed units, rate and ETA"""
+        self.Logger.setLevel(logging.INFO)
+        progress = ProgressReporter(100,interval=0.0,log=self.Logger)
+        progress.update(50)
+        self.assertEqual(len(self.Handler.Messages),1)
+        self.assertTrue("50/100 subject-steps" in self.Handler.Messages[0])
+        self.assertTrue("ETA" in self.Handler.Messages[0])
+        metrics = progress.get_metrics()
+        self.assertEqual(metrics["completed"],50)
+
+    def test_quiet_mode_does_nothing(self):
+        """ProgressReporter is disabled when its level is not logged"""
+        self.Logger.setLevel(logging.WARNING)
+        progress = ProgressReporter(100,interval=0.0,log=self.Logger)
+        self.assertFalse(progress.Enabled)
+        progress.update(50)
+        progress.finish()
+        self.assertEqual(self.Handler.Messages,[])
+        self.assertEqual(progress.Completed,0)
+
+    def test_interval_limits_messages(self):
+        """ProgressReporter only reports once per interval"""
+        self.Logger.setLevel(logging.INFO)
+        progress = ProgressReporter(100,interval=3600.0,log=self.Logger)
+        for i in range(10):
+            progress.update(1)
+        self.assertEqual(self.Handler.Messages,[])
+        progress.finish()
+        self.assertEqual(len(self.Handler.Messages),1)
+
+    def test_format_seconds(self):
+        """format_seconds produces h:mm:ss strings"""
+        self.assertEqual(format_seconds(3725),"1:02:05")
+        self.assertEqual(format_seconds(None),"?")
+
+if __name__ == '__main__':
+    unittest.main()
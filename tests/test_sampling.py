@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.sampling import make_random_sampling_times,parse_sampling_times_file,\
+  get_event_schedule,simulate_sampling_schedule
+from karenina.multivariate_process import MultivariateProcess
+from karenina.perturbation import Perturbation
+from karenina.experiment import Experiment
+from numpy import array,zeros,var,mean,exp
+import numpy.testing as npt
+
+"""
+Tests for sampling.py
+"""
+
+class TestSampling(unittest.TestCase):
+    """Tests of irregular sampling schedules"""
+
+    def test_make_random_sampling_times(self):
+        """make_random_sampling_times returns sorted times per subject"""
+        times = make_random_sampling_times(["a","b"],5,10.0,random_state=0)
+        self.assertEqual(sorted(times.keys()),["a","b"])
+        for subject_times in times.values():
+            self.assertEqual(len(subject_times),5)
+            self.assertEqual(subject_times[0],0.0)
+            self.assertTrue((subject_times[1:] >= subject_times[:-1]).all())
+            self.assertTrue(subject_times.max() <= 10.0)
+
+    def test_parse_sampling_times_file(self):
+        """parse_sampling_times_file reads one subject per line"""
+        lines = ["#SubjectID\ttimes\n","control_0\t0\t4.5\t1\n","control_1\t2\n"]
+        obs = parse_sampling_times_file(lines)
+        npt.assert_equal(obs["control_0"],array([0.0,1.0,4.5]))
+        npt.assert_equal(obs["control_1"],array([2.0]))
+        self.assertRaises(ValueError,parse_sampling_times_file,["a\t1\n","a\t2\n"])
+        self.assertRaises(ValueError,parse_sampling_times_file,["a\tlate\n"])
+
+    def test_get_event_schedule(self):
+        """Perturbation boundaries split each subject's timeline"""
+        perturbation = Perturbation(2,4,{"lambda":0.0})
+        event_times,is_sample = get_event_schedule([array([1.0,6.0]),array([3.0])],[perturbation])
+        npt.assert_equal(event_times[0],[0.0,1.0,2.0,5.0,6.0])
+        npt.assert_equal(is_sample[0],[False,True,False,False,True])
+        #The second subject ends at t=3, so only the start boundary applies; rows are padded
+        npt.assert_equal(event_times[1],[0.0,2.0,3.0,3.0,3.0])
+        npt.assert_equal(is_sample[1],[False,False,True,False,False])
+
+    def test_exact_transitions_match_stationary_variance(self):
+        """Irregular samples have the analytic OU variance at their sampling times"""
+        n = 4000
+        L = 0.3
+        delta = 0.5
+        cohort = MultivariateProcess(zeros((n,1)),["x"],{"lambda":L,"delta":delta},\
+          random_state=1,min_bound=None,max_bound=None)
+        #Half the subjects are sampled at 0.5 and 7.3, half only at 7.3
+        times = [array([0.5,7.3])] * (n//2) + [array([7.3])] * (n//2)
+        samples = simulate_sampling_schedule(cohort,times)
+        self.assertEqual(samples[0].shape,(2,1))
+        self.assertEqual(samples[-1].shape,(1,1))
+        final = array([s[-1,0] for s in samples])
+        expected_var = (delta**2)**2 * (1 - exp(-2*L*7.3)) / (2*L)
+        npt.assert_allclose(var(final),expected_var,rtol=0.1)
+
+    def test_perturbations_apply_per_subject_time(self):
+        """Perturbations are only active for subjects within the perturbation window"""
+        cohort = MultivariateProcess(zeros((2,1)),["x"],{"lambda":1.0,"delta":0.0},random_state=0)
+        shift = Perturbation(0,1,{"mu":0.5},axes=["x"])
+        samples = simulate_sampling_schedule(cohort,[array([1.5]),array([1.5,30.0])],[shift])
+        #Both subjects are pulled towards 0.5 during the perturbation
+        self.assertTrue(samples[0][0,0] > 0.3)
+        #After the perturbation ends, the second subject reverts to 0
+        npt.assert_almost_equal(samples[1][1,0],0.0,5)
+        self.assertEqual(cohort.Perturbations,[])
+
+    def test_experiment_sampling_schedule(self):
+        """Experiment emits sample ids with real time values"""
+        sampling_times = {"control_0":[0,2.5],"treated_0":[1.25],"treated_1":[3]}
+        perturbation = {"start":1,"end":2,"params":{"lambda":0.0},\
+          "update_mode":"replace","axes":["x","y","z"]}
+        experiment = Experiment(["control","treated"],[1,2],4,{"lambda":0.2,"delta":0.25},\
+          [[],[perturbation]],0.01,engine="multivariate",method="exact",random_state=0,\
+          sampling_times=sampling_times)
+        experiment.simulate_sampling_schedule()
+        sample_ids = [row.split("\t")[0] for row in experiment.Data[1:]]
+        self.assertEqual(sample_ids,["Scontrol_0_t0","Scontrol_0_t2.5","Streated_0_t1.25","Streated_1_t3"])
+        self.assertRaises(ValueError,Experiment,["control"],[1],4,{"lambda":0.2,"delta":0.25},\
+          [[]],0.01,sampling_times=sampling_times)
+        #The default euler method is the reference model, which cannot skip timesteps
+        self.assertRaises(ValueError,Experiment,["control"],[1],4,{"lambda":0.2,"delta":0.25},\
+          [[]],0.01,engine="multivariate",sampling_times=sampling_times)
+
+if __name__ == '__main__':
+    unittest.main()
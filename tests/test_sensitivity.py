@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.sensitivity import make_sensitivity_design,get_unit_samples,make_saltelli_samples,\
+  scale_samples,get_point_params,get_batch_dispersion,simulate_point_batch,evaluate_points,\
+  get_sobol_indices,get_sobol_confidence_intervals,run_sensitivity_analysis,\
+  format_sensitivity_table,parse_bounds,SENSITIVITY_OUTPUTS
+from scipy.spatial.distance import pdist
+from numpy import arange,array,floor,pi,sin,sort
+from numpy.random import RandomState
+import numpy.testing as npt
+
+"""
+Tests for sensitivity.py
+"""
+
+def ishigami(x):
+    """Return the Ishigami function (a=7, b=0.1) of points in [-pi,pi]^3"""
+    return sin(x[:,0]) + 7.0 * sin(x[:,1])**2 + 0.1 * x[:,2]**4 * sin(x[:,0])
+
+class TestSensitivity(unittest.TestCase):
+    """Tests of Sobol sensitivity analysis"""
+
+    def setUp(self):
+        self.Design = make_sensitivity_design(12,4,n_individuals=10,axes=("x","y"))
+
+    def test_latin_hypercube(self):
+        """Each dimension of a Latin hypercube has one point per stratum"""
+        samples = get_unit_samples(50,3,"lhs",seed=0)
+        for column in samples.T:
+            npt.assert_array_equal(sort(floor(column * 50)),arange(50))
+        self.assertEqual(get_unit_samples(64,4,"sobol",seed=0).shape,(64,4))
+        self.assertRaises(ValueError,get_unit_samples,10,2,"grid")
+
+    def test_saltelli_samples(self):
+        """AB_i matrices take column i from B and the rest from A"""
+        samples = make_saltelli_samples(8,3,seed=0).reshape(5,8,3)
+        A,B = samples[0],samples[1]
+        npt.assert_array_equal(samples[3][:,1],B[:,1])
+        npt.assert_array_equal(samples[3][:,[0,2]],A[:,[0,2]])
+
+    def test_ishigami_indices(self):
+        """Sobol indices of the Ishigami function match their analytical values"""
+        for sampling in ("sobol","lhs"):
+            x = -pi + 2.0 * pi * make_saltelli_samples(4096,3,sampling,seed=1)
+            first_order,total = get_sobol_indices(ishigami(x),3)
+            npt.assert_allclose(first_order,[0.314,0.442,0.0],atol=0.05)
+            npt.assert_allclose(total,[0.558,0.442,0.244],atol=0.05)
+        low,high,total_low,total_high = get_sobol_confidence_intervals(ishigami(x),3,50,0.95,0)
+        self.assertTrue((low <= first_order).all() and (first_order <= high).all())
+        self.assertTrue((total_low <= total).all() and (total <= total_high).all())
+        self.assertTrue((high - low < 0.2).all())
+
+    def test_design(self):
+        """Designs validate parameters and fill fixed values"""
+        self.assertEqual(self.Design["bounds"][-1],(0.0,7.0))
+        self.assertEqual(self.Design["method"],"euler")
+        self.assertRaises(ValueError,make_sensitivity_design,12,4,parameters=["kappa"])
+        self.assertRaises(ValueError,make_sensitivity_design,12,4,bounds={"delta":(0.5,0.1)})
+        design = make_sensitivity_design(12,4,parameters=["delta"],fixed_params={"mu_shift":0.1})
+        point_params = get_point_params(design,scale_samples(design,array([[0.0],[1.0]])))
+        npt.assert_array_equal(point_params["delta"],[0.05,0.5])
+        npt.assert_array_equal(point_params["mu_shift"],[0.1,0.1])
+        npt.assert_array_equal(point_params["perturbation_duration"],[7.0,7.0])
+        self.assertEqual(parse_bounds("lambda:0.1:0.3,delta:0:1"),{"lambda":(0.1,0.3),"delta":(0.0,1.0)})
+        self.assertRaises(ValueError,parse_bounds,"lambda:0.1")
+
+    def test_batch_dispersion(self):
+        """Batched dispersion metrics match per-point calculations"""
+        coords = RandomState(0).random_sample((4,6,2))
+        metrics = get_batch_dispersion(coords)
+        npt.assert_allclose(metrics["mean_pairwise_distance"],[pdist(c).mean() for c in coords])
+        npt.assert_allclose(metrics["variance"],[c.var(axis=0,ddof=1).sum() for c in coords])
+
+    def test_simulate_point_batch(self):
+        """Batches are reproducible, and the perturbation alone drives effects"""
+        points = scale_samples(self.Design,make_saltelli_samples(4,5,seed=0))
+        first = simulate_point_batch(self.Design,points,seed=3)
+        npt.assert_array_equal(first["variance"],simulate_point_batch(self.Design,points,seed=3)["variance"])
+        self.assertEqual(sorted(first.keys()),sorted(SENSITIVITY_OUTPUTS))
+        self.assertEqual(first["variance"].shape,(points.shape[0],))
+        unshifted = points.copy()
+        unshifted[:,2] = 0.0
+        npt.assert_array_equal(simulate_point_batch(self.Design,unshifted,seed=3)["variance_effect"],0.0)
+
+    def test_evaluate_points_independent_of_n_jobs(self):
+        """Results depend on seed and batch_size but not on n_jobs"""
+        points = scale_samples(self.Design,make_saltelli_samples(4,5,seed=0))
+        serial = evaluate_points(self.Design,points,batch_size=10,n_jobs=1,seed=2)
+        parallel = evaluate_points(self.Design,points,batch_size=10,n_jobs=2,seed=2)
+        npt.assert_array_equal(serial["centroid_distance"],parallel["centroid_distance"])
+
+    def test_run_sensitivity_analysis(self):
+        """delta drives the spread of individuals more than the perturbation does"""
+        rows,points,values = run_sensitivity_analysis(self.Design,n_base=128,outputs=["variance"],\
+          n_bootstrap=20,seed=0)
+        self.assertEqual(points.shape,(128 * 7,5))
+        self.assertEqual(len(rows),5)
+        totals = dict((row["parameter"],row["total"]) for row in rows)
+        self.assertEqual(max(totals,key=totals.get),"delta")
+        lines = format_sensitivity_table(rows)
+        self.assertEqual(lines[0].split("\t")[:3],["output","parameter","first_order"])
+        self.assertEqual(len(lines),6)
+        self.assertRaises(ValueError,run_sensitivity_analysis,self.Design,8,outputs=["speed"])
+
+if __name__ == '__main__':
+    unittest.main()
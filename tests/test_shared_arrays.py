@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+import pickle
+from karenina.shared_arrays import SharedArray,get_chunks,simulate_cohort_parallel,\
+  fit_timeseries_parallel
+from karenina.ou_likelihood import fit_OU_exact
+from karenina.bootstrap import simulate_ou_replicates
+from karenina.multivariate_process import MultivariateProcess
+from karenina.perturbation import Perturbation
+from karenina.experiment import Experiment
+from numpy import array,arange,isnan
+from numpy.random import RandomState
+import numpy.testing as npt
+
+"""
+Tests for shared_arrays.py
+"""
+
+def fit_or_fail(x,times):
+    """fit_OU_exact, raising a ValueError for series starting above 10"""
+    if x[0] > 10:
+        raise ValueError("Cannot fit series starting at %s" %x[0])
+    return fit_OU_exact(x,times)
+
+class TestSharedArray(unittest.TestCase):
+    """Tests of SharedArray"""
+
+    def test_pickled_array_shares_memory(self):
+        """An unpickled SharedArray attaches to the same memory"""
+        with SharedArray((3,2),fill_value=0.0) as shared:
+            attached = pickle.loads(pickle.dumps(shared))
+            self.assertFalse(attached.Owner)
+            attached.Array[1] = [4.0,5.0]
+            attached.close()
+            npt.assert_array_equal(shared.Array,array([[0,0],[4,5],[0,0]]))
+
+    def test_get_chunks(self):
+        """get_chunks covers every row"""
+        self.assertEqual(get_chunks(5,2),[(0,2),(2,4),(4,5)])
+        self.assertEqual(get_chunks(0,2),[])
+
+class TestParallelSimulation(unittest.TestCase):
+    """Tests of simulate_cohort_parallel"""
+
+    def setUp(self):
+        self.start = RandomState(0).uniform(-0.5,0.5,(25,3))
+        self.params = {"lambda":0.2,"delta":0.3}
+
+    def test_results_independent_of_n_jobs(self):
+        """Parallel and serial runs with the same seed and chunks agree"""
+        serial = simulate_cohort_parallel(self.start,["x","y","z"],self.params,10,\
+          n_jobs=1,chunk_size=7,seed=3)
+        parallel = simulate_cohort_parallel(self.start,["x","y","z"],self.params,10,\
+          n_jobs=2,chunk_size=7,seed=3)
+        try:
+            self.assertEqual(serial.Array.shape,(25,11,3))
+            npt.assert_array_equal(serial.Array[:,0],self.start)
+            npt.assert_array_equal(serial.Array,parallel.Array)
+            self.assertTrue((serial.Array[:,1:] != serial.Array[:,:-1]).any())
+        finally:
+            serial.unlink()
+            parallel.unlink()
+
+    def test_perturbations_applied_in_workers(self):
+        """A perturbation replacing mu moves every individual there"""
+        perturbation = Perturbation(5,20,{"lambda":5.0,"delta":0.0,"mu":0.5},"replace",["x"])
+        shared = simulate_cohort_parallel(self.start,["x","y","z"],self.params,10,\
+          perturbations=[perturbation],n_jobs=2,chunk_size=10,seed=1)
+        try:
+            npt.assert_allclose(shared.Array[:,-1,0],0.5,atol=1e-6)
+            self.assertTrue((shared.Array[:,-1,1] != 0.5).all())
+        finally:
+            shared.unlink()
+
+    def test_experiment_simulate_parallel(self):
+        """Experiment.simulate_parallel records every timepoint from shared memory"""
+        params = {"lambda":0.2,"delta":0.25,"interindividual_variation":0.01}
+        experiment = Experiment(["control","treated"],[4,3],6,params,[[],[]],0.1,\
+          engine="multivariate",random_state=0)
+        experiment.simulate_parallel(n_jobs=2,chunk_size=2,seed=0)
+        try:
+            self.assertEqual(len(experiment.Data),1+7*6)
+            data,colors = experiment.get_timeseries_data()
+            self.assertEqual(len(data),7)
+            self.assertEqual(data[0].shape,(3,6))
+            last = experiment.Treatments[0]["shared_history"].Array[:,-1]
+            npt.assert_array_equal(experiment.Treatments[0]["cohort"].Coords,last)
+            #A seeded experiment's treatments start from different coordinates
+            starts = [treatment["shared_history"].Array[:3,0] for treatment in experiment.Treatments]
+            self.assertFalse((starts[0] == starts[1]).any())
+        finally:
+            experiment.release_shared_arrays()
+        self.assertFalse("shared_history" in experiment.Treatments[0])
+
+class TestFitTimeseriesParallel(unittest.TestCase):
+    """Tests of batch fitting across worker processes"""
+
+    def test_fit_timeseries_parallel(self):
+        """Parallel batch fits match serial fits"""
+        x = simulate_ou_replicates(0.2,0.3,0.0,arange(50),0.0,6,random_state=4)
+        series = list(x)
+        times = [arange(50)]*6
+        shared = fit_timeseries_parallel(series,times,n_jobs=2,chunk_size=2)
+        try:
+            self.assertEqual(shared.Array.shape,(6,4))
+            for i in range(6):
+                npt.assert_allclose(shared.Array[i],fit_OU_exact(series[i],times[i]))
+        finally:
+            shared.unlink()
+
+    def test_failed_fits_are_nan(self):
+        """A series whose fit raises gets a NaN row without discarding the others"""
+        x = simulate_ou_replicates(0.2,0.3,0.0,arange(30),0.0,4,random_state=5)
+        x[1,0] = 20.0
+        shared = fit_timeseries_parallel(list(x),[arange(30)]*4,fit_function=fit_or_fail,\
+          n_jobs=2,chunk_size=2)
+        try:
+            self.assertTrue(isnan(shared.Array[1]).all())
+            for i in (0,2,3):
+                npt.assert_allclose(shared.Array[i],fit_OU_exact(x[i],arange(30)))
+        finally:
+            shared.unlink()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+import pickle
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from karenina.sinks import Sink,CallbackSink,TSVFileSink
+from karenina.experiment import Experiment
+from numpy import array
+import numpy.testing as npt
+
+"""
+Tests for sinks.py
+"""
+
+def make_experiment(sinks,engine="process",history_window=0):
+    """Return a small low-memory experiment streaming to sinks"""
+    perturbation = {"start":1,"end":2,"params":{"lambda":0.0},\
+      "update_mode":"replace","axes":["x","y","z"]}
+    return Experiment(["control","treated"],[2,3],4,{"lambda":0.2,"delta":0.25},\
+      [[],[perturbation]],0.01,engine=engine,history_window=history_window,\
+      sinks=sinks,collect_data=False)
+
+class TestSinks(unittest.TestCase):
+    """Tests of Sink objects and low-memory experiments"""
+
+    def setUp(self):
+        self.OutputDir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.OutputDir)
+
+    def test_base_sink_write_not_implemented(self):
+        """Sink subclasses must implement write"""
+        self.assertRaises(NotImplementedError,Sink().write,"control",0,["a"],array([[0.0]]))
+
+    def test_history_free_experiment_streams_every_timepoint(self):
+        """A history-free experiment forwards every timepoint to its sinks"""
+        for engine in ["process","multivariate"]:
+            received = []
+            sink = CallbackSink(lambda name,t,ids,coords: received.append((name,t,list(ids),coords.shape)))
+            experiment = make_experiment([sink],engine=engine)
+            experiment.simulate_timesteps(0,4)
+            self.assertEqual(len(received),2 * 4)
+            self.assertEqual(received[0],("control",0,["control_0","control_1"],(2,3)))
+            self.assertEqual(received[-1][:2],("treated",3))
+            #No rows or histories are held in memory
+            self.assertEqual(len(experiment.Data),1)
+            if engine == "process":
+                process = experiment.Treatments[0]["individuals"][0].MovementProcesses["x"]
+            else:
+                process = experiment.Treatments[0]["cohort"]
+            self.assertEqual(len(process.History),0)
+
+    def test_history_window_keeps_recent_timepoints(self):
+        """A history_window keeps only the most recent timepoints"""
+        experiment = make_experiment([],engine="process",history_window=2)
+        experiment.simulate_timesteps(0,4)
+        subject = experiment.Treatments[1]["individuals"][0]
+        history = subject.MovementProcesses["y"].History
+        self.assertEqual(len(history),2)
+        cohort_experiment = make_experiment([],engine="multivariate",history_window=2)
+        cohort_experiment.simulate_timesteps(0,4)
+        cohort = cohort_experiment.Treatments[1]["cohort"]
+        self.assertEqual(cohort.get_history_array().shape,(3,2,3))
+        npt.assert_equal(cohort.History[-1],cohort.Coords)
+
+    def test_tsv_file_sink(self):
+        """TSVFileSink writes one row per sample with a header"""
+        output_path = join(self.OutputDir,"simulated_coordinates.tsv")
+        experiment = make_experiment([TSVFileSink(output_path)])
+        experiment.simulate_timesteps(0,4)
+        experiment.close_sinks()
+        lines = open(output_path).read().strip().split("\n")
+        self.assertEqual(lines[0].split("\t"),["SampleID","SubjectID","Treatment","Timepoint","x","y","z"])
+        self.assertEqual(len(lines),1 + 5 * 4)
+        fields = lines[-1].split("\t")
+        self.assertEqual(fields[:4],["Streated_2_t3","treated_2","treated","3"])
+
+    def test_tsv_file_sink_pickle_truncates(self):
+        """An unpickled TSVFileSink resumes writing where it was pickled"""
+        output_path = join(self.OutputDir,"out.tsv")
+        sink = TSVFileSink(output_path)
+        sink.open(["x"])
+        sink.write("control",0,["a"],array([[0.5]]))
+        state = pickle.dumps(sink)
+        sink.write("control",1,["a"],array([[0.25]]))
+        sink.close()
+        restored = pickle.loads(state)
+        restored.write("control",1,["a"],array([[0.75]]))
+        restored.close()
+        lines = open(output_path).read().strip().split("\n")
+        self.assertEqual(len(lines),3)
+        self.assertEqual(lines[-1].split("\t")[-1],"0.75")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+__author__ = "Jesse Zaneveld"
+__copyright__ = "Copyright 2011-2013, The PICRUSt Project"
+__credits__ = ["Jesse Zaneveld"]
+__license__ = "GPL"
+__version__ = "1.0.0-dev"
+__maintainer__ = "Jesse Zaneveld"
+__email__ = "zaneveld@gmail.com"
+__status__ = "Development"
+
+import unittest
+from karenina.trajectory_storage import quantize,dequantize,encode_values,decode_values,\
+  delta_encode,delta_decode,save_trajectory_archive,load_trajectory_archive,check_storage_dtype
+from karenina.multivariate_process import MultivariateProcess
+from karenina.experiment import Experiment
+from karenina.memory import estimate_experiment_memory
+from numpy import array,nan,save,isnan,float32
+from numpy.random import RandomState
+from os.path import getsize,join
+from shutil import rmtree
+from tempfile import mkdtemp
+import numpy.testing as npt
+
+"""
+Tests for trajectory_storage.py
+"""
+
+class TestTrajectoryStorage(unittest.TestCase):
+    """Tests of reduced-precision and delta-encoded trajectory storage"""
+
+    def setUp(self):
+        self.OutputDir = mkdtemp()
+        steps = RandomState(0).normal(0.0,0.02,size=(20,200,3))
+        self.History = steps.cumsum(axis=1).clip(-1.0,1.0)
+
+    def tearDown(self):
+        rmtree(self.OutputDir)
+
+    def test_quantize(self):
+        """int16 levels recover values to within half a level, and keep NaN and the bounds"""
+        values = array([-1.0,-0.5,0.0,0.123456,1.0,nan])
+        levels = quantize(values)
+        self.assertEqual(levels.dtype.name,"int16")
+        decoded = dequantize(levels)
+        npt.assert_allclose(decoded[:5],values[:5],atol=0.5 / 32767)
+        npt.assert_array_equal(decoded[[0,4]],[-1.0,1.0])
+        self.assertTrue(isnan(decoded[5]))
+        npt.assert_allclose(dequantize(quantize([2.0,9.0],2.0,10.0),2.0,10.0),[2.0,9.0],atol=1e-4)
+        self.assertRaises(ValueError,quantize,[1.01])
+        self.assertRaises(ValueError,quantize,[0.0],None,1.0)
+        self.assertRaises(ValueError,check_storage_dtype,"int8")
+
+    def test_delta_encoding_is_lossless(self):
+        """Delta decoding recovers every storage dtype exactly, including wrapped differences"""
+        for storage in ("float64","float32","int16"):
+            encoded = encode_values(self.History,storage)
+            npt.assert_array_equal(delta_decode(delta_encode(encoded)),encoded)
+        levels = array([[32767,-32767,-32768,5]],dtype="int16")
+        npt.assert_array_equal(delta_decode(delta_encode(levels)),levels)
+        floats = array([[[0.5],[nan],[-0.25]]])
+        npt.assert_array_equal(delta_decode(delta_encode(floats)),floats)
+        self.assertEqual(decode_values(encode_values(self.History,"float32")).dtype.name,"float64")
+
+    def test_archive_round_trip(self):
+        """Archives decode transparently, and reduced precision shrinks them"""
+        sizes = {}
+        for storage in ("float64","float32","int16"):
+            path = join(self.OutputDir,"%s.npz" %storage)
+            save_trajectory_archive(path,self.History,storage,axes=["x","y","z"])
+            history,header = load_trajectory_archive(path)
+            self.assertEqual(history.dtype.name,"float64")
+            self.assertEqual(header["axes"],["x","y","z"])
+            sizes[storage] = getsize(path)
+        npt.assert_array_equal(load_trajectory_archive(join(self.OutputDir,"float64.npz"))[0],self.History)
+        npt.assert_allclose(load_trajectory_archive(join(self.OutputDir,"int16.npz"))[0],\
+          self.History,atol=0.5 / 32767)
+        self.assertTrue(sizes["int16"] < sizes["float32"] < sizes["float64"])
+        plain = join(self.OutputDir,"plain.npz")
+        save_trajectory_archive(plain,self.History,"int16",delta=False,compress=False)
+        self.assertTrue(sizes["int16"] < getsize(plain))
+        save(join(self.OutputDir,"history.npy"),self.History)
+        npt.assert_array_equal(load_trajectory_archive(join(self.OutputDir,"history.npy"))[0],self.History)
+
+    def test_reduced_precision_history(self):
+        """MultivariateProcess histories can be stored as float32 or int16"""
+        params = {"lambda":0.2,"delta":0.3}
+        start = RandomState(1).uniform(-0.5,0.5,size=(10,2))
+        full = MultivariateProcess(start,["x","y"],params,random_state=0)
+        full.simulate(30)
+        for storage,atol in (("float32",1e-7),("int16",0.5 / 32767)):
+            cohort = MultivariateProcess(start,["x","y"],params,random_state=0,history_dtype=storage)
+            cohort.simulate(30)
+            self.assertEqual(cohort.History[-1].dtype.name,storage)
+            npt.assert_array_equal(cohort.Coords,full.Coords)
+            npt.assert_allclose(cohort.get_history_array(),full.get_history_array(),atol=atol)
+        self.assertRaises(ValueError,MultivariateProcess,start,["x","y"],params,\
+          min_bound=None,history_dtype="int16")
+        float64_bytes = estimate_experiment_memory(100,50,2,"multivariate")["history"]
+        int16_bytes = estimate_experiment_memory(100,50,2,"multivariate",history_dtype="int16")["history"]
+        self.assertTrue(int16_bytes < float64_bytes / 3)
+
+    def test_experiment_archive(self):
+        """An Experiment writes the kept history of every individual to an archive"""
+        params = {"lambda":0.2,"delta":0.25,"interindividual_variation":0.01}
+        experiment = Experiment(["control","treated"],[3,4],5,params,[[],[]],0.1,\
+          engine="multivariate",random_state=0,history_dtype="float32")
+        experiment.simulate_timesteps(0,5,progress_interval=None)
+        path = join(self.OutputDir,"trajectories.npz")
+        experiment.write_trajectory_archive(path,"int16")
+        history,header = load_trajectory_archive(path)
+        self.assertEqual(history.shape,(7,6,3))
+        self.assertEqual(header["subject_ids"][3],"treated_0")
+        self.assertEqual(header["treatments"].count("treated"),4)
+        npt.assert_allclose(history[:3],experiment.Treatments[0]["cohort"].get_history_array(),atol=1e-4)
+        self.assertRaises(ValueError,Experiment,["control"],[3],5,params,[[]],0.1,history_dtype=float32)
+
+if __name__ == '__main__':
+    unittest.main()